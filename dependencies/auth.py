@@ -6,6 +6,7 @@ from typing import Optional
 import uuid
 
 from fastapi import Depends, HTTPException, Request, status
+from fastapi.requests import HTTPConnection
 import jwt
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
@@ -39,6 +40,44 @@ def verify_token(
         return None
 
 
+def get_rate_limit_key(
+    request: HTTPConnection,
+    settings: Settings = Depends(get_settings)
+) -> str:
+    """Identify the caller for per-user rate limits (user id when logged in, else client IP)"""
+    token = request.cookies.get("access_token")
+    if token:
+        payload = verify_token(token, settings)
+        if payload and payload.get("sub"):
+            return f"user:{payload['sub']}"
+    host = request.client.host if request.client else "unknown"
+    return f"ip:{host}"
+
+
+# Session key of the id that owns a client's chat conversations
+CHAT_CLIENT_SESSION_KEY = "chat_client_id"
+
+
+def get_conversation_owner(request: HTTPConnection) -> str:
+    """
+    Identify the owner of chat conversations: a client id kept in the signed session cookie
+
+    The id is issued on the client's first chat request and survives login and
+    logout, so conversations are neither shared by clients behind one IP nor
+    lost when the user signs in. A WebSocket can't set the cookie, so without
+    one its conversations are owned by that connection.
+    """
+    session = request.scope.get("session")
+    if session is None:
+        raise RuntimeError("SessionMiddleware is required to identify conversation owners")
+    client_id = session.get(CHAT_CLIENT_SESSION_KEY)
+    if not client_id:
+        client_id = uuid.uuid4().hex
+        if request.scope["type"] == "http":
+            session[CHAT_CLIENT_SESSION_KEY] = client_id
+    return f"client:{client_id}"
+
+
 async def get_current_user_from_cookies(
     request: Request,
     session: AsyncSession = Depends(get_db_session),
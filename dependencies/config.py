@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic_settings import BaseSettings
 
@@ -31,6 +31,181 @@ class Settings(BaseSettings):
     host: str = "0.0.0.0"
     port: int = 8000
 
+    # LLM backends: any OpenAI-compatible endpoint. LLM_BACKENDS is a JSON list of
+    # {"name", "base_url", "model", "weight", "api_key" | "api_key_env"}; when empty,
+    # OpenRouter is used with OPENROUTER_API_KEY and OPENROUTER_LLM_MODEL
+    llm_base_url: str = "https://openrouter.ai/api/v1"
+    llm_backends: List[Dict[str, Any]] = []
+
+    # Circuit breaker per LLM backend: opens when the error rate or slow-call rate over
+    # the rolling window (seconds) crosses its threshold, fails fast while open, then
+    # lets probe calls through after breaker_open_seconds
+    breaker_window: float = 60.0
+    breaker_min_requests: int = 10
+    breaker_failure_rate: float = 0.5
+    breaker_slow_call_seconds: float = 10.0
+    breaker_slow_call_rate: float = 0.8
+    breaker_open_seconds: float = 30.0
+    breaker_half_open_max_calls: int = 1
+
+    # Upstream LLM HTTP client (shared connection pool)
+    upstream_pool_limit: int = 100
+    upstream_pool_limit_per_host: int = 20
+    upstream_dns_cache_ttl: int = 300
+    upstream_keepalive_timeout: float = 30.0
+    upstream_connect_timeout: float = 10.0
+    upstream_timeout: float = 120.0
+
+    # Chat response cache (in-memory LRU, optional SQLite file shared by workers)
+    response_cache_enabled: bool = True
+    response_cache_max_entries: int = 512
+    response_cache_ttl: int = 3600
+    response_cache_path: Optional[str] = None
+    response_cache_replay_chunk_chars: int = 24
+    response_cache_replay_delay: float = 0.02
+
+    # Semantic cache (needs NumPy): prompts whose hashed n-gram TF-IDF vectors reach the
+    # cosine threshold reuse a cached answer; SimHash preselects the candidates reranked
+    semantic_cache_enabled: bool = False
+    semantic_cache_threshold: float = 0.9
+    semantic_cache_max_entries: int = 10000
+    semantic_cache_dim: int = 256
+    semantic_cache_candidates: int = 32
+
+    # Share one upstream stream between concurrent identical prompts
+    stream_coalescing_enabled: bool = True
+
+    # Server-side caps for one upstream stream (wall time in seconds, content deltas)
+    stream_max_duration: float = 120.0
+    stream_max_tokens: int = 2000
+
+    # SSE framing: batch deltas per window (ms) or size (chars), heartbeat comments (s)
+    stream_flush_interval_ms: int = 50
+    stream_flush_max_chars: int = 256
+    stream_heartbeat_interval: int = 10
+
+    # Markdown rendering: highlighted code blocks cached by language and source (bytes of
+    # HTML, 0 = off); renders of at least markdown_offload_chars run in a thread pool
+    markdown_highlight_cache_bytes: int = 16 * 1024 * 1024
+    markdown_offload_chars: int = 4000
+    markdown_render_workers: int = 2
+
+    # Resumable streams (opt-in): /api/chat/stream keeps the last stream_resume_max_events events
+    # and keeps running for stream_resume_grace (s) after the client drops, for Last-Event-ID.
+    # Off, a disconnect aborts the upstream request at once
+    stream_resume_enabled: bool = False
+    stream_resume_grace: float = 30.0
+    stream_resume_max_events: int = 2000
+
+    # Hedged streams: with no first token after the live TTFT p95 (clamped), a second
+    # request goes to another backend; at most hedge_budget_ratio of streams hedge
+    stream_hedging_enabled: bool = True
+    hedge_quantile: float = 0.95
+    hedge_window: int = 200
+    hedge_min_samples: int = 20
+    hedge_initial_delay: float = 5.0
+    hedge_min_delay: float = 1.0
+    hedge_max_delay: float = 15.0
+    hedge_budget_ratio: float = 0.1
+
+    # WebSocket chat (/ws/chat): concurrent streams per socket, outgoing frames buffered
+    # per socket, and seconds a stream may wait on a full buffer before the socket closes
+    ws_max_streams: int = 4
+    ws_send_queue_size: int = 64
+    ws_send_timeout: float = 30.0
+
+    # Retrieval over products and public webinar registrations (needs NumPy): chunks of
+    # about rag_chunk_chars are embedded locally; "auto" switches from a flat scan to IVF
+    # lists at rag_ivf_min_rows chunks (rag_ivf_lists 0 = sqrt of the rows). Changed rows
+    # are re-indexed every rag_sync_interval (s) and all rows compared every
+    # rag_reconcile_interval (s); rag_index_path saves the index for memory-mapping
+    rag_enabled: bool = True
+    rag_top_k: int = 4
+    rag_min_score: float = 0.1
+    rag_chunk_chars: int = 600
+    rag_embedding_dim: int = 384
+    rag_index_mode: str = "auto"
+    rag_ivf_min_rows: int = 20000
+    rag_ivf_lists: int = 0
+    rag_ivf_probe: int = 8
+    rag_index_path: Optional[str] = None
+    rag_sync_interval: float = 2.0
+    rag_reconcile_interval: float = 300.0
+
+    # Model comparison (/api/chat/compare): models per request, upstream streams one
+    # comparison may hold at a time, and the models allowed (empty = any; also the default)
+    compare_max_models: int = 4
+    compare_concurrency: int = 2
+    compare_models: List[str] = []
+
+    # Product statistics from the product_category_stats and product_price_range_stats tables,
+    # rebuilt on start and kept current by write hooks on Product (off: grouped aggregates over
+    # products per request)
+    product_stats_materialized: bool = False
+
+    # /api/products pages (keyset pagination): rows per page by default and at most
+    products_page_size: int = 50
+    products_page_max: int = 200
+
+    # Read-through cache of product and webinar queries, invalidated by per-table versions
+    # bumped on commit; set the versions path (a SQLite file) to share them between workers
+    query_cache_enabled: bool = False
+    query_cache_max_entries: int = 256
+    query_cache_ttl: float = 300.0
+    query_cache_versions_path: Optional[str] = None
+
+    # Conditional GET for /api/products, /api/registrants and /api/webinar-attendees: strong
+    # ETags from table state (304 on If-None-Match) and Cache-Control per route name
+    # (products, registrants, webinar-attendees; JSON object, e.g. {"products": "private, max-age=30"})
+    http_etags_enabled: bool = True
+    http_cache_control_default: str = "private, no-cache"
+    http_cache_control: Dict[str, str] = {}
+
+    # Streaming exports (/api/products/export, /api/registrants/export): rows fetched per
+    # server-side cursor batch, each batch encoded and sent before the next is read
+    export_batch_size: int = 500
+
+    # Multi-turn conversations (server-side history, packed into the model context)
+    chat_context_window: int = 8192
+    conversation_max_messages: int = 100
+    conversation_max_in_memory: int = 1000
+    conversation_persist: bool = True
+
+    # Batch chat jobs: workers per process, limits per job, seconds before an item left
+    # running by a dead worker is claimed again, attempts per item, and times an item is
+    # put back while the upstream is busy (429/503, open circuit) before it fails
+    batch_workers_enabled: bool = True
+    batch_concurrency: int = 4
+    batch_max_prompts: int = 1000
+    batch_max_prompt_chars: int = 20000
+    batch_item_lease: float = 600.0
+    batch_max_attempts: int = 3
+    batch_max_requeues: int = 20
+
+    # Token usage accounting (llm_usage table): the writer flushes every interval (s)
+    # or once a batch is waiting; records beyond the buffer are dropped
+    usage_tracking_enabled: bool = True
+    usage_flush_interval: float = 2.0
+    usage_batch_size: int = 200
+    usage_buffer_size: int = 10000
+    # USD per million tokens of the default backend (LLM_BACKENDS entries set their own)
+    llm_prompt_price: Optional[float] = None
+    llm_completion_price: Optional[float] = None
+
+    # Upstream governor (per-worker rate limits, wait queue and retry backoff); a user over
+    # their rate waits without holding up others, with at most governor_max_queue_per_user places
+    governor_max_concurrent: int = 8
+    governor_global_rpm: float = 120.0
+    governor_global_burst: float = 20.0
+    governor_user_rpm: float = 20.0
+    governor_user_burst: float = 5.0
+    governor_max_queue: int = 100
+    governor_max_queue_per_user: int = 10
+    governor_max_queue_time: float = 30.0
+    governor_max_retries: int = 3
+    governor_backoff_base: float = 1.0
+    governor_backoff_max: float = 30.0
+
     class Config:
         env_file = ".env"
         case_sensitive = False
@@ -120,6 +120,8 @@ def get_fallback_data() -> Dict[str, Any]:
     """Get fallback data when database is unavailable"""
     return {
         "products": [],
+        "next_cursor": None,
+        "has_more": False,
         "categories": [],
         "stats": {
             "avg_price": 0,
@@ -132,6 +134,7 @@ def get_fallback_data() -> Dict[str, Any]:
             "in_stock": 0,
             "out_of_stock": 0
         },
+        "price_ranges": [],
         "database_available": False,
         "fallback_message": "Database is currently unavailable. Please check your database configuration."
     }
@@ -0,0 +1,123 @@
+"""
+Conditional GET for JSON API endpoints: strong ETags from table state, 304 before the route runs
+"""
+import hashlib
+import logging
+import sqlite3
+from typing import Dict, Optional, Sequence, Tuple
+
+from fastapi import Depends, HTTPException, Request
+from fastapi.responses import Response
+from sqlalchemy import func, select
+from sqlalchemy.exc import DatabaseError, OperationalError
+from sqlmodel import SQLModel
+
+from .config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+
+async def table_state(tables: Sequence[str], settings: Settings) -> Optional[Dict[str, Tuple]]:
+    """
+    Cheap fingerprint of the tables a response is built from, or None if unavailable
+
+    Uses the query cache's table versions when it is running with versions shared
+    by all workers (no query at all); otherwise one ``count(*), max(updated_at)``
+    query per table.
+    """
+    from services.query_cache import get_query_cache
+
+    cache = get_query_cache(settings)
+    if cache is not None and cache.ready and cache.versions.shared:
+        try:
+            versions = await cache.versions.get(tables)
+            return {table: ("v", version) for table, version in versions.items()}
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Table versions unavailable for ETags, reading the tables: {e}")
+
+    from db import AsyncSessionLocal
+
+    state: Dict[str, Tuple] = {}
+    try:
+        async with AsyncSessionLocal() as session:
+            for table in tables:
+                columns = SQLModel.metadata.tables[table].c
+                count, updated = (await session.execute(select(func.count(), func.max(columns.updated_at)))).one()
+                state[table] = (count, str(updated))
+    except (OperationalError, DatabaseError) as e:
+        logger.warning(f"Table state unavailable for ETags: {e}")
+        return None
+    return state
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """``If-None-Match`` comparison (weak, as RFC 9110 requires for this header)"""
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (candidate.strip() for candidate in if_none_match.split(","))
+    return etag in (candidate[2:] if candidate.startswith("W/") else candidate for candidate in candidates)
+
+
+class CacheValidators:
+    """Response headers for a conditional GET: ``ETag`` (when known), ``Cache-Control`` and ``Vary``"""
+
+    def __init__(self, etag: Optional[str], cache_control: str, vary: Optional[str] = None):
+        self.etag = etag
+        self.cache_control = cache_control
+        self.vary = vary
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = {"Cache-Control": self.cache_control}
+        if self.etag is not None:
+            headers["ETag"] = self.etag
+        if self.vary:
+            headers["Vary"] = self.vary
+        return headers
+
+    def apply(self, response: Response) -> Response:
+        """Add the headers to a full (200) response"""
+        response.headers.update(self.headers)
+        return response
+
+
+class ConditionalGet:
+    """
+    Dependency answering ``If-None-Match`` with 304 before the route body runs.
+
+    The strong ETag hashes the route name, the query string, the HTMX flag
+    (when the route also renders partials) and the state of the tables the
+    response is built from, so the body never has to be built to compute it.
+    Place it after authentication dependencies so a 304 is never sent to a
+    client that may not read the resource. The route returns its response
+    through ``validators.apply``.
+    """
+
+    def __init__(self, name: str, tables: Sequence[str], vary_htmx: bool = False):
+        self.name = name
+        self.tables = list(tables)
+        self.vary_htmx = vary_htmx
+
+    async def __call__(self, request: Request, settings: Settings = Depends(get_settings)) -> CacheValidators:
+        cache_control = settings.http_cache_control.get(self.name, settings.http_cache_control_default)
+        vary = "HX-Request" if self.vary_htmx else None
+        if not settings.http_etags_enabled:
+            return CacheValidators(None, cache_control, vary)
+
+        state = await table_state(self.tables, settings)
+        if state is None:
+            # Database unavailable: the route serves its fallback, which must not be validated
+            return CacheValidators(None, "no-store", vary)
+
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.name.encode("utf-8"))
+        digest.update(b"\0" + "&".join(sorted(str(request.query_params).split("&"))).encode("utf-8"))
+        if self.vary_htmx:
+            digest.update(b"\0htmx" if "hx-request" in request.headers else b"\0json")
+        digest.update(b"\0" + repr(sorted(state.items())).encode("utf-8"))
+        validators = CacheValidators(f'"{digest.hexdigest()}"', cache_control, vary)
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, validators.etag):
+            raise HTTPException(status_code=304, headers=validators.headers)
+        return validators
@@ -14,4 +14,19 @@ def get_product_service(
     return ProductService(session=session, settings=settings)
 
 
+def get_http_client():
+    """Dependency to get the shared, lifespan-managed upstream HTTP client"""
+    from services.upstream_client import get_upstream_client
+    return get_upstream_client()
+
+
+def get_chat_service(
+    settings: Settings = Depends(get_settings),
+    http_client=Depends(get_http_client)
+):
+    """Dependency to get ChatService instance"""
+    from services.chat_service import ChatService
+    return ChatService(settings=settings, http_client=http_client)
+
+
 # Note: Other services will be added in Phase 1B
@@ -1,6 +1,7 @@
 # =========================
 # main.py
 # =========================
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -13,7 +14,7 @@ from starlette.middleware.sessions import SessionMiddleware
 
 from admin.setup import setup_admin
 from routes.api import router as api_router
-from routes.chat import router as chat_router
+from routes.chat import router as chat_router, ws_router as chat_ws_router
 from routes.health import router as health_router
 
 try:
@@ -38,6 +39,12 @@ except Exception:
 # Import dependency injection modules
 from dependencies.config import get_settings
 from dependencies.database import create_database_engine, create_session_factory
+from services.batch_jobs import get_batch_job_manager
+from services.knowledge_base import get_knowledge_base
+from services.product_stats import get_product_stats_table
+from services.query_cache import get_query_cache
+from services.upstream_client import close_upstream_client, get_upstream_client
+from services.usage_tracker import get_usage_recorder
 
 # Load environment variables
 load_dotenv()
@@ -56,7 +63,56 @@ except Exception as e:
     print(f"Warning: Storage initialization failed: {e}")
     print("Application will continue but file uploads may not work.")
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application lifespan: create and close app-scoped resources"""
+    # Shared pooled HTTP client for upstream LLM calls
+    upstream_client = get_upstream_client()
+    await upstream_client.start()
+    app.state.upstream_client = upstream_client
+
+    # Workers for batch chat jobs (unfinished items of earlier runs are resumed)
+    batch_jobs = get_batch_job_manager(settings) if settings.batch_workers_enabled else None
+    if batch_jobs is not None:
+        await batch_jobs.start()
+
+    # Batched writer for the llm_usage table
+    usage = get_usage_recorder(settings) if settings.usage_tracking_enabled else None
+    if usage is not None:
+        await usage.start()
+
+    # Vector index over products and webinar registrations for retrieval-augmented chat
+    knowledge = get_knowledge_base(settings)
+    if knowledge is not None:
+        await knowledge.start()
+
+    # Materialized product statistics (rebuilt, then maintained on writes)
+    product_stats = get_product_stats_table(settings)
+    if product_stats is not None:
+        await product_stats.start()
+
+    # Read-through query cache (invalidated on commits that write its tables)
+    query_cache = get_query_cache(settings)
+    if query_cache is not None:
+        await query_cache.start()
+
+    yield
+
+    if query_cache is not None:
+        await query_cache.stop()
+    if product_stats is not None:
+        await product_stats.stop()
+    if knowledge is not None:
+        await knowledge.stop()
+    if batch_jobs is not None:
+        await batch_jobs.stop()
+    if usage is not None:
+        await usage.stop()
+    await close_upstream_client()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(SessionMiddleware, secret_key=settings.secret_key)
 
 
@@ -326,6 +382,7 @@ async def inject_fontawesome_cdn(request: Request, call_next):
 # Include routers
 app.include_router(health_router)
 app.include_router(chat_router, prefix="/api")
+app.include_router(chat_ws_router)
 app.include_router(api_router, prefix="/api")
 if auth_router:
     app.include_router(auth_router)
@@ -5,6 +5,7 @@
 from datetime import UTC, datetime
 import uuid
 
+from sqlalchemy import Index
 from sqlmodel import Field, SQLModel
 
 
@@ -22,6 +23,13 @@ class User(SQLModel, table=True):
 
 class Product(SQLModel, table=True):
     __tablename__ = "products"  # type: ignore
+    # Keyset pagination: one (sort column, id) index per sort order of /api/products
+    __table_args__ = (
+        Index("ix_products_created_at_id", "created_at", "id"),
+        Index("ix_products_price_id", "price", "id"),
+        Index("ix_products_name_id", "name", "id"),
+        Index("ix_products_category_created_at_id", "category", "created_at", "id"),
+    )
 
     id: uuid.UUID | None = Field(default_factory=uuid.uuid4, primary_key=True)
     name: str = Field(max_length=100, nullable=False)
@@ -30,6 +38,31 @@ class Product(SQLModel, table=True):
     category: str | None = Field(max_length=50, default=None, nullable=True)
     in_stock: bool = Field(default=True)
     created_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+    # Set on every ORM update too: max(updated_at) is part of the /api/products ETag
+    updated_at: datetime = Field(
+        default_factory=lambda: datetime.now(UTC), sa_column_kwargs={"onupdate": lambda: datetime.now(UTC)}
+    )
+
+
+class ProductCategoryStats(SQLModel, table=True):
+    __tablename__ = "product_category_stats"  # type: ignore
+
+    # Kept current by services/product_stats.py; "" stands for products without a category
+    category: str = Field(primary_key=True, max_length=50)
+    product_count: int = Field(default=0)
+    in_stock_count: int = Field(default=0)
+    price_sum: float = Field(default=0.0)
+    price_min: float | None = Field(default=None, nullable=True)
+    price_max: float | None = Field(default=None, nullable=True)
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+
+
+class ProductPriceRangeStats(SQLModel, table=True):
+    __tablename__ = "product_price_range_stats"  # type: ignore
+
+    # Kept current by services/product_stats.py; bucket is an index into its PRICE_RANGES
+    bucket: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    product_count: int = Field(default=0)
     updated_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
 
 
@@ -50,7 +83,10 @@ class WebinarRegistrants(SQLModel, table=True):
     notes: str | None = Field(default=None, nullable=True)
     photo_url: str | None = Field(default=None, nullable=True)  # Path to uploaded photo
     created_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+    # Set on every ORM update too: max(updated_at) is part of the registrant list ETags
+    updated_at: datetime = Field(
+        default_factory=lambda: datetime.now(UTC), sa_column_kwargs={"onupdate": lambda: datetime.now(UTC)}
+    )
 
 
 class AuditLog(SQLModel, table=True):
@@ -65,3 +101,71 @@ class AuditLog(SQLModel, table=True):
     ip_address: str | None = Field(default=None, nullable=True)
     user_agent: str | None = Field(default=None, nullable=True)
     timestamp: datetime = Field(default_factory=lambda: datetime.now(UTC))
+
+
+class Conversation(SQLModel, table=True):
+    __tablename__ = "conversations"  # type: ignore
+
+    id: uuid.UUID | None = Field(default_factory=uuid.uuid4, primary_key=True)
+    owner: str = Field(max_length=100, index=True, nullable=False)  # client:<hex> (get_conversation_owner)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+
+
+class ConversationMessage(SQLModel, table=True):
+    __tablename__ = "conversation_messages"  # type: ignore
+
+    id: int | None = Field(default=None, primary_key=True)
+    conversation_id: uuid.UUID = Field(foreign_key="conversations.id", index=True)
+    role: str = Field(max_length=20)  # user, assistant
+    content: str = Field(nullable=False)
+    token_count: int = Field(default=0)  # local estimate used by the context packer
+    created_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+
+
+class ChatBatchJob(SQLModel, table=True):
+    __tablename__ = "chat_batch_jobs"  # type: ignore
+
+    id: uuid.UUID | None = Field(default_factory=uuid.uuid4, primary_key=True)
+    owner: str = Field(max_length=100, index=True, nullable=False)  # user:<id>
+    status: str = Field(default="pending", max_length=20)  # pending, running, completed, cancelled
+    total: int = Field(default=0)
+    completed: int = Field(default=0)
+    failed: int = Field(default=0)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+    finished_at: datetime | None = Field(default=None, nullable=True)
+
+
+class ChatBatchItem(SQLModel, table=True):
+    __tablename__ = "chat_batch_items"  # type: ignore
+
+    id: int | None = Field(default=None, primary_key=True)
+    job_id: uuid.UUID = Field(foreign_key="chat_batch_jobs.id", index=True)
+    position: int = Field(nullable=False)  # order of the prompt in the request
+    prompt: str = Field(nullable=False)
+    status: str = Field(default="pending", max_length=20, index=True)  # pending, running, done, error, cancelled
+    response: str | None = Field(default=None, nullable=True)  # raw markdown answer
+    model: str | None = Field(default=None, nullable=True)
+    error: str | None = Field(default=None, nullable=True)
+    attempts: int = Field(default=0)
+    requeues: int = Field(default=0)  # times put back because the upstream was busy
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+
+
+class LLMUsage(SQLModel, table=True):
+    __tablename__ = "llm_usage"  # type: ignore
+
+    # Append-only: one row per upstream completion, written in batches
+    id: int | None = Field(default=None, primary_key=True)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(UTC), index=True)
+    user_key: str = Field(max_length=100, index=True, nullable=False)  # user:<id>, ip:<address>, batch:<owner>
+    backend: str = Field(max_length=100)
+    model: str = Field(max_length=200, index=True)
+    prompt_tokens: int = Field(default=0)
+    completion_tokens: int = Field(default=0)
+    latency_ms: int = Field(default=0)
+    status: str = Field(default="ok", max_length=20)  # ok, cancelled, truncated
+    streamed: bool = Field(default=False)
+    estimated: bool = Field(default=False)  # local token estimate (the upstream sent no usage)
+    cost: float | None = Field(default=None, nullable=True)  # USD
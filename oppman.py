@@ -53,6 +53,7 @@ Examples:
             "makemigrations", "sqlmigrate", "showmigrations",
             # Core database and user management
             "db", "superuser", "check_users", "test_auth", "change_password", "list_users", "emergency",
+            "product_stats",
             # Project management
             "clean"
         ],
@@ -170,7 +171,7 @@ Examples:
         return
     
     # Handle user management commands (async)
-    core_commands = ["db", "superuser", "check_users", "test_auth", "change_password", "list_users"]
+    core_commands = ["db", "superuser", "check_users", "test_auth", "change_password", "list_users", "product_stats"]
     
     # Handle emergency access command (non-async)
     if args.command == "emergency":
@@ -192,6 +193,8 @@ Examples:
                 await users.run_change_password()
             elif args.command == "list_users":
                 await users.run_list_users()
+            elif args.command == "product_stats":
+                await database.run_product_stats()
         
         # Run the async command
         asyncio.run(run_command())
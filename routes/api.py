@@ -1,34 +1,116 @@
 """
 API routes for data endpoints
 """
-from fastapi import APIRouter, Depends, Request
-from fastapi.responses import JSONResponse
+from datetime import UTC, datetime
+from typing import Optional
+from urllib.parse import urlencode
+
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.templating import Jinja2Templates
 
 from core.services.auth import get_current_staff_or_admin
+from dependencies.http_cache import CacheValidators, ConditionalGet
 from dependencies.services import get_product_service
 from models import User
+from services.product_pagination import ProductFilters
 
 router = APIRouter()
+templates = Jinja2Templates(directory="templates")
 
 
 @router.get("/products")
-async def get_products(product_service = Depends(get_product_service)):
-    """API endpoint to fetch product data for the dashboard"""
-    data = await product_service.get_products_with_stats()
-    return JSONResponse(data)
+async def get_products(
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    sort: str = "newest",
+    category: Optional[str] = None,
+    in_stock: Optional[bool] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    q: Optional[str] = None,
+    validators: CacheValidators = Depends(ConditionalGet("products", ["products"], vary_htmx=True)),
+    product_service = Depends(get_product_service),
+):
+    """API endpoint to fetch product data for the dashboard, one keyset-paginated page at a time"""
+    filters = ProductFilters(
+        category=category, in_stock=in_stock, min_price=min_price, max_price=max_price, search=q
+    )
+    is_htmx = 'hx-request' in request.headers
+    data = await product_service.get_products_with_stats(
+        limit=limit, cursor=cursor, sort=sort, filters=filters, include_stats=not is_htmx
+    )
+
+    # Return table rows (ending in a sentinel that lazily loads the next page) for HTMX requests
+    if is_htmx:
+        next_url = None
+        if data.get("next_cursor"):
+            params = dict(request.query_params, cursor=data["next_cursor"])
+            next_url = f"{request.url.path}?{urlencode(params)}"
+        response = templates.TemplateResponse("partials/product-rows.html", {
+            "request": request,
+            "products": data["products"],
+            "next_url": next_url,
+            "first_page": cursor is None,
+        })
+    else:
+        response = JSONResponse(data)
+    # Fallback data (database unavailable) is never validated
+    return validators.apply(response) if data.get("database_available") else response
+
+
+async def _export_response(name: str, fmt: str, compress: bool) -> StreamingResponse:
+    """Stream an export as a file download, gzip-encoded when ``compress``"""
+    from services.data_export import EXPORT_FORMATS, get_data_export
+
+    body = await get_data_export().start(name, fmt, compress)
+    headers = {
+        "Content-Disposition": f'attachment; filename="{name}-{datetime.now(UTC):%Y%m%d}.{fmt}"',
+        "Cache-Control": "no-store",
+    }
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type=EXPORT_FORMATS[fmt], headers=headers)
+
+
+@router.get("/products/export")
+async def export_products(
+    fmt: str = Query("ndjson", alias="format"),
+    gzip: bool = False,
+    current_user: User = Depends(get_current_staff_or_admin),
+):
+    """Download every product as NDJSON or CSV, streamed while it is read (staff only)"""
+    return await _export_response("products", fmt, gzip)
+
+
+@router.get("/registrants/export")
+async def export_registrants(
+    fmt: str = Query("ndjson", alias="format"),
+    gzip: bool = False,
+    current_user: User = Depends(get_current_staff_or_admin),
+):
+    """Download every webinar registrant as NDJSON or CSV, streamed while it is read (staff only)"""
+    return await _export_response("registrants", fmt, gzip)
 
 
 @router.get("/registrants")
-async def get_registrants(current_user: User = Depends(get_current_staff_or_admin)):
+async def get_registrants(
+    current_user: User = Depends(get_current_staff_or_admin),
+    validators: CacheValidators = Depends(ConditionalGet("registrants", ["webinar_registrants"])),
+):
     """Get all webinar registrants with their photos"""
     from services.webinar_service import WebinarService
     
     registrants = await WebinarService.get_all_registrants()
-    return JSONResponse({"registrants": registrants})
+    return validators.apply(JSONResponse({"registrants": registrants}))
 
 
 @router.get("/webinar-attendees")
-async def get_webinar_attendees(request: Request):
+async def get_webinar_attendees(
+    request: Request,
+    validators: CacheValidators = Depends(ConditionalGet("webinar-attendees", ["webinar_registrants"], vary_htmx=True)),
+):
     """Get webinar attendees for the marketing demo page"""
     from fastapi.templating import Jinja2Templates
 
@@ -41,9 +123,9 @@ async def get_webinar_attendees(request: Request):
     
     # Return HTML for HTMX requests, JSON for API requests
     if 'hx-request' in request.headers:
-        return templates.TemplateResponse("partials/attendees-grid.html", {
+        return validators.apply(templates.TemplateResponse("partials/attendees-grid.html", {
             "request": request,
             "attendees": attendees
-        })
+        }))
     else:
-        return JSONResponse({"attendees": attendees}) 
\ No newline at end of file
+        return validators.apply(JSONResponse({"attendees": attendees})) 
\ No newline at end of file
@@ -1,22 +1,54 @@
 """
 Chat routes for AI chat functionality
 """
+from contextlib import aclosing
 import json
+import os
+import time
+from typing import Optional
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse
+from sqlalchemy.exc import DatabaseError, OperationalError
 from sse_starlette.sse import EventSourceResponse
+from starlette.background import BackgroundTask
 
-from services.chat_service import ChatService
+from core.services.auth import get_current_staff_or_admin, get_current_superuser
+from dependencies.auth import get_conversation_owner, get_rate_limit_key
+from dependencies.services import get_chat_service
+from models import User
+from services.batch_jobs import get_batch_job_manager
+from services.chat_service import ChatService, stream_event_name
+from services.chat_socket import ChatSocketSession
+from services.stream_coalescer import StreamGapError
+from services.stream_resume import get_stream_resumer, parse_last_event_id
+from services.usage_tracker import get_usage_recorder
 
 router = APIRouter()
+# Mounted without the /api prefix (/ws/chat)
+ws_router = APIRouter()
 
 
 @router.get("/chat/test")
-async def test_chat_connection():
-    """Test endpoint to check OpenRouter API connection"""
+async def test_chat_connection(
+    request: Request,
+    probe: bool = False,
+    chat_service: ChatService = Depends(get_chat_service)
+):
+    """
+    Test endpoint to check OpenRouter API connection
+
+    Reports the cached circuit state. ``probe=true`` sends a real completion,
+    outside the governor and usage accounting, so it is honored for superusers
+    only; anyone else gets the cached state.
+    """
+    if probe:
+        try:
+            await get_current_superuser(request)
+        except HTTPException:
+            probe = False
     try:
-        result = await ChatService.test_connection()
+        result = await chat_service.test_connection(probe=probe)
         return JSONResponse(content=result)
     except Exception as e:
         return JSONResponse(
@@ -25,13 +57,103 @@ async def test_chat_connection():
         )
 
 
+@router.get("/chat/metrics")
+async def chat_metrics(
+    chat_service: ChatService = Depends(get_chat_service),
+    current_user: User = Depends(get_current_superuser)
+):
+    """Chat pipeline metrics: cache, governor, batch job and usage counters, process CPU (superusers only)"""
+    metrics = chat_service.get_metrics()
+    metrics["batch_jobs"] = get_batch_job_manager().get_stats()
+    metrics["resumable_streams"] = get_stream_resumer(chat_service.settings).get_stats()
+    metrics["usage"] = chat_service.usage.get_stats() if chat_service.usage else None
+    # CPU time of this worker process (scripts/bench_chat.py reports it per stream)
+    metrics["process"] = {"pid": os.getpid(), "cpu_seconds": time.process_time()}
+    return JSONResponse(content=metrics)
+
+
+@router.get("/chat/usage")
+async def chat_usage(
+    group_by: str = "user",
+    days: int = 7,
+    user: Optional[str] = None,
+    model: Optional[str] = None,
+    limit: int = 50,
+    current_user: User = Depends(get_current_superuser)
+):
+    """Token usage and cost per user, model or day over the last ``days`` days (superusers only)"""
+    # A huge window would overflow the cutoff datetime
+    days = min(max(days, 1), 366)
+    try:
+        rows = await get_usage_recorder().summarize(
+            group_by, days=days, user_key=user, model=model, limit=min(max(limit, 1), 500)
+        )
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except (OperationalError, DatabaseError):
+        return JSONResponse(status_code=503, content={"error": "Usage data is not available"})
+    return JSONResponse(content={"group_by": group_by, "days": days, "rows": rows})
+
+
+@router.post("/chat/knowledge/rebuild")
+async def rebuild_knowledge_base(
+    chat_service: ChatService = Depends(get_chat_service),
+    current_user: User = Depends(get_current_superuser)
+):
+    """Re-index products and webinar registrations for retrieval-augmented chat (superusers only)"""
+    if chat_service.knowledge is None:
+        return JSONResponse(status_code=503, content={"error": "Project data search is not enabled"})
+    try:
+        stats = await chat_service.knowledge.build()
+    except (OperationalError, DatabaseError):
+        return JSONResponse(status_code=503, content={"error": "Database is not available"})
+    return JSONResponse(content={"status": "rebuilt", "index": stats, **chat_service.knowledge.get_stats()})
+
+
+@router.get("/chat/conversations/{conversation_id}")
+async def get_conversation(
+    conversation_id: str,
+    chat_service: ChatService = Depends(get_chat_service),
+    owner: str = Depends(get_conversation_owner)
+):
+    """Get the stored messages of one of the caller's conversations"""
+    history = await chat_service.conversations.get_history(conversation_id, owner)
+    if history is None:
+        return JSONResponse(status_code=404, content={"error": "Conversation not found"})
+    return JSONResponse(content={
+        "conversation_id": conversation_id,
+        "messages": [{"role": m["role"], "content": m["content"]} for m in history]
+    })
+
+
+@router.delete("/chat/conversations/{conversation_id}")
+async def delete_conversation(
+    conversation_id: str,
+    chat_service: ChatService = Depends(get_chat_service),
+    owner: str = Depends(get_conversation_owner)
+):
+    """Delete one of the caller's conversations"""
+    if not await chat_service.conversations.delete(conversation_id, owner):
+        return JSONResponse(status_code=404, content={"error": "Conversation not found"})
+    return JSONResponse(content={"status": "deleted"})
+
+
 @router.post("/chat")
-async def chat_with_llama(request: Request):
+async def chat_with_llama(
+    request: Request,
+    chat_service: ChatService = Depends(get_chat_service),
+    user_key: str = Depends(get_rate_limit_key),
+    owner: str = Depends(get_conversation_owner)
+):
     """Chat endpoint using OpenRouter API with Llama 3.3 70B (non-streaming)"""
     try:
         # Get the request body
         body = await request.json()
         user_message = body.get("message", "")
+        # Omit to start a new conversation; the response carries its id
+        conversation_id = body.get("conversation_id")
+        # Answer from products and webinar registrations retrieved for the message
+        rag = bool(body.get("rag", False))
         
         if not user_message:
             return JSONResponse(
@@ -40,7 +162,9 @@ async def chat_with_llama(request: Request):
             )
         
         # Use service to handle chat
-        response = await ChatService.chat_with_llama(user_message)
+        response = await chat_service.chat_with_llama(
+            user_message, user_key=user_key, conversation_id=conversation_id, rag=rag, owner=owner
+        )
         return JSONResponse(content=response)
         
     except json.JSONDecodeError:
@@ -48,6 +172,13 @@ async def chat_with_llama(request: Request):
             status_code=400,
             content={"error": "Invalid JSON"}
         )
+    except HTTPException as e:
+        # Keeps 429/503 status codes and their Retry-After header
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"error": e.detail},
+            headers=e.headers
+        )
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -56,12 +187,29 @@ async def chat_with_llama(request: Request):
 
 
 @router.post("/chat/stream")
-async def chat_with_llama_stream(request: Request):
-    """Streaming chat endpoint using OpenRouter API with Llama 3.3 70B"""
+async def chat_with_llama_stream(
+    request: Request,
+    chat_service: ChatService = Depends(get_chat_service),
+    user_key: str = Depends(get_rate_limit_key),
+    owner: str = Depends(get_conversation_owner)
+):
+    """
+    Streaming chat endpoint using OpenRouter API with Llama 3.3 70B
+
+    Events carry ids (``<stream id>:<sequence>``); posting again with one of
+    them as ``Last-Event-ID`` resumes that stream instead of starting a new one.
+    """
+    last_event = parse_last_event_id(request.headers.get("last-event-id"))
+    if last_event is not None:
+        return _resumed_stream_response(chat_service, *last_event, owner=owner)
     try:
         # Get the request body
         body = await request.json()
         user_message = body.get("message", "")
+        # "delta" (default) sends append/tail HTML deltas, "snapshot" sends the full HTML each time
+        stream_format = body.get("format", "delta")
+        conversation_id = body.get("conversation_id")
+        rag = bool(body.get("rag", False))
         
         if not user_message:
             return JSONResponse(
@@ -69,26 +217,81 @@ async def chat_with_llama_stream(request: Request):
                 content={"error": "Message is required"}
             )
         
+        if stream_format not in ("delta", "snapshot"):
+            return JSONResponse(
+                status_code=400,
+                content={"error": "Format must be 'delta' or 'snapshot'"}
+            )
+        
+        stream_metrics = chat_service.stream_metrics
+        stream_metrics.record_started()
+        finished = False
+        
         # Create SSE response
         async def event_generator():
+            nonlocal finished
             try:
-                async for chunk in ChatService.chat_with_llama_stream(user_message):
-                    yield {
-                        "event": "message",
-                        "data": json.dumps(chunk)
-                    }
+                async with aclosing(chat_service.chat_with_llama_stream(
+                    user_message,
+                    snapshot=stream_format == "snapshot",
+                    user_key=user_key,
+                    conversation_id=conversation_id,
+                    rag=rag,
+                    owner=owner
+                )) as chunks:
+                    async for chunk in chunks:
+                        yield {
+                            "event": stream_event_name(chunk),
+                            "data": json.dumps(chunk)
+                        }
                 # Send completion event
                 yield {
                     "event": "complete",
                     "data": json.dumps({"status": "completed"})
                 }
+            except HTTPException as e:
+                error = {"error": e.detail, "status_code": e.status_code}
+                if e.headers and "Retry-After" in e.headers:
+                    error["retry_after"] = int(e.headers["Retry-After"])
+                yield {
+                    "event": "error",
+                    "data": json.dumps(error)
+                }
             except Exception as e:
                 yield {
                     "event": "error",
                     "data": json.dumps({"error": str(e)})
                 }
+            finished = True
+        
+        events = event_generator()
+
+        if chat_service.settings.stream_resume_enabled:
+            # The stream outlives the connection for the grace period, so it ends (and is counted) on its own
+            stream = get_stream_resumer(chat_service.settings).start(events, owner=owner)
+            stream.task.add_done_callback(
+                lambda task: stream_metrics.record_completed() if finished else stream_metrics.record_cancelled()
+            )
+            return _resumed_stream_response(chat_service, stream.key, owner=owner)
         
-        return EventSourceResponse(event_generator())
+        async def finish_stream():
+            # EventSourceResponse stops iterating when the client disconnects,
+            # possibly with the generator parked at a yield; closing it closes
+            # the service stream and aborts the upstream request
+            await events.aclose()
+            if finished:
+                stream_metrics.record_completed()
+            else:
+                stream_metrics.record_cancelled()
+        
+        return EventSourceResponse(
+            events,
+            background=BackgroundTask(finish_stream),
+            # Heartbeat comments keep proxies from timing out quiet streams
+            ping=chat_service.settings.stream_heartbeat_interval,
+            # Ask proxies not to buffer or transform the stream (X-Accel-Buffering is set by default)
+            headers={"Cache-Control": "no-cache, no-transform"}
+        )
         
     except json.JSONDecodeError:
         return JSONResponse(
@@ -99,4 +302,182 @@ async def chat_with_llama_stream(request: Request):
         return JSONResponse(
             status_code=500,
             content={"error": f"Internal server error: {str(e)}"}
-        ) 
\ No newline at end of file
+        ) 
+
+
+@router.get("/chat/stream/{stream_id}")
+async def resume_chat_stream(
+    stream_id: str,
+    request: Request,
+    chat_service: ChatService = Depends(get_chat_service),
+    owner: str = Depends(get_conversation_owner)
+):
+    """Attach to a running (or recently finished) chat stream of the caller, after ``Last-Event-ID`` if given"""
+    last_event = parse_last_event_id(request.headers.get("last-event-id"))
+    if last_event is not None and last_event[0] != stream_id:
+        return JSONResponse(status_code=400, content={"error": "Last-Event-ID belongs to another stream"})
+    return _resumed_stream_response(chat_service, stream_id, last_event[1] if last_event else None, owner=owner)
+
+
+def _resumed_stream_response(
+    chat_service: ChatService, stream_id: str, after: Optional[int] = None, owner: Optional[str] = None
+):
+    """SSE response replaying a resumable stream's buffered events after ``after``, then following it live"""
+    try:
+        events = get_stream_resumer(chat_service.settings).subscribe(stream_id, after, owner=owner)
+    except KeyError:
+        return JSONResponse(status_code=404, content={"error": "Stream not found or expired"})
+    except StreamGapError:
+        return JSONResponse(status_code=410, content={"error": "Missed events are no longer buffered"})
+
+    async def event_generator():
+        try:
+            async with aclosing(events):
+                async for event in events:
+                    yield event
+        except StreamGapError:
+            # This client read too slowly and the buffer moved on without it
+            error = {"error": "Missed events are no longer buffered", "status_code": 410}
+            yield {"event": "error", "data": json.dumps(error)}
+
+    follow = event_generator()
+    return EventSourceResponse(
+        follow,
+        # Detaching starts the grace period; the upstream stream keeps running until it ends
+        background=BackgroundTask(follow.aclose),
+        ping=chat_service.settings.stream_heartbeat_interval,
+        headers={"Cache-Control": "no-cache, no-transform", "X-Stream-ID": stream_id}
+    )
+
+
+@router.post("/chat/compare")
+async def compare_models_stream(
+    request: Request,
+    chat_service: ChatService = Depends(get_chat_service),
+    user_key: str = Depends(get_rate_limit_key),
+    current_user: User = Depends(get_current_staff_or_admin)
+):
+    """Stream one prompt from several models at once, each event tagged with its model (staff only)"""
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON"})
+    stream_format = body.get("format", "delta")
+    if stream_format not in ("delta", "snapshot"):
+        return JSONResponse(status_code=400, content={"error": "Format must be 'delta' or 'snapshot'"})
+    models = body.get("models") or []
+    if not isinstance(models, list) or not all(isinstance(model, str) for model in models):
+        return JSONResponse(status_code=400, content={"error": "Models must be a list of model ids"})
+    try:
+        chunks = chat_service.compare_stream(
+            body.get("message", ""), models, snapshot=stream_format == "snapshot", user_key=user_key
+        )
+    except HTTPException as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.detail}, headers=e.headers)
+
+    async def event_generator():
+        # Per-model failures arrive as "result" events; this only covers the comparison itself
+        try:
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    yield {"event": stream_event_name(chunk), "data": json.dumps(chunk)}
+            yield {"event": "complete", "data": json.dumps({"status": "completed"})}
+        except Exception as e:
+            yield {"event": "error", "data": json.dumps({"error": str(e)})}
+
+    events = event_generator()
+    return EventSourceResponse(
+        events,
+        # Closing the generator on disconnect cancels every model's upstream stream
+        background=BackgroundTask(events.aclose),
+        ping=chat_service.settings.stream_heartbeat_interval,
+        headers={"Cache-Control": "no-cache, no-transform"}
+    )
+
+
+@ws_router.websocket("/ws/chat")
+async def chat_websocket(
+    websocket: WebSocket,
+    chat_service: ChatService = Depends(get_chat_service),
+    user_key: str = Depends(get_rate_limit_key),
+    owner: str = Depends(get_conversation_owner)
+):
+    """Chat streams multiplexed over one socket, with cancel and regenerate frames (see ``ChatSocketSession``)"""
+    await websocket.accept()
+    session = ChatSocketSession(chat_service, user_key, websocket.send_json, websocket.close, owner=owner)
+    await session.start()
+    try:
+        while True:
+            try:
+                frame = await websocket.receive_json()
+            except json.JSONDecodeError:
+                session.reject("Invalid JSON")
+                continue
+            await session.handle(frame)
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: the session closed the socket itself (client not reading)
+        pass
+    finally:
+        await session.close()
+
+
+@router.post("/chat/batch")
+async def create_chat_batch(request: Request, current_user: User = Depends(get_current_staff_or_admin)):
+    """Queue a batch of prompts (``{"prompts": [...]}``); answers are collected by background workers"""
+    try:
+        body = await request.json()
+        job = await get_batch_job_manager().create_job(f"user:{current_user.id}", body.get("prompts"))
+        return JSONResponse(status_code=202, content=job)
+    except json.JSONDecodeError:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON"})
+    except HTTPException as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.detail})
+
+
+@router.get("/chat/batch/{job_id}")
+async def get_chat_batch(job_id: str, current_user: User = Depends(get_current_staff_or_admin)):
+    """Progress of one of the caller's batch jobs"""
+    job = await get_batch_job_manager().get_job(job_id, f"user:{current_user.id}")
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Batch job not found"})
+    return JSONResponse(content=job)
+
+
+@router.get("/chat/batch/{job_id}/results")
+async def get_chat_batch_results(
+    job_id: str,
+    after: int = -1,
+    limit: int = 100,
+    current_user: User = Depends(get_current_staff_or_admin)
+):
+    """Page through a batch job's items in prompt order (pass ``next_after`` as ``after``)"""
+    page = await get_batch_job_manager().get_items(job_id, f"user:{current_user.id}", after=after, limit=limit)
+    if page is None:
+        return JSONResponse(status_code=404, content={"error": "Batch job not found"})
+    return JSONResponse(content=page)
+
+
+@router.get("/chat/batch/{job_id}/events")
+async def stream_chat_batch(job_id: str, current_user: User = Depends(get_current_staff_or_admin)):
+    """SSE progress events for a batch job, ending with ``complete`` when it finishes"""
+    manager = get_batch_job_manager()
+    owner = f"user:{current_user.id}"
+    if await manager.get_job(job_id, owner) is None:
+        return JSONResponse(status_code=404, content={"error": "Batch job not found"})
+
+    async def event_generator():
+        async with aclosing(manager.watch(job_id, owner)) as updates:
+            async for job in updates:
+                yield {"event": "progress", "data": json.dumps(job)}
+        yield {"event": "complete", "data": json.dumps({"status": "completed"})}
+
+    return EventSourceResponse(event_generator(), headers={"Cache-Control": "no-cache, no-transform"})
+
+
+@router.delete("/chat/batch/{job_id}")
+async def cancel_chat_batch(job_id: str, current_user: User = Depends(get_current_staff_or_admin)):
+    """Cancel the pending items of one of the caller's batch jobs"""
+    job = await get_batch_job_manager().cancel_job(job_id, f"user:{current_user.id}")
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Batch job not found"})
+    return JSONResponse(content=job)
@@ -1,10 +1,11 @@
 """
 Health check routes
 """
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from fastapi.responses import JSONResponse
 
 from dependencies.database_health import get_database_status
+from dependencies.services import get_http_client
 
 router = APIRouter()
 
@@ -22,3 +23,18 @@ async def database_health_check():
     """Database health check endpoint"""
     status = await get_database_status()
     return JSONResponse(status)
+
+
+@router.get("/health/upstream")
+async def upstream_health_check(http_client=Depends(get_http_client)):
+    """Upstream LLM connection pool statistics"""
+    return JSONResponse(http_client.get_stats())
+
+
+@router.get("/health/query-cache")
+async def query_cache_health_check():
+    """Query cache hit rate, invalidations and size"""
+    from services.query_cache import get_query_cache
+
+    cache = get_query_cache()
+    return JSONResponse(cache.get_stats() if cache is not None else {"enabled": False})
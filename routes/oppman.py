@@ -17,12 +17,14 @@ from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from fastapi_users.password import PasswordHelper
 from sqlalchemy import text
+from sqlalchemy.exc import DatabaseError, OperationalError
 from sqlmodel import SQLModel, select
 
 from core.services.auth import get_current_superuser
 from db import AsyncSessionLocal
 from dependencies.config import Settings, get_settings
 from models import User
+from services.usage_tracker import GROUP_BY as USAGE_GROUP_BY, get_usage_recorder
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
@@ -274,6 +276,35 @@ async def run_user_management_command(
         return JSONResponse(result)
 
 
+@router.get("/usage", response_class=HTMLResponse)
+async def usage_panel(
+    request: Request,
+    group_by: str = "user",
+    days: int = 7,
+    current_user: User = Depends(get_current_superuser)
+):
+    """LLM token usage panel (HTMX partial): top users, models or days"""
+    if group_by not in USAGE_GROUP_BY:
+        group_by = "user"
+    days = min(max(days, 1), 365)
+    try:
+        rows = await get_usage_recorder().summarize(group_by, days=days, limit=25)
+        error = None
+    except (OperationalError, DatabaseError) as e:
+        rows, error = [], f"Usage table not available: {e.__class__.__name__}"
+    return templates.TemplateResponse("partials/usage-table.html", {
+        "request": request,
+        "rows": rows,
+        "group_by": group_by,
+        "days": days,
+        "error": error,
+        "totals": {
+            "requests": sum(row["requests"] for row in rows),
+            "total_tokens": sum(row["total_tokens"] for row in rows),
+            "cost": sum(row["cost"] or 0 for row in rows),
+        },
+    })
+
 
 # =========================
 # EMERGENCY ACCESS ROUTES
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Streaming benchmark for /api/chat/stream
+Drives the endpoint with K concurrent clients and reports time-to-first-token,
+tokens per second, end-to-end latency percentiles and server CPU per stream.
+
+Usage (with the app pointed at scripts/mock_llm.py):
+    uv run python -m scripts.bench_chat --url http://127.0.0.1:8000 --clients 20 --requests 200
+
+Server CPU comes from /api/chat/metrics, which needs a superuser: pass the
+``access_token`` cookie of a logged-in superuser with --access-token.
+"""
+import argparse
+import asyncio
+import json
+import math
+import time
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from services.conversation_store import estimate_tokens
+
+
+class StreamResult:
+    """Timings of one benchmarked stream"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.text = ""
+        self.error: Optional[str] = None
+
+    @property
+    def ttft(self) -> Optional[float]:
+        return self.first_token - self.started if self.first_token else None
+
+    @property
+    def latency(self) -> Optional[float]:
+        return self.finished - self.started if self.finished else None
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.text)
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        if not self.first_token or not self.finished or self.finished <= self.first_token:
+            return None
+        return self.tokens / (self.finished - self.first_token)
+
+
+def percentile(values: List[float], quantile: float) -> Optional[float]:
+    """Nearest-rank percentile (None for no values)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(quantile * len(ordered)) - 1))]
+
+
+async def run_stream(session: aiohttp.ClientSession, url: str, message: str) -> StreamResult:
+    """Send one streaming chat request and time its events"""
+    result = StreamResult()
+    event = None
+    try:
+        async with session.post(f"{url}/api/chat/stream", json={"message": message}) as response:
+            if response.status != 200:
+                result.error = f"HTTP {response.status}"
+                return result
+            async for raw_line in response.content:
+                line = raw_line.decode("utf-8").rstrip("\r\n")
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:") and event == "message":
+                    chunk = json.loads(line[5:].strip())
+                    if result.first_token is None:
+                        result.first_token = time.perf_counter()
+                    result.text += chunk.get("raw_delta") or ""
+                elif line.startswith("data:") and event == "error":
+                    result.error = json.loads(line[5:].strip()).get("error", "stream error")
+                elif line.startswith("data:") and event == "complete":
+                    break
+        result.finished = time.perf_counter()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        result.error = repr(e)
+    return result
+
+
+async def fetch_server_cpu(session: aiohttp.ClientSession, url: str) -> Optional[Dict[str, Any]]:
+    """CPU time of the app process from /api/chat/metrics (None without superuser access)"""
+    try:
+        async with session.get(f"{url}/api/chat/metrics") as response:
+            if response.status != 200:
+                return None
+            return (await response.json()).get("process")
+    except (aiohttp.ClientError, json.JSONDecodeError):
+        return None
+
+
+async def run_benchmark(
+    url: str,
+    clients: int,
+    requests: int,
+    prompt: str,
+    same_prompt: bool,
+    timeout: float,
+    access_token: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Run ``requests`` streams with ``clients`` concurrent workers and summarize them"""
+    url = url.rstrip("/")
+    results: List[StreamResult] = []
+    counter = iter(range(requests))
+    timeout_config = aiohttp.ClientTimeout(total=timeout)
+    connector = aiohttp.TCPConnector(limit=clients)
+
+    cookies = {"access_token": access_token} if access_token else None
+
+    async with aiohttp.ClientSession(timeout=timeout_config, connector=connector, cookies=cookies) as session:
+        cpu_before = await fetch_server_cpu(session, url)
+
+        async def client():
+            for index in counter:
+                # Unique prompts by default so the response cache and coalescing do not kick in
+                message = prompt if same_prompt else f"{prompt} (request {index})"
+                results.append(await run_stream(session, url, message))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+        cpu_after = await fetch_server_cpu(session, url)
+
+    ok = [result for result in results if not result.error and result.finished]
+    ttfts = [result.ttft for result in ok if result.ttft is not None]
+    latencies = [result.latency for result in ok]
+    rates = [rate for rate in (result.tokens_per_second for result in ok) if rate]
+
+    server_cpu_per_stream = None
+    if cpu_before and cpu_after and cpu_before.get("pid") == cpu_after.get("pid") and results:
+        server_cpu_per_stream = (cpu_after["cpu_seconds"] - cpu_before["cpu_seconds"]) / len(results)
+
+    def ms(value: Optional[float]) -> Optional[float]:
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        "requests": len(results),
+        "clients": clients,
+        "ok": len(ok),
+        "errors": len(results) - len(ok),
+        "error_samples": sorted({result.error for result in results if result.error})[:5],
+        "elapsed_s": round(elapsed, 2),
+        "ttft_ms": {"p50": ms(percentile(ttfts, 0.5)), "p95": ms(percentile(ttfts, 0.95)),
+                    "p99": ms(percentile(ttfts, 0.99))},
+        "latency_ms": {"p50": ms(percentile(latencies, 0.5)), "p99": ms(percentile(latencies, 0.99))},
+        "tokens_per_second": {
+            "per_stream_p50": round(percentile(rates, 0.5), 1) if rates else None,
+            "aggregate": round(sum(result.tokens for result in ok) / elapsed, 1) if elapsed else None,
+        },
+        "server_cpu_ms_per_stream": ms(server_cpu_per_stream),
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    """Print a benchmark summary"""
+    print(f"📊 /api/chat/stream: {report['requests']} requests, {report['clients']} concurrent clients, "
+          f"{report['elapsed_s']}s")
+    print(f"   ok {report['ok']}, errors {report['errors']}")
+    for error in report["error_samples"]:
+        print(f"   ⚠️  {error}")
+    ttft = report["ttft_ms"]
+    latency = report["latency_ms"]
+    rates = report["tokens_per_second"]
+    print(f"   TTFT        p50 {ttft['p50']} ms, p95 {ttft['p95']} ms, p99 {ttft['p99']} ms")
+    print(f"   End-to-end  p50 {latency['p50']} ms, p99 {latency['p99']} ms")
+    print(f"   Tokens/s    {rates['per_stream_p50']} per stream (p50), {rates['aggregate']} aggregate")
+    cpu = report["server_cpu_ms_per_stream"]
+    if cpu is None:
+        print("   Server CPU  n/a (needs --access-token of a superuser and a single app worker)")
+    else:
+        print(f"   Server CPU  {cpu} ms per stream")
+
+
+def main():
+    """Run the streaming benchmark"""
+    parser = argparse.ArgumentParser(description="Benchmark /api/chat/stream")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of the app")
+    parser.add_argument("--clients", type=int, default=10, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=100, help="Total streams to run")
+    parser.add_argument("--prompt", default="Tell me a story", help="Prompt to send")
+    parser.add_argument("--same-prompt", action="store_true", help="Send identical prompts (tests cache/coalescing)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request timeout in seconds")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--access-token", help="access_token cookie of a superuser, to read server CPU")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmark(
+        args.url, args.clients, args.requests, args.prompt, args.same_prompt, args.timeout, args.access_token
+    ))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,8 @@ from datetime import datetime
 from pathlib import Path
 import shutil
 
+from sqlalchemy.exc import DatabaseError, OperationalError
+
 
 def backup_database():
     """Backup the current database with timestamp"""
@@ -109,3 +111,25 @@ def delete_migration_files() -> bool:
     except Exception as e:
         print(f"❌ Failed to delete migration files: {e}")
         return False
+
+
+async def run_product_stats():
+    """Compare the product statistics table with the products table and rebuild it"""
+    from services.product_stats import ProductStatsTable
+
+    print("🔄 Checking product statistics...")
+    try:
+        result = await ProductStatsTable().check(rebuild=True)
+    except (OperationalError, DatabaseError) as e:
+        print(f"❌ Database not available: {e}")
+        print("Run 'uv run python oppman.py db' to create the tables")
+        return False
+    if result["mismatched"]:
+        names = ", ".join(key or "(no category)" for key in result["mismatched"])
+        print(f"⚠️  {len(result['mismatched'])} stale categories: {names}")
+    if result["mismatched_ranges"]:
+        print(f"⚠️  {len(result['mismatched_ranges'])} stale price ranges: {', '.join(result['mismatched_ranges'])}")
+    if not (result["mismatched"] or result["mismatched_ranges"]):
+        print(f"✅ Statistics matched the products table ({result['categories']} categories)")
+    print("✅ Product statistics table rebuilt")
+    return True
@@ -30,6 +30,7 @@ COMMANDS:
     sqlmigrate  Show SQL for a migration (Django-style)
     showmigrations  Show migration status (Django-style)
     db          Initialize database (creates all tables)
+    product_stats  Check the product statistics table and rebuild it
     
     # User management
     superuser   Create superuser account
@@ -62,6 +63,7 @@ EXAMPLES:
     uv run python oppman.py migrate        # Apply migrations (Django-style)
     uv run python oppman.py sqlmigrate abc123def  # Show SQL for migration
     uv run python oppman.py showmigrations # Show migration status
+    uv run python oppman.py product_stats  # Check and rebuild product statistics
     
     # User management
     uv run python oppman.py superuser      # Create superuser
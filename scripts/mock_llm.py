@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Local OpenAI-compatible mock upstream for ChatService
+Serves /v1/chat/completions (streaming SSE and plain JSON) with configurable
+time-to-first-token, token rate, jitter and error injection, so the chat
+pipeline can be exercised and benchmarked without calling OpenRouter.
+
+Usage:
+    uv run python -m scripts.mock_llm --port 9100 --tokens-per-second 50 --ttft 0.3
+
+Point the app at it with:
+    LLM_BASE_URL=http://127.0.0.1:9100/v1 OPENROUTER_API_KEY=mock uv run python oppman.py runserver
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional
+import uuid
+
+from aiohttp import web
+
+from services.chat_service import mock_response_parts
+
+_TOKEN_RE = re.compile(r"\s*\S+")
+
+CONFIG_KEY = web.AppKey("config", "MockUpstreamConfig")
+STATS_KEY = web.AppKey("stats", Dict[str, int])
+
+
+class MockUpstreamConfig:
+    """Behaviour of the mock upstream"""
+
+    def __init__(
+        self,
+        tokens_per_second: float = 50.0,
+        ttft: float = 0.3,
+        jitter: float = 0.2,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        disconnect_rate: float = 0.0,
+        response_tokens: Optional[int] = None,
+    ):
+        self.tokens_per_second = tokens_per_second
+        self.ttft = ttft
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.disconnect_rate = disconnect_rate
+        self.response_tokens = response_tokens
+
+
+def split_tokens(text: str) -> List[str]:
+    """Split text into word-sized pseudo tokens (leading whitespace kept)"""
+    return _TOKEN_RE.findall(text)
+
+
+def response_tokens(user_message: str, count: Optional[int] = None) -> List[str]:
+    """Tokens of the canned answer, repeated or cut to ``count`` tokens when given"""
+    tokens = split_tokens("".join(mock_response_parts(user_message)))
+    if not count:
+        return tokens
+    repeated = []
+    while len(repeated) < count:
+        repeated.extend(tokens if not repeated else [" ", *tokens])
+    return repeated[:count]
+
+
+def _jittered(config: MockUpstreamConfig, seconds: float) -> float:
+    if seconds <= 0:
+        return 0.0
+    return max(0.0, seconds * (1 + random.uniform(-config.jitter, config.jitter)))
+
+
+def _last_user_message(body: Dict[str, Any]) -> str:
+    for message in reversed(body.get("messages") or []):
+        if message.get("role") == "user":
+            return str(message.get("content") or "")
+    return ""
+
+
+def _usage(body: Dict[str, Any], completion_tokens: int) -> Dict[str, int]:
+    prompt_tokens = sum(len(split_tokens(str(m.get("content") or ""))) for m in body.get("messages") or [])
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _chunk(
+    completion_id: str,
+    model: str,
+    delta: Optional[Dict[str, Any]],
+    finish_reason: Optional[str] = None,
+    usage: Optional[Dict[str, int]] = None,
+) -> bytes:
+    data: Dict[str, Any] = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        # The usage chunk of stream_options.include_usage has no choices
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+    }
+    if usage is not None:
+        data["usage"] = usage
+    return f"data: {json.dumps(data)}\n\n".encode()
+
+
+async def chat_completions(request: web.Request) -> web.StreamResponse:
+    config: MockUpstreamConfig = request.app[CONFIG_KEY]
+    stats: Dict[str, int] = request.app[STATS_KEY]
+    stats["requests"] += 1
+
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        return web.json_response({"error": {"message": "Invalid JSON", "code": 400}}, status=400)
+
+    if config.error_rate and random.random() < config.error_rate:
+        stats["errors"] += 1
+        headers = {"Retry-After": "1"} if config.error_status in (429, 503) else None
+        return web.json_response(
+            {"error": {"message": "Injected upstream error", "code": config.error_status}},
+            status=config.error_status,
+            headers=headers,
+        )
+
+    model = body.get("model") or "mock-model"
+    tokens = response_tokens(_last_user_message(body), config.response_tokens)
+    max_tokens = body.get("max_tokens")
+    if max_tokens:
+        tokens = tokens[:max_tokens]
+    completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+
+    await asyncio.sleep(_jittered(config, config.ttft))
+
+    if not body.get("stream"):
+        return web.json_response({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": _usage(body, len(tokens)),
+        })
+
+    stats["streams"] += 1
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+
+    # Cut some streams off part-way to exercise truncation handling
+    cut_at = random.randrange(len(tokens)) if tokens and random.random() < config.disconnect_rate else None
+    interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+    try:
+        await response.write(_chunk(completion_id, model, {"role": "assistant", "content": ""}))
+        for index, token in enumerate(tokens):
+            if index == cut_at:
+                stats["disconnects"] += 1
+                request.transport.close()
+                return response
+            if index:
+                await asyncio.sleep(_jittered(config, interval))
+            await response.write(_chunk(completion_id, model, {"content": token}))
+        await response.write(_chunk(completion_id, model, {}, finish_reason="stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await response.write(_chunk(completion_id, model, None, usage=_usage(body, len(tokens))))
+        await response.write(b"data: [DONE]\n\n")
+    except (ConnectionResetError, asyncio.CancelledError):
+        # The client (ChatService) closed the stream early
+        stats["client_aborts"] += 1
+        raise
+    return response
+
+
+async def list_models(request: web.Request) -> web.Response:
+    return web.json_response({"object": "list", "data": [{"id": "mock-model", "object": "model"}]})
+
+
+async def get_stats(request: web.Request) -> web.Response:
+    return web.json_response(request.app[STATS_KEY])
+
+
+def create_app(config: Optional[MockUpstreamConfig] = None) -> web.Application:
+    """Build the mock upstream application"""
+    app = web.Application()
+    app[CONFIG_KEY] = config or MockUpstreamConfig()
+    app[STATS_KEY] = {"requests": 0, "streams": 0, "errors": 0, "disconnects": 0, "client_aborts": 0}
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/v1/models", list_models)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+def main():
+    """Run the mock upstream server"""
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible mock upstream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Token rate per stream")
+    parser.add_argument("--ttft", type=float, default=0.3, help="Seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relative jitter on TTFT and token gaps (0-1)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of injected errors")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="Fraction of streams cut off mid-way")
+    parser.add_argument("--response-tokens", type=int, default=None, help="Answer length (default: canned text)")
+    args = parser.parse_args()
+
+    config = MockUpstreamConfig(
+        tokens_per_second=args.tokens_per_second,
+        ttft=args.ttft,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        disconnect_rate=args.disconnect_rate,
+        response_tokens=args.response_tokens,
+    )
+    print(f"🧪 Mock LLM upstream at http://{args.host}:{args.port}/v1")
+    print(f"   {config.tokens_per_second} tokens/s, TTFT {config.ttft}s, jitter {config.jitter:.0%}, "
+          f"errors {config.error_rate:.0%} ({config.error_status})")
+    print(f"💡 Start the app with LLM_BASE_URL=http://{args.host}:{args.port}/v1 and any OPENROUTER_API_KEY")
+    web.run_app(create_app(config), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+"""
+Batch chat jobs: many prompts run by a bounded worker pool, with job state in the database
+"""
+import asyncio
+from datetime import UTC, datetime, timedelta
+import logging
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Set
+import uuid
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, update
+from sqlalchemy.exc import DatabaseError, OperationalError
+from sqlmodel import select
+
+from dependencies.config import Settings, get_settings
+from models import ChatBatchItem, ChatBatchJob
+from services.chat_service import ChatService
+
+logger = logging.getLogger(__name__)
+
+# Job statuses
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_CANCELLED = "cancelled"
+
+# Item statuses
+ITEM_PENDING = "pending"
+ITEM_RUNNING = "running"
+ITEM_DONE = "done"
+ITEM_ERROR = "error"
+ITEM_CANCELLED = "cancelled"
+
+# Seconds an idle worker waits before looking for new items (other processes may add them)
+IDLE_POLL_INTERVAL = 5.0
+
+# Seconds between progress snapshots when nothing changes in this process
+PROGRESS_POLL_INTERVAL = 2.0
+
+# Longest pause after the governor asks a batch item to come back later
+MAX_REQUEUE_DELAY = 60.0
+
+# Statuses that mean the upstream is busy; the item is put back instead of failing
+REQUEUE_STATUSES = (429, 503)
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _job_dict(job: ChatBatchJob) -> Dict[str, Any]:
+    return {
+        "job_id": str(job.id),
+        "status": job.status,
+        "total": job.total,
+        "completed": job.completed,
+        "failed": job.failed,
+        "remaining": job.total - job.completed - job.failed,
+        "created_at": _isoformat(job.created_at),
+        "updated_at": _isoformat(job.updated_at),
+        "finished_at": _isoformat(job.finished_at),
+    }
+
+
+def _item_dict(item: ChatBatchItem) -> Dict[str, Any]:
+    return {
+        "position": item.position,
+        "status": item.status,
+        "prompt": item.prompt,
+        "response": item.response,
+        "model": item.model,
+        "error": item.error,
+        "attempts": item.attempts,
+    }
+
+
+class BatchJobManager:
+    """
+    Run batch chat jobs with a pool of ``batch_concurrency`` workers.
+
+    Jobs and their items live in the chat_batch_jobs / chat_batch_items
+    tables, which also serve as the work queue: a worker claims the oldest
+    pending item with a conditional update (safe across processes), sends it
+    through ``ChatService.complete`` and stores the answer. An item left
+    running by a worker that died is claimed again once its
+    ``batch_item_lease`` expires, so jobs resume after a restart.
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        chat_service_factory: Optional[Callable[[], ChatService]] = None,
+        session_factory=None,
+    ):
+        self.settings = settings
+        self.concurrency = max(1, settings.batch_concurrency)
+        self._chat_service_factory = chat_service_factory or (lambda: ChatService(settings=settings))
+        self._session_factory = session_factory
+        self._workers: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        # One event per watcher of a job, set (and dropped) when the job changes
+        self._job_events: Dict[str, Set[asyncio.Event]] = {}
+        self.jobs_created = 0
+        self.items_done = 0
+        self.items_failed = 0
+        self.items_requeued = 0
+        self.items_reclaimed = 0
+        self.db_errors = 0
+
+    def _sessions(self):
+        if self._session_factory is None:
+            from db import AsyncSessionLocal
+            self._session_factory = AsyncSessionLocal
+        return self._session_factory
+
+    async def start(self) -> None:
+        """Start the worker pool (idempotent)"""
+        if self._workers:
+            return
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"chat-batch-worker-{index}")
+            for index in range(self.concurrency)
+        ]
+        logger.info(f"Started {self.concurrency} batch chat workers")
+
+    async def stop(self) -> None:
+        """Stop the workers; items they were running go back to pending"""
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    async def create_job(self, owner: str, prompts: List[str]) -> Dict[str, Any]:
+        """
+        Store a new job with one item per prompt and wake the workers
+
+        Args:
+            owner: Caller identity (``user:<id>``)
+            prompts: The prompts, answered independently
+
+        Returns:
+            dict: The job summary
+
+        Raises:
+            HTTPException: 400 for invalid prompts, 503 when the database is unavailable
+        """
+        if not isinstance(prompts, list) or not prompts:
+            raise HTTPException(status_code=400, detail="prompts must be a non-empty list of strings")
+        if len(prompts) > self.settings.batch_max_prompts:
+            raise HTTPException(
+                status_code=400,
+                detail=f"A batch can contain at most {self.settings.batch_max_prompts} prompts"
+            )
+        for prompt in prompts:
+            if not isinstance(prompt, str) or not prompt.strip():
+                raise HTTPException(status_code=400, detail="Every prompt must be a non-empty string")
+            if len(prompt) > self.settings.batch_max_prompt_chars:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Prompts can be at most {self.settings.batch_max_prompt_chars} characters"
+                )
+
+        job = ChatBatchJob(owner=owner, total=len(prompts))
+        try:
+            async with self._sessions()() as session:
+                session.add(job)
+                session.add_all(
+                    ChatBatchItem(job_id=job.id, position=position, prompt=prompt)
+                    for position, prompt in enumerate(prompts)
+                )
+                await session.commit()
+                await session.refresh(job)
+        except (OperationalError, DatabaseError) as e:
+            self._db_error("create", e)
+            raise HTTPException(status_code=503, detail="Batch jobs are unavailable (database error)") from e
+
+        self.jobs_created += 1
+        self._wake_workers()
+        return _job_dict(job)
+
+    async def get_job(self, job_id: str, owner: str) -> Optional[Dict[str, Any]]:
+        """Get a job summary, or None if unknown or not owned"""
+        job = await self._load_job(job_id, owner)
+        return _job_dict(job) if job else None
+
+    async def get_items(
+        self, job_id: str, owner: str, after: int = -1, limit: int = 100
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Page through a job's items in prompt order
+
+        Args:
+            after: Return items with a position greater than this (from ``next_after``)
+            limit: Page size (capped at 500)
+
+        Returns:
+            dict: ``items`` and ``next_after`` (None on the last page), or None if the job is unknown
+        """
+        job = await self._load_job(job_id, owner)
+        if job is None:
+            return None
+        limit = max(1, min(limit, 500))
+        async with self._sessions()() as session:
+            result = await session.execute(
+                select(ChatBatchItem)
+                .where(ChatBatchItem.job_id == job.id, ChatBatchItem.position > after)
+                .order_by(ChatBatchItem.position)  # type: ignore
+                .limit(limit)
+            )
+            items = list(result.scalars().all())
+        return {
+            "job": _job_dict(job),
+            "items": [_item_dict(item) for item in items],
+            "next_after": items[-1].position if len(items) == limit else None,
+        }
+
+    async def cancel_job(self, job_id: str, owner: str) -> Optional[Dict[str, Any]]:
+        """Cancel a job's pending items (running items finish); None if unknown or not owned"""
+        job = await self._load_job(job_id, owner)
+        if job is None:
+            return None
+        now = datetime.now(UTC)
+        async with self._sessions()() as session:
+            await session.execute(
+                update(ChatBatchItem)
+                .where(ChatBatchItem.job_id == job.id, ChatBatchItem.status == ITEM_PENDING)  # type: ignore
+                .values(status=ITEM_CANCELLED, updated_at=now)
+            )
+            await session.execute(
+                update(ChatBatchJob)
+                .where(ChatBatchJob.id == job.id, ChatBatchJob.status.in_([JOB_PENDING, JOB_RUNNING]))  # type: ignore
+                .values(status=JOB_CANCELLED, updated_at=now, finished_at=now)
+            )
+            await session.commit()
+        self._notify_job(job_id)
+        return await self.get_job(job_id, owner)
+
+    async def watch(self, job_id: str, owner: str) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Yield the job summary whenever it changes, until the job finishes
+
+        Yields:
+            dict: Job summaries (the first one immediately)
+        """
+        # Unknown jobs and other owners' jobs register nothing
+        if await self.get_job(job_id, owner) is None:
+            return
+        last = None
+        event: Optional[asyncio.Event] = None
+        try:
+            while True:
+                # Registered before reading the job, so a change in between still wakes this watcher
+                event = asyncio.Event()
+                self._job_events.setdefault(job_id, set()).add(event)
+                job = await self.get_job(job_id, owner)
+                if job is None:
+                    return
+                if job != last:
+                    yield job
+                    last = job
+                if job["status"] in (JOB_COMPLETED, JOB_CANCELLED):
+                    return
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=PROGRESS_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._forget_watcher(job_id, event)
+        finally:
+            if event is not None:
+                self._forget_watcher(job_id, event)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get batch worker counters"""
+        return {
+            "workers": len(self._workers),
+            "jobs_created": self.jobs_created,
+            "items_done": self.items_done,
+            "items_failed": self.items_failed,
+            "items_requeued": self.items_requeued,
+            "items_reclaimed": self.items_reclaimed,
+            "db_errors": self.db_errors,
+        }
+
+    async def _load_job(self, job_id: str, owner: str) -> Optional[ChatBatchJob]:
+        try:
+            key = uuid.UUID(job_id)
+        except ValueError:
+            return None
+        async with self._sessions()() as session:
+            job = await session.get(ChatBatchJob, key)
+        if job is None or job.owner != owner:
+            return None
+        return job
+
+    async def _worker(self) -> None:
+        chat_service = self._chat_service_factory()
+        while True:
+            try:
+                claim = await self._claim()
+            except (OperationalError, DatabaseError) as e:
+                self._db_error("claim", e)
+                claim = None
+            if claim is None:
+                await self._idle()
+                continue
+            delay = await self._run_item(chat_service, claim)
+            if delay:
+                await asyncio.sleep(delay)
+
+    async def _idle(self) -> None:
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=IDLE_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+    def _wake_workers(self) -> None:
+        self._wakeup.set()
+        self._wakeup = asyncio.Event()
+
+    def _notify_job(self, job_id: str) -> None:
+        for event in self._job_events.pop(job_id, ()):
+            event.set()
+
+    def _forget_watcher(self, job_id: str, event: asyncio.Event) -> None:
+        events = self._job_events.get(job_id)
+        if events is not None:
+            events.discard(event)
+            if not events:
+                del self._job_events[job_id]
+
+    def _claimable(self, now: datetime):
+        stale = now - timedelta(seconds=self.settings.batch_item_lease)
+        return or_(
+            ChatBatchItem.status == ITEM_PENDING,
+            and_(ChatBatchItem.status == ITEM_RUNNING, ChatBatchItem.updated_at < stale),  # type: ignore
+        )
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        """Mark the oldest claimable item as running and return it, or None when there is no work"""
+        now = datetime.now(UTC)
+        claimable = self._claimable(now)
+        async with self._sessions()() as session:
+            result = await session.execute(
+                select(ChatBatchItem.id, ChatBatchItem.status)
+                .where(claimable)
+                .order_by(ChatBatchItem.id)  # type: ignore
+                .limit(self.concurrency + 1)
+            )
+            for item_id, status in result.all():
+                # Another worker (or process) may have claimed it since the select
+                claimed = await session.execute(
+                    update(ChatBatchItem)
+                    .where(ChatBatchItem.id == item_id, claimable)  # type: ignore
+                    .values(status=ITEM_RUNNING, updated_at=now, attempts=ChatBatchItem.attempts + 1)
+                )
+                if claimed.rowcount != 1:
+                    continue
+                item = await session.get(ChatBatchItem, item_id)
+                job = await session.get(ChatBatchJob, item.job_id)
+                if job.status == JOB_PENDING:
+                    job.status = JOB_RUNNING
+                    job.updated_at = now
+                await session.commit()
+                if status == ITEM_RUNNING:
+                    self.items_reclaimed += 1
+                    logger.warning(f"Reclaiming batch item {item_id} after its lease expired")
+                return {
+                    "item_id": item_id,
+                    "job_id": str(item.job_id),
+                    "owner": job.owner,
+                    "prompt": item.prompt,
+                    "attempts": item.attempts,
+                    "requeues": item.requeues,
+                }
+        return None
+
+    async def _run_item(self, chat_service: ChatService, claim: Dict[str, Any]) -> float:
+        """Answer one item; returns seconds to pause when the upstream asked us to slow down"""
+        if claim["attempts"] > self.settings.batch_max_attempts:
+            await self._finish_item(claim, ITEM_ERROR, error=f"Gave up after {claim['attempts'] - 1} attempts")
+            return 0.0
+        try:
+            # Batch traffic has its own per-user bucket so it cannot starve the owner's chats
+            result = await chat_service.complete(claim["prompt"], user_key=f"batch:{claim['owner']}")
+        except HTTPException as e:
+            if e.status_code in REQUEUE_STATUSES:
+                if claim["requeues"] >= self.settings.batch_max_requeues:
+                    # The upstream stayed unavailable: stop cycling the item
+                    error = f"Upstream unavailable after {claim['requeues']} retries: {e.detail}"
+                    await self._finish_item(claim, ITEM_ERROR, error=error)
+                    return 0.0
+                retry_after = float((e.headers or {}).get("Retry-After", 1))
+                await self._requeue_item(claim, busy=True)
+                return min(retry_after, MAX_REQUEUE_DELAY)
+            await self._finish_item(claim, ITEM_ERROR, error=str(e.detail))
+            return 0.0
+        except asyncio.CancelledError:
+            # Shutting down: give the item back so it does not wait for its lease
+            await self._requeue_item(claim)
+            raise
+        await self._finish_item(claim, ITEM_DONE, response=result["raw_response"], model=result["model"])
+        return 0.0
+
+    async def _requeue_item(self, claim: Dict[str, Any], busy: bool = False) -> None:
+        """Put a claimed item back without counting the attempt (``busy`` counts it against the requeue budget)"""
+        self.items_requeued += 1
+        try:
+            async with self._sessions()() as session:
+                await session.execute(
+                    update(ChatBatchItem)
+                    .where(ChatBatchItem.id == claim["item_id"], ChatBatchItem.status == ITEM_RUNNING)  # type: ignore
+                    .values(
+                        status=ITEM_PENDING,
+                        attempts=ChatBatchItem.attempts - 1,
+                        requeues=ChatBatchItem.requeues + (1 if busy else 0),
+                        updated_at=datetime.now(UTC),
+                    )
+                )
+                await session.commit()
+        except (OperationalError, DatabaseError) as e:
+            self._db_error("requeue", e)
+
+    async def _finish_item(
+        self,
+        claim: Dict[str, Any],
+        status: str,
+        response: Optional[str] = None,
+        model: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        now = datetime.now(UTC)
+        job_id = uuid.UUID(claim["job_id"])
+        try:
+            async with self._sessions()() as session:
+                finished = await session.execute(
+                    update(ChatBatchItem)
+                    .where(ChatBatchItem.id == claim["item_id"], ChatBatchItem.status == ITEM_RUNNING)  # type: ignore
+                    .values(status=status, response=response, model=model, error=error, updated_at=now)
+                )
+                if finished.rowcount == 1:
+                    await session.execute(
+                        update(ChatBatchJob)
+                        .where(ChatBatchJob.id == job_id)  # type: ignore
+                        .values(
+                            completed=ChatBatchJob.completed + int(status == ITEM_DONE),
+                            failed=ChatBatchJob.failed + int(status == ITEM_ERROR),
+                            updated_at=now,
+                        )
+                    )
+                    await session.execute(
+                        update(ChatBatchJob)
+                        .where(
+                            ChatBatchJob.id == job_id,  # type: ignore
+                            ChatBatchJob.status == JOB_RUNNING,  # type: ignore
+                            ChatBatchJob.completed + ChatBatchJob.failed >= ChatBatchJob.total,
+                        )
+                        .values(status=JOB_COMPLETED, finished_at=now)
+                    )
+                await session.commit()
+        except (OperationalError, DatabaseError) as e:
+            # The item stays running and is retried once its lease expires
+            self._db_error("finish", e)
+            return
+        if status == ITEM_DONE:
+            self.items_done += 1
+        else:
+            self.items_failed += 1
+        self._notify_job(claim["job_id"])
+
+    def _db_error(self, operation: str, error: Exception) -> None:
+        self.db_errors += 1
+        logger.warning(f"Batch job {operation} failed: {error}")
+
+
+# Global batch job manager instance
+_batch_job_manager: Optional[BatchJobManager] = None
+
+
+def get_batch_job_manager(settings: Optional[Settings] = None) -> BatchJobManager:
+    """Get or create the shared batch job manager"""
+    global _batch_job_manager
+    if _batch_job_manager is None:
+        _batch_job_manager = BatchJobManager(settings or get_settings())
+    return _batch_job_manager
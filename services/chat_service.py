@@ -1,140 +1,447 @@
 """
 Chat service for handling AI chat functionality using OpenRouter API
 """
+import asyncio
+from contextlib import AsyncExitStack, aclosing
 import json
 import logging
-import os
-from typing import Any, AsyncGenerator, Dict
+import math
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 
 import aiohttp
 from fastapi import HTTPException
-import markdown
 
-from dependencies.config import get_settings
+from dependencies.config import Settings, get_settings
+from services.code_highlight import get_highlight_cache
+from services.conversation_store import (
+    MESSAGE_OVERHEAD_TOKENS,
+    ConversationStore,
+    estimate_tokens,
+    get_conversation_store,
+    pack_messages,
+)
+from services.delta_batcher import batch_deltas
+from services.knowledge_base import KnowledgeBase, get_knowledge_base
+from services.llm_providers import DEFAULT_MODEL, BackendError, LLMBackend, ProviderRouter, get_provider_router
+from services.markdown_stream import StreamingMarkdownRenderer, get_render_executor, render_markdown
+from services.response_cache import ResponseCache, get_response_cache, make_cache_key
+from services.semantic_cache import SemanticCache, context_hash, get_semantic_cache
+from services.stream_coalescer import StreamCoalescer, get_stream_coalescer
+from services.stream_hedger import StreamHedger, get_stream_hedger
+from services.stream_metrics import StreamMetrics, get_stream_metrics
+from services.upstream_client import UpstreamClient, get_upstream_client
+from services.upstream_governor import (
+    GovernorQueueFull,
+    GovernorQueueTimeout,
+    GovernorTicket,
+    UpstreamGovernor,
+    UpstreamRetryableError,
+    get_upstream_governor,
+    parse_retry_after,
+)
+from services.usage_tracker import UsageRecorder, get_usage_recorder
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# LLM Configuration - Uses environment variable with fallback
-LLM_MODEL = os.getenv("OPENROUTER_LLM_MODEL", "meta-llama/llama-3.3-70b-instruct:free")
-
-# Print LLM model being used to console
-print(f"🤖 Using LLM Model: {LLM_MODEL}")
-logger.info(f"LLM Model configured: {LLM_MODEL}")
-
+# LLM backends (endpoints, keys, models) are configured in services/llm_providers.py.
 # Alternative models you can use (set OPENROUTER_LLM_MODEL in your .env file):
 # OPENROUTER_LLM_MODEL=meta-llama/llama-3.3-70b-instruct  # Paid version
 # OPENROUTER_LLM_MODEL=qwen/qwen3-coder:free              # Qwen3 Coder
 
+SYSTEM_PROMPT = (
+    "You are a helpful AI assistant. Provide clear, concise, "
+    "and accurate responses. Be friendly and engaging in your "
+    "communication style. IMPORTANT: Always format your responses "
+    "using markdown syntax for better readability. Use **bold** for emphasis, "
+    "*italic* for subtle emphasis, `code` for inline code, ```code blocks``` "
+    "for multi-line code, and proper markdown formatting for lists, "
+    "headings, and other structured content."
+)
+# Introduces the retrieved records in the system prompt of retrieval-augmented chats
+RAG_PROMPT = (
+    "Answer from the following records of the FastOpp database when they are relevant, "
+    "and say so when they do not contain the answer."
+)
+TEMPERATURE = 0.7
+MAX_TOKENS = 1000
+
+# Upstream statuses that are retried with backoff instead of failing the request
+RETRYABLE_STATUSES = (429, 502, 503)
+
+
+def stream_event_name(chunk: Dict[str, Any]) -> str:
+    """Event name of a ``chat_with_llama_stream`` chunk (SSE event / WebSocket frame type)"""
+    if "conversation_id" in chunk:
+        return "conversation"
+    if "queue_position" in chunk:
+        # Sent while waiting for an upstream slot
+        return "queue"
+    if "sources" in chunk:
+        # Records retrieved for a retrieval-augmented answer
+        return "sources"
+    if "result" in chunk:
+        # End of one model's answer in a comparison (timings or error)
+        return "result"
+    if "models" in chunk:
+        return "models"
+    if "summary" in chunk:
+        return "summary"
+    return "message"
+
+
+def mock_response_parts(user_message: str) -> List[str]:
+    """
+    Canned markdown answer for a message, in streaming-sized parts
+
+    Used by ``_mock_stream_response`` and by the local mock upstream
+    (``scripts/mock_llm.py``).
+    """
+    # Mock response based on user message
+    if "story" in user_message.lower():
+        response_parts = [
+            "Once upon a time, in a **distant galaxy**, there lived a curious robot named ",
+            "**Rusty**. Unlike other robots who spent their days processing data, Rusty had a ",
+            "dream: to understand the meaning of *human emotions*. \n\n",
+            "Every day, Rusty would observe the humans from afar, watching them laugh, cry, ",
+            "and share moments of joy. The robot's circuits would buzz with questions: ",
+            "`What makes them smile?` `Why do they hold hands?` `What is love?`\n\n",
+            "One day, Rusty decided to take a bold step. Instead of staying in the shadows, ",
+            "the robot approached a group of children playing in the park. At first, the ",
+            "children were surprised, but Rusty's gentle nature and endless curiosity ",
+            "soon won them over.\n\n",
+            "Through their friendship, Rusty learned that emotions weren't just data to be ",
+            "processed—they were experiences to be felt. The robot discovered that ",
+            "**empathy** was the bridge between artificial and human intelligence.\n\n",
+            "And so, Rusty became the first robot to truly understand the heart, proving ",
+            "that sometimes the most profound discoveries come from the simplest connections."
+        ]
+    else:
+        response_parts = [
+            "Hello! I'm **Midori**, your AI assistant. I'm here to help you with ",
+            "any questions or tasks you might have. I can assist with:\n\n",
+            "- **Writing and editing** content\n",
+            "- **Problem solving** and analysis\n",
+            "- **Creative projects** and brainstorming\n",
+            "- **Learning** new topics\n",
+            "- **Coding** and technical questions\n\n",
+            "What would you like to explore today? I'm excited to help you discover ",
+            "new possibilities and find solutions to your challenges!"
+        ]
+    return response_parts
+
 
 class ChatService:
     """Service for AI chat operations using OpenRouter API"""
 
+    def __init__(
+        self,
+        settings: Optional[Settings] = None,
+        http_client: Optional[UpstreamClient] = None,
+        response_cache: Optional[ResponseCache] = None,
+        coalescer: Optional[StreamCoalescer] = None,
+        governor: Optional[UpstreamGovernor] = None,
+        stream_metrics: Optional[StreamMetrics] = None,
+        conversations: Optional[ConversationStore] = None,
+        providers: Optional[ProviderRouter] = None,
+        hedger: Optional[StreamHedger] = None,
+        usage: Optional[UsageRecorder] = None,
+        semantic_cache: Optional[SemanticCache] = None,
+        knowledge: Optional[KnowledgeBase] = None,
+    ):
+        self.settings = settings or get_settings()
+        self.http_client = http_client or get_upstream_client()
+        self.response_cache = response_cache or get_response_cache(self.settings)
+        if coalescer is None and self.settings.stream_coalescing_enabled:
+            coalescer = get_stream_coalescer()
+        self.coalescer = coalescer
+        self.governor = governor or get_upstream_governor(self.settings)
+        self.stream_metrics = stream_metrics or get_stream_metrics()
+        self.conversations = conversations or get_conversation_store(self.settings)
+        self.providers = providers or get_provider_router(self.settings)
+        self.hedger = hedger or get_stream_hedger(self.settings)
+        if usage is None and self.settings.usage_tracking_enabled:
+            usage = get_usage_recorder(self.settings)
+        self.usage = usage
+        if semantic_cache is None:
+            semantic_cache = get_semantic_cache(self.settings)
+        self.semantic_cache = semantic_cache
+        self.knowledge = knowledge or get_knowledge_base(self.settings)
+        # Markdown renders sent to the render thread pool (large code answers)
+        self.renders_offloaded = 0
+
+    def _build_payload(
+        self,
+        user_message: str,
+        stream: bool = False,
+        history: Optional[List[Dict[str, Any]]] = None,
+        context: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Build the OpenRouter chat-completions payload for a user message, its history and retrieved context"""
+        # free model is meta-llama/llama-3.3-70b-instruct:free
+        # paid model is meta-llama/llama-3.3-70b-instruct
+        # https://openrouter.ai/meta-llama/llama-3.3-70b-instruct:free/api
+        # Recent turns are packed into the context window, leaving room for the answer
+        system_prompt = SYSTEM_PROMPT
+        if context:
+            system_prompt = f"{SYSTEM_PROMPT}\n\n{RAG_PROMPT}\n\n{context}"
+        messages = pack_messages(
+            system_prompt,
+            history or [],
+            user_message,
+            budget=self.settings.chat_context_window - MAX_TOKENS,
+        )
+        # The primary backend's model names the request for caching; each
+        # attempt substitutes the model of the backend it is sent to
+        primary = self.providers.primary
+        payload: Dict[str, Any] = {
+            "model": primary.model if primary else None,
+            "messages": messages,
+            "temperature": TEMPERATURE,
+            "max_tokens": MAX_TOKENS,
+        }
+        if stream:
+            payload["stream"] = True
+            # Ask for a final chunk with token usage (for usage accounting)
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Get chat pipeline metrics"""
+        return {
+            "response_cache": self.response_cache.get_stats() if self.response_cache else None,
+            "semantic_cache": self.semantic_cache.get_stats() if self.semantic_cache is not None else None,
+            "knowledge_base": self.knowledge.get_stats() if self.knowledge else None,
+            "stream_coalescing": self.coalescer.get_stats() if self.coalescer else None,
+            "governor": self.governor.get_stats(),
+            "conversations": self.conversations.get_stats(),
+            "streams": self.stream_metrics.get_stats(),
+            "providers": self.providers.get_stats(),
+            "hedging": self.hedger.get_stats(),
+            "markdown": {"renders_offloaded": self.renders_offloaded, "highlight_cache": self._highlight_stats()},
+        }
+
+    def _highlight_stats(self) -> Optional[Dict[str, Any]]:
+        cache = get_highlight_cache(self.settings)
+        return cache.get_stats() if cache is not None else None
+
     @staticmethod
-    async def test_connection() -> Dict[str, Any]:
+    def _cache_key(payload: Dict[str, Any]) -> str:
+        """Cache key for a payload (the stream flag does not change the answer)"""
+        return make_cache_key(
+            payload["model"], payload["messages"], payload["temperature"], payload["max_tokens"]
+        )
+
+    def _retrieve(self, user_message: str) -> tuple[str, List[Dict[str, Any]]]:
+        """Retrieve records for a message and return them as prompt context plus their sources"""
+        if self.knowledge is None or not self.knowledge.ready:
+            raise HTTPException(status_code=503, detail="Project data search is not available")
+        results = self.knowledge.search(user_message)
+        context = "\n\n".join(f"[{i}] {result['text']}" for i, result in enumerate(results, 1))
+        sources = [
+            {key: result[key] for key in ("source", "row_id", "title", "score")}
+            for result in results
+        ]
+        return context, sources
+
+    async def _cached_answer(self, payload: Dict[str, Any], cache_key: str) -> Optional[Dict[str, Any]]:
+        """Look up the answer to a payload, falling back to a near-duplicate prompt"""
+        if self.response_cache is None:
+            return None
+        cached = await self.response_cache.get(cache_key)
+        if cached is not None or self.semantic_cache is None:
+            return cached
+        match = self.semantic_cache.lookup(payload["messages"][-1]["content"], context_hash(payload))
+        if match is None:
+            return None
+        similar_key, similarity = match
+        cached = await self.response_cache.get(similar_key)
+        if cached is not None:
+            logger.info(f"Semantic cache hit (similarity {similarity:.3f})")
+        return cached
+
+    async def _store_answer(self, payload: Dict[str, Any], cache_key: str, entry: Dict[str, Any]) -> None:
+        """Cache an answer and index its prompt for near-duplicate lookups"""
+        if self.response_cache is None:
+            return
+        await self.response_cache.set(cache_key, entry)
+        if self.semantic_cache is not None:
+            self.semantic_cache.add(payload["messages"][-1]["content"], context_hash(payload), cache_key)
+
+    async def _start_turn(
+        self, conversation_id: Optional[str], owner: str
+    ) -> tuple[str, List[Dict[str, Any]]]:
+        """Resolve (or create) the caller's conversation and return its id and history"""
+        if not conversation_id:
+            return await self.conversations.create(owner), []
+        history = await self.conversations.get_history(conversation_id, owner)
+        if history is None:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        return conversation_id, history
+
+    async def _finish_turn(self, conversation_id: str, owner: str, user_message: str, answer: str) -> None:
+        """Store a completed exchange in the conversation history"""
+        if answer:
+            await self.conversations.append(conversation_id, owner, "user", user_message)
+            await self.conversations.append(conversation_id, owner, "assistant", answer)
+
+    async def test_connection(self, probe: bool = False) -> Dict[str, Any]:
         """
-        Test method to check if the OpenRouter API is accessible
+        Check if the OpenRouter API is accessible
+
+        Without ``probe`` the cached circuit breaker state is reported and no
+        request is made; with ``probe`` a real completion is sent and its
+        outcome is recorded in the breaker.
+
+        Args:
+            probe: Send a test completion instead of reporting the cached state
 
         Returns:
             dict: Connection test result
         """
+        backend = self.providers.primary
+        if backend is None:
+            return {"status": "error", "message": "No API key found", "api_key_length": 0}
+        if not probe:
+            return self._cached_connection_state()
+
+        started = time.monotonic()
+        result = await self._probe_connection(backend)
+        latency = time.monotonic() - started
+        if result["status"] == "success":
+            backend.record_success(latency)
+        else:
+            backend.record_failure(result["message"], latency)
+        result["circuit"] = backend.breaker.get_stats()
+        return result
+
+    def _cached_connection_state(self) -> Dict[str, Any]:
+        """Connection status from the circuit breakers (no upstream request)"""
+        backends = self.providers.available()
+        circuits = {backend.name: backend.breaker.get_stats() for backend in backends}
+        usable = [backend for backend in backends if circuits[backend.name]["state"] != "open"]
+        if usable:
+            return {
+                "status": "success",
+                "message": "API connection healthy",
+                "cached": True,
+                "circuits": circuits,
+            }
+        last_error = backends[0].last_error or "upstream errors"
+        return {
+            "status": "error",
+            "message": f"AI service unavailable, circuit open after {last_error}",
+            "cached": True,
+            "circuits": circuits,
+        }
+
+    async def _probe_connection(self, backend: LLMBackend) -> Dict[str, Any]:
+        """Send a small test completion to one backend"""
+        settings = self.settings
         try:
-            settings = get_settings()
-            api_key = os.getenv("OPENROUTER_API_KEY")
-            if not api_key:
-                return {"status": "error", "message": "No API key found", "api_key_length": 0}
 
             if settings.debug:
-                print(f"DEBUG: Testing connection with API key: {api_key[:10]}...")
+                print(f"DEBUG: Testing connection to backend {backend.name} ({backend.base_url})")
 
             # Simple test payload
             test_payload = {
-                "model": LLM_MODEL,
+                "model": backend.model,
                 "messages": [
                     {"role": "user", "content": "Hello"}
                 ],
                 "max_tokens": 10
             }
 
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://localhost",
-                "X-Title": "FastOpp AI Demo"
-            }
-
             if settings.debug:
-                print("DEBUG: Making test request to OpenRouter...")
-
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    "https://openrouter.ai/api/v1/chat/completions",
-                    headers=headers,
-                    json=test_payload
-                ) as response:
+                print(f"DEBUG: Making test request to {backend.name}...")
+
+            session = await self.http_client.get_session()
+            async with session.post(
+                backend.chat_completions_url,
+                headers=backend.headers(),
+                json=test_payload
+            ) as response:
+                if settings.debug:
+                    print(f"DEBUG: Test response status: {response.status}")
+
+                if response.status == 200:
+                    result = await response.json()
                     if settings.debug:
-                        print(f"DEBUG: Test response status: {response.status}")
+                        print(f"DEBUG: Test response: {result}")
+                    return {
+                        "status": "success",
+                        "message": "API connection successful",
+                        "response": result
+                    }
+                else:
+                    error_text = await response.text()
+                    if settings.debug:
+                        print(f"DEBUG: Test error: {error_text}")
 
-                    if response.status == 200:
-                        result = await response.json()
-                        if settings.debug:
-                            print(f"DEBUG: Test response: {result}")
+                    # Provide more specific error messages
+                    if response.status == 401:
                         return {
-                            "status": "success",
-                            "message": "API connection successful",
-                            "response": result
+                            "status": "error",
+                            "message": (
+                                "Authentication failed. "
+                                "Please check your OPENROUTER_API_KEY is correct and valid."
+                            ),
+                            "status_code": response.status
                         }
-                    else:
-                        error_text = await response.text()
-                        if settings.debug:
-                            print(f"DEBUG: Test error: {error_text}")
-                        
-                        # Provide more specific error messages
-                        if response.status == 401:
+                    elif response.status == 400:
+                        error_lower = error_text.lower()
+                        if "model" in error_lower and ("not found" in error_lower or "unavailable" in error_lower):
                             return {
                                 "status": "error",
-                                "message": "Authentication failed. Please check your OPENROUTER_API_KEY is correct and valid.",
-                                "status_code": response.status
-                            }
-                        elif response.status == 400:
-                            if "model" in error_text.lower() and ("not found" in error_text.lower() or "unavailable" in error_text.lower()):
-                                return {
-                                    "status": "error",
-                                    "message": f"The LLM model '{LLM_MODEL}' is not available. Please try a different model or check OpenRouter's available models.",
-                                    "status_code": response.status
-                                }
-                            else:
-                                return {
-                                    "status": "error",
-                                    "message": f"Bad request: {error_text}",
-                                    "status_code": response.status
-                                }
-                        elif response.status == 429:
-                            return {
-                                "status": "error",
-                                "message": "Rate limit exceeded. Please try again later.",
+                                "message": (
+                                    f"The LLM model '{backend.model}' is not available. "
+                                    "Please try a different model or check OpenRouter's available models."
+                                ),
                                 "status_code": response.status
                             }
                         else:
                             return {
                                 "status": "error",
-                                "message": f"API error (status {response.status}): {error_text}",
+                                "message": f"Bad request: {error_text}",
                                 "status_code": response.status
                             }
+                    elif response.status == 429:
+                        return {
+                            "status": "error",
+                            "message": "Rate limit exceeded. Please try again later.",
+                            "status_code": response.status
+                        }
+                    else:
+                        return {
+                            "status": "error",
+                            "message": f"API error (status {response.status}): {error_text}",
+                            "status_code": response.status
+                        }
 
         except Exception as e:
             if settings.debug:
                 print(f"DEBUG: Test exception: {e}")
             return {"status": "error", "message": f"Exception: {str(e)}"}
 
-    @staticmethod
-    async def chat_with_llama(user_message: str) -> Dict[str, Any]:
+    async def chat_with_llama(
+        self,
+        user_message: str,
+        user_key: str = "anonymous",
+        conversation_id: Optional[str] = None,
+        rag: bool = False,
+        owner: Optional[str] = None,
+    ) -> Dict[str, Any]:
         """
         Send a message to Llama 3.3 70B via OpenRouter API (non-streaming)
         
         Args:
             user_message: The user's message to send to the AI
+            user_key: Caller identity for per-user rate limits
+            conversation_id: Continue this conversation (a new one is started when omitted)
+            rag: Answer from records of the project's database retrieved for the message
+            owner: Identity owning the conversation (``user_key`` when omitted)
             
         Returns:
             dict: Response containing the AI's reply and model info
@@ -142,342 +449,914 @@ class ChatService:
         Raises:
             HTTPException: If there's an error with the API call
         """
+        if not user_message:
+            raise HTTPException(status_code=400, detail="Message is required")
+
+        owner = owner or user_key
+        conversation_id, history = await self._start_turn(conversation_id, owner)
+        result = await self.complete(user_message, user_key=user_key, history=history, rag=rag)
+        await self._finish_turn(conversation_id, owner, user_message, result["raw_response"])
+        result["conversation_id"] = conversation_id
+        return result
+
+    async def complete(
+        self,
+        user_message: str,
+        user_key: str = "anonymous",
+        history: Optional[List[Dict[str, Any]]] = None,
+        rag: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Get one completion for a message (no conversation is stored)
+
+        Goes through the response cache, the governor and backend failover
+        like ``chat_with_llama``; batch jobs call it directly.
+
+        Args:
+            user_message: The user's message to send to the AI
+            user_key: Caller identity for per-user rate limits
+            history: Earlier messages to pack into the context
+            rag: Answer from records of the project's database retrieved for the message
+
+        Returns:
+            dict: ``response`` (HTML), ``raw_response``, ``model``, ``cached`` when replayed
+                and ``sources`` (the retrieved records) with ``rag``
+
+        Raises:
+            HTTPException: If there's an error with the API call
+        """
+        settings = self.settings
         try:
-            settings = get_settings()
             if not user_message:
                 raise HTTPException(status_code=400, detail="Message is required")
+
+            context, sources = self._retrieve(user_message) if rag else (None, None)
+            payload = self._build_payload(user_message, history=history, context=context)
+            cache_key = self._cache_key(payload)
+            cached = await self._cached_answer(payload, cache_key)
+            if cached is not None:
+                logger.info(f"Response cache hit for message: {user_message[:50]}...")
+                result = {
+                    "response": cached["html"],
+                    "raw_response": cached["raw"],
+                    "model": cached["model"],
+                    "cached": True
+                }
+                if sources is not None:
+                    result["sources"] = sources
+                return result
             
-            # Get API key from environment
-            api_key = os.getenv("OPENROUTER_API_KEY")
-            if not api_key:
+            if self.providers.primary is None:
                 raise HTTPException(status_code=500, detail="OpenRouter API key not configured")
             
             logger.info(f"Starting chat request with message: {user_message[:50]}...")
-            logger.info(f"API key found: {api_key[:10]}...")
             if settings.debug:
                 print(f"DEBUG: Starting chat request with message: {user_message[:50]}...")
-                print(f"DEBUG: API key found: {api_key[:10]}...")
-            
-            # Prepare the request to OpenRouter
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://localhost",  # More generic referer
-                "X-Title": "FastOpp AI Demo"
-            }
-            
-            # free model is meta-llama/llama-3.3-70b-instruct:free
-            # paid model is meta-llama/llama-3.3-70b-instruct
-            # https://openrouter.ai/meta-llama/llama-3.3-70b-instruct:free/api
-            payload = {
-                "model": LLM_MODEL,
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": (
-                            "You are a helpful AI assistant. Provide clear, concise, "
-                            "and accurate responses. Be friendly and engaging in your "
-                            "communication style. IMPORTANT: Always format your responses "
-                            "using markdown syntax for better readability. Use **bold** for emphasis, "
-                            "*italic* for subtle emphasis, `code` for inline code, ```code blocks``` "
-                            "for multi-line code, and proper markdown formatting for lists, "
-                            "headings, and other structured content."
-                        )
-                    },
-                    {
-                        "role": "user",
-                        "content": user_message
-                    }
-                ],
-                "temperature": 0.7,
-                "max_tokens": 1000
-            }
             
-            logger.info(f"Making request to OpenRouter with payload: {json.dumps(payload, indent=2)}")
+            logger.info(f"Making chat request with payload: {json.dumps(payload, indent=2)}")
             if settings.debug:
-                print(f"DEBUG: Making request to OpenRouter with payload: {json.dumps(payload, indent=2)}")
+                print(f"DEBUG: Making chat request with payload: {json.dumps(payload, indent=2)}")
             
-            # Make request to OpenRouter
-            async with aiohttp.ClientSession() as session:
+            # Wait for an upstream slot, then fail over / back off across backends
+            ticket = await self._acquire_slot(user_key)
+            started = time.monotonic()
+            try:
+                backend, result = await self._with_failover(
+                    lambda backend: self._post_completion(backend, payload)
+                )
+            finally:
+                ticket.release()
+
+            # Extract the assistant's response
+            assistant_message = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+            if not assistant_message:
+                logger.warning("No assistant message content found in response")
+                logger.warning(f"Full response structure: {result}")
                 if settings.debug:
-                    print("DEBUG: Created aiohttp session")
-                async with session.post(
-                    "https://openrouter.ai/api/v1/chat/completions",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if settings.debug:
-                        print(f"DEBUG: Got response from OpenRouter, status: {response.status}")
-                    logger.info(f"OpenRouter response status: {response.status}")
-                    logger.info(f"OpenRouter response headers: {dict(response.headers)}")
-                    
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"OpenRouter API error: {error_text}")
-                        
-                        # Provide more specific error messages
-                        if response.status == 401:
-                            raise HTTPException(
-                                status_code=401, 
-                                detail="Authentication failed. Please check your OPENROUTER_API_KEY is correct and valid."
-                            )
-                        elif response.status == 400:
-                            # Check if it's a model availability issue
-                            if "model" in error_text.lower() and ("not found" in error_text.lower() or "unavailable" in error_text.lower()):
-                                raise HTTPException(
-                                    status_code=400,
-                                    detail=f"The LLM model '{LLM_MODEL}' is not available. Please try a different model or check OpenRouter's available models."
-                                )
-                            else:
-                                raise HTTPException(
-                                    status_code=400,
-                                    detail=f"Bad request: {error_text}"
-                                )
-                        elif response.status == 429:
-                            raise HTTPException(
-                                status_code=429,
-                                detail="Rate limit exceeded. Please try again later."
-                            )
-                        else:
-                            raise HTTPException(
-                                status_code=500, 
-                                detail=f"OpenRouter API error (status {response.status}): {error_text}"
-                            )
-                    
-                    result = await response.json()
-                    logger.info(f"OpenRouter response: {json.dumps(result, indent=2)}")
-                    if settings.debug:
-                        print(f"DEBUG: OpenRouter response: {json.dumps(result, indent=2)}")
-                    
-                    # Extract the assistant's response
-                    assistant_message = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-                    
-                    if not assistant_message:
-                        logger.warning("No assistant message content found in response")
-                        logger.warning(f"Full response structure: {result}")
-                        if settings.debug:
-                            print("DEBUG: No assistant message content found in response")
-                            print(f"DEBUG: Full response structure: {result}")
-                    
-                    # Convert markdown to HTML
-                    formatted_html = markdown.markdown(
-                        assistant_message,
-                        extensions=['fenced_code', 'codehilite', 'tables', 'nl2br']
-                    )
-                    
-                    logger.info(f"Successfully processed response, length: {len(assistant_message)}")
-                    if settings.debug:
-                        print(f"DEBUG: Successfully processed response, length: {len(assistant_message)}")
-                    
-                    return {
-                        "response": formatted_html,
-                        "raw_response": assistant_message,  # Keep original for debugging
-                        "model": LLM_MODEL
-                    }
-                    
+                    print("DEBUG: No assistant message content found in response")
+                    print(f"DEBUG: Full response structure: {result}")
+
+            self._record_usage(user_key, backend, payload, result.get("usage"), assistant_message, started)
+
+            # Convert markdown to HTML
+            formatted_html = await self._render_markdown(assistant_message)
+
+            logger.info(f"Successfully processed response, length: {len(assistant_message)}")
+            if settings.debug:
+                print(f"DEBUG: Successfully processed response, length: {len(assistant_message)}")
+
+            if assistant_message:
+                await self._store_answer(
+                    payload, cache_key, {"raw": assistant_message, "html": formatted_html, "model": backend.model}
+                )
+
+            response = {
+                "response": formatted_html,
+                "raw_response": assistant_message,  # Keep original for debugging
+                "model": backend.model
+            }
+            if sources is not None:
+                response["sources"] = sources
+            return response
+
         except json.JSONDecodeError as e:
             logger.error(f"JSON decode error: {e}")
             if settings.debug:
                 print(f"DEBUG: JSON decode error: {e}")
             raise HTTPException(status_code=400, detail="Invalid JSON")
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Unexpected error: {e}", exc_info=True)
             if settings.debug:
                 print(f"DEBUG: Unexpected error: {e}")
             raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+    async def _post_completion(self, backend: LLMBackend, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        POST a non-streaming completion request to one backend
+
+        Returns:
+            dict: Parsed chat-completions response
+
+        Raises:
+            UpstreamRetryableError: On 429/502/503 (carries Retry-After when sent)
+            BackendError: On errors another backend may not have (auth, model, server)
+            HTTPException: On a bad request
+        """
+        settings = self.settings
+        session = await self.http_client.get_session()
+        if settings.debug:
+            print(f"DEBUG: Using shared upstream session for backend {backend.name}")
+        async with session.post(
+            backend.chat_completions_url,
+            headers=backend.headers(),
+            json=dict(payload, model=backend.model)
+        ) as response:
+            if settings.debug:
+                print(f"DEBUG: Got response from {backend.name}, status: {response.status}")
+            logger.info(f"{backend.name} response status: {response.status}")
+            logger.info(f"{backend.name} response headers: {dict(response.headers)}")
+
+            if response.status != 200:
+                error_text = await response.text()
+                logger.error(f"{backend.name} API error: {error_text}")
+                self._raise_for_status(backend, response.status, error_text, response.headers)
+
+            result = await response.json()
+            logger.info(f"{backend.name} response: {json.dumps(result, indent=2)}")
+            if settings.debug:
+                print(f"DEBUG: {backend.name} response: {json.dumps(result, indent=2)}")
+            return result
+
+    def _record_usage(
+        self,
+        user_key: str,
+        backend: LLMBackend,
+        payload: Dict[str, Any],
+        usage: Optional[Dict[str, Any]],
+        answer: str,
+        started: float,
+        status: str = "ok",
+        streamed: bool = False,
+    ) -> None:
+        """Queue a usage record for one upstream call (estimating tokens when the upstream sent no usage)"""
+        if self.usage is None:
+            return
+        if usage and usage.get("prompt_tokens") is not None:
+            prompt_tokens = int(usage["prompt_tokens"])
+            completion_tokens = int(usage.get("completion_tokens") or 0)
+            estimated = False
+        else:
+            prompt_tokens = sum(
+                estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in payload["messages"]
+            )
+            completion_tokens = estimate_tokens(answer)
+            estimated = True
+        # OpenRouter reports the charged cost; otherwise price from the backend configuration
+        cost = usage.get("cost") if usage else None
+        if cost is None:
+            cost = backend.cost(prompt_tokens, completion_tokens)
+        self.usage.record(
+            user_key,
+            backend.name,
+            backend.model,
+            prompt_tokens,
+            completion_tokens,
+            time.monotonic() - started,
+            status=status,
+            streamed=streamed,
+            estimated=estimated,
+            cost=cost,
+        )
+
+    @staticmethod
+    def _raise_for_status(backend: LLMBackend, status: int, error_text: str, headers: Any) -> None:
+        """Raise the error for a non-200 upstream response"""
+        # Provide more specific error messages
+        if status in (401, 403):
+            key_name = backend.api_key_env or f"API key of backend '{backend.name}'"
+            raise BackendError(
+                401,
+                f"Authentication failed. Please check your {key_name} is correct and valid."
+            )
+        elif status == 400:
+            # Check if it's a model availability issue (another backend may serve another model)
+            error_lower = error_text.lower()
+            if "model" in error_lower and ("not found" in error_lower or "unavailable" in error_lower):
+                raise BackendError(
+                    400,
+                    f"The LLM model '{backend.model}' is not available. "
+                    "Please try a different model or check OpenRouter's available models."
+                )
+            raise HTTPException(
+                status_code=400,
+                detail=f"Bad request: {error_text}"
+            )
+        elif status in RETRYABLE_STATUSES:
+            raise UpstreamRetryableError(
+                status,
+                error_text,
+                parse_retry_after(headers.get("Retry-After"))
+            )
+        raise BackendError(
+            500,
+            f"{backend.name} API error (status {status}): {error_text}"
+        )
+
+    async def _with_failover(
+        self,
+        call: Callable[[LLMBackend], Awaitable[Any]],
+        avoid: Optional[LLMBackend] = None,
+        backends: Optional[List[LLMBackend]] = None,
+    ) -> Tuple[LLMBackend, Any]:
+        """
+        Run ``call`` against the routed backends until one succeeds
+
+        A failing backend is skipped in favour of the next one before the
+        client sees an error. When every backend failed and at least one was
+        throttled, the round is retried after backoff. ``avoid`` is tried last.
+        Backends whose circuit breaker is open are skipped; when all of them
+        are open the call fails fast with 503. ``backends`` replaces the
+        routed candidates (retries and breakers still apply).
+
+        Returns:
+            tuple: The backend that answered and the result of ``call``
+        """
+        attempt = 0
+        fixed = backends
+        while True:
+            backends = fixed if fixed is not None else self.providers.candidates(avoid)
+            retryable: Optional[UpstreamRetryableError] = None
+            failure: Optional[BackendError] = None
+            attempted = False
+            for index, backend in enumerate(backends):
+                if not backend.breaker.allow_request():
+                    continue
+                attempted = True
+                started = time.monotonic()
+                try:
+                    result = await call(backend)
+                except UpstreamRetryableError as e:
+                    retryable = e
+                    error = f"status {e.status}"
+                except BackendError as e:
+                    failure = e
+                    error = e.message
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    retryable = UpstreamRetryableError(503, str(e))
+                    error = f"connection error: {e!r}"
+                except HTTPException:
+                    # The backend answered; the request itself was rejected
+                    backend.record_success(time.monotonic() - started)
+                    raise
+                except BaseException:
+                    backend.breaker.record_cancelled()
+                    raise
+                else:
+                    backend.record_success(time.monotonic() - started)
+                    return backend, result
+
+                backend.record_failure(error, time.monotonic() - started)
+                if index + 1 < len(backends):
+                    backend.failovers += 1
+                    logger.warning(
+                        f"Backend {backend.name} failed ({error}), failing over to {backends[index + 1].name}"
+                    )
+
+            if backends and not attempted:
+                raise self._circuit_open_error(backends)
+            if retryable is None:
+                if failure is None:
+                    raise HTTPException(status_code=500, detail="OpenRouter API key not configured")
+                raise HTTPException(status_code=failure.status, detail=failure.message)
+            await self._backoff(attempt, retryable)
+            attempt += 1
+
+    @staticmethod
+    def _circuit_open_error(backends: List[LLMBackend]) -> HTTPException:
+        """503 for when every backend's circuit breaker is open"""
+        retry_after = min(backend.breaker.retry_after() for backend in backends)
+        return HTTPException(
+            status_code=503,
+            detail="The AI service is temporarily unavailable. Please try again shortly.",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    async def _acquire_slot(self, user_key: str) -> GovernorTicket:
+        """Wait for an upstream slot without reporting queue positions"""
+        try:
+            return await self.governor.run(user_key)
+        except (GovernorQueueFull, GovernorQueueTimeout) as e:
+            raise self._governor_error(e) from e
+
     @staticmethod
-    async def chat_with_llama_stream(user_message: str) -> AsyncGenerator[Dict[str, Any], None]:
+    def _governor_error(error: Exception) -> HTTPException:
+        """Map a governor rejection to a 429/503 with Retry-After"""
+        retry_after = str(max(1, math.ceil(getattr(error, "retry_after", 1))))
+        if isinstance(error, GovernorQueueFull):
+            return HTTPException(
+                status_code=429,
+                detail="Too many chat requests are waiting. Please try again shortly.",
+                headers={"Retry-After": retry_after}
+            )
+        return HTTPException(
+            status_code=503,
+            detail="Timed out waiting for the AI service. Please try again shortly.",
+            headers={"Retry-After": retry_after}
+        )
+
+    async def _backoff(self, attempt: int, error: UpstreamRetryableError) -> None:
+        """Sleep before retrying a throttled call, or give up after the retry budget"""
+        if attempt >= self.settings.governor_max_retries:
+            retry_after = error.retry_after or self.settings.governor_backoff_base
+            raise HTTPException(
+                status_code=429 if error.status == 429 else 503,
+                detail="Rate limit exceeded. Please try again later.",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+        delay = self.governor.backoff_delay(attempt, error.retry_after)
+        logger.warning(
+            f"OpenRouter returned {error.status}, retry {attempt + 1}/"
+            f"{self.settings.governor_max_retries} in {delay:.1f}s"
+        )
+        await asyncio.sleep(delay)
+
+    async def chat_with_llama_stream(
+        self,
+        user_message: str,
+        snapshot: bool = False,
+        user_key: str = "anonymous",
+        conversation_id: Optional[str] = None,
+        regenerate: bool = False,
+        rag: bool = False,
+        owner: Optional[str] = None,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
         """
         Stream a message to Llama 3.3 70B via OpenRouter API with server-side markdown processing
         
         Args:
             user_message: The user's message to send to the AI
+            snapshot: Yield the full HTML and raw text on every chunk instead of deltas
+            user_key: Caller identity for per-user rate limits
+            conversation_id: Continue this conversation (a new one is started when omitted)
+            regenerate: Answer the last user message of ``conversation_id`` again (bypassing
+                the response cache); the new answer replaces the old one once it completes
+            rag: Answer from records of the project's database retrieved for the message
+            owner: Identity owning the conversation (``user_key`` when omitted)
             
         Yields:
-            dict: Streaming response chunks from the AI with HTML formatting
+            dict: A ``{"conversation_id": id}`` chunk first, ``{"sources": [...]}`` with
+                ``rag``, ``{"queue_position": n}``
+                chunks while waiting for a slot, then streaming response chunks from
+                the AI with HTML formatting (see ``_format_stream_chunk`` for the
+                delta and snapshot shapes)
             
         Raises:
             HTTPException: If there's an error with the API call
         """
+        owner = owner or user_key
         try:
-            if not user_message:
+            if regenerate:
+                if not conversation_id:
+                    raise HTTPException(status_code=400, detail="conversation_id is required to regenerate")
+                conversation_id, history = await self._start_turn(conversation_id, owner)
+                if len(history) < 2 or [m["role"] for m in history[-2:]] != ["user", "assistant"]:
+                    raise HTTPException(status_code=409, detail="Nothing to regenerate")
+                user_message = history[-2]["content"]
+                history = history[:-2]
+            elif not user_message:
                 raise HTTPException(status_code=400, detail="Message is required")
+            else:
+                conversation_id, history = await self._start_turn(conversation_id, owner)
+            yield {"conversation_id": conversation_id}
+
+            context = None
+            if rag:
+                context, sources = self._retrieve(user_message)
+                yield {"sources": sources}
+            
+            payload = self._build_payload(user_message, stream=True, history=history, context=context)
+            cache_key = self._cache_key(payload)
+            cached = None if regenerate else await self._cached_answer(payload, cache_key)
+            if cached is not None:
+                logger.info(f"Replaying cached response for message: {user_message[:50]}...")
+                async for chunk in self._replay_cached(cached, snapshot):
+                    yield chunk
+                await self._finish_turn(conversation_id, owner, user_message, cached["raw"])
+                return
             
-            # Get API key from environment
-            api_key = os.getenv("OPENROUTER_API_KEY")
-            if not api_key:
+            if self.providers.primary is None:
                 raise HTTPException(status_code=500, detail="OpenRouter API key not configured")
             
             logger.info(f"Starting streaming chat request with message: {user_message[:50]}...")
-            logger.info(f"API key found: {api_key[:10]}...")
             
-            # Prepare the request to OpenRouter
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://localhost",  # More generic referer
-                "X-Title": "FastOpp AI Demo"
-            }
-            # free model is meta-llama/llama-3.3-70b-instruct:free
-            # https://openrouter.ai/meta-llama/llama-3.3-70b-instruct:free/api
-            # paid model is meta-llama/llama-3.3-70b-instruct
-            payload = {
-                "model": LLM_MODEL,
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": (
-                            "You are a helpful AI assistant. Provide clear, concise, "
-                            "and accurate responses. Be friendly and engaging in your "
-                            "communication style. IMPORTANT: Always format your responses "
-                            "using markdown syntax for better readability. Use **bold** for emphasis, "
-                            "*italic* for subtle emphasis, `code` for inline code, ```code blocks``` "
-                            "for multi-line code, and proper markdown formatting for lists, "
-                            "headings, and other structured content."
-                        )
-                    },
-                    {
-                        "role": "user",
-                        "content": user_message
-                    }
-                ],
-                "temperature": 0.7,
-                "max_tokens": 1000,
-                "stream": True  # Enable streaming
-            }
-            
-            logger.info(f"Making streaming request to OpenRouter with payload: {json.dumps(payload, indent=2)}")
-            
-            # Make streaming request to OpenRouter
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    "https://openrouter.ai/api/v1/chat/completions",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    logger.info(f"OpenRouter streaming response status: {response.status}")
-                    logger.info(f"OpenRouter streaming response headers: {dict(response.headers)}")
-                    
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"OpenRouter API streaming error: {error_text}")
-                        raise HTTPException(status_code=500, detail=f"OpenRouter API error: {error_text}")
-                    
-                    # Accumulate raw content for markdown processing
-                    accumulated_content = ""
-                    chunk_count = 0
-                    
-                    logger.info("Starting to stream response...")
-                    
-                    # Stream the response
-                    async for line in response.content:
-                        line = line.decode('utf-8').strip()
-                        if line.startswith('data: '):
-                            data = line[6:]  # Remove 'data: ' prefix
-                            if data == '[DONE]':
-                                logger.info("Stream completed with [DONE]")
-                                break
-                            
-                            try:
-                                chunk = json.loads(data)
-                                chunk_count += 1
-                                logger.debug(f"Received chunk {chunk_count}: {chunk}")
-                                
-                                if 'choices' in chunk and len(chunk['choices']) > 0:
-                                    delta = chunk['choices'][0].get('delta', {})
-                                    content = delta.get('content', '')
-                                    if content:
-                                        # Accumulate the raw content
-                                        accumulated_content += content
-                                        
-                                        # Convert accumulated content to HTML
-                                        formatted_html = markdown.markdown(
-                                            accumulated_content,
-                                            extensions=['fenced_code', 'codehilite', 'tables', 'nl2br']
-                                        )
-                                        # free model is meta-llama/llama-3.3-70b-instruct:free
-                                        # https://openrouter.ai/meta-llama/llama-3.3-70b-instruct:free/api
-                                        # paid model is meta-llama/llama-3.3-70b-instruct
-                                        yield {
-                                            "content": formatted_html,
-                                            "raw_content": accumulated_content,
-                                            "model": LLM_MODEL
-                                        }
-                            except json.JSONDecodeError as e:
-                                logger.warning(f"JSON decode error in chunk: {e}, chunk: {data}")
-                                continue  # Skip invalid JSON chunks
-                    
-                    logger.info(
-                        f"Streaming completed. Total chunks: {chunk_count}, "
-                        f"Final content length: {len(accumulated_content)}"
-                    )
-                    
+            # Incremental markdown renderer (closed blocks are rendered once)
+            renderer = StreamingMarkdownRenderer()
+
+            # Requests joining an in-flight stream do not need an upstream slot
+            ticket: Optional[GovernorTicket] = None
+            if not self._is_inflight(cache_key):
+                try:
+                    ticket = self.governor.enqueue(user_key)
+                    async for position in ticket.wait():
+                        yield {"queue_position": position}
+                except (GovernorQueueFull, GovernorQueueTimeout) as e:
+                    raise self._governor_error(e) from e
+                except BaseException:
+                    if ticket is not None:
+                        ticket.release()
+                    raise
+                if self._is_inflight(cache_key):
+                    # Another request started the same stream while we waited
+                    ticket.release()
+                    ticket = None
+
+            # Identical concurrent prompts share one upstream stream; the
+            # upstream stream owns the slot and releases it when it ends
+            started = False
+
+            def upstream() -> AsyncIterator[str]:
+                nonlocal started
+                started = True
+                return self._governed_stream(ticket, user_key, payload, cache_key)
+
+            try:
+                if self.coalescer is not None:
+                    contents = self.coalescer.stream(cache_key, upstream)
+                else:
+                    contents = upstream()
+
+                # One frame (JSON encode + markdown render) per window instead of per delta
+                contents = batch_deltas(
+                    contents,
+                    self.settings.stream_flush_interval_ms / 1000,
+                    self.settings.stream_flush_max_chars,
+                )
+
+                # Closing this generator (client disconnect) closes the upstream chain
+                async with aclosing(contents):
+                    async for content in contents:
+                        yield await self._render_stream_chunk(renderer, content, snapshot, payload["model"])
+            finally:
+                if ticket is not None and not started:
+                    ticket.release()
+
+            # Only answers the client received in full become history
+            if regenerate and renderer.raw:
+                await self.conversations.drop_last_exchange(conversation_id, owner)
+            await self._finish_turn(conversation_id, owner, user_message, renderer.raw)
+
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Unexpected error in streaming: {e}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+    def compare_stream(
+        self,
+        user_message: str,
+        models: Optional[List[str]] = None,
+        snapshot: bool = False,
+        user_key: str = "anonymous",
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Stream one prompt to several models at once, multiplexed into one stream
+
+        Every model gets its own upstream stream through the governor (without
+        failover, since the answer must come from that model). At most
+        ``compare_concurrency`` of them hold an upstream slot at a time, so a
+        comparison cannot crowd out ordinary chats.
+
+        Args:
+            user_message: The prompt sent to every model
+            models: 2 to ``compare_max_models`` model ids or backend names
+                (defaults to the ``compare_models`` allowlist)
+            snapshot: Yield the full HTML and raw text on every chunk instead of deltas
+            user_key: Caller identity for per-user rate limits
+
+        Returns:
+            AsyncGenerator: Yields ``{"models": [...]}`` first, then chunks tagged with ``model``:
+                ``queue_position`` while waiting, message chunks (see
+                ``_format_stream_chunk``) and one ``result`` per model with
+                ``status``, ``queued_ms``, ``ttft_ms``, ``total_ms`` and ``chars``
+                (or ``error``); ``{"summary": [...]}`` with every result last
+
+        Raises:
+            HTTPException: If the request is invalid (raised here, before streaming)
+        """
+        settings = self.settings
+        if not user_message:
+            raise HTTPException(status_code=400, detail="Message is required")
+        models = list(dict.fromkeys(model for model in (models or settings.compare_models) if model))
+        if not 2 <= len(models) <= settings.compare_max_models:
+            raise HTTPException(
+                status_code=400, detail=f"Compare between 2 and {settings.compare_max_models} models"
+            )
+        if settings.compare_models:
+            unknown = [model for model in models if model not in settings.compare_models]
+            if unknown:
+                raise HTTPException(
+                    status_code=400, detail=f"Models not available for comparison: {', '.join(unknown)}"
+                )
+        backends = [self.providers.for_model(model, settings) for model in models]
+        if any(backend is None for backend in backends):
+            raise HTTPException(status_code=500, detail="OpenRouter API key not configured")
+        return self._compare(models, backends, self._build_payload(user_message, stream=True), snapshot, user_key)
+
+    async def _compare(
+        self,
+        models: List[str],
+        backends: List[LLMBackend],
+        payload: Dict[str, Any],
+        snapshot: bool,
+        user_key: str,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Run one ``_compare_one`` task per model and yield their chunks as they arrive"""
+        settings = self.settings
+        chunks: asyncio.Queue = asyncio.Queue()
+        slots = asyncio.Semaphore(max(1, settings.compare_concurrency))
+        started = time.monotonic()
+        tasks = [
+            asyncio.create_task(
+                self._compare_one(model, backend, payload, user_key, snapshot, slots, chunks.put_nowait, started)
+            )
+            for model, backend in zip(models, backends, strict=True)
+        ]
+        results: Dict[str, Dict[str, Any]] = {}
+        try:
+            yield {"models": models}
+            while len(results) < len(models):
+                chunk = await chunks.get()
+                if "result" in chunk:
+                    results[chunk["model"]] = chunk["result"]
+                yield chunk
+        finally:
+            # Closing the generator (client disconnect) aborts the streams still running
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        yield {"summary": [dict(results[model], model=model) for model in models]}
+
+    async def _compare_one(
+        self,
+        model: str,
+        backend: LLMBackend,
+        payload: Dict[str, Any],
+        user_key: str,
+        snapshot: bool,
+        slots: asyncio.Semaphore,
+        emit: Callable[[Dict[str, Any]], None],
+        started: float,
+    ) -> None:
+        """Stream one model of a comparison, emitting its chunks and then its ``result``"""
+        def elapsed_ms() -> int:
+            return round((time.monotonic() - started) * 1000)
+
+        renderer = StreamingMarkdownRenderer()
+        result: Dict[str, Any] = {"status": "ok", "queued_ms": None, "ttft_ms": None, "total_ms": None}
+        try:
+            async with slots:
+                ticket: Optional[GovernorTicket] = None
+                try:
+                    ticket = self.governor.enqueue(user_key)
+                    async for position in ticket.wait():
+                        emit({"model": model, "queue_position": position})
+                except (GovernorQueueFull, GovernorQueueTimeout) as e:
+                    raise self._governor_error(e) from e
+                except BaseException:
+                    # Cancelled while queued (client disconnect): give the place or slot back
+                    if ticket is not None:
+                        ticket.release()
+                    raise
+                result["queued_ms"] = elapsed_ms()
+                try:
+                    # Cached answers and usage are keyed by the model that actually answered
+                    model_payload = dict(payload, model=backend.model)
+                    contents = batch_deltas(
+                        self._attempt_stream(
+                            model_payload,
+                            self._cache_key(model_payload),
+                            [],
+                            ticket=ticket,
+                            user_key=user_key,
+                            backends=[backend],
+                        ),
+                        self.settings.stream_flush_interval_ms / 1000,
+                        self.settings.stream_flush_max_chars,
+                    )
+                    async with aclosing(contents):
+                        async for content in contents:
+                            if result["ttft_ms"] is None:
+                                result["ttft_ms"] = elapsed_ms()
+                            chunk = await self._render_stream_chunk(renderer, content, snapshot, backend.model)
+                            emit(dict(chunk, model=model))
+                finally:
+                    ticket.release()
+        except HTTPException as e:
+            result.update(status="error", error=e.detail, status_code=e.status_code)
+        except Exception as e:
+            logger.error(f"Comparison stream for {model} failed: {e}", exc_info=True)
+            result.update(status="error", error=str(e))
+        result["total_ms"] = elapsed_ms()
+        result["chars"] = len(renderer.raw)
+        emit({"model": model, "result": result})
+
+    def _is_inflight(self, cache_key: str) -> bool:
+        """Whether an upstream stream for this key is already being shared"""
+        return self.coalescer is not None and self.coalescer.is_inflight(cache_key)
+
+    async def _governed_stream(
+        self, ticket: Optional[GovernorTicket], user_key: str, payload: Dict[str, Any], cache_key: str
+    ) -> AsyncGenerator[str, None]:
+        """Stream from the upstream (hedging a late first token) and release the slot at the end"""
+        tried: List[LLMBackend] = []
+        tickets = [ticket] if ticket is not None else []
+
+        def start_hedge() -> Optional[AsyncGenerator[str, None]]:
+            # Hedges never queue: they only run when a slot is free right now
+            hedge_ticket = self.governor.try_acquire(user_key)
+            if hedge_ticket is None:
+                return None
+            tickets.append(hedge_ticket)
+            avoid = tried[-1] if tried else None
+            return self._attempt_stream(payload, cache_key, [], avoid=avoid, ticket=hedge_ticket, user_key=user_key)
+
+        try:
+            stream = self.hedger.stream(
+                self._attempt_stream(payload, cache_key, tried, ticket=ticket, user_key=user_key), start_hedge
+            )
+            async with aclosing(stream):
+                async for content in stream:
+                    yield content
+        finally:
+            # Attempts release their own slot when they end; this covers attempts closed before they started
+            for held in tickets:
+                held.release()
+
+    async def _attempt_stream(
+        self,
+        payload: Dict[str, Any],
+        cache_key: str,
+        tried: List[LLMBackend],
+        avoid: Optional[LLMBackend] = None,
+        ticket: Optional[GovernorTicket] = None,
+        user_key: str = "anonymous",
+        backends: Optional[List[LLMBackend]] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream from the first backend that answers (failing over / backing off)
+
+        Args:
+            tried: Receives each backend as it is tried
+            avoid: Backend to try last (the one a hedged attempt is racing)
+            ticket: Governor slot released when the attempt ends
+            user_key: Caller identity for usage accounting
+            backends: Only try these backends (instead of the routed ones)
+        """
+        def open_on(backend: LLMBackend) -> Awaitable[aiohttp.ClientResponse]:
+            tried.append(backend)
+            return self._open_stream(stack, backend, payload)
+
+        try:
+            async with AsyncExitStack() as stack:
+                # Failover happens before any content is yielded, so it is invisible to the client
+                started = time.monotonic()
+                backend, response = await self._with_failover(open_on, avoid=avoid, backends=backends)
+                upstream = self._stream_upstream(backend, response, cache_key, payload, user_key, started)
+                async with aclosing(upstream) as stream:
+                    async for content in stream:
+                        yield content
+        finally:
+            if ticket is not None:
+                ticket.release()
+
+    async def _open_stream(
+        self, stack: AsyncExitStack, backend: LLMBackend, payload: Dict[str, Any]
+    ) -> aiohttp.ClientResponse:
+        """Start a streaming request on one backend (the response is closed with ``stack``)"""
+        logger.info(f"Making streaming request to {backend.name} with payload: {json.dumps(payload, indent=2)}")
+
+        session = await self.http_client.get_session()
+        response = await stack.enter_async_context(session.post(
+            backend.chat_completions_url,
+            headers=backend.headers(),
+            json=dict(payload, model=backend.model)
+        ))
+        logger.info(f"{backend.name} streaming response status: {response.status}")
+        logger.info(f"{backend.name} streaming response headers: {dict(response.headers)}")
+
+        if response.status != 200:
+            error_text = await response.text()
+            response.release()
+            logger.error(f"{backend.name} API streaming error: {error_text}")
+            self._raise_for_status(backend, response.status, error_text, response.headers)
+        return response
+
+    async def _stream_upstream(
+        self,
+        backend: LLMBackend,
+        response: aiohttp.ClientResponse,
+        cache_key: str,
+        payload: Optional[Dict[str, Any]] = None,
+        user_key: str = "anonymous",
+        started: Optional[float] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream raw content deltas from an open chat-completions response
+
+        Complete answers (ending with [DONE]) are stored in the response cache.
+        The stream is cut off after ``stream_max_duration`` seconds or
+        ``stream_max_tokens`` content deltas, and closing the generator
+        aborts the upstream request. Token usage (from the final usage chunk,
+        or estimated when the stream ends without one) is recorded either way.
+
+        Yields:
+            str: Raw markdown content deltas
+        """
+        parts: List[str] = []
+        chunk_count = 0
+        completed = False
+        truncated: Optional[str] = None
+        usage: Optional[Dict[str, Any]] = None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.settings.stream_max_duration
+        started = started if started is not None else time.monotonic()
+
+        logger.info("Starting to stream response...")
+
+        try:
+            # Stream the response
+            while True:
+                remaining = deadline - loop.time()
+                try:
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError
+                    line = await asyncio.wait_for(response.content.readline(), remaining)
+                except asyncio.TimeoutError:
+                    truncated = "max_duration"
+                    break
+                if not line:
+                    break
+                line = line.decode('utf-8').strip()
+                if line.startswith('data: '):
+                    data = line[6:]  # Remove 'data: ' prefix
+                    if data == '[DONE]':
+                        logger.info("Stream completed with [DONE]")
+                        completed = True
+                        break
+
+                    try:
+                        chunk = json.loads(data)
+                        chunk_count += 1
+                        logger.debug(f"Received chunk {chunk_count}: {chunk}")
+                        if chunk.get("usage"):
+                            # Final chunk of stream_options.include_usage (no choices)
+                            usage = chunk["usage"]
+
+                        if 'choices' in chunk and len(chunk['choices']) > 0:
+                            delta = chunk['choices'][0].get('delta', {})
+                            content = delta.get('content', '')
+                            if content:
+                                parts.append(content)
+                                yield content
+                                if len(parts) >= self.settings.stream_max_tokens:
+                                    truncated = "max_tokens"
+                                    break
+                    except json.JSONDecodeError as e:
+                        logger.warning(f"JSON decode error in chunk: {e}, chunk: {data}")
+                        continue  # Skip invalid JSON chunks
+        except (GeneratorExit, asyncio.CancelledError):
+            # Nobody is reading any more; leaving the block drops the connection
+            logger.info(f"Aborting upstream stream after {chunk_count} chunks")
+            self.stream_metrics.record_upstream_aborted()
+            if payload is not None:
+                self._record_usage(user_key, backend, payload, None, "".join(parts), started,
+                                   status="cancelled", streamed=True)
+            raise
+
+        if truncated:
+            logger.warning(f"Upstream stream cut off ({truncated}) after {len(parts)} deltas")
+            self.stream_metrics.record_truncated(truncated)
+
+        raw = "".join(parts)
+        logger.info(
+            f"Streaming completed. Total chunks: {chunk_count}, "
+            f"Final content length: {len(raw)}"
+        )
+        if payload is not None:
+            self._record_usage(user_key, backend, payload, usage, raw, started,
+                               status="truncated" if truncated else "ok", streamed=True)
+
+        # Only complete answers are cached so replays never end early
+        if completed and raw and self.response_cache is not None:
+            entry = {"raw": raw, "html": await self._render_markdown(raw), "model": backend.model}
+            if payload is not None:
+                await self._store_answer(payload, cache_key, entry)
+            else:
+                await self.response_cache.set(cache_key, entry)
+
+    async def _replay_cached(
+        self, cached: Dict[str, Any], snapshot: bool
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Replay a cached answer as stream chunks at the configured speed"""
+        renderer = StreamingMarkdownRenderer()
+        raw = cached["raw"]
+        size = max(1, self.settings.response_cache_replay_chunk_chars)
+        delay = self.settings.response_cache_replay_delay
+        for start in range(0, len(raw), size):
+            if delay > 0 and start:
+                await asyncio.sleep(delay)
+            chunk = await self._render_stream_chunk(renderer, raw[start:start + size], snapshot, cached["model"])
+            chunk["cached"] = True
+            yield chunk
+
+    async def _render_markdown(self, text: str) -> str:
+        """Render a complete answer, in the render thread pool when it is large"""
+        if len(text) < self.settings.markdown_offload_chars:
+            return render_markdown(text)
+        self.renders_offloaded += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_render_executor(self.settings), render_markdown, text)
+
+    async def _render_stream_chunk(
+        self, renderer: StreamingMarkdownRenderer, content: str, snapshot: bool, model: Optional[str]
+    ) -> Dict[str, Any]:
+        """``_format_stream_chunk``, in the render thread pool when the re-rendered tail is large"""
+        if renderer.pending_chars + len(content) < self.settings.markdown_offload_chars:
+            return self._format_stream_chunk(renderer, content, snapshot, model)
+        self.renders_offloaded += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            get_render_executor(self.settings), self._format_stream_chunk, renderer, content, snapshot, model
+        )
+
+    @staticmethod
+    def _format_stream_chunk(
+        renderer: StreamingMarkdownRenderer, content: str, snapshot: bool, model: Optional[str]
+    ) -> Dict[str, Any]:
+        """
+        Feed new raw content to the renderer and build the chunk to yield
+
+        Delta chunks carry ``append`` (HTML of newly closed blocks), ``tail``
+        (replacement HTML for the open trailing block) and ``raw_delta``.
+        Snapshot chunks carry the full ``content`` HTML and ``raw_content``.
+        """
+        delta = renderer.feed(content)
+        if snapshot:
+            return {
+                "content": renderer.html,
+                "raw_content": renderer.raw,
+                "model": model
+            }
+        return {
+            "append": delta["append"],
+            "tail": delta["tail"],
+            "raw_delta": content,
+            "model": model
+        }
+
     @staticmethod
-    async def _mock_stream_response(user_message: str) -> AsyncGenerator[Dict[str, Any], None]:
+    async def _mock_stream_response(
+        user_message: str, snapshot: bool = True
+    ) -> AsyncGenerator[Dict[str, Any], None]:
         """
         Mock streaming response for testing when API is not available
         
         Args:
             user_message: The user's message
+            snapshot: Yield full snapshots (default) instead of deltas
             
         Yields:
             dict: Mock streaming response chunks with HTML formatting
         """
-        import asyncio
-        
-        # Mock response based on user message
-        if "story" in user_message.lower():
-            response_parts = [
-                "Once upon a time, in a **distant galaxy**, there lived a curious robot named ",
-                "**Rusty**. Unlike other robots who spent their days processing data, Rusty had a ",
-                "dream: to understand the meaning of *human emotions*. \n\n",
-                "Every day, Rusty would observe the humans from afar, watching them laugh, cry, ",
-                "and share moments of joy. The robot's circuits would buzz with questions: ",
-                "`What makes them smile?` `Why do they hold hands?` `What is love?`\n\n",
-                "One day, Rusty decided to take a bold step. Instead of staying in the shadows, ",
-                "the robot approached a group of children playing in the park. At first, the ",
-                "children were surprised, but Rusty's gentle nature and endless curiosity ",
-                "soon won them over.\n\n",
-                "Through their friendship, Rusty learned that emotions weren't just data to be ",
-                "processed—they were experiences to be felt. The robot discovered that ",
-                "**empathy** was the bridge between artificial and human intelligence.\n\n",
-                "And so, Rusty became the first robot to truly understand the heart, proving ",
-                "that sometimes the most profound discoveries come from the simplest connections."
-            ]
-        else:
-            response_parts = [
-                "Hello! I'm **Midori**, your AI assistant. I'm here to help you with ",
-                "any questions or tasks you might have. I can assist with:\n\n",
-                "- **Writing and editing** content\n",
-                "- **Problem solving** and analysis\n",
-                "- **Creative projects** and brainstorming\n",
-                "- **Learning** new topics\n",
-                "- **Coding** and technical questions\n\n",
-                "What would you like to explore today? I'm excited to help you discover ",
-                "new possibilities and find solutions to your challenges!"
-            ]
+        response_parts = mock_response_parts(user_message)
         
-        # Accumulate content for markdown processing
-        accumulated_content = ""
+        # Incremental markdown renderer
+        renderer = StreamingMarkdownRenderer()
         
         # Stream the response with delays to simulate real streaming
         for part in response_parts:
             await asyncio.sleep(0.1)  # Small delay between chunks
-            accumulated_content += part
-            
-            # Convert accumulated content to HTML
-            formatted_html = markdown.markdown(
-                accumulated_content,
-                extensions=['fenced_code', 'codehilite', 'tables', 'nl2br']
-            )
-            
-            yield {
-                "content": formatted_html,
-                "raw_content": accumulated_content,
-                "model": LLM_MODEL
-            } 
\ No newline at end of file
+            yield ChatService._format_stream_chunk(renderer, part, snapshot, DEFAULT_MODEL) 
\ No newline at end of file
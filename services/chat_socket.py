@@ -0,0 +1,232 @@
+"""
+Multiplexed chat streams over one WebSocket connection
+"""
+import asyncio
+from contextlib import aclosing
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from services.chat_service import ChatService, stream_event_name
+
+logger = logging.getLogger(__name__)
+
+# Close code sent when the client stops reading (policy violation)
+SLOW_CLIENT_CLOSE_CODE = 1008
+
+
+class ChatSocketSession:
+    """
+    Chat streams of one WebSocket connection, keyed by client-chosen stream ids.
+
+    Client frames: ``{"type": "chat", "id", "message", "conversation_id"?, "format"?, "rag"?}``,
+    ``{"type": "regenerate", "id", "conversation_id", "format"?, "rag"?}``,
+    ``{"type": "cancel", "id"}`` and ``{"type": "ping"}``.
+    Server frames carry the stream ``id`` and a ``type`` of ``conversation``,
+    ``sources``, ``queue``, ``message``, ``complete``, ``error`` or ``cancelled`` (plus ``pong``),
+    with the same fields as the SSE events of ``/api/chat/stream``.
+
+    One writer task sends all frames. Stream frames need one of
+    ``ws_send_queue_size`` send credits, returned when the frame has been
+    written, so a client that reads slowly holds its streams (and their
+    upstream reads) back instead of buffering without bound. A stream that
+    waits longer than ``ws_send_timeout`` for a credit closes the socket.
+    Control frames (errors, cancellations, pongs) skip the credits so
+    cancel frames are always answered; a client that lets more than
+    ``ws_send_queue_size`` of them pile up (e.g. by flooding invalid
+    frames without reading) is disconnected.
+    """
+
+    def __init__(
+        self,
+        chat_service: ChatService,
+        user_key: str,
+        send: Callable[[Dict[str, Any]], Awaitable[None]],
+        close: Callable[[int, str], Awaitable[None]],
+        owner: Optional[str] = None,
+    ):
+        settings = chat_service.settings
+        self.chat_service = chat_service
+        self.user_key = user_key
+        # Owner of the connection's conversations
+        self.owner = owner or user_key
+        self._send = send
+        self._close = close
+        self.max_streams = settings.ws_max_streams
+        self.send_timeout = settings.ws_send_timeout
+        self._credits = asyncio.Semaphore(settings.ws_send_queue_size)
+        self.max_pending_control = settings.ws_send_queue_size
+        self._pending_control = 0
+        self._outbox: "asyncio.Queue[Tuple[Dict[str, Any], bool]]" = asyncio.Queue()
+        self._streams: Dict[str, asyncio.Task] = {}
+        self._writer: Optional[asyncio.Task] = None
+        self._abort_task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.streams_started = 0
+        self.streams_cancelled = 0
+
+    async def start(self) -> None:
+        """Start the writer task"""
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def close(self) -> None:
+        """Cancel all streams and stop the writer (the connection is gone)"""
+        self._closing = True
+        streams = list(self._streams.values())
+        for task in streams:
+            task.cancel()
+        await asyncio.gather(*streams, return_exceptions=True)
+        if self._writer is not None:
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+
+    @property
+    def active_streams(self) -> int:
+        return len(self._streams)
+
+    async def handle(self, frame: Any) -> None:
+        """
+        Handle one client frame without waiting on the client's read speed
+
+        Args:
+            frame: Decoded JSON frame from the client
+        """
+        if not isinstance(frame, dict):
+            self.reject("Frames must be JSON objects")
+            return
+        kind = frame.get("type")
+        stream_id = frame.get("id")
+        if kind == "ping":
+            self._queue_control({"type": "pong"})
+            return
+        if not isinstance(stream_id, str) or not stream_id:
+            self.reject("Stream id is required")
+            return
+
+        if kind == "cancel":
+            if not await self._cancel(stream_id):
+                self.reject("Stream not found", stream_id, status_code=404)
+            return
+        if kind not in ("chat", "regenerate"):
+            self.reject(f"Unknown frame type: {kind}", stream_id)
+            return
+
+        stream_format = frame.get("format", "delta")
+        if stream_format not in ("delta", "snapshot"):
+            self.reject("Format must be 'delta' or 'snapshot'", stream_id)
+            return
+        if kind == "regenerate":
+            # Regenerating under a running stream's id replaces that stream
+            await self._cancel(stream_id)
+        elif stream_id in self._streams:
+            self.reject("Stream id already in use", stream_id, status_code=409)
+            return
+        if len(self._streams) >= self.max_streams:
+            self.reject(f"At most {self.max_streams} concurrent streams per connection", stream_id, status_code=429)
+            return
+
+        chunks = self.chat_service.chat_with_llama_stream(
+            frame.get("message", ""),
+            snapshot=stream_format == "snapshot",
+            user_key=self.user_key,
+            conversation_id=frame.get("conversation_id"),
+            regenerate=kind == "regenerate",
+            rag=bool(frame.get("rag", False)),
+            owner=self.owner,
+        )
+        self.chat_service.stream_metrics.record_started()
+        self.streams_started += 1
+        task = asyncio.create_task(self._run_stream(stream_id, chunks))
+        self._streams[stream_id] = task
+        task.add_done_callback(lambda done: self._stream_done(stream_id, done))
+
+    def reject(self, error: str, stream_id: Optional[str] = None, status_code: int = 400) -> None:
+        """Send an error frame for a frame that could not be handled"""
+        frame: Dict[str, Any] = {"type": "error", "error": error, "status_code": status_code}
+        if stream_id is not None:
+            frame["id"] = stream_id
+        self._queue_control(frame)
+
+    async def _cancel(self, stream_id: str) -> bool:
+        task = self._streams.get(stream_id)
+        if task is None:
+            return False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return True
+
+    async def _run_stream(self, stream_id: str, chunks) -> None:
+        try:
+            # Closing the service stream (cancel, disconnect) aborts the upstream request
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    await self._queue_stream({"type": stream_event_name(chunk), "id": stream_id, **chunk})
+            await self._queue_stream({"type": "complete", "id": stream_id, "status": "completed"})
+        except HTTPException as e:
+            error = {"type": "error", "id": stream_id, "error": e.detail, "status_code": e.status_code}
+            if e.headers and "Retry-After" in e.headers:
+                error["retry_after"] = int(e.headers["Retry-After"])
+            self._queue_control(error)
+        except asyncio.TimeoutError:
+            logger.warning(f"WebSocket client {self.user_key} stopped reading, closing the connection")
+            self._abort_soon()
+        except Exception as e:
+            logger.error(f"WebSocket chat stream failed: {e}", exc_info=True)
+            self._queue_control({"type": "error", "id": stream_id, "error": str(e)})
+
+    def _stream_done(self, stream_id: str, task: asyncio.Task) -> None:
+        if self._streams.get(stream_id) is task:
+            del self._streams[stream_id]
+        metrics = self.chat_service.stream_metrics
+        if task.cancelled():
+            metrics.record_cancelled()
+            self.streams_cancelled += 1
+            if not self._closing:
+                self._queue_control({"type": "cancelled", "id": stream_id})
+        else:
+            metrics.record_completed()
+
+    async def _queue_stream(self, frame: Dict[str, Any]) -> None:
+        # Waits while the client has ws_send_queue_size frames unread
+        await asyncio.wait_for(self._credits.acquire(), self.send_timeout)
+        self._outbox.put_nowait((frame, True))
+
+    def _queue_control(self, frame: Dict[str, Any]) -> None:
+        if self._closing:
+            return
+        if self._pending_control >= self.max_pending_control:
+            logger.warning(f"WebSocket client {self.user_key} left too many control frames unread, closing")
+            self._abort_soon()
+            return
+        self._pending_control += 1
+        self._outbox.put_nowait((frame, False))
+
+    async def _write_loop(self) -> None:
+        while True:
+            frame, counted = await self._outbox.get()
+            try:
+                await self._send(frame)
+            except Exception as e:
+                # The connection is gone; the receive loop notices and closes the session
+                logger.debug(f"WebSocket send failed: {e}")
+                return
+            finally:
+                if counted:
+                    self._credits.release()
+                else:
+                    self._pending_control -= 1
+
+    def _abort_soon(self) -> None:
+        if self._abort_task is None:
+            self._abort_task = asyncio.create_task(self._abort())
+
+    async def _abort(self) -> None:
+        if self._closing:
+            return
+        self._closing = True
+        try:
+            await self._close(SLOW_CLIENT_CLOSE_CODE, "Client is not reading")
+        except Exception as e:
+            logger.debug(f"WebSocket close failed: {e}")
+        await self.close()
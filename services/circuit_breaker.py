@@ -0,0 +1,157 @@
+"""
+Circuit breaker for upstream LLM backends (closed / open / half-open)
+"""
+from collections import Counter, deque
+import logging
+import time
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Bound on outcomes kept in the rolling window
+MAX_WINDOW_CALLS = 1000
+
+# Number of recent transitions kept for metrics
+TRANSITION_HISTORY = 20
+
+
+class CircuitBreaker:
+    """
+    Track the outcomes of recent calls to one backend and stop calling it when it degrades.
+
+    The breaker opens when, over the last ``window`` seconds and at least
+    ``min_requests`` calls, the error rate reaches ``failure_rate`` or the
+    share of calls slower than ``slow_call_seconds`` reaches
+    ``slow_call_rate``. While open, calls are rejected immediately. After
+    ``open_seconds`` it lets ``half_open_max_calls`` probe calls through:
+    if they all succeed it closes, and any failure opens it again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: float = 60.0,
+        min_requests: int = 10,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 10.0,
+        slow_call_rate: float = 0.8,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 1,
+    ):
+        self.name = name
+        self.window = window
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._calls: Deque[Tuple[float, bool, bool]] = deque(maxlen=MAX_WINDOW_CALLS)
+        self._probes_inflight = 0
+        self._probe_successes = 0
+        self.rejected = 0
+        self.transitions: Counter = Counter()
+        self.history: Deque[Dict[str, Any]] = deque(maxlen=TRANSITION_HISTORY)
+
+    @property
+    def state(self) -> str:
+        """Current state (an open breaker turns half-open once its cool-down has passed)"""
+        if self._state == OPEN and time.monotonic() >= self._opened_at + self.open_seconds:
+            self._transition(HALF_OPEN, "cool-down elapsed")
+        return self._state
+
+    def retry_after(self) -> float:
+        """Seconds until an open breaker lets a probe through"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def allow_request(self) -> bool:
+        """Whether a call may go out now (reserves a probe slot while half-open)"""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self._probes_inflight < self.half_open_max_calls:
+            self._probes_inflight += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self, latency: float) -> None:
+        self._record(True, latency)
+
+    def record_failure(self, latency: Optional[float] = None) -> None:
+        self._record(False, latency)
+
+    def record_cancelled(self) -> None:
+        """A call ended without an outcome (frees its half-open probe slot)"""
+        if self._state == HALF_OPEN:
+            self._probes_inflight = max(0, self._probes_inflight - 1)
+
+    def _record(self, ok: bool, latency: Optional[float]) -> None:
+        now = time.monotonic()
+        slow = latency is not None and latency >= self.slow_call_seconds
+        state = self.state
+
+        if state == HALF_OPEN:
+            self._probes_inflight = max(0, self._probes_inflight - 1)
+            if not ok or slow:
+                self._transition(OPEN, "probe failed" if not ok else "probe slow")
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_max_calls:
+                self._transition(CLOSED, "probes succeeded")
+            return
+
+        self._calls.append((now, ok, slow))
+        if state != CLOSED:
+            return
+        calls = self._window_calls(now)
+        if len(calls) < self.min_requests:
+            return
+        error_rate = sum(1 for _, call_ok, _ in calls if not call_ok) / len(calls)
+        slow_rate = sum(1 for _, _, call_slow in calls if call_slow) / len(calls)
+        if error_rate >= self.failure_rate:
+            self._transition(OPEN, f"error rate {error_rate:.0%}")
+        elif slow_rate >= self.slow_call_rate:
+            self._transition(OPEN, f"slow call rate {slow_rate:.0%}")
+
+    def _window_calls(self, now: float) -> List[Tuple[float, bool, bool]]:
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+        return list(self._calls)
+
+    def _transition(self, state: str, reason: str) -> None:
+        previous = self._state
+        self._state = state
+        self._probes_inflight = 0
+        self._probe_successes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == CLOSED:
+            self._calls.clear()
+        self.transitions[f"{previous}->{state}"] += 1
+        self.history.append({"at": time.time(), "from": previous, "to": state, "reason": reason})
+        log = logger.warning if state == OPEN else logger.info
+        log(f"Circuit for {self.name}: {previous} -> {state} ({reason})")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the breaker state, window rates and transition counters"""
+        calls = self._window_calls(time.monotonic())
+        count = len(calls)
+        return {
+            "state": self.state,
+            "retry_after": round(self.retry_after(), 1),
+            "window_calls": count,
+            "window_error_rate": round(sum(1 for _, ok, _ in calls if not ok) / count, 4) if count else 0.0,
+            "window_slow_rate": round(sum(1 for _, _, slow in calls if slow) / count, 4) if count else 0.0,
+            "rejected": self.rejected,
+            "transitions": dict(self.transitions),
+            "recent_transitions": list(self.history),
+        }
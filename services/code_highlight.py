@@ -0,0 +1,175 @@
+"""
+Content-addressed cache of Pygments-highlighted fenced code blocks
+"""
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from markdown import Markdown
+from markdown.extensions import Extension
+from markdown.extensions.codehilite import CodeHilite, CodeHiliteExtension
+from markdown.extensions.fenced_code import FencedBlockPreprocessor
+from markdown.preprocessors import Preprocessor
+
+from dependencies.config import Settings, get_settings
+
+
+class HighlightCache:
+    """
+    LRU cache of highlighted code blocks, bounded by the bytes of HTML held.
+
+    Keys are hashes of the highlighter options, the language and the source,
+    so a block is highlighted once however many renders (streaming tails,
+    closed blocks, cached answers, other streams) contain it. Renders may run
+    in worker threads, so access is locked.
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[bytes, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.highlight_ms_total = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(options: str, lang: Optional[str], source: str) -> bytes:
+        """Key for a block: options fingerprint, language and source"""
+        digest = hashlib.blake2b(digest_size=16)
+        for part in (options, lang or "", source):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.digest()
+
+    def get(self, key: bytes) -> Optional[str]:
+        """Cached HTML for a key (marked most recently used), or None"""
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key: bytes, html: str, elapsed_ms: float = 0.0) -> None:
+        """Store highlighted HTML, evicting least recently used blocks beyond ``max_bytes``"""
+        size = len(html.encode("utf-8"))
+        with self._lock:
+            self.highlight_ms_total += elapsed_ms
+            if size > self.max_bytes or key in self._entries:
+                return
+            self._entries[key] = html
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted.encode("utf-8"))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache counters"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "highlight_ms_total": round(self.highlight_ms_total, 2),
+        }
+
+
+class CachedFencePreprocessor(Preprocessor):
+    """
+    Highlight plain fenced code blocks (```lang) through the HighlightCache.
+
+    Runs just before ``fenced_code`` and stashes the same HTML it would
+    produce; blocks with ``{attrs}`` or ``hl_lines`` are left to it.
+    """
+
+    def __init__(self, md: Markdown, cache: Optional["HighlightCache"] = None):
+        super().__init__(md)
+        self._cache = cache
+        self._options: Optional[Dict[str, Any]] = None
+        self._fingerprint = ""
+
+    def _codehilite_options(self) -> Optional[Dict[str, Any]]:
+        if self._options is None:
+            self._options = {}
+            for ext in self.md.registeredExtensions:
+                if isinstance(ext, CodeHiliteExtension):
+                    self._options = ext.getConfigs()
+            self._fingerprint = repr(sorted(self._options.items()))
+        return self._options if self._options.get("use_pygments") else None
+
+    def run(self, lines: List[str]) -> List[str]:
+        options = self._codehilite_options()
+        cache = self._cache if self._cache is not None else get_highlight_cache()
+        if options is None or cache is None:
+            return lines
+
+        text = "\n".join(lines)
+        index = 0
+        while True:
+            m = FencedBlockPreprocessor.FENCED_BLOCK_RE.search(text, index)
+            if not m:
+                break
+            if m.group("attrs") is not None or m.group("hl_lines") is not None:
+                index = m.end()
+                continue
+            lang = m.group("lang") or None
+            code = m.group("code")
+            key = cache.make_key(self._fingerprint, lang, code)
+            html = cache.get(key)
+            if html is None:
+                started = time.perf_counter()
+                local = options.copy()
+                style = local.pop("pygments_style", "default")
+                html = CodeHilite(code, lang=lang, style=style, **local).hilite(shebang=False)
+                cache.put(key, html, (time.perf_counter() - started) * 1000)
+            placeholder = self.md.htmlStash.store(html)
+            text = f"{text[:m.start()]}\n{placeholder}\n{text[m.end():]}"
+            index = m.start() + 1 + len(placeholder)
+        return text.split("\n")
+
+
+class CachedHighlightExtension(Extension):
+    """Markdown extension adding ``CachedFencePreprocessor`` (use with ``fenced_code`` and ``codehilite``)"""
+
+    def __init__(self, cache: Optional[HighlightCache] = None, **kwargs):
+        self.cache = cache
+        super().__init__(**kwargs)
+
+    def extendMarkdown(self, md: Markdown) -> None:
+        # fenced_code_block is registered at 25; higher priorities run first
+        md.preprocessors.register(CachedFencePreprocessor(md, self.cache), "cached_fenced_code", 26)
+
+
+# Global highlight cache instance
+_highlight_cache: Optional[HighlightCache] = None
+
+
+def get_highlight_cache(settings: Optional[Settings] = None) -> Optional[HighlightCache]:
+    """Get or create the shared highlight cache (None when ``markdown_highlight_cache_bytes`` is 0)"""
+    global _highlight_cache
+    if _highlight_cache is None:
+        settings = settings or get_settings()
+        if settings.markdown_highlight_cache_bytes <= 0:
+            return None
+        _highlight_cache = HighlightCache(settings.markdown_highlight_cache_bytes)
+    return _highlight_cache
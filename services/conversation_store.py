@@ -0,0 +1,281 @@
+"""
+Server-side conversation history with token-budget packing of the LLM context
+"""
+from collections import OrderedDict, deque
+from datetime import UTC, datetime
+import logging
+import math
+import re
+from typing import Any, Deque, Dict, List, Optional
+import uuid
+
+from sqlalchemy.exc import DatabaseError, OperationalError
+from sqlmodel import delete, select
+
+from dependencies.config import Settings, get_settings
+from models import Conversation, ConversationMessage
+
+logger = logging.getLogger(__name__)
+
+# Tokens added per message for role markers and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the token count of a text without a tokenizer
+
+    Uses the larger of ~4 characters per token and one token per word or
+    punctuation mark, which errs on the high side for English and code.
+    """
+    if not text:
+        return 0
+    return max(math.ceil(len(text) / 4), len(_WORD_RE.findall(text)))
+
+
+def pack_messages(
+    system_prompt: str,
+    history: List[Dict[str, Any]],
+    user_message: str,
+    budget: int,
+) -> List[Dict[str, str]]:
+    """
+    Build the chat messages: system prompt, the most recent history that fits
+    in ``budget`` tokens, then the new user message
+
+    Args:
+        system_prompt: System message (always included)
+        history: Earlier messages, oldest first (``role``, ``content``, optional ``tokens``)
+        user_message: The new user message (always included)
+        budget: Token budget for the prompt
+
+    Returns:
+        list: OpenAI-style ``{"role", "content"}`` messages
+    """
+    used = (
+        estimate_tokens(system_prompt) + estimate_tokens(user_message) + 2 * MESSAGE_OVERHEAD_TOKENS
+    )
+    packed: List[Dict[str, str]] = []
+    for message in reversed(history):
+        tokens = message.get("tokens") or estimate_tokens(message["content"])
+        tokens += MESSAGE_OVERHEAD_TOKENS
+        if used + tokens > budget:
+            break
+        used += tokens
+        packed.append({"role": message["role"], "content": message["content"]})
+    packed.reverse()
+
+    # Never start the history with an orphaned assistant reply
+    while packed and packed[0]["role"] != "user":
+        packed.pop(0)
+
+    return [
+        {"role": "system", "content": system_prompt},
+        *packed,
+        {"role": "user", "content": user_message},
+    ]
+
+
+class _ConversationState:
+    def __init__(self, owner: str, max_messages: int):
+        self.owner = owner
+        self.messages: Deque[Dict[str, Any]] = deque(maxlen=max_messages)
+
+
+class ConversationStore:
+    """
+    Conversation histories kept in a bounded in-memory LRU and, when
+    ``persist`` is on, written through to the conversations tables.
+
+    Only role, content and a token estimate are kept per message. Database
+    errors are logged and the store keeps working from memory.
+    """
+
+    def __init__(
+        self,
+        max_conversations: int = 1000,
+        max_messages: int = 100,
+        persist: bool = True,
+        session_factory=None,
+    ):
+        self.max_conversations = max_conversations
+        self.max_messages = max_messages
+        self.persist = persist
+        self._session_factory = session_factory
+        self._conversations: "OrderedDict[str, _ConversationState]" = OrderedDict()
+        self.created = 0
+        self.loaded = 0
+        self.evictions = 0
+        self.db_errors = 0
+
+    def _sessions(self):
+        if self._session_factory is None:
+            from db import AsyncSessionLocal
+            self._session_factory = AsyncSessionLocal
+        return self._session_factory
+
+    async def create(self, owner: str) -> str:
+        """Start a new conversation and return its id"""
+        conversation_id = str(uuid.uuid4())
+        self._remember(conversation_id, _ConversationState(owner, self.max_messages))
+        self.created += 1
+        if self.persist:
+            try:
+                async with self._sessions()() as session:
+                    session.add(Conversation(id=uuid.UUID(conversation_id), owner=owner))
+                    await session.commit()
+            except (OperationalError, DatabaseError) as e:
+                self._db_error("create", e)
+        return conversation_id
+
+    async def get_history(self, conversation_id: str, owner: str) -> Optional[List[Dict[str, Any]]]:
+        """Get the messages of a conversation (oldest first), or None if unknown or not owned"""
+        state = self._conversations.get(conversation_id)
+        if state is None:
+            state = await self._load(conversation_id)
+            if state is None:
+                return None
+            self._remember(conversation_id, state)
+        else:
+            self._conversations.move_to_end(conversation_id)
+        if state.owner != owner:
+            return None
+        return list(state.messages)
+
+    async def append(self, conversation_id: str, owner: str, role: str, content: str) -> None:
+        """Append a message to a conversation the caller owns"""
+        if await self.get_history(conversation_id, owner) is None:
+            return
+        state = self._conversations[conversation_id]
+        message = {"role": role, "content": content, "tokens": estimate_tokens(content)}
+        state.messages.append(message)
+        if self.persist:
+            try:
+                async with self._sessions()() as session:
+                    session.add(ConversationMessage(
+                        conversation_id=uuid.UUID(conversation_id),
+                        role=role,
+                        content=content,
+                        token_count=message["tokens"],
+                    ))
+                    conversation = await session.get(Conversation, uuid.UUID(conversation_id))
+                    if conversation is not None:
+                        conversation.updated_at = datetime.now(UTC)
+                    await session.commit()
+            except (OperationalError, DatabaseError) as e:
+                self._db_error("append", e)
+
+    async def drop_last_exchange(self, conversation_id: str, owner: str) -> bool:
+        """Remove the trailing user/assistant pair of a conversation the caller owns (for regenerate)"""
+        history = await self.get_history(conversation_id, owner)
+        if not history or len(history) < 2 or [m["role"] for m in history[-2:]] != ["user", "assistant"]:
+            return False
+        state = self._conversations[conversation_id]
+        state.messages.pop()
+        state.messages.pop()
+        if self.persist:
+            try:
+                async with self._sessions()() as session:
+                    key = uuid.UUID(conversation_id)
+                    result = await session.execute(
+                        select(ConversationMessage.id)
+                        .where(ConversationMessage.conversation_id == key)
+                        .order_by(ConversationMessage.id.desc())  # type: ignore
+                        .limit(2)
+                    )
+                    ids = list(result.scalars().all())
+                    await session.execute(
+                        delete(ConversationMessage).where(ConversationMessage.id.in_(ids))  # type: ignore
+                    )
+                    await session.commit()
+            except (OperationalError, DatabaseError) as e:
+                self._db_error("drop_last_exchange", e)
+        return True
+
+    async def delete(self, conversation_id: str, owner: str) -> bool:
+        """Delete a conversation the caller owns"""
+        if await self.get_history(conversation_id, owner) is None:
+            return False
+        del self._conversations[conversation_id]
+        if self.persist:
+            try:
+                async with self._sessions()() as session:
+                    key = uuid.UUID(conversation_id)
+                    await session.execute(
+                        delete(ConversationMessage).where(ConversationMessage.conversation_id == key)  # type: ignore
+                    )
+                    await session.execute(delete(Conversation).where(Conversation.id == key))  # type: ignore
+                    await session.commit()
+            except (OperationalError, DatabaseError) as e:
+                self._db_error("delete", e)
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get store counters"""
+        return {
+            "conversations_in_memory": len(self._conversations),
+            "max_conversations": self.max_conversations,
+            "persistent": self.persist,
+            "created": self.created,
+            "loaded_from_db": self.loaded,
+            "evictions": self.evictions,
+            "db_errors": self.db_errors,
+        }
+
+    def _remember(self, conversation_id: str, state: _ConversationState) -> None:
+        self._conversations[conversation_id] = state
+        self._conversations.move_to_end(conversation_id)
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+            self.evictions += 1
+
+    async def _load(self, conversation_id: str) -> Optional[_ConversationState]:
+        if not self.persist:
+            return None
+        try:
+            key = uuid.UUID(conversation_id)
+        except ValueError:
+            return None
+        try:
+            async with self._sessions()() as session:
+                conversation = await session.get(Conversation, key)
+                if conversation is None:
+                    return None
+                result = await session.execute(
+                    select(ConversationMessage)
+                    .where(ConversationMessage.conversation_id == key)
+                    .order_by(ConversationMessage.id.desc())  # type: ignore
+                    .limit(self.max_messages)
+                )
+                rows = list(reversed(result.scalars().all()))
+        except (OperationalError, DatabaseError) as e:
+            self._db_error("load", e)
+            return None
+        state = _ConversationState(conversation.owner, self.max_messages)
+        for row in rows:
+            state.messages.append({"role": row.role, "content": row.content, "tokens": row.token_count})
+        self.loaded += 1
+        return state
+
+    def _db_error(self, operation: str, error: Exception) -> None:
+        self.db_errors += 1
+        logger.warning(f"Conversation store {operation} failed, using memory only: {error}")
+
+
+# Global conversation store instance
+_conversation_store: Optional[ConversationStore] = None
+
+
+def get_conversation_store(settings: Optional[Settings] = None) -> ConversationStore:
+    """Get or create the shared conversation store"""
+    global _conversation_store
+    if _conversation_store is None:
+        settings = settings or get_settings()
+        _conversation_store = ConversationStore(
+            max_conversations=settings.conversation_max_in_memory,
+            max_messages=settings.conversation_max_messages,
+            persist=settings.conversation_persist,
+        )
+    return _conversation_store
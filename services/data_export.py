@@ -0,0 +1,163 @@
+"""
+Streaming NDJSON/CSV exports of products and webinar registrants, read through server-side cursors
+"""
+import csv
+from datetime import date, datetime
+import io
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Sequence
+import uuid
+import zlib
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.exc import DatabaseError, OperationalError
+
+from dependencies.config import Settings, get_settings
+from models import Product, WebinarRegistrants
+
+logger = logging.getLogger(__name__)
+
+# Export name -> (table, exported columns in order)
+EXPORTS: Dict[str, Any] = {
+    "products": (
+        Product.__table__,  # type: ignore[attr-defined]
+        ["id", "name", "description", "price", "category", "in_stock", "created_at", "updated_at"],
+    ),
+    "registrants": (
+        WebinarRegistrants.__table__,  # type: ignore[attr-defined]
+        [
+            "id", "name", "email", "company", "webinar_title", "webinar_date", "registration_date", "status",
+            "assigned_sales_rep", "group", "is_public", "notes", "photo_url", "created_at", "updated_at",
+        ],
+    ),
+}
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _plain(value: Any) -> Any:
+    """A column value as JSON/CSV-friendly data"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _ndjson_chunk(columns: Sequence[str], rows: Sequence[Sequence[Any]]) -> str:
+    return "".join(
+        json.dumps(dict(zip(columns, map(_plain, row), strict=True)), ensure_ascii=False, separators=(",", ":")) + "\n"
+        for row in rows
+    )
+
+
+def _csv_writer() -> Callable[[Sequence[Sequence[Any]]], str]:
+    """CSV rows to text, reusing one buffer"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def write(rows: Sequence[Sequence[Any]]) -> str:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_plain(value) for value in row] for row in rows)
+        return buffer.getvalue()
+
+    return write
+
+
+class DataExport:
+    """
+    Stream one table as NDJSON or CSV while it is being read.
+
+    Rows come from a server-side cursor in batches of ``export_batch_size`` (``yield_per``),
+    and each batch is encoded and sent before the next is fetched, so memory stays
+    flat however large the table is. With ``compress``, the bytes are gzipped on
+    the fly and flushed per batch so the client keeps receiving data.
+    """
+
+    def __init__(self, settings: Settings, session_factory: Optional[Callable[[], Any]] = None):
+        self.settings = settings
+        self._session_factory = session_factory
+
+    def _sessions(self):
+        if self._session_factory is None:
+            from db import AsyncSessionLocal
+            self._session_factory = AsyncSessionLocal
+        return self._session_factory
+
+    async def start(self, name: str, fmt: str = "ndjson", compress: bool = False) -> AsyncIterator[bytes]:
+        """
+        Open the cursor and return the body of the export
+
+        The first batch is read before returning, so a database that is
+        unavailable is reported as an error status instead of a truncated download.
+
+        Raises:
+            HTTPException: 400 for an unknown export or format, 503 when the database is unavailable
+        """
+        if name not in EXPORTS:
+            raise HTTPException(status_code=400, detail=f"Unknown export: {name}")
+        if fmt not in EXPORT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+
+        chunks = self._chunks(name, fmt, compress)
+        try:
+            first = await anext(chunks)
+        except (OperationalError, DatabaseError) as e:
+            logger.warning(f"Export of {name} failed to start: {e}")
+            raise HTTPException(status_code=503, detail="Export unavailable (database error)") from e
+        return self._follow(first, chunks, name)
+
+    async def _follow(self, first: bytes, chunks: AsyncIterator[bytes], name: str) -> AsyncIterator[bytes]:
+        yield first
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except (OperationalError, DatabaseError) as e:
+            # The status line is already sent: the client sees a truncated body
+            logger.warning(f"Export of {name} stopped early: {e}")
+        finally:
+            await chunks.aclose()
+
+    async def _chunks(self, name: str, fmt: str, compress: bool) -> AsyncIterator[bytes]:
+        table, columns = EXPORTS[name]
+        query = (
+            select(*(table.c[column] for column in columns))
+            .order_by(table.c.created_at, table.c.id)
+            .execution_options(yield_per=self.settings.export_batch_size)
+        )
+        gzip = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+
+        def encode(text: str, final: bool = False) -> bytes:
+            if gzip is None:
+                return text.encode("utf-8")
+            data = gzip.compress(text.encode("utf-8"))
+            return data + gzip.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+        write_csv = _csv_writer() if fmt == "csv" else None
+        async with self._sessions()() as session:
+            result = await session.stream(query)
+            # CSV header (and the gzip header) go out with the first batch, as soon as the cursor is open
+            header = write_csv([columns]) if write_csv is not None else ""
+            started = False
+            async for rows in result.partitions():
+                text = write_csv(rows) if write_csv is not None else _ndjson_chunk(columns, rows)
+                yield encode(header + text)
+                header = ""
+                started = True
+            if not started or gzip is not None:
+                yield encode(header, final=True)
+
+
+# Global data export instance
+_data_export: Optional[DataExport] = None
+
+
+def get_data_export(settings: Optional[Settings] = None) -> DataExport:
+    """Get or create the shared exporter"""
+    global _data_export
+    if _data_export is None:
+        _data_export = DataExport(settings or get_settings())
+    return _data_export
@@ -0,0 +1,96 @@
+"""
+Time-window batching of upstream content deltas into fewer SSE frames
+"""
+import asyncio
+from contextlib import aclosing
+from typing import AsyncGenerator, AsyncIterator
+
+# Upstream deltas read ahead while the client is slow (backpressure beyond this)
+QUEUE_SIZE = 256
+
+_END = object()
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def batch_deltas(
+    source: AsyncIterator[str], interval: float, max_chars: int
+) -> AsyncGenerator[str, None]:
+    """
+    Join content deltas into one chunk per ``interval`` seconds or ``max_chars``
+    characters, whichever comes first
+
+    The first delta is passed through immediately so time-to-first-token is
+    unchanged. An ``interval`` of 0 disables batching.
+
+    Args:
+        source: Upstream content deltas
+        interval: Maximum time a delta waits in the batch, in seconds
+        max_chars: Flush as soon as the batch holds this many characters
+
+    Yields:
+        str: Batched content
+    """
+    if interval <= 0:
+        async with aclosing(source):
+            async for delta in source:
+                yield delta
+        return
+
+    # A reader task fills the queue so a stalled upstream cannot hold back
+    # a batch whose window has already expired
+    queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    async def pump() -> None:
+        try:
+            async with aclosing(source):
+                async for delta in source:
+                    await queue.put(delta)
+            await queue.put(_END)
+        except Exception as e:
+            await queue.put(_Failure(e))
+
+    reader = asyncio.create_task(pump())
+    loop = asyncio.get_running_loop()
+    parts = []
+    size = 0
+    flush_at = 0.0
+    first = True
+    try:
+        while True:
+            try:
+                if parts:
+                    item = await asyncio.wait_for(queue.get(), max(0.0, flush_at - loop.time()))
+                else:
+                    item = await queue.get()
+            except asyncio.TimeoutError:
+                yield "".join(parts)
+                parts, size = [], 0
+                continue
+
+            if item is _END or isinstance(item, _Failure):
+                if parts:
+                    yield "".join(parts)
+                if isinstance(item, _Failure):
+                    raise item.error
+                return
+
+            if first:
+                first = False
+                yield item
+                continue
+
+            if not parts:
+                flush_at = loop.time() + interval
+            parts.append(item)
+            size += len(item)
+            if size >= max_chars:
+                yield "".join(parts)
+                parts, size = [], 0
+    finally:
+        # Closing the batcher stops the reader, which closes the upstream source
+        reader.cancel()
+        await asyncio.wait([reader])
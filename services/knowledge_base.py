@@ -0,0 +1,448 @@
+"""
+Retrieval over the project's own data (products, webinar registrations) for chat answers
+"""
+import asyncio
+from collections import deque
+import hashlib
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import time
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.exc import DatabaseError, OperationalError
+from sqlmodel import select
+
+from dependencies.config import Settings, get_settings
+from models import Product, WebinarRegistrants
+from services.vector_index import NUMPY_AVAILABLE, HashingEmbedder, VectorIndex
+
+if NUMPY_AVAILABLE:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Indexed tables by source name
+SOURCES = {"products": Product, "registrants": WebinarRegistrants}
+
+# Query latencies kept for the percentiles in the metrics
+LATENCY_SAMPLES = 500
+
+
+def product_document(product: Product) -> Tuple[str, str]:
+    """Title and text of a product row"""
+    lines = [
+        f"Product: {product.name}",
+        f"Category: {product.category or 'uncategorized'}",
+        f"Price: ${product.price:.2f}",
+        f"In stock: {'yes' if product.in_stock else 'no'}",
+    ]
+    if product.description:
+        lines.append(f"Description: {product.description}")
+    return product.name, "\n".join(lines)
+
+
+def registrant_document(registrant: WebinarRegistrants) -> Optional[Tuple[str, str]]:
+    """Title and text of a public webinar registration (contact details and notes are left out)"""
+    if not registrant.is_public:
+        return None
+    company = f" from {registrant.company}" if registrant.company else ""
+    text = (
+        f"Webinar: {registrant.webinar_title}\n"
+        f"Date: {registrant.webinar_date:%Y-%m-%d}\n"
+        f"Registrant: {registrant.name}{company}, status {registrant.status}"
+    )
+    return f"{registrant.name} – {registrant.webinar_title}", text
+
+
+DOCUMENT_BUILDERS = {"products": product_document, "registrants": registrant_document}
+
+
+def chunk_text(text: str, max_chars: int) -> List[str]:
+    """
+    Split a document into chunks of about ``max_chars`` on word boundaries
+
+    The first line (the row's heading) is repeated at the top of every chunk
+    so each one still says what it belongs to.
+    """
+    if len(text) <= max_chars:
+        return [text]
+    heading, _, body = text.partition("\n")
+    budget = max(max_chars - len(heading) - 1, 1)
+    chunks, current = [], ""
+    for word in body.split(" "):
+        if current and len(current) + 1 + len(word) > budget:
+            chunks.append(f"{heading}\n{current}")
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        chunks.append(f"{heading}\n{current}")
+    return chunks
+
+
+class KnowledgeBase:
+    """
+    Vector index over products and public webinar registrations, kept in step with the tables.
+
+    ``build`` reads every row, fits the embedder and indexes the rows'
+    chunks (in a worker thread, then swapped in). After that the index is
+    updated incrementally: ORM events mark inserted, updated and deleted rows
+    of this process, and the sync loop re-embeds only those every
+    ``rag_sync_interval`` seconds. Every ``rag_reconcile_interval`` seconds
+    the rows are compared with the indexed text hashes, which picks up bulk
+    statements and changes made by other workers. With ``rag_index_path`` the
+    index is saved after builds and on shutdown and memory-mapped on start.
+    """
+
+    def __init__(self, settings: Settings, session_factory=None, embedder: Optional[HashingEmbedder] = None):
+        self.settings = settings
+        self._session_factory = session_factory
+        self.embedder = embedder
+        self.index: Optional[VectorIndex] = None
+        # chunk id -> {"source", "row_id", "title", "text"}
+        self._chunks: Dict[str, Dict[str, str]] = {}
+        # "source:row_id" -> (text hash, chunk ids)
+        self._rows: Dict[str, Tuple[str, List[str]]] = {}
+        self._dirty: Set[Tuple[str, str]] = set()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._listeners: List[Tuple[Any, str, Any]] = []
+        self._listening = False
+        self._last_reconcile = 0.0
+        self._query_ms: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.queries = 0
+        self.builds = 0
+        self.build_seconds: Optional[float] = None
+        self.rows_synced = 0
+        self.sync_errors = 0
+
+    def _sessions(self):
+        if self._session_factory is None:
+            from db import AsyncSessionLocal
+            self._session_factory = AsyncSessionLocal
+        return self._session_factory
+
+    @property
+    def ready(self) -> bool:
+        return self.index is not None
+
+    def _new_index(self) -> VectorIndex:
+        settings = self.settings
+        return VectorIndex(
+            settings.rag_embedding_dim,
+            mode=settings.rag_index_mode,
+            ivf_min_rows=settings.rag_ivf_min_rows,
+            n_lists=settings.rag_ivf_lists,
+            n_probe=settings.rag_ivf_probe,
+        )
+
+    async def _load_documents(
+        self, source: str, row_ids: Optional[List[str]] = None
+    ) -> Dict[str, Optional[Tuple[str, str]]]:
+        """Documents of a source's rows by "source:row_id" (all rows, or just ``row_ids``)"""
+        model = SOURCES[source]
+        query = select(model)
+        if row_ids is not None:
+            query = query.where(model.id.in_([uuid.UUID(row_id) for row_id in row_ids]))
+        async with self._sessions()() as session:
+            rows = (await session.execute(query)).scalars().all()
+        documents: Dict[str, Optional[Tuple[str, str]]] = {
+            f"{source}:{row_id}": None for row_id in row_ids or []
+        }
+        for row in rows:
+            documents[f"{source}:{row.id}"] = DOCUMENT_BUILDERS[source](row)
+        return documents
+
+    async def _load_all(self) -> Dict[str, Optional[Tuple[str, str]]]:
+        documents: Dict[str, Optional[Tuple[str, str]]] = {}
+        for source in SOURCES:
+            documents.update(await self._load_documents(source))
+        return documents
+
+    def _chunk(self, row_key: str, document: Tuple[str, str]) -> List[Tuple[str, Dict[str, str]]]:
+        source, row_id = row_key.split(":", 1)
+        title, text = document
+        return [
+            (f"{row_key}#{i}", {"source": source, "row_id": row_id, "title": title, "text": chunk})
+            for i, chunk in enumerate(chunk_text(text, self.settings.rag_chunk_chars))
+        ]
+
+    @staticmethod
+    def _hash(document: Tuple[str, str]) -> str:
+        return hashlib.blake2b("\x00".join(document).encode("utf-8"), digest_size=16).hexdigest()
+
+    def _build_index(self, documents: Dict[str, Optional[Tuple[str, str]]]):
+        """Fit the embedder and index every document (runs in a worker thread)"""
+        rows: Dict[str, Tuple[str, List[str]]] = {}
+        chunks: Dict[str, Dict[str, str]] = {}
+        for row_key, document in documents.items():
+            if document is None:
+                continue
+            row_chunks = self._chunk(row_key, document)
+            chunks.update(row_chunks)
+            rows[row_key] = (self._hash(document), [chunk_id for chunk_id, _ in row_chunks])
+        texts = [chunk["text"] for chunk in chunks.values()]
+        embedder = HashingEmbedder(self.settings.rag_embedding_dim).fit(texts)
+        index = self._new_index()
+        index.add(list(chunks), embedder.embed(texts))
+        return embedder, index, chunks, rows
+
+    async def build(self) -> Dict[str, Any]:
+        """Re-index every row from scratch and return the index stats"""
+        async with self._lock:
+            started = time.perf_counter()
+            # Changes from here on are picked up by the next sync
+            self._dirty.clear()
+            documents = await self._load_all()
+            embedder, index, chunks, rows = await asyncio.to_thread(self._build_index, documents)
+            self.embedder, self.index, self._chunks, self._rows = embedder, index, chunks, rows
+            self.build_seconds = time.perf_counter() - started
+            self.builds += 1
+            self._last_reconcile = time.monotonic()
+            logger.info(f"Knowledge base built: {len(rows)} rows, {len(chunks)} chunks in {self.build_seconds:.2f}s")
+            if self.settings.rag_index_path:
+                await asyncio.to_thread(self.save, self.settings.rag_index_path)
+            return self.index.get_stats()
+
+    async def _apply(self, documents: Dict[str, Optional[Tuple[str, str]]]) -> int:
+        """Re-index the rows whose documents changed and drop rows that are gone; returns rows changed"""
+        stale: List[str] = []
+        fresh: List[Tuple[str, Dict[str, str]]] = []
+        changed: Dict[str, Tuple[str, List[str]]] = {}
+        removed: List[str] = []
+        for row_key, document in documents.items():
+            known = self._rows.get(row_key)
+            if document is None:
+                if known is not None:
+                    stale.extend(known[1])
+                    removed.append(row_key)
+                continue
+            digest = self._hash(document)
+            if known is not None and known[0] == digest:
+                continue
+            if known is not None:
+                stale.extend(known[1])
+            row_chunks = self._chunk(row_key, document)
+            fresh.extend(row_chunks)
+            changed[row_key] = (digest, [chunk_id for chunk_id, _ in row_chunks])
+        if not stale and not fresh:
+            return 0
+
+        vectors = await asyncio.to_thread(self.embedder.embed, [chunk["text"] for _, chunk in fresh])
+        self.index.remove(stale)
+        for chunk_id in stale:
+            self._chunks.pop(chunk_id, None)
+        self.index.add([chunk_id for chunk_id, _ in fresh], vectors)
+        self._chunks.update(fresh)
+        for row_key in removed:
+            del self._rows[row_key]
+        self._rows.update(changed)
+        self.rows_synced += len(changed) + len(removed)
+        return len(changed) + len(removed)
+
+    async def sync(self) -> int:
+        """Re-index rows marked by ORM events and return how many changed"""
+        if not self._dirty or self.index is None:
+            return 0
+        async with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            by_source: Dict[str, List[str]] = {}
+            for source, row_id in dirty:
+                by_source.setdefault(source, []).append(row_id)
+            documents: Dict[str, Optional[Tuple[str, str]]] = {}
+            try:
+                for source, row_ids in by_source.items():
+                    documents.update(await self._load_documents(source, row_ids))
+            except (OperationalError, DatabaseError) as e:
+                self.sync_errors += 1
+                self._dirty |= dirty
+                logger.warning(f"Knowledge base sync failed, retrying later: {e}")
+                return 0
+            return await self._apply(documents)
+
+    async def reconcile(self) -> int:
+        """Compare every row with the index and re-index the differences"""
+        if self.index is None:
+            return 0
+        async with self._lock:
+            documents = await self._load_all()
+            # Rows no longer in the tables
+            documents.update({row_key: None for row_key in self._rows if row_key not in documents})
+            self._last_reconcile = time.monotonic()
+            return await self._apply(documents)
+
+    def search(self, query: str, k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Find the chunks most similar to a query
+
+        Returns:
+            list: ``source``, ``row_id``, ``title``, ``text`` and ``score`` per chunk, best
+                first, above ``rag_min_score`` and at most one chunk per row
+        """
+        if self.index is None:
+            return []
+        started = time.perf_counter()
+        k = k or self.settings.rag_top_k
+        # Extra candidates so long rows with several matching chunks do not crowd out others
+        hits = self.index.search(self.embedder.embed([query], query=True)[0], 3 * k)
+        results, seen = [], set()
+        for chunk_id, score in hits:
+            chunk = self._chunks.get(chunk_id)
+            if chunk is None or score < self.settings.rag_min_score:
+                continue
+            row_key = f"{chunk['source']}:{chunk['row_id']}"
+            if row_key in seen:
+                continue
+            seen.add(row_key)
+            results.append(dict(chunk, score=round(score, 4)))
+            if len(results) == k:
+                break
+        self.queries += 1
+        self._query_ms.append((time.perf_counter() - started) * 1000)
+        return results
+
+    def _mark(self, source: str):
+        def listener(mapper, connection, target) -> None:
+            if target.id is not None:
+                self._dirty.add((source, str(target.id)))
+        return listener
+
+    def install_listeners(self) -> None:
+        """Mark rows changed through the ORM in this process for the next sync (idempotent)"""
+        if self._listening:
+            return
+        for source, model in SOURCES.items():
+            listener = self._mark(source)
+            for name in ("after_insert", "after_update", "after_delete"):
+                event.listen(model, name, listener)
+                self._listeners.append((model, name, listener))
+        self._listening = True
+
+    def remove_listeners(self) -> None:
+        """Stop marking changed rows"""
+        if not self._listening:
+            return
+        for model, name, listener in self._listeners:
+            event.remove(model, name, listener)
+        self._listeners.clear()
+        self._listening = False
+
+    async def start(self) -> None:
+        """Load or build the index, then keep it in sync in the background (idempotent)"""
+        if self._task is None:
+            self.install_listeners()
+            self._task = asyncio.create_task(self._run(), name="knowledge-base-sync")
+
+    async def stop(self) -> None:
+        """Stop syncing and save the index when a path is configured"""
+        self.remove_listeners()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.index is not None and self.settings.rag_index_path:
+            await asyncio.to_thread(self.save, self.settings.rag_index_path)
+
+    async def _open(self) -> None:
+        path = self.settings.rag_index_path
+        if path and (Path(path) / "index.json").exists():
+            try:
+                self.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Knowledge base index at {path} is unreadable, rebuilding: {e}")
+        try:
+            if self.index is None:
+                await self.build()
+            else:
+                await self.reconcile()
+        except (OperationalError, DatabaseError) as e:
+            # Retried after rag_reconcile_interval
+            self._last_reconcile = time.monotonic()
+            logger.warning(f"Knowledge base not built, the database is unavailable: {e}")
+
+    async def _run(self) -> None:
+        await self._open()
+        while True:
+            await asyncio.sleep(self.settings.rag_sync_interval)
+            due = time.monotonic() - self._last_reconcile >= self.settings.rag_reconcile_interval
+            try:
+                if self.index is None:
+                    if due:
+                        await self.build()
+                elif due:
+                    await self.reconcile()
+                else:
+                    await self.sync()
+            except (OperationalError, DatabaseError) as e:
+                self.sync_errors += 1
+                self._last_reconcile = time.monotonic()
+                logger.warning(f"Knowledge base sync failed: {e}")
+
+    def save(self, path: str) -> None:
+        """Write the index, the embedder's IDF and the chunk texts to a directory"""
+        self.index.save(path)
+        directory = Path(path)
+        np.save(directory / "idf.npy", self.embedder.idf)
+        np.save(directory / "seen.npy", self.embedder.seen)
+        temporary = directory / "documents.tmp.json"
+        temporary.write_text(json.dumps({"chunks": self._chunks, "rows": self._rows}))
+        os.replace(temporary, directory / "documents.json")
+
+    def load(self, path: str) -> None:
+        """Open a saved index (memory-mapped)"""
+        directory = Path(path)
+        documents = json.loads((directory / "documents.json").read_text())
+        index = VectorIndex.load(path)
+        if index.dim != self.settings.rag_embedding_dim:
+            raise ValueError(
+                f"index has {index.dim} dimensions, RAG_EMBEDDING_DIM is {self.settings.rag_embedding_dim}"
+            )
+        self.embedder = HashingEmbedder(
+            index.dim, idf=np.load(directory / "idf.npy"), seen=np.load(directory / "seen.npy")
+        )
+        self.index = index
+        self._chunks = documents["chunks"]
+        self._rows = {row_key: (digest, chunk_ids) for row_key, (digest, chunk_ids) in documents["rows"].items()}
+
+    def _query_quantile(self, quantile: float) -> Optional[float]:
+        if not self._query_ms:
+            return None
+        ordered = sorted(self._query_ms)
+        return round(ordered[min(len(ordered) - 1, max(0, math.ceil(quantile * len(ordered)) - 1))], 3)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get index size, build time and query latency"""
+        return {
+            "ready": self.ready,
+            "rows": len(self._rows),
+            "chunks": len(self._chunks),
+            "index": self.index.get_stats() if self.index is not None else None,
+            "builds": self.builds,
+            "build_seconds": round(self.build_seconds, 3) if self.build_seconds is not None else None,
+            "pending_rows": len(self._dirty),
+            "rows_synced": self.rows_synced,
+            "sync_errors": self.sync_errors,
+            "queries": self.queries,
+            "query_ms_p50": self._query_quantile(0.5),
+            "query_ms_p95": self._query_quantile(0.95),
+        }
+
+
+# Global knowledge base instance
+_knowledge_base: Optional[KnowledgeBase] = None
+
+
+def get_knowledge_base(settings: Optional[Settings] = None) -> Optional[KnowledgeBase]:
+    """Get or create the shared knowledge base (None when disabled or NumPy is missing)"""
+    global _knowledge_base
+    settings = settings or get_settings()
+    if not settings.rag_enabled or not NUMPY_AVAILABLE:
+        return None
+    if _knowledge_base is None:
+        _knowledge_base = KnowledgeBase(settings)
+    return _knowledge_base
@@ -0,0 +1,273 @@
+"""
+OpenAI-compatible LLM backends with weighted routing, health scoring and failover
+"""
+import logging
+import os
+import random
+from typing import Any, Dict, List, Optional
+
+from dependencies.config import Settings, get_settings
+from services.circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "meta-llama/llama-3.3-70b-instruct:free"
+
+# Smoothing factor for the latency and error-rate moving averages
+EWMA_ALPHA = 0.2
+
+# Latency (seconds) at which the latency part of the health score halves
+LATENCY_REFERENCE = 2.0
+
+
+class BackendError(Exception):
+    """A backend failed in a way another backend may not (auth, model, server error)"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class LLMBackend:
+    """One OpenAI-compatible endpoint + key + model, with its health statistics"""
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        model: str,
+        weight: float = 1.0,
+        api_key: Optional[str] = None,
+        api_key_env: Optional[str] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        prompt_price: Optional[float] = None,
+        completion_price: Optional[float] = None,
+    ):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.weight = weight
+        self._api_key = api_key
+        self.api_key_env = api_key_env
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.failovers = 0
+        self.latency_ewma: Optional[float] = None
+        self.error_rate = 0.0
+        self.last_error: Optional[str] = None
+        self.breaker = breaker or CircuitBreaker(name)
+        # USD per million tokens, for usage accounting when the upstream reports no cost
+        self.prompt_price = prompt_price
+        self.completion_price = completion_price
+
+    @property
+    def api_key(self) -> Optional[str]:
+        """API key (read from the environment at call time when ``api_key_env`` is set)"""
+        if self.api_key_env:
+            return os.getenv(self.api_key_env)
+        return self._api_key
+
+    @property
+    def configured(self) -> bool:
+        """Whether the backend can be called (keys from the environment must be present)"""
+        return not self.api_key_env or bool(self.api_key)
+
+    @property
+    def chat_completions_url(self) -> str:
+        return f"{self.base_url}/chat/completions"
+
+    def headers(self) -> Dict[str, str]:
+        """Request headers for this backend"""
+        headers = {
+            "Content-Type": "application/json",
+            "HTTP-Referer": "https://localhost",  # More generic referer
+            "X-Title": "FastOpp AI Demo"
+        }
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+        """USD cost of a call from the configured prices (None when no price is set)"""
+        if self.prompt_price is None and self.completion_price is None:
+            return None
+        return (prompt_tokens * (self.prompt_price or 0.0) + completion_tokens * (self.completion_price or 0.0)) / 1e6
+
+    def health(self) -> float:
+        """Health score in (0, 1]: penalizes recent errors and high latency"""
+        latency = self.latency_ewma or 0.0
+        return max(0.01, (1.0 - self.error_rate) * LATENCY_REFERENCE / (LATENCY_REFERENCE + latency))
+
+    def record_success(self, latency: float) -> None:
+        self.requests += 1
+        self.successes += 1
+        self.latency_ewma = latency if self.latency_ewma is None else (
+            EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency_ewma
+        )
+        self.error_rate = (1 - EWMA_ALPHA) * self.error_rate
+        self.breaker.record_success(latency)
+
+    def record_failure(self, error: str, latency: Optional[float] = None) -> None:
+        self.requests += 1
+        self.failures += 1
+        self.last_error = error
+        self.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.error_rate
+        self.breaker.record_failure(latency)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "model": self.model,
+            "weight": self.weight,
+            "configured": self.configured,
+            "requests": self.requests,
+            "successes": self.successes,
+            "failures": self.failures,
+            "failovers": self.failovers,
+            "latency_ewma_ms": round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "health": round(self.health(), 4),
+            "last_error": self.last_error,
+            "circuit": self.breaker.get_stats(),
+        }
+
+
+class ProviderRouter:
+    """
+    Pick backends for each request.
+
+    The first backend is drawn at random with probability proportional to
+    weight x health; the rest follow in descending weight x health order and
+    are used for failover.
+    """
+
+    def __init__(self, backends: List[LLMBackend]):
+        self.backends = backends
+        # Backends for other models on the primary endpoint (model comparisons), by model
+        self._extra: Dict[str, LLMBackend] = {}
+
+    @property
+    def primary(self) -> Optional[LLMBackend]:
+        """The first configured backend (its model names the logical model for caching)"""
+        available = self.available()
+        return available[0] if available else None
+
+    def available(self) -> List[LLMBackend]:
+        return [backend for backend in self.backends if backend.configured]
+
+    def candidates(self, avoid: Optional[LLMBackend] = None) -> List[LLMBackend]:
+        """Backends to try for one request, in order (``avoid`` is only used as a last resort)"""
+        available = self.available()
+        if avoid is not None and len(available) > 1 and avoid in available:
+            available.remove(avoid)
+            return [*self._ordered(available), avoid]
+        return self._ordered(available)
+
+    @staticmethod
+    def _ordered(available: List[LLMBackend]) -> List[LLMBackend]:
+        if len(available) <= 1:
+            return available
+        scores = [backend.weight * backend.health() for backend in available]
+        first = random.choices(available, weights=scores)[0]
+        rest = sorted(
+            (backend for backend in available if backend is not first),
+            key=lambda backend: backend.weight * backend.health(),
+            reverse=True,
+        )
+        return [first, *rest]
+
+    def for_model(self, model: str, settings: Optional[Settings] = None) -> Optional[LLMBackend]:
+        """
+        Backend that serves ``model``: a configured backend with that name or model,
+        else the primary endpoint asked for that model (kept so its health and
+        circuit breaker carry over between requests; never used for routing)
+        """
+        available = self.available()
+        for backend in available:
+            if model in (backend.name, backend.model):
+                return backend
+        primary = available[0] if available else None
+        if primary is None:
+            return None
+        if model not in self._extra:
+            name = f"{primary.name}:{model}"
+            self._extra[model] = LLMBackend(
+                name=name,
+                base_url=primary.base_url,
+                model=model,
+                api_key=primary._api_key,
+                api_key_env=primary.api_key_env,
+                breaker=build_breaker(name, settings) if settings else CircuitBreaker(name),
+            )
+        return self._extra[model]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backends": [backend.get_stats() for backend in self.backends]}
+
+
+def build_backends(settings: Settings) -> List[LLMBackend]:
+    """
+    Backends from ``LLM_BACKENDS`` (JSON list), or the single OpenRouter backend
+
+    Each entry takes ``name``, ``base_url``, ``model``, ``weight``, either
+    ``api_key`` or ``api_key_env`` (name of the environment variable holding it),
+    and optionally ``prompt_price`` / ``completion_price`` (USD per million tokens).
+    """
+    if not settings.llm_backends:
+        return [LLMBackend(
+            name="openrouter",
+            base_url=settings.llm_base_url,
+            model=settings.openrouter_llm_model or os.getenv("OPENROUTER_LLM_MODEL") or DEFAULT_MODEL,
+            api_key_env="OPENROUTER_API_KEY",
+            breaker=build_breaker("openrouter", settings),
+            prompt_price=settings.llm_prompt_price,
+            completion_price=settings.llm_completion_price,
+        )]
+
+    backends = []
+    for index, config in enumerate(settings.llm_backends):
+        name = config.get("name") or f"backend-{index}"
+        backends.append(LLMBackend(
+            name=name,
+            base_url=config.get("base_url") or settings.llm_base_url,
+            model=config["model"],
+            weight=float(config.get("weight", 1.0)),
+            api_key=config.get("api_key"),
+            api_key_env=config.get("api_key_env"),
+            breaker=build_breaker(name, settings),
+            prompt_price=config.get("prompt_price"),
+            completion_price=config.get("completion_price"),
+        ))
+    return backends
+
+
+def build_breaker(name: str, settings: Settings) -> CircuitBreaker:
+    """Circuit breaker for one backend from the ``BREAKER_*`` settings"""
+    return CircuitBreaker(
+        name,
+        window=settings.breaker_window,
+        min_requests=settings.breaker_min_requests,
+        failure_rate=settings.breaker_failure_rate,
+        slow_call_seconds=settings.breaker_slow_call_seconds,
+        slow_call_rate=settings.breaker_slow_call_rate,
+        open_seconds=settings.breaker_open_seconds,
+        half_open_max_calls=settings.breaker_half_open_max_calls,
+    )
+
+
+# Global provider router instance
+_provider_router: Optional[ProviderRouter] = None
+
+
+def get_provider_router(settings: Optional[Settings] = None) -> ProviderRouter:
+    """Get or create the shared provider router"""
+    global _provider_router
+    if _provider_router is None:
+        _provider_router = ProviderRouter(build_backends(settings or get_settings()))
+        # Print the configured backends to console
+        for backend in _provider_router.backends:
+            print(f"🤖 Using LLM backend {backend.name}: {backend.model} @ {backend.base_url}")
+    return _provider_router
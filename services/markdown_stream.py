@@ -0,0 +1,164 @@
+"""
+Incremental markdown rendering for streamed chat responses
+"""
+from concurrent.futures import ThreadPoolExecutor
+import html
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import markdown
+
+from dependencies.config import Settings, get_settings
+from services.code_highlight import CachedHighlightExtension
+
+# Markdown extensions used for all chat responses (fenced code is highlighted through the shared cache)
+MARKDOWN_EXTENSIONS: List[Any] = ['fenced_code', 'codehilite', 'tables', 'nl2br', CachedHighlightExtension()]
+
+# Opening/closing line of a fenced code block (``` or ~~~)
+_FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+
+# First line of a block that continues the previous one (indented text or a list item)
+_CONTINUATION_RE = re.compile(r"^(\s+|[-*+]\s|\d+[.)]\s)")
+
+# A partial last line shorter than this could still turn into a list marker
+_MIN_PARTIAL_LINE = 6
+
+
+def render_markdown(text: str) -> str:
+    """Render a complete markdown document to HTML"""
+    return markdown.markdown(text, extensions=MARKDOWN_EXTENSIONS)
+
+
+def render_open_fence(block: str) -> str:
+    """
+    Render a fenced code block that has not been closed yet as plain (escaped) code
+
+    It is highlighted once it closes; until then every feed would re-run
+    Pygments (or inline markdown) over the whole growing block.
+    """
+    _, _, code = block.partition("\n")
+    return f'<div class="codehilite"><pre><span></span><code>{html.escape(code, quote=False)}</code></pre></div>'
+
+
+class StreamingMarkdownRenderer:
+    """
+    Render a growing markdown document without re-rendering closed blocks.
+
+    The text is split into a closed prefix and an open trailing block. A
+    block is closed once a blank line (outside a fenced code block) is
+    followed by the start of a new, non-continuation block. Closed blocks are
+    rendered once and cached; only the open tail is re-rendered on each feed.
+    A fenced code block still open at the end of the tail is shown as plain
+    code until its closing fence arrives.
+    """
+
+    def __init__(self, extensions: Optional[List[str]] = None):
+        self._md = markdown.Markdown(extensions=extensions or MARKDOWN_EXTENSIONS)
+        self.raw = ""
+        self._committed = 0
+        self._closed_html: List[str] = []
+        self._tail_html = ""
+        self.blocks_rendered = 0
+        self.tail_renders = 0
+
+    @property
+    def pending_chars(self) -> int:
+        """Length of the open trailing block, which the next feed re-renders"""
+        return len(self.raw) - self._committed
+
+    @property
+    def html(self) -> str:
+        """Full HTML of everything fed so far"""
+        return "".join(self._closed_html) + self._tail_html
+
+    def feed(self, text: str) -> Dict[str, str]:
+        """
+        Append raw markdown text
+
+        Returns:
+            dict: ``append`` is HTML for blocks closed by this feed (to be
+            appended to the client's closed HTML) and ``tail`` replaces the
+            HTML of the open trailing block.
+        """
+        self.raw += text
+        tail = self.raw[self._committed:]
+
+        appended = ""
+        boundary, fence_start = self._find_boundary(tail)
+        if boundary:
+            appended = self._render(tail[:boundary]) + "\n"
+            self._closed_html.append(appended)
+            self.blocks_rendered += 1
+            self._committed += boundary
+            tail = tail[boundary:]
+
+        if fence_start is not None:
+            head = tail[:fence_start - boundary]
+            self._tail_html = (self._render(head) if head.strip() else "") + render_open_fence(
+                tail[fence_start - boundary:]
+            )
+        else:
+            self._tail_html = self._render(tail) if tail.strip() else ""
+        self.tail_renders += 1
+        return {"append": appended, "tail": self._tail_html}
+
+    def _render(self, text: str) -> str:
+        html = self._md.convert(text)
+        self._md.reset()
+        return html
+
+    @staticmethod
+    def _find_boundary(tail: str) -> Tuple[int, Optional[int]]:
+        """
+        Return the offset in ``tail`` where the open block starts (0 if all of it is open),
+        and the offset of a fenced code block left open at the end (or None)
+        """
+        boundary = 0
+        fence: Optional[str] = None
+        fence_start = 0
+        seen_content = False
+        after_blank = False
+        offset = 0
+
+        lines = tail.split("\n")
+        for index, line in enumerate(lines):
+            is_last = index == len(lines) - 1
+            start = offset
+            offset += len(line) + 1
+
+            if fence is not None:
+                stripped = line.strip()
+                if not is_last and stripped.startswith(fence) and set(stripped) == {fence[0]}:
+                    fence = None
+                continue
+
+            if not line.strip():
+                after_blank = seen_content
+                continue
+
+            if after_blank and (not is_last or len(line) >= _MIN_PARTIAL_LINE) and not _CONTINUATION_RE.match(line):
+                boundary = start
+            after_blank = False
+            seen_content = True
+
+            match = _FENCE_RE.match(line)
+            if match and not is_last:
+                fence = match.group(1)
+                fence_start = start
+
+        return boundary, fence_start if fence is not None else None
+
+
+# Worker threads for large renders (Pygments would otherwise block the event loop)
+_render_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_render_executor(settings: Optional[Settings] = None) -> ThreadPoolExecutor:
+    """Get or create the shared markdown render thread pool"""
+    global _render_executor
+    if _render_executor is None:
+        settings = settings or get_settings()
+        _render_executor = ThreadPoolExecutor(
+            max_workers=max(1, settings.markdown_render_workers), thread_name_prefix="markdown"
+        )
+    return _render_executor
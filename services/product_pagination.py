@@ -0,0 +1,105 @@
+"""
+Keyset (cursor) pagination, filters and sort orders for product listings
+"""
+import base64
+from dataclasses import dataclass
+from datetime import datetime
+import json
+from typing import Any, Dict, Optional, Tuple
+import uuid
+
+from sqlalchemy import and_, or_
+from sqlmodel import select
+
+from models import Product
+
+PRODUCTS = Product.__table__.c  # type: ignore[attr-defined]
+
+# Sort name -> (column, descending). Every order is made total with ``id`` as the tie-breaker,
+# and is served by the matching (column, id) index on products.
+PRODUCT_SORTS: Dict[str, Tuple[Any, bool]] = {
+    "newest": (PRODUCTS.created_at, True),
+    "oldest": (PRODUCTS.created_at, False),
+    "price_asc": (PRODUCTS.price, False),
+    "price_desc": (PRODUCTS.price, True),
+    "name": (PRODUCTS.name, False),
+}
+
+
+@dataclass
+class ProductFilters:
+    """Product listing filters (None means "any")"""
+
+    category: Optional[str] = None
+    in_stock: Optional[bool] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    search: Optional[str] = None
+
+
+def _encode_value(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def encode_cursor(sort: str, product: Product) -> str:
+    """Opaque cursor pointing just after ``product`` in the ``sort`` order"""
+    column, _ = PRODUCT_SORTS[sort]
+    value = getattr(product, column.key)
+    payload = json.dumps([sort, _encode_value(value), product.id.hex], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[Any, uuid.UUID]:
+    """
+    Read the sort key and id from a cursor
+
+    Raises:
+        ValueError: If the cursor is malformed or was issued for another sort order
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, value, product_id = json.loads(base64.urlsafe_b64decode(padded))
+        product_id = uuid.UUID(product_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if cursor_sort != sort:
+        raise ValueError(f"Cursor was issued for sort '{cursor_sort}', not '{sort}'")
+    if PRODUCT_SORTS[sort][0].key == "created_at":
+        value = datetime.fromisoformat(value)
+    return value, product_id
+
+
+def page_query(sort: str, filters: ProductFilters, after: Optional[Tuple[Any, uuid.UUID]], limit: int):
+    """
+    Select one page of products: filtered, ordered by (sort column, id), starting after a cursor
+
+    Fetches ``limit + 1`` rows so the caller can tell whether another page follows.
+    """
+    column, descending = PRODUCT_SORTS[sort]
+    product_id = PRODUCTS.id
+    query = select(Product)
+
+    if filters.category is not None:
+        query = query.where(PRODUCTS.category == filters.category)
+    if filters.in_stock is not None:
+        query = query.where(PRODUCTS.in_stock == filters.in_stock)
+    if filters.min_price is not None:
+        query = query.where(PRODUCTS.price >= filters.min_price)
+    if filters.max_price is not None:
+        query = query.where(PRODUCTS.price <= filters.max_price)
+    if filters.search:
+        pattern = f"%{filters.search}%"
+        query = query.where(or_(PRODUCTS.name.ilike(pattern), PRODUCTS.description.ilike(pattern)))
+
+    if after is not None:
+        value, last_id = after
+        if descending:
+            query = query.where(or_(column < value, and_(column == value, product_id < last_id)))
+        else:
+            query = query.where(or_(column > value, and_(column == value, product_id > last_id)))
+
+    if descending:
+        query = query.order_by(column.desc(), product_id.desc())
+    else:
+        query = query.order_by(column.asc(), product_id.asc())
+    return query.limit(limit + 1)
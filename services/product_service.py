@@ -1,14 +1,22 @@
 """
 Product service for handling product-related business logic
 """
-from sqlalchemy import case
+from dataclasses import asdict
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
 from sqlalchemy.exc import DatabaseError, OperationalError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import func, select
 
 from dependencies.config import Settings
 from dependencies.database_health import get_fallback_data
 from models import Product
+from services.product_pagination import PRODUCT_SORTS, ProductFilters, decode_cursor, encode_cursor, page_query
+from services.product_stats import aggregate_product_stats, get_product_stats_table, price_ranges
+from services.query_cache import cached_query
+
+logger = logging.getLogger(__name__)
 
 
 class ProductService:
@@ -18,84 +26,108 @@ class ProductService:
         self.session = session
         self.settings = settings
     
-    async def get_products_with_stats(self):
-        """Get all products with statistics, with graceful database failure handling"""
-        try:
-            # Get all products
-            result = await self.session.execute(select(Product))
-            products = result.scalars().all()
+    async def get_products_with_stats(
+        self,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        sort: str = "newest",
+        filters: Optional[ProductFilters] = None,
+        include_stats: bool = True,
+    ):
+        """
+        Get one page of products (keyset pagination) with statistics, with graceful database failure handling
 
-            # Get category statistics
-            category_stats = await self.session.execute(
-                select(Product.category, func.count(Product.id).label('count'))  # type: ignore
-                .group_by(Product.category)
-            )
-            categories = category_stats.all()
+        Args:
+            limit: Products per page (default ``products_page_size``, capped at ``products_page_max``;
+                0 returns statistics only)
+            cursor: ``next_cursor`` of the previous page; None for the first page
+            sort: One of ``PRODUCT_SORTS``
+            filters: Category, stock, price range and search filters
+            include_stats: Add category, price and stock statistics (first page only)
 
-            # Get price statistics
-            price_stats = await self.session.execute(
-                select(
-                    func.avg(Product.price).label('avg_price'),
-                    func.min(Product.price).label('min_price'),
-                    func.max(Product.price).label('max_price'),
-                    func.count(Product.id).label('total_products')  # type: ignore
-                )
-            )
-            stats = price_stats.first()
+        Raises:
+            HTTPException: 400 for an unknown sort or an invalid cursor
+        """
+        if sort not in PRODUCT_SORTS:
+            raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(PRODUCT_SORTS)}")
+        try:
+            after = decode_cursor(cursor, sort) if cursor else None
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e)) from e
+        if limit is None:
+            limit = self.settings.products_page_size
+        limit = max(0, min(limit, self.settings.products_page_max))
+        filters = filters or ProductFilters()
 
-            # Get stock statistics
-            stock_stats = await self.session.execute(
-                select(
-                    func.count(Product.id).label('total'),  # type: ignore
-                    func.sum(case(
-                        (Product.in_stock.is_(True), 1),  # type: ignore
-                        else_=0)).label('in_stock'),
-                    func.sum(case(
-                        (Product.in_stock.is_(False), 1),  # type: ignore
-                        else_=0)).label('out_of_stock')  # type: ignore
-                )
+        # Read through the query cache: entries are dropped when products are written
+        params = {
+            "limit": limit,
+            "cursor": cursor,
+            "sort": sort,
+            "filters": asdict(filters),
+            "include_stats": include_stats and after is None,
+        }
+        try:
+            return await cached_query(
+                "products.page",
+                [Product.__tablename__],  # type: ignore[attr-defined]
+                lambda: self._load_page(sort, filters, after, limit, params["include_stats"]),
+                params,
+                self.settings,
             )
-            stock = stock_stats.first()
-            
-            # Handle potential None values safely
-            stats_data = {
-                "avg_price": float(stats.avg_price) if stats and stats.avg_price is not None else 0,
-                "min_price": float(stats.min_price) if stats and stats.min_price is not None else 0,
-                "max_price": float(stats.max_price) if stats and stats.max_price is not None else 0,
-                "total_products": stats.total_products if stats else 0
-            }
-
-            stock_data = {
-                "total": stock.total if stock else 0,
-                "in_stock": stock.in_stock if stock else 0,
-                "out_of_stock": stock.out_of_stock if stock else 0
-            }
-
-            return {
-                "products": [
-                    {
-                        "id": str(product.id),
-                        "name": product.name,
-                        "description": product.description,
-                        "price": product.price,
-                        "category": product.category,
-                        "in_stock": product.in_stock,
-                        "created_at": product.created_at.isoformat()
-                    }
-                    for product in products
-                ],
-                "categories": [
-                    {"category": cat.category, "count": cat.count}
-                    for cat in categories if cat.category
-                ],
-                "stats": stats_data,
-                "stock": stock_data,
-                "database_available": True
-            }
-            
         except (OperationalError, DatabaseError, Exception) as e:
-            print(f"Database error in ProductService: {e}")
+            logger.error(f"Database error in ProductService: {e}")
             # Return fallback data when database is unavailable
             fallback_data = get_fallback_data()
             fallback_data["error"] = f"Database unavailable: {str(e)}"
-            return fallback_data
\ No newline at end of file
+            return fallback_data
+
+    async def _load_page(
+        self,
+        sort: str,
+        filters: ProductFilters,
+        after: Optional[Tuple[Any, Any]],
+        limit: int,
+        include_stats: bool,
+    ) -> Dict[str, Any]:
+        """Query one page of products (and the statistics when ``include_stats``)"""
+        # One page in (sort column, id) order, seeking past the cursor instead of
+        # skipping rows, so deep pages cost the same as the first
+        products: List[Product] = []
+        if limit:
+            result = await self.session.execute(page_query(sort, filters, after, limit))
+            products = list(result.scalars().all())
+        has_more = len(products) > limit
+        products = products[:limit]
+
+        data: Dict[str, Any] = {
+            "products": [
+                {
+                    "id": str(product.id),
+                    "name": product.name,
+                    "description": product.description,
+                    "price": product.price,
+                    "category": product.category,
+                    "in_stock": product.in_stock,
+                    "created_at": product.created_at.isoformat()
+                }
+                for product in products
+            ],
+            "next_cursor": encode_cursor(sort, products[-1]) if has_more else None,
+            "has_more": has_more,
+            "limit": limit,
+            "sort": sort,
+        }
+
+        if include_stats:
+            # Category, price-range and stock statistics: O(categories) from the maintained
+            # stats tables, else grouped aggregates over the products table
+            stats_table = get_product_stats_table(self.settings)
+            if stats_table is not None and stats_table.ready:
+                data.update(await stats_table.read(self.session))
+            else:
+                data.update(await aggregate_product_stats(self.session))
+                data["price_ranges"] = await price_ranges(self.session)
+
+        data["database_available"] = True
+        return data
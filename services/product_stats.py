@@ -0,0 +1,436 @@
+"""
+Product statistics: one grouped aggregate query, or a stats table maintained on write
+"""
+from datetime import UTC, datetime
+import logging
+import math
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import case, delete, event, func, insert, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DatabaseError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from dependencies.config import Settings, get_settings
+from models import Product, ProductCategoryStats, ProductPriceRangeStats
+
+logger = logging.getLogger(__name__)
+
+STATS_TABLE = ProductCategoryStats.__table__  # type: ignore[attr-defined]
+PRODUCTS_TABLE = Product.__table__  # type: ignore[attr-defined]
+RANGES_TABLE = ProductPriceRangeStats.__table__  # type: ignore[attr-defined]
+
+# One row per category: (category key, count, in stock, price sum, price min, price max)
+CategoryRow = Tuple[str, int, int, float, Optional[float], Optional[float]]
+
+
+def _category_key(category: Optional[str]) -> str:
+    """Stats table key of a category ("" for products without one)"""
+    return category or ""
+
+
+def _category_filter(key: str):
+    column = PRODUCTS_TABLE.c.category
+    return column.is_(None) | (column == "") if key == "" else column == key
+
+
+def aggregate_query(key: Optional[str] = None):
+    """Per-category count, in-stock count and price sum/min/max in one grouped query"""
+    products = PRODUCTS_TABLE.c
+    query = select(
+        products.category,
+        func.count().label("product_count"),
+        func.coalesce(func.sum(case((products.in_stock.is_(True), 1), else_=0)), 0).label("in_stock_count"),
+        func.coalesce(func.sum(products.price), 0.0).label("price_sum"),
+        func.min(products.price).label("price_min"),
+        func.max(products.price).label("price_max"),
+    ).group_by(products.category)
+    if key is not None:
+        query = query.where(_category_filter(key))
+    return query
+
+
+def _merge_rows(rows: Sequence[Any]) -> List[CategoryRow]:
+    """Combine aggregate rows by category key (NULL and "" are both uncategorized)"""
+    merged: Dict[str, List[Any]] = {}
+    for category, count, in_stock, price_sum, price_min, price_max in rows:
+        key = _category_key(category)
+        if key not in merged:
+            merged[key] = [key, 0, 0, 0.0, None, None]
+        row = merged[key]
+        row[1] += int(count)
+        row[2] += int(in_stock or 0)
+        row[3] += float(price_sum or 0.0)
+        if price_min is not None:
+            row[4] = price_min if row[4] is None else min(row[4], price_min)
+        if price_max is not None:
+            row[5] = price_max if row[5] is None else max(row[5], price_max)
+    return [tuple(row) for row in sorted(merged.values())]  # type: ignore[misc]
+
+
+def summarize(rows: Sequence[CategoryRow]) -> Dict[str, Any]:
+    """Build the ``categories``, ``stats`` and ``stock`` sections of the products API from category rows"""
+    total = sum(row[1] for row in rows)
+    in_stock = sum(row[2] for row in rows)
+    price_sum = sum(row[3] for row in rows)
+    minimums = [row[4] for row in rows if row[4] is not None]
+    maximums = [row[5] for row in rows if row[5] is not None]
+    return {
+        "categories": [{"category": row[0], "count": row[1]} for row in rows if row[0] and row[1]],
+        "stats": {
+            "avg_price": float(price_sum / total) if total else 0,
+            "min_price": float(min(minimums)) if minimums else 0,
+            "max_price": float(max(maximums)) if maximums else 0,
+            "total_products": total,
+        },
+        "stock": {"total": total, "in_stock": in_stock, "out_of_stock": total - in_stock},
+    }
+
+
+# Price histogram buckets of the products dashboard: (label, lower bound, upper bound or None)
+PRICE_RANGES: List[Tuple[str, float, Optional[float]]] = [
+    ("$0 - $25", 0, 25),
+    ("$25 - $50", 25, 50),
+    ("$50 - $100", 50, 100),
+    ("$100 - $500", 100, 500),
+    ("$500+", 500, None),
+]
+
+
+def _price_bucket(price: float) -> int:
+    """Index of the price range a price falls in (the same rule as ``bucket_query``)"""
+    for index, (_, _, upper) in enumerate(PRICE_RANGES):
+        if upper is not None and price < upper:
+            return index
+    return len(PRICE_RANGES) - 1
+
+
+def bucket_query(bucket: Optional[int] = None):
+    """Product count per price range index in one grouped query"""
+    price = PRODUCTS_TABLE.c.price
+    index = case(
+        *[(price < upper, index) for index, (_, _, upper) in enumerate(PRICE_RANGES) if upper is not None],
+        else_=len(PRICE_RANGES) - 1,
+    )
+    query = select(index.label("bucket"), func.count().label("product_count")).group_by(index)
+    if bucket is not None:
+        query = query.where(index == bucket)
+    return query
+
+
+def _price_range_counts(counts: Dict[int, int]) -> List[Dict[str, Any]]:
+    """Build the ``price_ranges`` section of the products API from counts per range index"""
+    return [
+        {"label": label, "min": lower, "max": upper, "count": int(counts.get(index, 0))}
+        for index, (label, lower, upper) in enumerate(PRICE_RANGES)
+    ]
+
+
+async def price_ranges(session: AsyncSession) -> List[Dict[str, Any]]:
+    """Count products per price range in one grouped query"""
+    return _price_range_counts(dict((await session.execute(bucket_query())).all()))  # type: ignore[arg-type]
+
+
+async def aggregate_product_stats(session: AsyncSession) -> Dict[str, Any]:
+    """Compute product statistics from the products table in one round trip"""
+    rows = (await session.execute(aggregate_query())).all()
+    return summarize(_merge_rows(rows))
+
+
+class ProductStatsTable:
+    """
+    Keep ``product_category_stats`` and ``product_price_range_stats`` current
+    as products are written.
+
+    ORM inserts, updates and deletes of ``Product`` adjust the row of their
+    category and price range inside the same flush (and transaction), so
+    reading the stats costs two small queries however large the catalog is.
+    Counts and sums are adjusted in place; when a product at a category's
+    minimum or maximum price leaves it, that category is recomputed. Bulk
+    ``update()``/``delete()`` statements and other processes that write
+    without these hooks are not seen; ``check`` reports the drift and
+    rebuilds the table (``oppman.py product_stats``).
+    """
+
+    def __init__(self, session_factory: Optional[Callable[[], Any]] = None):
+        self._session_factory = session_factory
+        self._listeners: List[Tuple[Any, str, Callable[..., None]]] = []
+        self.ready = False
+        self.rebuilds = 0
+        self.recomputes = 0
+
+    def _sessions(self):
+        if self._session_factory is None:
+            from db import AsyncSessionLocal
+            self._session_factory = AsyncSessionLocal
+        return self._session_factory
+
+    # Write-time hooks (run inside the flush, on its connection)
+
+    def install_listeners(self) -> None:
+        """Maintain the table on ORM writes to products (idempotent)"""
+        if self._listeners:
+            return
+        for name, listener in (
+            ("after_insert", self._after_insert),
+            ("after_update", self._after_update),
+            ("after_delete", self._after_delete),
+        ):
+            event.listen(Product, name, listener)
+            self._listeners.append((Product, name, listener))
+
+    def remove_listeners(self) -> None:
+        """Stop maintaining the table"""
+        for model, name, listener in self._listeners:
+            event.remove(model, name, listener)
+        self._listeners.clear()
+
+    def _after_insert(self, mapper, connection: Connection, target: Product) -> None:
+        self._add(connection, _category_key(target.category), target.in_stock, target.price)
+        self._count_price(connection, _price_bucket(target.price), 1)
+
+    def _after_delete(self, mapper, connection: Connection, target: Product) -> None:
+        self._remove(connection, _category_key(target.category), target.in_stock, target.price)
+        self._count_price(connection, _price_bucket(target.price), -1)
+
+    def _after_update(self, mapper, connection: Connection, target: Product) -> None:
+        state = inspect(target)
+        old: Dict[str, Any] = {}
+        changed = False
+        for name in ("category", "in_stock", "price"):
+            history = state.attrs[name].history
+            if history.deleted:
+                old[name] = history.deleted[0]
+                changed = True
+            else:
+                old[name] = getattr(target, name)
+        if not changed:
+            return
+        old_bucket, new_bucket = _price_bucket(old["price"]), _price_bucket(target.price)
+        if old_bucket != new_bucket:
+            self._count_price(connection, old_bucket, -1)
+            self._count_price(connection, new_bucket, 1)
+        old_key, new_key = _category_key(old["category"]), _category_key(target.category)
+        if old_key == new_key and old["price"] == target.price:
+            # Only the stock flag changed
+            stock_delta = int(bool(target.in_stock)) - int(bool(old["in_stock"]))
+            connection.execute(
+                update(STATS_TABLE)
+                .where(STATS_TABLE.c.category == new_key)
+                .values(in_stock_count=STATS_TABLE.c.in_stock_count + stock_delta, updated_at=datetime.now(UTC))
+            )
+            return
+        recomputed = self._remove(connection, old_key, old["in_stock"], old["price"])
+        # A recomputed category already includes the row's new values
+        if not (recomputed and old_key == new_key):
+            self._add(connection, new_key, target.in_stock, target.price)
+
+    def _add(self, connection: Connection, key: str, in_stock: bool, price: float) -> None:
+        """Count one product in a category (an upsert on SQLite and PostgreSQL)"""
+        dialect = {"sqlite": sqlite, "postgresql": postgresql}.get(connection.dialect.name)
+        if dialect is None:
+            self._recompute(connection, key)
+            return
+        stats = STATS_TABLE.c
+        now = datetime.now(UTC)
+        lower = stats.price_min.is_(None) | (stats.price_min > price)
+        higher = stats.price_max.is_(None) | (stats.price_max < price)
+        statement = dialect.insert(STATS_TABLE).values(
+            category=key,
+            product_count=1,
+            in_stock_count=int(bool(in_stock)),
+            price_sum=price,
+            price_min=price,
+            price_max=price,
+            updated_at=now,
+        )
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[stats.category],
+            set_={
+                "product_count": stats.product_count + 1,
+                "in_stock_count": stats.in_stock_count + int(bool(in_stock)),
+                "price_sum": stats.price_sum + price,
+                "price_min": case((lower, price), else_=stats.price_min),
+                "price_max": case((higher, price), else_=stats.price_max),
+                "updated_at": now,
+            },
+        ))
+
+    def _remove(self, connection: Connection, key: str, in_stock: bool, price: float) -> bool:
+        """
+        Stop counting one product in a category
+
+        Returns:
+            bool: True when the category was recomputed from the products table
+        """
+        row = connection.execute(select(STATS_TABLE).where(STATS_TABLE.c.category == key)).first()
+        if row is None or row.product_count <= 1 or price <= row.price_min or price >= row.price_max:
+            # The minimum or maximum may have left the category
+            self._recompute(connection, key)
+            return True
+        connection.execute(
+            update(STATS_TABLE)
+            .where(STATS_TABLE.c.category == key)
+            .values(
+                product_count=STATS_TABLE.c.product_count - 1,
+                in_stock_count=STATS_TABLE.c.in_stock_count - int(bool(in_stock)),
+                price_sum=STATS_TABLE.c.price_sum - price,
+                updated_at=datetime.now(UTC),
+            )
+        )
+        return False
+
+    def _recompute(self, connection: Connection, key: str) -> None:
+        """Replace one category's row with a fresh aggregate over its products"""
+        self.recomputes += 1
+        rows = _merge_rows(connection.execute(aggregate_query(key)).all())
+        connection.execute(delete(STATS_TABLE).where(STATS_TABLE.c.category == key))
+        if rows:
+            connection.execute(insert(STATS_TABLE).values(self._values(rows[0])))
+
+    def _count_price(self, connection: Connection, bucket: int, delta: int) -> None:
+        """Adjust the product count of one price range (recomputed when its row is missing)"""
+        result = connection.execute(
+            update(RANGES_TABLE)
+            .where(RANGES_TABLE.c.bucket == bucket)
+            .values(product_count=RANGES_TABLE.c.product_count + delta, updated_at=datetime.now(UTC))
+        )
+        if result.rowcount == 0:
+            # The flush already wrote the product, so the fresh count includes it
+            self.recomputes += 1
+            count = sum(row[1] for row in connection.execute(bucket_query(bucket)).all())
+            connection.execute(insert(RANGES_TABLE).values(self._range_values(bucket, count)))
+
+    @staticmethod
+    def _range_values(bucket: int, count: int) -> Dict[str, Any]:
+        return {"bucket": bucket, "product_count": count, "updated_at": datetime.now(UTC)}
+
+    @staticmethod
+    def _values(row: CategoryRow) -> Dict[str, Any]:
+        key, count, in_stock, price_sum, price_min, price_max = row
+        return {
+            "category": key,
+            "product_count": count,
+            "in_stock_count": in_stock,
+            "price_sum": price_sum,
+            "price_min": price_min,
+            "price_max": price_max,
+            "updated_at": datetime.now(UTC),
+        }
+
+    # Reads, rebuilds and the consistency check
+
+    async def read(self, session: AsyncSession) -> Dict[str, Any]:
+        """Product statistics from the stats tables (one query over the categories, one over the price ranges)"""
+        stats = STATS_TABLE.c
+        rows = (await session.execute(
+            select(
+                stats.category, stats.product_count, stats.in_stock_count,
+                stats.price_sum, stats.price_min, stats.price_max,
+            ).order_by(stats.category)
+        )).all()
+        summary = summarize([tuple(row) for row in rows])  # type: ignore[misc]
+        summary["price_ranges"] = _price_range_counts(await self._stored_ranges(session))
+        return summary
+
+    @staticmethod
+    async def _stored_ranges(session: AsyncSession) -> Dict[int, int]:
+        rows = (await session.execute(select(RANGES_TABLE.c.bucket, RANGES_TABLE.c.product_count))).all()
+        return dict(rows)  # type: ignore[arg-type]
+
+    async def check(self, rebuild: bool = True) -> Dict[str, Any]:
+        """
+        Compare the stats tables with the products table and optionally rebuild them
+
+        Returns:
+            dict: ``categories`` (in the products table), ``mismatched`` (category
+            keys whose row is missing, extra or different), ``mismatched_ranges``
+            (labels of price ranges whose count is wrong) and ``rebuilt``
+        """
+        async with self._sessions()() as session:
+            await session.run_sync(lambda sync: STATS_TABLE.create(sync.connection(), checkfirst=True))
+            await session.run_sync(lambda sync: RANGES_TABLE.create(sync.connection(), checkfirst=True))
+            expected = {row[0]: row for row in _merge_rows((await session.execute(aggregate_query())).all())}
+            stored = {
+                row.category: (
+                    row.category, row.product_count, row.in_stock_count, row.price_sum, row.price_min, row.price_max
+                )
+                for row in (await session.execute(select(STATS_TABLE))).all()
+            }
+            mismatched = sorted(
+                key for key in expected.keys() | stored.keys()
+                if not self._same(expected.get(key), stored.get(key))
+            )
+            expected_ranges: Dict[int, int] = dict((await session.execute(bucket_query())).all())  # type: ignore[arg-type]
+            stored_ranges = await self._stored_ranges(session)
+            mismatched_ranges = [
+                label for index, (label, _, _) in enumerate(PRICE_RANGES)
+                if index not in stored_ranges or stored_ranges[index] != expected_ranges.get(index, 0)
+            ]
+            if rebuild:
+                await session.execute(delete(STATS_TABLE))
+                if expected:
+                    await session.execute(insert(STATS_TABLE), [self._values(row) for row in expected.values()])
+                await session.execute(delete(RANGES_TABLE))
+                await session.execute(insert(RANGES_TABLE), [
+                    self._range_values(index, expected_ranges.get(index, 0)) for index in range(len(PRICE_RANGES))
+                ])
+                self.rebuilds += 1
+            await session.commit()
+        return {
+            "categories": len(expected),
+            "mismatched": mismatched,
+            "mismatched_ranges": mismatched_ranges,
+            "rebuilt": rebuild,
+        }
+
+    @staticmethod
+    def _same(expected: Optional[CategoryRow], stored: Optional[CategoryRow]) -> bool:
+        if expected is None or stored is None:
+            return expected is stored
+        return (
+            tuple(expected[:3]) == tuple(stored[:3])
+            and math.isclose(expected[3], stored[3], rel_tol=1e-9, abs_tol=1e-6)
+            and expected[4:] == stored[4:]
+        )
+
+    async def start(self) -> None:
+        """Rebuild the table (creating it if needed), then maintain it on writes"""
+        try:
+            result = await self.check(rebuild=True)
+        except (OperationalError, DatabaseError) as e:
+            # Without a current table the hooks could fail writes; reads fall back to the aggregate
+            logger.warning(f"Product stats table not available, using the aggregate query: {e}")
+            return
+        if result["mismatched"] or result["mismatched_ranges"]:
+            logger.info(
+                f"Product stats tables rebuilt ({len(result['mismatched'])} categories and "
+                f"{len(result['mismatched_ranges'])} price ranges were stale)"
+            )
+        self.install_listeners()
+        self.ready = True
+
+    async def stop(self) -> None:
+        """Stop maintaining the table"""
+        self.remove_listeners()
+        self.ready = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get maintenance counters"""
+        return {"ready": self.ready, "rebuilds": self.rebuilds, "recomputes": self.recomputes}
+
+
+# Global product stats table instance
+_product_stats: Optional[ProductStatsTable] = None
+
+
+def get_product_stats_table(settings: Optional[Settings] = None) -> Optional[ProductStatsTable]:
+    """Get or create the shared product stats table (None when ``product_stats_materialized`` is off)"""
+    global _product_stats
+    settings = settings or get_settings()
+    if not settings.product_stats_materialized:
+        return None
+    if _product_stats is None:
+        _product_stats = ProductStatsTable()
+    return _product_stats
@@ -0,0 +1,338 @@
+"""
+Read-through cache of service query results, invalidated by per-table version counters
+"""
+import asyncio
+from collections import OrderedDict
+import json
+import logging
+from pathlib import Path
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from dependencies.config import Settings, get_settings
+from models import Product, WebinarRegistrants
+
+logger = logging.getLogger(__name__)
+
+# Tables whose writes bump a version (every table a cached query reads from)
+VERSIONED_TABLES: Set[str] = {
+    Product.__tablename__,  # type: ignore[attr-defined]
+    WebinarRegistrants.__tablename__,  # type: ignore[attr-defined]
+}
+
+# session.info key collecting the versioned tables written in the current transaction
+_PENDING_KEY = "query_cache_tables"
+
+
+class TableVersions:
+    """
+    In-process table version counters (the default backend).
+
+    A backend maps table names to integers that change on every committed
+    write. Subclasses share them between processes; ``get`` may do I/O,
+    ``bump`` runs inside the commit hook and only touches memory, and
+    ``write`` (called in a worker thread after the bump) shares it.
+    """
+
+    # Whether every process sees the same versions
+    shared = False
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+
+    async def get(self, tables: Iterable[str]) -> Dict[str, int]:
+        """Current version of each table (0 if never written)"""
+        return {table: self._versions.get(table, 0) for table in tables}
+
+    def bump(self, tables: Iterable[str]) -> None:
+        """Move the versions of tables that were written"""
+        for table in tables:
+            self._versions[table] = self._versions.get(table, 0) + 1
+
+    def write(self, tables: Iterable[str]) -> None:
+        """Share a bump with the other processes (nothing to share in-process)"""
+
+
+class SQLiteTableVersions(TableVersions):
+    """
+    Table versions kept in a SQLite file, shared by all gunicorn workers on the host.
+
+    A table's first write stores the current time in nanoseconds rather than 1,
+    so recreating the file cannot bring back a version an old entry was cached under.
+    ``bump`` moves an in-process counter added to the stored versions, so this
+    process sees its own commits at once while ``write`` updates the file.
+    """
+
+    shared = True
+
+    def __init__(self, db_path: str):
+        super().__init__()
+        self.db_path = db_path
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            # WAL lets several worker processes read while one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS table_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _read(self, tables: Tuple[str, ...]) -> Dict[str, int]:
+        with self._connect() as conn:
+            placeholders = ",".join("?" * len(tables))
+            rows = conn.execute(
+                f"SELECT name, version FROM table_versions WHERE name IN ({placeholders})", tables
+            ).fetchall()
+        versions = dict(rows)
+        return {table: versions.get(table, 0) for table in tables}
+
+    async def get(self, tables: Iterable[str]) -> Dict[str, int]:
+        # Both parts only grow, so their sum changes whenever either does
+        stored = await asyncio.to_thread(self._read, tuple(tables))
+        return {table: version + self._versions.get(table, 0) for table, version in stored.items()}
+
+    def write(self, tables: Iterable[str]) -> None:
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO table_versions (name, version) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET version = version + 1",
+                [(table, time.time_ns()) for table in tables],
+            )
+
+
+class QueryCache:
+    """
+    Bounded LRU cache of query results keyed by (query name, parameters).
+
+    Each entry remembers the versions of the tables it was read from; a
+    lookup first fetches the current versions, so any committed write to
+    those tables through a SQLAlchemy session (flushes and ORM bulk
+    statements alike) turns the entry into a miss. Versions are bumped after
+    commit, never before, so a result read before a write lands can't be
+    cached under the new version. ``ttl_seconds`` bounds staleness from
+    writes that don't go through a session of this process (raw SQL, other
+    processes when the versions are not shared).
+    """
+
+    def __init__(
+        self,
+        versions: Optional[TableVersions] = None,
+        max_entries: int = 256,
+        ttl_seconds: float = 300,
+    ):
+        self.versions = versions if versions is not None else TableVersions()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[Dict[str, int], float, Any]]" = OrderedDict()
+        self.ready = False
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.bumps = 0
+        self.version_errors = 0
+        self._writes: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def make_key(name: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """Canonical key of a query and its parameters"""
+        return json.dumps([name, params or {}], sort_keys=True, separators=(",", ":"), default=str)
+
+    async def get_or_load(
+        self,
+        name: str,
+        tables: Iterable[str],
+        loader: Callable[[], Awaitable[Any]],
+        params: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        """
+        Return the cached result of a query, or run ``loader`` and cache what it returns
+
+        Args:
+            name: Query name (with ``params``, the cache key)
+            tables: Tables the query reads; writes to any of them invalidate the entry
+            loader: Coroutine function running the query. Exceptions propagate and nothing is cached
+            params: JSON-serializable query parameters
+
+        Returns:
+            The query result, shared between callers: treat it as read-only
+        """
+        tables = sorted(tables)
+        try:
+            versions = await self.versions.get(tables)
+        except (OSError, sqlite3.Error) as e:
+            # Without current versions a cached entry can't be trusted
+            logger.warning(f"Query cache versions unavailable, reading through: {e}")
+            self.version_errors += 1
+            return await loader()
+
+        key = self.make_key(name, params)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            cached_versions, expires_at, value = entry
+            if cached_versions == versions and expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+            if cached_versions != versions:
+                self.invalidations += 1
+            else:
+                self.expirations += 1
+
+        self.misses += 1
+        value = await loader()
+        self._entries[key] = (versions, now + self.ttl_seconds, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return value
+
+    def clear(self) -> None:
+        """Drop all entries"""
+        self._entries.clear()
+
+    # Invalidation: collect written tables per session, bump their versions on commit
+
+    def install_listeners(self) -> None:
+        """Bump table versions on commits of every SQLAlchemy session in this process (idempotent)"""
+        if self.ready:
+            return
+        event.listen(Session, "after_flush", self._after_flush)
+        event.listen(Session, "do_orm_execute", self._do_orm_execute)
+        event.listen(Session, "after_commit", self._after_commit)
+        event.listen(Session, "after_rollback", self._after_rollback)
+        self.ready = True
+
+    def remove_listeners(self) -> None:
+        """Stop bumping table versions"""
+        if not self.ready:
+            return
+        event.remove(Session, "after_flush", self._after_flush)
+        event.remove(Session, "do_orm_execute", self._do_orm_execute)
+        event.remove(Session, "after_commit", self._after_commit)
+        event.remove(Session, "after_rollback", self._after_rollback)
+        self.ready = False
+
+    @staticmethod
+    def _mark(session: Session, table: Optional[str]) -> None:
+        if table in VERSIONED_TABLES:
+            session.info.setdefault(_PENDING_KEY, set()).add(table)
+
+    def _after_flush(self, session: Session, flush_context) -> None:
+        for instance in (*session.new, *session.dirty, *session.deleted):
+            self._mark(session, getattr(type(instance), "__tablename__", None))
+
+    def _do_orm_execute(self, orm_execute_state) -> None:
+        # Bulk insert()/update()/delete() statements write without a flush
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            table = getattr(orm_execute_state.statement, "table", None)
+            self._mark(orm_execute_state.session, getattr(table, "name", None))
+
+    def _after_commit(self, session: Session) -> None:
+        tables = session.info.pop(_PENDING_KEY, None)
+        if not tables:
+            return
+        self.versions.bump(tables)
+        self.bumps += 1
+        if not self.versions.shared:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # A synchronous session outside the event loop can wait for the file
+            self._write_done(tables, None)
+            return
+        # Shared versions are file I/O (with a lock timeout): keep it off the event loop
+        task = loop.create_task(asyncio.to_thread(self.versions.write, tables))
+        self._writes.add(task)
+        task.add_done_callback(lambda done: self._write_done(tables, done))
+
+    def _write_done(self, tables: Set[str], task: Optional[asyncio.Task]) -> None:
+        try:
+            if task is None:
+                self.versions.write(tables)
+            else:
+                self._writes.discard(task)
+                if not task.cancelled():
+                    task.result()
+        except (OSError, sqlite3.Error) as e:
+            # This process already sees the write; other workers keep their entries until the TTL
+            logger.warning(f"Query cache version write failed, other workers may serve stale entries: {e}")
+            self.version_errors += 1
+
+    def _after_rollback(self, session: Session) -> None:
+        session.info.pop(_PENDING_KEY, None)
+
+    async def start(self) -> None:
+        """Start invalidating on writes"""
+        self.install_listeners()
+
+    async def stop(self) -> None:
+        """Stop invalidating, finish pending version writes and drop the entries (they could go stale unseen)"""
+        self.remove_listeners()
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+        self.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache counters"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "shared_versions": self.versions.shared,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "bumps": self.bumps,
+            "version_errors": self.version_errors,
+        }
+
+
+# Global query cache instance
+_query_cache: Optional[QueryCache] = None
+
+
+def get_query_cache(settings: Optional[Settings] = None) -> Optional[QueryCache]:
+    """Get or create the shared query cache (None when disabled)"""
+    global _query_cache
+    settings = settings or get_settings()
+    if not settings.query_cache_enabled:
+        return None
+    if _query_cache is None:
+        versions = (
+            SQLiteTableVersions(settings.query_cache_versions_path)
+            if settings.query_cache_versions_path
+            else TableVersions()
+        )
+        _query_cache = QueryCache(
+            versions=versions,
+            max_entries=settings.query_cache_max_entries,
+            ttl_seconds=settings.query_cache_ttl,
+        )
+    return _query_cache
+
+
+async def cached_query(
+    name: str,
+    tables: Iterable[str],
+    loader: Callable[[], Awaitable[Any]],
+    params: Optional[Dict[str, Any]] = None,
+    settings: Optional[Settings] = None,
+) -> Any:
+    """Run a query through the shared cache once it is listening for writes, else directly"""
+    cache = get_query_cache(settings)
+    if cache is None or not cache.ready:
+        return await loader()
+    return await cache.get_or_load(name, tables, loader, params)
@@ -0,0 +1,175 @@
+"""
+Response cache for chat completions (in-memory LRU + TTL with optional SQLite tier)
+"""
+import asyncio
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+from pathlib import Path
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from dependencies.config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+    """Canonical hash of the request fields that determine a completion"""
+    canonical = json.dumps(
+        {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of chat completions with TTL expiry.
+
+    When ``db_path`` is set, entries are also written to a SQLite file so
+    they survive restarts and are shared by all gunicorn workers on the host.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 3600, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+        if self.db_path:
+            self._init_db()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get a cached value, or None on miss/expiry"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+            self.expirations += 1
+
+        if self.db_path:
+            row = await asyncio.to_thread(self._db_get, key, now)
+            if row is not None:
+                expires_at, value = row
+                self._store(key, value, expires_at)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Store a value in memory (and on disk when enabled)"""
+        expires_at = time.time() + self.ttl_seconds
+        self._store(key, value, expires_at)
+        if self.db_path:
+            await asyncio.to_thread(self._db_set, key, value, expires_at)
+
+    def clear(self) -> None:
+        """Clear the in-memory tier"""
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache counters"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "persistent": bool(self.db_path),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _store(self, key: str, value: Dict[str, Any], expires_at: float) -> None:
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    # SQLite tier (runs in a worker thread; one short-lived connection per call)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=5)  # type: ignore[arg-type]
+
+    def _init_db(self) -> None:
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)  # type: ignore[arg-type]
+        with self._connect() as conn:
+            # WAL lets several worker processes read while one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _db_get(self, key: str, now: float) -> Optional[Tuple[float, Dict[str, Any]]]:
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if row[1] <= now:
+                    conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                    self.expirations += 1
+                    return None
+                return row[1], json.loads(row[0])
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache read failed: {e}")
+            return None
+
+    def _db_set(self, key: str, value: Dict[str, Any], expires_at: float) -> None:
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at),
+                )
+                conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache write failed: {e}")
+
+
+# Global response cache instance
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache(settings: Optional[Settings] = None) -> Optional[ResponseCache]:
+    """Get or create the shared response cache (None when disabled)"""
+    global _response_cache
+    settings = settings or get_settings()
+    if not settings.response_cache_enabled:
+        return None
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            max_entries=settings.response_cache_max_entries,
+            ttl_seconds=settings.response_cache_ttl,
+            db_path=settings.response_cache_path,
+        )
+    return _response_cache
@@ -0,0 +1,270 @@
+"""
+Semantic near-duplicate lookup for chat prompts (hashed n-gram TF-IDF vectors in NumPy)
+"""
+import hashlib
+import json
+import logging
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import zlib
+
+from dependencies.config import Settings, get_settings
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Bits of the SimHash signature used to preselect candidates
+SIGNATURE_BITS = 64
+
+_CONTRACTIONS = [
+    (re.compile(r"n't\b"), " not"),
+    (re.compile(r"'re\b"), " are"),
+    (re.compile(r"'s\b"), " is"),
+    (re.compile(r"'m\b"), " am"),
+    (re.compile(r"'ll\b"), " will"),
+    (re.compile(r"'ve\b"), " have"),
+    (re.compile(r"'d\b"), " would"),
+]
+_NON_WORD_RE = re.compile(r"[^\w]+")
+
+
+def normalize_prompt(text: str) -> str:
+    """Lowercase, expand contractions and drop punctuation ("What's FastAPI?" -> "what is fastapi")"""
+    text = text.lower().replace("’", "'")
+    for pattern, replacement in _CONTRACTIONS:
+        text = pattern.sub(replacement, text)
+    return _NON_WORD_RE.sub(" ", text).strip()
+
+
+def prompt_features(text: str) -> List[str]:
+    """Word unigrams plus character 3-grams inside each padded word"""
+    features = []
+    for word in normalize_prompt(text).split():
+        features.append(f"w:{word}")
+        padded = f" {word} "
+        features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return features
+
+
+def context_hash(payload: Dict[str, Any]) -> int:
+    """Signed 64-bit hash of everything in a request except the last user message"""
+    canonical = json.dumps(
+        {
+            "model": payload["model"],
+            "messages": payload["messages"][:-1],
+            "temperature": payload["temperature"],
+            "max_tokens": payload["max_tokens"],
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return int.from_bytes(hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+class SemanticCache:
+    """
+    Map prompts to the response-cache keys of near-duplicate earlier prompts.
+
+    Prompts are embedded as L2-normalized TF-IDF vectors over ``dim`` hashed
+    features (word unigrams and character 3-grams, with document frequencies
+    kept online) and stored in a preallocated ``max_entries x dim`` float32
+    matrix, so memory is fixed up front; when full, the least recently used
+    entry is replaced. A lookup ranks all entries by the Hamming distance of
+    64-bit SimHash signatures (one XOR + popcount pass), then takes exact
+    cosine similarity over the ``candidates`` closest ones and returns the
+    best key at or above ``threshold``. Only prompts with the same history,
+    model and sampling settings can match.
+
+    The cache only holds keys; answers stay in the ``ResponseCache``.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        dim: int = 256,
+        threshold: float = 0.9,
+        candidates: int = 32,
+        seed: int = 0,
+    ):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("The semantic cache needs NumPy (pip install numpy)")
+        self.max_entries = max_entries
+        self.dim = dim
+        self.threshold = threshold
+        self.candidates = max(1, candidates)
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._signatures = np.zeros(max_entries, dtype=np.uint64)
+        self._contexts = np.zeros(max_entries, dtype=np.int64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._keys: List[Optional[str]] = [None] * max_entries
+        self._slots: Dict[str, int] = {}
+        self._size = 0
+        # Document frequency per hashed feature, for the IDF weights
+        self._df = np.zeros(dim, dtype=np.float64)
+        self._projection = np.random.default_rng(seed).standard_normal((SIGNATURE_BITS, dim)).astype(np.float32)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lookup_ms_total = 0.0
+        self.lookup_ms_max = 0.0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _term_counts(self, text: str) -> "np.ndarray":
+        counts = np.zeros(self.dim, dtype=np.float32)
+        for feature in prompt_features(text):
+            counts[zlib.crc32(feature.encode("utf-8")) % self.dim] += 1.0
+        return counts
+
+    def _weigh(self, counts: "np.ndarray") -> "np.ndarray":
+        """Sublinear TF x smoothed IDF, L2-normalized"""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        present = counts > 0
+        idf = np.log((1.0 + self._size) / (1.0 + self._df[present])) + 1.0
+        vector[present] = (1.0 + np.log(counts[present])) * idf
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else vector
+
+    def _signature(self, vector: "np.ndarray") -> "np.uint64":
+        bits = np.packbits(self._projection @ vector > 0)
+        return bits.view(np.uint64)[0]
+
+    def lookup(self, prompt: str, context: int) -> Optional[Tuple[str, float]]:
+        """
+        Find the response-cache key of the most similar earlier prompt
+
+        Args:
+            prompt: The new user message
+            context: ``context_hash`` of the request
+
+        Returns:
+            tuple: ``(cache_key, similarity)`` at or above the threshold, or None
+        """
+        started = time.perf_counter()
+        result = self._lookup(prompt, context)
+        elapsed = (time.perf_counter() - started) * 1000
+        self.lookup_ms_total += elapsed
+        self.lookup_ms_max = max(self.lookup_ms_max, elapsed)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def _lookup(self, prompt: str, context: int) -> Optional[Tuple[str, float]]:
+        size = self._size
+        if size == 0:
+            return None
+        vector = self._weigh(self._term_counts(prompt))
+        if not vector.any():
+            return None
+
+        # Candidates: closest SimHash signatures among entries with the same context
+        distances = np.bitwise_count(self._signatures[:size] ^ self._signature(vector))
+        distances[self._contexts[:size] != context] = SIGNATURE_BITS + 1
+        # Distances are 0..64, so a histogram finds the cut-off radius faster than a partial sort
+        histogram = np.bincount(distances, minlength=SIGNATURE_BITS + 2)[:SIGNATURE_BITS + 1]
+        covered = np.cumsum(histogram)
+        if covered[-1] == 0:
+            return None
+        radius = min(int(np.searchsorted(covered, self.candidates)), SIGNATURE_BITS)
+        # Ties at the radius can admit many more; the rerank stays bounded
+        candidates = np.flatnonzero(distances <= radius)[:self.candidates * 4]
+
+        scores = self._vectors[candidates] @ vector
+        best = int(np.argmax(scores))
+        similarity = float(scores[best])
+        if similarity < self.threshold:
+            return None
+        slot = int(candidates[best])
+        self._last_used[slot] = time.monotonic()
+        return self._keys[slot], similarity
+
+    def add(self, prompt: str, context: int, cache_key: str) -> None:
+        """Remember a prompt whose answer is stored in the response cache under ``cache_key``"""
+        if cache_key in self._slots:
+            self._last_used[self._slots[cache_key]] = time.monotonic()
+            return
+        counts = self._term_counts(prompt)
+        if not counts.any():
+            return
+
+        if self._size < self.max_entries:
+            slot = self._size
+            self._size += 1
+        else:
+            slot = int(np.argmin(self._last_used))
+            self._df -= self._vectors[slot] > 0
+            del self._slots[self._keys[slot]]
+            self.evictions += 1
+        self._df += counts > 0
+
+        vector = self._weigh(counts)
+        self._vectors[slot] = vector
+        self._signatures[slot] = self._signature(vector)
+        self._contexts[slot] = context
+        self._last_used[slot] = time.monotonic()
+        self._keys[slot] = cache_key
+        self._slots[cache_key] = slot
+
+    def clear(self) -> None:
+        """Drop all entries"""
+        self._vectors[:] = 0
+        self._signatures[:] = 0
+        self._last_used[:] = 0
+        self._df[:] = 0
+        self._keys = [None] * self.max_entries
+        self._slots.clear()
+        self._size = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache counters"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._size,
+            "max_entries": self.max_entries,
+            "dim": self.dim,
+            "threshold": self.threshold,
+            "memory_bytes": self._vectors.nbytes + self._signatures.nbytes + self._contexts.nbytes
+            + self._last_used.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "lookup_ms_avg": round(self.lookup_ms_total / lookups, 4) if lookups else None,
+            "lookup_ms_max": round(self.lookup_ms_max, 4),
+        }
+
+
+# Global semantic cache instance
+_semantic_cache: Optional[SemanticCache] = None
+_semantic_cache_unavailable = False
+
+
+def get_semantic_cache(settings: Optional[Settings] = None) -> Optional[SemanticCache]:
+    """Get or create the shared semantic cache (None when disabled or NumPy is missing)"""
+    global _semantic_cache, _semantic_cache_unavailable
+    settings = settings or get_settings()
+    if not settings.semantic_cache_enabled or _semantic_cache_unavailable:
+        return None
+    if _semantic_cache is None:
+        if not NUMPY_AVAILABLE:
+            logger.warning("SEMANTIC_CACHE_ENABLED is set but NumPy is not installed; semantic cache disabled")
+            _semantic_cache_unavailable = True
+            return None
+        _semantic_cache = SemanticCache(
+            max_entries=settings.semantic_cache_max_entries,
+            dim=settings.semantic_cache_dim,
+            threshold=settings.semantic_cache_threshold,
+            candidates=settings.semantic_cache_candidates,
+        )
+    return _semantic_cache
@@ -0,0 +1,161 @@
+"""
+Single-flight coalescing of identical concurrent upstream streams
+"""
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StreamGapError(LookupError):
+    """The chunks a subscriber asked for were already dropped from a bounded buffer"""
+
+
+class BroadcastStream:
+    """
+    In-process broadcast buffer for one upstream stream.
+
+    The leader publishes chunks; every subscriber first receives the backlog
+    of chunks published so far, then live chunks as they arrive. With
+    ``max_chunks`` only the most recent chunks are kept; chunk positions stay
+    absolute (``dropped`` counts the ones gone).
+    """
+
+    def __init__(self, key: str, max_chunks: Optional[int] = None):
+        self.key = key
+        self.chunks: List[Any] = []
+        self.max_chunks = max_chunks
+        self.dropped = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        # Only this identity may subscribe (None: anyone)
+        self.owner: Optional[str] = None
+        self._changed = asyncio.Event()
+
+    def publish(self, chunk: Any) -> None:
+        """Append a chunk and wake all subscribers"""
+        self.chunks.append(chunk)
+        if self.max_chunks is not None and len(self.chunks) > self.max_chunks:
+            del self.chunks[0]
+            self.dropped += 1
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """Mark the stream as finished (optionally with an error)"""
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    @property
+    def published(self) -> int:
+        """Number of chunks published so far (including dropped ones)"""
+        return self.dropped + len(self.chunks)
+
+    async def subscribe(self, start: int = 0) -> AsyncIterator[Any]:
+        """
+        Yield chunks from position ``start`` (backlog first), then live chunks until finished
+
+        Raises:
+            StreamGapError: If a chunk to yield was already dropped
+        """
+        index = start
+        while True:
+            while index < self.published:
+                if index < self.dropped:
+                    raise StreamGapError(f"Chunk {index} of stream {self.key} is no longer buffered")
+                yield self.chunks[index - self.dropped]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class StreamCoalescer:
+    """
+    Share one upstream stream between concurrent requests for the same key.
+
+    The first request for a key becomes the leader: its upstream stream runs
+    in a background task that publishes into a BroadcastStream. Requests that
+    arrive while it is in flight subscribe to that buffer instead of opening
+    their own upstream stream. The upstream task is cancelled once every
+    subscriber has gone away.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, BroadcastStream] = {}
+        self.leaders = 0
+        self.followers = 0
+        self.abandoned = 0
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Yield the chunks of the upstream stream for ``key``, starting it if needed"""
+        broadcast = self._inflight.get(key)
+        if broadcast is None:
+            broadcast = BroadcastStream(key)
+            self._inflight[key] = broadcast
+            broadcast.task = asyncio.create_task(self._run_leader(broadcast, factory))
+            self.leaders += 1
+        else:
+            self.followers += 1
+            logger.info(f"Coalescing stream request onto in-flight upstream stream {key[:12]}")
+
+        broadcast.subscribers += 1
+        try:
+            async for chunk in broadcast.subscribe():
+                yield chunk
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.done and broadcast.task is not None:
+                # Nobody is listening any more: stop paying for upstream tokens
+                self.abandoned += 1
+                if self._inflight.get(key) is broadcast:
+                    del self._inflight[key]
+                broadcast.task.cancel()
+
+    def is_inflight(self, key: str) -> bool:
+        """Whether a stream for ``key`` is running and can be joined"""
+        return key in self._inflight
+
+    async def _run_leader(self, broadcast: BroadcastStream, factory: Callable[[], AsyncIterator[Any]]) -> None:
+        try:
+            async for chunk in factory():
+                broadcast.publish(chunk)
+            broadcast.finish()
+        except asyncio.CancelledError:
+            broadcast.finish(asyncio.CancelledError())
+        except Exception as e:
+            broadcast.finish(e)
+        finally:
+            if self._inflight.get(broadcast.key) is broadcast:
+                del self._inflight[broadcast.key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get coalescing counters"""
+        return {
+            "inflight": len(self._inflight),
+            "subscribers": sum(b.subscribers for b in self._inflight.values()),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "abandoned": self.abandoned,
+        }
+
+
+# Global coalescer instance
+_stream_coalescer: Optional[StreamCoalescer] = None
+
+
+def get_stream_coalescer() -> StreamCoalescer:
+    """Get or create the shared stream coalescer"""
+    global _stream_coalescer
+    if _stream_coalescer is None:
+        _stream_coalescer = StreamCoalescer()
+    return _stream_coalescer
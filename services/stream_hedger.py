@@ -0,0 +1,204 @@
+"""
+Hedged upstream streams: race a second request when the first token is late
+"""
+import asyncio
+from collections import deque
+import logging
+import math
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Deque, Dict, Generic, List, Optional, TypeVar
+
+from dependencies.config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Upper bound on saved-up hedge credits (one credit pays for one hedge)
+MAX_HEDGE_CREDITS = 10.0
+
+# Marks an attempt that finished without producing any item
+_EMPTY = object()
+
+
+class _Attempt(Generic[T]):
+    """One upstream attempt: its stream and the task waiting for its first item"""
+
+    def __init__(self, stream: AsyncIterator[T], started: float, hedge: bool):
+        self.stream = stream
+        self.started = started
+        self.hedge = hedge
+        self.first_at: Optional[float] = None
+        self.task = asyncio.create_task(self._first())
+
+    async def _first(self) -> Any:
+        try:
+            item = await self.stream.__anext__()
+        except StopAsyncIteration:
+            item = _EMPTY
+        self.first_at = asyncio.get_running_loop().time()
+        return item
+
+    @property
+    def succeeded(self) -> bool:
+        return self.task.done() and not self.task.cancelled() and self.task.exception() is None
+
+    async def close(self) -> None:
+        """Stop the attempt; closing the stream aborts its upstream request"""
+        if not self.task.done():
+            self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        aclose = getattr(self.stream, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+class StreamHedger:
+    """
+    Track time-to-first-token (TTFT) and hedge slow streams.
+
+    When an upstream stream has produced nothing after the hedge delay (the
+    live TTFT p95 of recent streams, clamped to ``hedge_min_delay`` ..
+    ``hedge_max_delay``), a second attempt is started. Whichever yields first
+    wins and the other is closed. Hedges are paid for from a budget that
+    grows by ``hedge_budget_ratio`` per stream, so at most that fraction of
+    streams sends a second request.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.enabled = settings.stream_hedging_enabled
+        self.samples: Deque[float] = deque(maxlen=max(1, settings.hedge_window))
+        self.credits = 1.0
+        self.streams = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.skipped_budget = 0
+        self.skipped_unavailable = 0
+
+    def record_ttft(self, seconds: float) -> None:
+        """Record one observed time-to-first-token"""
+        self.samples.append(seconds)
+
+    def ttft_quantile(self, quantile: float) -> Optional[float]:
+        """Nearest-rank quantile of the recent TTFT samples (None without samples)"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(quantile * len(ordered)) - 1))
+        return ordered[index]
+
+    def delay(self) -> float:
+        """Seconds without a first token before hedging"""
+        if len(self.samples) < self.settings.hedge_min_samples:
+            return self.settings.hedge_initial_delay
+        threshold = self.ttft_quantile(self.settings.hedge_quantile) or self.settings.hedge_initial_delay
+        return min(self.settings.hedge_max_delay, max(self.settings.hedge_min_delay, threshold))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hedging counters and the current TTFT estimate"""
+        p50 = self.ttft_quantile(0.5)
+        p95 = self.ttft_quantile(0.95)
+        return {
+            "enabled": self.enabled,
+            "streams": self.streams,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "skipped_budget": self.skipped_budget,
+            "skipped_unavailable": self.skipped_unavailable,
+            "ttft_samples": len(self.samples),
+            "ttft_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "ttft_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "hedge_delay_ms": round(self.delay() * 1000, 1),
+        }
+
+    async def stream(
+        self,
+        primary: AsyncIterator[T],
+        start_hedge: Callable[[], Optional[AsyncIterator[T]]],
+    ) -> AsyncGenerator[T, None]:
+        """
+        Yield from ``primary``, or from a hedge if that produces an item first
+
+        Args:
+            primary: The first upstream attempt
+            start_hedge: Starts a second attempt; returns None when no
+                upstream capacity is available right now
+
+        Yields:
+            Items of the winning attempt
+        """
+        loop = asyncio.get_running_loop()
+        self.streams += 1
+        self.credits = min(MAX_HEDGE_CREDITS, self.credits + self.settings.hedge_budget_ratio)
+        started = loop.time()
+        hedge_at = started + self.delay()
+        hedge_considered = not self.enabled
+        attempts: List[_Attempt[T]] = [_Attempt(primary, started, hedge=False)]
+        winner: Optional[_Attempt[T]] = None
+
+        try:
+            while winner is None:
+                winner = next((attempt for attempt in attempts if attempt.succeeded), None)
+                if winner is not None:
+                    break
+                live = [attempt for attempt in attempts if not attempt.task.done()]
+                if not live:
+                    # Every attempt failed: report the primary's error
+                    raise attempts[0].task.exception()
+                if not hedge_considered and loop.time() >= hedge_at:
+                    hedge_considered = True
+                    hedge = self._start_hedge(start_hedge)
+                    if hedge is not None:
+                        logger.info(f"No first token after {loop.time() - started:.2f}s, hedging stream")
+                        attempts.append(_Attempt(hedge, loop.time(), hedge=True))
+                    continue
+                timeout = None if hedge_considered else hedge_at - loop.time()
+                await asyncio.wait(
+                    [attempt.task for attempt in live], timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+
+            self.record_ttft(winner.first_at - winner.started)
+            for attempt in attempts:
+                if attempt is not winner:
+                    if not attempt.hedge and not attempt.task.done():
+                        # A lower bound for the primary, so slow periods still raise the estimate
+                        self.record_ttft(loop.time() - attempt.started)
+                    await attempt.close()
+            if winner.hedge:
+                self.hedge_wins += 1
+
+            first = winner.task.result()
+            if first is _EMPTY:
+                return
+            yield first
+            async for item in winner.stream:
+                yield item
+        finally:
+            for attempt in attempts:
+                await attempt.close()
+
+    def _start_hedge(
+        self, start_hedge: Callable[[], Optional[AsyncIterator[T]]]
+    ) -> Optional[AsyncIterator[T]]:
+        if self.credits < 1.0:
+            self.skipped_budget += 1
+            return None
+        hedge = start_hedge()
+        if hedge is None:
+            self.skipped_unavailable += 1
+            return None
+        self.credits -= 1.0
+        self.hedged += 1
+        return hedge
+
+
+# Global stream hedger instance
+_stream_hedger: Optional[StreamHedger] = None
+
+
+def get_stream_hedger(settings: Optional[Settings] = None) -> StreamHedger:
+    """Get or create the shared stream hedger"""
+    global _stream_hedger
+    if _stream_hedger is None:
+        _stream_hedger = StreamHedger(settings or get_settings())
+    return _stream_hedger
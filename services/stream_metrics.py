@@ -0,0 +1,59 @@
+"""
+Counters for chat streams (client disconnects, upstream aborts, server-side caps)
+"""
+from collections import Counter
+from typing import Any, Dict, Optional
+
+
+class StreamMetrics:
+    """Process-wide chat stream counters"""
+
+    def __init__(self):
+        self.started = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.upstream_aborted = 0
+        self.truncated: Counter = Counter()
+
+    def record_started(self) -> None:
+        """A client stream started"""
+        self.started += 1
+
+    def record_completed(self) -> None:
+        """A client stream finished normally"""
+        self.completed += 1
+
+    def record_cancelled(self) -> None:
+        """A client disconnected before its stream finished"""
+        self.cancelled += 1
+
+    def record_upstream_aborted(self) -> None:
+        """An upstream request was closed before the model finished"""
+        self.upstream_aborted += 1
+
+    def record_truncated(self, reason: str) -> None:
+        """An upstream stream hit a server-side cap (``max_duration`` or ``max_tokens``)"""
+        self.truncated[reason] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get stream counters"""
+        return {
+            "started": self.started,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "active": self.started - self.completed - self.cancelled,
+            "upstream_aborted": self.upstream_aborted,
+            "truncated": dict(self.truncated),
+        }
+
+
+# Global stream metrics instance
+_stream_metrics: Optional[StreamMetrics] = None
+
+
+def get_stream_metrics() -> StreamMetrics:
+    """Get or create the shared stream metrics"""
+    global _stream_metrics
+    if _stream_metrics is None:
+        _stream_metrics = StreamMetrics()
+    return _stream_metrics
@@ -0,0 +1,165 @@
+"""
+Resumable chat streams: sequence-numbered events kept in a bounded replay buffer
+"""
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+import uuid
+
+from dependencies.config import Settings, get_settings
+from services.stream_coalescer import BroadcastStream, StreamGapError
+
+logger = logging.getLogger(__name__)
+
+
+def parse_last_event_id(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Split a ``Last-Event-ID`` of the form ``<stream id>:<sequence>`` (None if malformed)"""
+    if not value:
+        return None
+    stream_id, _, sequence = value.strip().rpartition(":")
+    if not stream_id or not sequence.isdigit():
+        return None
+    return stream_id, int(sequence)
+
+
+class StreamResumer:
+    """
+    Keep chat streams running across client reconnects.
+
+    ``start`` runs a stream of SSE events in a background task that publishes
+    into a bounded BroadcastStream, so the upstream request no longer depends
+    on the client connection. Every event gets the id ``<stream id>:<sequence>``;
+    a client that reconnects with that id as ``Last-Event-ID`` first receives
+    the events it missed, then the live ones. Once no client is attached
+    (or the stream has finished) the buffer is kept for ``grace`` seconds;
+    after that an unfinished stream is cancelled, which aborts the upstream
+    request, and the buffer is dropped. A stream started with an ``owner``
+    can only be attached to by that owner.
+    """
+
+    def __init__(self, grace: float = 30.0, max_events: int = 2000):
+        self.grace = grace
+        self.max_events = max_events
+        self._streams: Dict[str, BroadcastStream] = {}
+        self._expiry: Dict[str, asyncio.TimerHandle] = {}
+        self.started = 0
+        self.resumed = 0
+        self.replayed_events = 0
+        self.expired = 0
+        self.abandoned = 0
+
+    def start(self, events: AsyncIterator[Dict[str, Any]], owner: Optional[str] = None) -> BroadcastStream:
+        """
+        Run a stream of SSE event dicts in the background
+
+        Args:
+            events: SSE event dicts to publish
+            owner: Identity allowed to attach to the stream (None: anyone holding its id)
+
+        Returns:
+            BroadcastStream: Its ``key`` is the stream id and ``task`` the producer
+        """
+        stream_id = str(uuid.uuid4())
+        broadcast = BroadcastStream(stream_id, max_chunks=self.max_events)
+        broadcast.owner = owner
+        broadcast.task = asyncio.create_task(self._run(broadcast, events))
+        self._streams[stream_id] = broadcast
+        self.started += 1
+        return broadcast
+
+    def subscribe(
+        self, stream_id: str, after: Optional[int] = None, owner: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Attach to a stream, yielding the events that come after sequence number ``after``
+
+        Raises:
+            KeyError: If the stream is unknown, has expired or belongs to another owner
+            StreamGapError: If events after ``after`` were already dropped from the buffer
+        """
+        broadcast = self._streams.get(stream_id)
+        if broadcast is None or (broadcast.owner is not None and broadcast.owner != owner):
+            raise KeyError(stream_id)
+        start = 0 if after is None else after + 1
+        if start < broadcast.dropped:
+            raise StreamGapError(f"Events of stream {stream_id} before {broadcast.dropped} are no longer buffered")
+        if after is not None:
+            self.resumed += 1
+            self.replayed_events += max(0, broadcast.published - start)
+        return self._follow(broadcast, start)
+
+    async def _follow(self, broadcast: BroadcastStream, start: int) -> AsyncIterator[Dict[str, Any]]:
+        handle = self._expiry.pop(broadcast.key, None)
+        if handle is not None:
+            handle.cancel()
+        broadcast.subscribers += 1
+        try:
+            async for event in broadcast.subscribe(start):
+                yield event
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0:
+                self._schedule_expiry(broadcast)
+
+    def _schedule_expiry(self, broadcast: BroadcastStream) -> None:
+        handle = self._expiry.pop(broadcast.key, None)
+        if handle is not None:
+            handle.cancel()
+        if self._streams.get(broadcast.key) is broadcast:
+            loop = asyncio.get_running_loop()
+            self._expiry[broadcast.key] = loop.call_later(self.grace, self._expire, broadcast)
+
+    def _expire(self, broadcast: BroadcastStream) -> None:
+        self._expiry.pop(broadcast.key, None)
+        if broadcast.subscribers or self._streams.get(broadcast.key) is not broadcast:
+            return
+        del self._streams[broadcast.key]
+        self.expired += 1
+        if not broadcast.done and broadcast.task is not None:
+            # Nobody came back within the grace period: stop paying for upstream tokens
+            logger.info(f"Abandoning stream {broadcast.key} after {self.grace}s without a client")
+            self.abandoned += 1
+            broadcast.task.cancel()
+
+    async def _run(self, broadcast: BroadcastStream, events: AsyncIterator[Dict[str, Any]]) -> None:
+        try:
+            async for event in events:
+                broadcast.publish(dict(event, id=f"{broadcast.key}:{broadcast.published}"))
+            broadcast.finish()
+        except asyncio.CancelledError:
+            broadcast.finish(asyncio.CancelledError())
+        except Exception as e:
+            broadcast.finish(e)
+        finally:
+            await events.aclose()
+            if broadcast.subscribers == 0:
+                self._schedule_expiry(broadcast)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get resumption counters"""
+        return {
+            "buffered": len(self._streams),
+            "running": sum(1 for broadcast in self._streams.values() if not broadcast.done),
+            "attached": sum(broadcast.subscribers for broadcast in self._streams.values()),
+            "started": self.started,
+            "resumed": self.resumed,
+            "replayed_events": self.replayed_events,
+            "expired": self.expired,
+            "abandoned": self.abandoned,
+        }
+
+
+# Global stream resumer instance
+_stream_resumer: Optional[StreamResumer] = None
+
+
+def get_stream_resumer(settings: Optional[Settings] = None) -> StreamResumer:
+    """Get or create the shared stream resumer"""
+    global _stream_resumer
+    if _stream_resumer is None:
+        settings = settings or get_settings()
+        _stream_resumer = StreamResumer(
+            grace=settings.stream_resume_grace,
+            max_events=settings.stream_resume_max_events,
+        )
+    return _stream_resumer
@@ -0,0 +1,113 @@
+"""
+Shared HTTP client for upstream LLM API calls (OpenRouter)
+"""
+import logging
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+from dependencies.config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamClient:
+    """
+    Application-scoped pooled HTTP client for upstream LLM requests.
+
+    A single aiohttp session is created when the application starts and closed
+    on shutdown, so chat requests reuse warm keep-alive connections instead of
+    paying a DNS lookup and TCP+TLS handshake on every message.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self.requests_total = 0
+        self.sessions_created = 0
+
+    async def start(self) -> None:
+        """Create the pooled session (safe to call more than once)"""
+        if self._session is not None and not self._session.closed:
+            return
+
+        self._connector = aiohttp.TCPConnector(
+            limit=self.settings.upstream_pool_limit,
+            limit_per_host=self.settings.upstream_pool_limit_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=self.settings.upstream_dns_cache_ttl,
+            keepalive_timeout=self.settings.upstream_keepalive_timeout,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=self.settings.upstream_timeout,
+            connect=self.settings.upstream_connect_timeout,
+        )
+        self._session = aiohttp.ClientSession(connector=self._connector, timeout=timeout)
+        self.sessions_created += 1
+        logger.info(
+            f"Upstream client started (limit={self.settings.upstream_pool_limit}, "
+            f"limit_per_host={self.settings.upstream_pool_limit_per_host})"
+        )
+
+    async def close(self) -> None:
+        """Close the pooled session and release all connections"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("Upstream client closed")
+        self._session = None
+        self._connector = None
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """
+        Get the shared session for one upstream request
+
+        The session is started lazily if the application lifespan has not
+        started it yet (for example in scripts or tests).
+        """
+        if self._session is None or self._session.closed:
+            await self.start()
+        self.requests_total += 1
+        return self._session  # type: ignore[return-value]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get connection pool statistics"""
+        connector = self._connector
+        in_use = 0
+        idle = 0
+        if connector is not None and not connector.closed:
+            # aiohttp does not expose pool counters publicly; read them defensively
+            in_use = len(getattr(connector, "_acquired", ()))
+            idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+
+        return {
+            "started": self._session is not None and not self._session.closed,
+            "limit": self.settings.upstream_pool_limit,
+            "limit_per_host": self.settings.upstream_pool_limit_per_host,
+            "dns_cache_ttl": self.settings.upstream_dns_cache_ttl,
+            "keepalive_timeout": self.settings.upstream_keepalive_timeout,
+            "connections_in_use": in_use,
+            "connections_idle": idle,
+            "requests_total": self.requests_total,
+            "sessions_created": self.sessions_created,
+        }
+
+
+# Global upstream client instance
+_upstream_client: Optional[UpstreamClient] = None
+
+
+def get_upstream_client() -> UpstreamClient:
+    """Get or create the shared upstream client"""
+    global _upstream_client
+    if _upstream_client is None:
+        _upstream_client = UpstreamClient(get_settings())
+    return _upstream_client
+
+
+async def close_upstream_client() -> None:
+    """Close the shared upstream client if it was created"""
+    global _upstream_client
+    if _upstream_client is not None:
+        await _upstream_client.close()
+        _upstream_client = None
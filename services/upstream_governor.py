@@ -0,0 +1,323 @@
+"""
+Concurrency governor for upstream LLM calls (token buckets, wait queue, backoff)
+"""
+import asyncio
+from collections import OrderedDict
+import logging
+import random
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+from dependencies.config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the number of per-user buckets kept in memory
+MAX_USER_BUCKETS = 10000
+
+
+class GovernorQueueFull(Exception):
+    """Raised when the wait queue, or the caller's share of it, is full"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Upstream queue is full")
+        self.retry_after = retry_after
+
+
+class GovernorQueueTimeout(Exception):
+    """Raised when a request waited longer than the maximum queue time"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Timed out waiting for an upstream slot")
+        self.retry_after = retry_after
+
+
+class UpstreamRetryableError(Exception):
+    """Upstream answered with a retryable status (429/502/503)"""
+
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds (HTTP dates are ignored)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate`` tokens per second"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until one token is available (0 if available now)"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        """Consume one token (call only after wait_time() returned 0)"""
+        self._refill()
+        self.tokens -= 1
+
+
+class GovernorTicket:
+    """A request's place in the governor queue"""
+
+    def __init__(self, governor: "UpstreamGovernor", user_key: str):
+        self.governor = governor
+        self.user_key = user_key
+        self.enqueued_at = time.monotonic()
+        self.position = 0  # 1-based place in the queue, kept current by the governor
+        self.acquired = False
+        self.released = False
+
+    async def wait(self) -> AsyncIterator[int]:
+        """
+        Wait for an upstream slot
+
+        Yields:
+            int: Queue position (1-based) whenever it changes while waiting
+        """
+        async for position in self.governor._wait_turn(self):
+            yield position
+
+    def release(self) -> None:
+        """Give the slot (or the queue place) back"""
+        if not self.released:
+            self.released = True
+            self.governor._release(self)
+
+
+class UpstreamGovernor:
+    """
+    Gate all upstream LLM calls made by this worker.
+
+    Requests wait in a bounded queue. While a concurrency slot is free and the
+    global token bucket has a token, the first queued request whose user
+    bucket also has one is admitted, so a user over their rate waits without
+    holding up the others. Each user may hold at most ``max_queue_per_user``
+    places. Waiting longer than ``max_queue_time`` fails with
+    GovernorQueueTimeout.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.max_concurrent = settings.governor_max_concurrent
+        self.max_queue = settings.governor_max_queue
+        self.max_queue_per_user = settings.governor_max_queue_per_user
+        self.max_queue_time = settings.governor_max_queue_time
+        self.global_bucket = TokenBucket(settings.governor_global_rpm / 60.0, settings.governor_global_burst)
+        self._user_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        # Queued tickets in arrival order (a dict removes any ticket in O(1))
+        self._queue: "OrderedDict[GovernorTicket, None]" = OrderedDict()
+        self._queued_per_user: Dict[str, int] = {}
+        self._changed = asyncio.Event()
+        self._refill_timer: Optional[asyncio.TimerHandle] = None
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.retries = 0
+
+    def enqueue(self, user_key: str) -> GovernorTicket:
+        """Join the wait queue (raises GovernorQueueFull when it, or the user's share, is full)"""
+        if len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            raise GovernorQueueFull(retry_after=self._estimated_wait())
+        if self._queued_per_user.get(user_key, 0) >= self.max_queue_per_user:
+            self.rejected += 1
+            raise GovernorQueueFull(retry_after=max(self._estimated_wait(), self._user_bucket(user_key).wait_time()))
+        ticket = GovernorTicket(self, user_key)
+        self._queue[ticket] = None
+        self._queued_per_user[user_key] = self._queued_per_user.get(user_key, 0) + 1
+        self._schedule()
+        self._notify()
+        return ticket
+
+    async def run(self, user_key: str):
+        """Wait for a slot without reporting queue positions (for non-streaming calls)"""
+        ticket = self.enqueue(user_key)
+        try:
+            async for _ in ticket.wait():
+                pass
+        except BaseException:
+            ticket.release()
+            raise
+        return ticket
+
+    def try_acquire(self, user_key: str) -> Optional[GovernorTicket]:
+        """Take a slot only if one is free right now (for optional calls that must not queue)"""
+        if self._queue or self.active >= self.max_concurrent:
+            return None
+        user_bucket = self._user_bucket(user_key)
+        if self.global_bucket.wait_time() > 0 or user_bucket.wait_time() > 0:
+            return None
+        self.global_bucket.take()
+        user_bucket.take()
+        ticket = GovernorTicket(self, user_key)
+        ticket.acquired = True
+        self.active += 1
+        self.admitted += 1
+        return ticket
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Delay before retry ``attempt`` (0-based); honors Retry-After when given"""
+        self.retries += 1
+        if retry_after is not None:
+            return min(retry_after, self.settings.governor_backoff_max)
+        delay = self.settings.governor_backoff_base * (2 ** attempt)
+        # Full jitter spreads retries from concurrent requests
+        return random.uniform(0, min(delay, self.settings.governor_backoff_max))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get governor counters"""
+        self.global_bucket._refill()
+        return {
+            "active": self.active,
+            "queued": len(self._queue),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "max_queue_per_user": self.max_queue_per_user,
+            "queued_users": len(self._queued_per_user),
+            "global_tokens": round(self.global_bucket.tokens, 2),
+            "tracked_users": len(self._user_buckets),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "retries": self.retries,
+        }
+
+    def _user_bucket(self, user_key: str) -> TokenBucket:
+        bucket = self._user_buckets.get(user_key)
+        if bucket is None:
+            bucket = TokenBucket(self.settings.governor_user_rpm / 60.0, self.settings.governor_user_burst)
+            self._user_buckets[user_key] = bucket
+            while len(self._user_buckets) > MAX_USER_BUCKETS:
+                self._user_buckets.popitem(last=False)
+        else:
+            self._user_buckets.move_to_end(user_key)
+        return bucket
+
+    def _estimated_wait(self) -> float:
+        return max(1.0, self.global_bucket.wait_time())
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _dequeue(self, ticket: GovernorTicket) -> None:
+        del self._queue[ticket]
+        count = self._queued_per_user[ticket.user_key] - 1
+        if count:
+            self._queued_per_user[ticket.user_key] = count
+        else:
+            del self._queued_per_user[ticket.user_key]
+
+    def _schedule(self) -> None:
+        """
+        Admit queued tickets while slots and global tokens last, then renumber the rest
+
+        One pass over the queue per change (enqueue, release, token refill) rather
+        than one per waiter; waiters read their ``position`` and ``acquired``.
+        """
+        if self._refill_timer is not None:
+            self._refill_timer.cancel()
+            self._refill_timer = None
+        refill: Optional[float] = None
+        position = 0
+        for ticket in list(self._queue):
+            if self.active < self.max_concurrent:
+                global_wait = self.global_bucket.wait_time()
+                if global_wait > 0:
+                    refill = global_wait if refill is None else min(refill, global_wait)
+                else:
+                    user_bucket = self._user_bucket(ticket.user_key)
+                    user_wait = user_bucket.wait_time()
+                    if user_wait == 0:
+                        self.global_bucket.take()
+                        user_bucket.take()
+                        self._dequeue(ticket)
+                        ticket.acquired = True
+                        self.active += 1
+                        self.admitted += 1
+                        continue
+                    # Over their rate: skip this ticket, later users may still go
+                    refill = user_wait if refill is None else min(refill, user_wait)
+            position += 1
+            ticket.position = position
+
+        if refill is not None and refill != float("inf") and self._queue:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._refill_timer = loop.call_later(refill, self._on_refill)
+
+    def _on_refill(self) -> None:
+        self._refill_timer = None
+        self._schedule()
+        self._notify()
+
+    async def _wait_turn(self, ticket: GovernorTicket) -> AsyncIterator[int]:
+        deadline = ticket.enqueued_at + self.max_queue_time
+        last_position = 0
+        while True:
+            # Taken before yielding, so a change while the caller handles a position is not missed
+            changed = self._changed
+            if ticket.acquired:
+                return
+            if ticket.position != last_position:
+                last_position = ticket.position
+                yield ticket.position
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.timeouts += 1
+                ticket.release()
+                raise GovernorQueueTimeout(retry_after=self._estimated_wait())
+
+            # Sleep until a release, an admission or a token refill, or the deadline
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    def _release(self, ticket: GovernorTicket) -> None:
+        if ticket.acquired:
+            self.active -= 1
+        elif ticket in self._queue:
+            self._dequeue(ticket)
+        self._schedule()
+        self._notify()
+
+
+# Global governor instance
+_upstream_governor: Optional[UpstreamGovernor] = None
+
+
+def get_upstream_governor(settings: Optional[Settings] = None) -> UpstreamGovernor:
+    """Get or create the shared upstream governor"""
+    global _upstream_governor
+    if _upstream_governor is None:
+        _upstream_governor = UpstreamGovernor(settings or get_settings())
+    return _upstream_governor
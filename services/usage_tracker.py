@@ -0,0 +1,225 @@
+"""
+Token usage and cost accounting for upstream LLM calls
+"""
+import asyncio
+from collections import deque
+from datetime import UTC, datetime, timedelta
+import logging
+from typing import Any, Deque, Dict, List, Optional
+
+from sqlalchemy import case, func
+from sqlalchemy.exc import DatabaseError, OperationalError
+from sqlmodel import select
+
+from dependencies.config import Settings, get_settings
+from models import LLMUsage
+
+logger = logging.getLogger(__name__)
+
+# Columns usage can be grouped by
+GROUP_BY = ("user", "model", "day")
+
+
+class UsageRecorder:
+    """
+    Append-only log of upstream LLM calls (tokens, latency, cost) in the llm_usage table.
+
+    ``record`` only appends to an in-memory buffer, so request handling never
+    waits on the database. A background writer inserts the buffer in one
+    transaction every ``usage_flush_interval`` seconds, or sooner once
+    ``usage_batch_size`` records are waiting; ``stop`` writes what is left.
+    When the buffer holds ``usage_buffer_size`` records (database down),
+    new records are dropped and counted.
+    """
+
+    def __init__(self, settings: Settings, session_factory=None):
+        self.flush_interval = settings.usage_flush_interval
+        self.batch_size = max(1, settings.usage_batch_size)
+        self._session_factory = session_factory
+        self._buffer: Deque[LLMUsage] = deque()
+        self._buffer_size = settings.usage_buffer_size
+        self._wakeup = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.db_errors = 0
+
+    def _sessions(self):
+        if self._session_factory is None:
+            from db import AsyncSessionLocal
+            self._session_factory = AsyncSessionLocal
+        return self._session_factory
+
+    def record(
+        self,
+        user_key: str,
+        backend: str,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        latency: float,
+        status: str = "ok",
+        streamed: bool = False,
+        estimated: bool = False,
+        cost: Optional[float] = None,
+    ) -> None:
+        """
+        Queue one usage record (never blocks)
+
+        Args:
+            latency: Seconds from sending the request to the last token
+            status: ``ok``, ``cancelled`` (client went away) or ``truncated`` (server-side cap)
+            estimated: Token counts are local estimates because the upstream sent no usage
+            cost: USD, reported by the upstream or priced from the backend's configuration
+        """
+        if len(self._buffer) >= self._buffer_size:
+            self.dropped += 1
+            return
+        self._buffer.append(LLMUsage(
+            user_key=user_key[:100],
+            backend=backend,
+            model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            latency_ms=round(latency * 1000),
+            status=status,
+            streamed=streamed,
+            estimated=estimated,
+            cost=cost,
+        ))
+        self.recorded += 1
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        """Start the background writer (idempotent)"""
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_loop(), name="llm-usage-writer")
+
+    async def stop(self) -> None:
+        """Stop the writer and write the remaining records"""
+        if self._writer is not None:
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+        while self._buffer and await self.flush():
+            pass
+
+    async def flush(self) -> int:
+        """Write up to ``usage_batch_size`` buffered records and return how many were written"""
+        batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+        if not batch:
+            return 0
+        try:
+            async with self._sessions()() as session:
+                session.add_all(batch)
+                await session.commit()
+        except (OperationalError, DatabaseError) as e:
+            self.db_errors += 1
+            logger.warning(f"Writing {len(batch)} usage records failed, keeping them for the next flush: {e}")
+            self._buffer.extendleft(reversed(batch))
+            while len(self._buffer) > self._buffer_size:
+                # The oldest records go first
+                self._buffer.popleft()
+                self.dropped += 1
+            return 0
+        self.written += len(batch)
+        self.flushes += 1
+        return len(batch)
+
+    async def _write_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._buffer and await self.flush() == self.batch_size:
+                pass
+
+    async def summarize(
+        self,
+        group_by: str = "user",
+        days: int = 7,
+        user_key: Optional[str] = None,
+        model: Optional[str] = None,
+        limit: int = 50,
+    ) -> List[Dict[str, Any]]:
+        """
+        Aggregate usage per user, model or day over the last ``days`` days
+
+        Returns:
+            list: Rows with ``key``, ``requests``, ``prompt_tokens``, ``completion_tokens``,
+                ``total_tokens``, ``avg_latency_ms``, ``cost`` and ``estimated`` (records
+                with estimated counts); users and models by total tokens, days in date order
+        """
+        if group_by not in GROUP_BY:
+            raise ValueError(f"group_by must be one of {', '.join(GROUP_BY)}")
+        key = {
+            "user": LLMUsage.user_key,
+            "model": LLMUsage.model,
+            "day": func.date(LLMUsage.created_at),
+        }[group_by]
+        total_tokens = func.sum(LLMUsage.prompt_tokens + LLMUsage.completion_tokens)
+        query = (
+            select(
+                key.label("key"),
+                func.count().label("requests"),
+                func.sum(LLMUsage.prompt_tokens).label("prompt_tokens"),
+                func.sum(LLMUsage.completion_tokens).label("completion_tokens"),
+                total_tokens.label("total_tokens"),
+                func.avg(LLMUsage.latency_ms).label("avg_latency_ms"),
+                func.sum(LLMUsage.cost).label("cost"),
+                func.sum(case((LLMUsage.estimated, 1), else_=0)).label("estimated"),
+            )
+            .where(LLMUsage.created_at >= datetime.now(UTC) - timedelta(days=days))
+            .group_by(key)
+            .order_by(key if group_by == "day" else total_tokens.desc())
+            .limit(limit)
+        )
+        if user_key:
+            query = query.where(LLMUsage.user_key == user_key)
+        if model:
+            query = query.where(LLMUsage.model == model)
+
+        async with self._sessions()() as session:
+            rows = (await session.execute(query)).all()
+        return [
+            {
+                "key": str(row.key),
+                "requests": row.requests,
+                "prompt_tokens": row.prompt_tokens or 0,
+                "completion_tokens": row.completion_tokens or 0,
+                "total_tokens": row.total_tokens or 0,
+                "avg_latency_ms": round(row.avg_latency_ms or 0),
+                "cost": round(row.cost, 6) if row.cost is not None else None,
+                "estimated": row.estimated or 0,
+            }
+            for row in rows
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get recorder counters"""
+        return {
+            "running": self._writer is not None,
+            "buffered": len(self._buffer),
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "db_errors": self.db_errors,
+        }
+
+
+# Global usage recorder instance
+_usage_recorder: Optional[UsageRecorder] = None
+
+
+def get_usage_recorder(settings: Optional[Settings] = None) -> UsageRecorder:
+    """Get or create the shared usage recorder"""
+    global _usage_recorder
+    if _usage_recorder is None:
+        _usage_recorder = UsageRecorder(settings or get_settings())
+    return _usage_recorder
@@ -0,0 +1,314 @@
+"""
+In-process vector index (NumPy) with a local hashing embedder, for retrieval over project data
+"""
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import zlib
+
+from services.semantic_cache import prompt_features
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Index modes: exact scan over every row, or inverted file (k-means lists, probe the closest)
+MODES = ("flat", "ivf", "auto")
+
+# k-means iterations and training sample size for the IVF lists
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 50000
+
+
+class HashingEmbedder:
+    """
+    Local stand-in for an embedding model: TF-IDF over hashed word and character 3-gram features.
+
+    Features are hashed into ``dim`` signed buckets (the sign halves the bias of
+    collisions) and weighted by sublinear term frequency times the IDF fitted on
+    the corpus at build time, then L2-normalized. The IDF stays fixed between
+    builds so vectors of rows embedded later remain comparable. Queries ignore
+    buckets no document has used, so words like "sell" in "which keyboard do
+    you sell?" do not dilute the words that can match.
+    """
+
+    def __init__(self, dim: int = 384, idf: Optional["np.ndarray"] = None, seen: Optional["np.ndarray"] = None):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("The vector index needs NumPy (pip install numpy)")
+        self.dim = dim
+        self.idf = idf if idf is not None else np.ones(dim, dtype=np.float32)
+        self.seen = seen if seen is not None else np.ones(dim, dtype=bool)
+
+    def _counts(self, text: str) -> Tuple["np.ndarray", "np.ndarray"]:
+        counts = np.zeros(self.dim, dtype=np.float32)
+        signs = np.zeros(self.dim, dtype=np.float32)
+        for feature in prompt_features(text):
+            digest = zlib.crc32(feature.encode("utf-8"))
+            bucket = digest % self.dim
+            counts[bucket] += 1.0
+            signs[bucket] += 1.0 if digest & 0x80000000 else -1.0
+        return counts, np.where(signs < 0, -1.0, 1.0).astype(np.float32)
+
+    def fit(self, texts: Sequence[str]) -> "HashingEmbedder":
+        """Fit the IDF weights on a corpus"""
+        df = np.zeros(self.dim, dtype=np.float64)
+        for text in texts:
+            df += self._counts(text)[0] > 0
+        self.idf = (np.log((1.0 + len(texts)) / (1.0 + df)) + 1.0).astype(np.float32)
+        self.seen = df > 0
+        return self
+
+    def embed(self, texts: Sequence[str], query: bool = False) -> "np.ndarray":
+        """
+        Embed texts as rows of an L2-normalized ``len(texts) x dim`` float32 matrix
+
+        Args:
+            texts: Documents to index, or a query
+            query: Leave out buckets no document has used (documents mark theirs as used)
+        """
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            counts, signs = self._counts(text)
+            present = counts > 0
+            if query:
+                present &= self.seen
+            else:
+                self.seen |= present
+            vectors[i, present] = (1.0 + np.log(counts[present])) * self.idf[present] * signs[present]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class VectorIndex:
+    """
+    Cosine top-k search over normalized vectors keyed by string ids.
+
+    Rows live in one contiguous float32 matrix that grows by doubling; removed
+    rows are swapped with the last one, so the matrix stays dense. In ``flat``
+    mode a query scores every row (one matrix-vector product). In ``ivf`` mode
+    rows are assigned to ``n_lists`` k-means centroids and a query only scores
+    the rows of the ``n_probe`` closest lists, trading a little recall for
+    speed on large catalogs; ``auto`` switches to IVF once the index holds
+    ``ivf_min_rows`` rows. Rows added after training join their nearest list,
+    and the lists are retrained once the index has doubled.
+
+    ``save`` writes ``.npy`` files that ``load`` memory-maps, so a restarted
+    worker serves queries without reading the whole index into memory; the
+    first change copies it back into memory.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        mode: str = "auto",
+        ivf_min_rows: int = 20000,
+        n_lists: int = 0,
+        n_probe: int = 8,
+    ):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("The vector index needs NumPy (pip install numpy)")
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        self.dim = dim
+        self.mode = mode
+        self.ivf_min_rows = ivf_min_rows
+        self.n_lists = n_lists
+        self.n_probe = max(1, n_probe)
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._lists = np.zeros(0, dtype=np.int32)
+        self._centroids: Optional["np.ndarray"] = None
+        self._trained_rows = 0
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._mapped = False
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._rows
+
+    @property
+    def is_ivf(self) -> bool:
+        return self._centroids is not None
+
+    def _writable(self, rows: int) -> None:
+        """Make room for ``rows`` rows in writable (not memory-mapped) arrays"""
+        capacity = self._vectors.shape[0]
+        if rows <= capacity and not self._mapped:
+            return
+        size = len(self._ids)
+        capacity = max(rows, 2 * capacity, 64) if rows > capacity else capacity
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:size] = self._vectors[:size]
+        lists = np.zeros(capacity, dtype=np.int32)
+        lists[:size] = self._lists[:size]
+        if self._centroids is not None:
+            self._centroids = np.array(self._centroids)
+        self._vectors, self._lists, self._mapped = vectors, lists, False
+
+    def _nearest_list(self, vectors: "np.ndarray") -> "np.ndarray":
+        return np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+
+    def add(self, ids: Sequence[str], vectors: "np.ndarray") -> None:
+        """Insert or replace rows (vectors must be L2-normalized)"""
+        if not len(ids):
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dim)
+        self._writable(len(self._ids) + len(ids))
+        lists = self._nearest_list(vectors) if self._centroids is not None else None
+        for i, item_id in enumerate(ids):
+            row = self._rows.get(item_id)
+            if row is None:
+                row = len(self._ids)
+                self._ids.append(item_id)
+                self._rows[item_id] = row
+            self._vectors[row] = vectors[i]
+            if lists is not None:
+                self._lists[row] = lists[i]
+        self._maybe_train()
+
+    def remove(self, ids: Sequence[str]) -> int:
+        """Remove rows by id and return how many existed"""
+        removed = 0
+        for item_id in ids:
+            row = self._rows.pop(item_id, None)
+            if row is None:
+                continue
+            self._writable(len(self._ids))
+            last = len(self._ids) - 1
+            if row != last:
+                moved = self._ids[last]
+                self._vectors[row] = self._vectors[last]
+                self._lists[row] = self._lists[last]
+                self._ids[row] = moved
+                self._rows[moved] = row
+            self._ids.pop()
+            removed += 1
+        return removed
+
+    def _maybe_train(self) -> None:
+        size = len(self._ids)
+        if self.mode == "flat" or (self.mode == "auto" and size < self.ivf_min_rows):
+            return
+        if self._centroids is None or size >= 2 * self._trained_rows:
+            self.train()
+
+    def train(self, seed: int = 0) -> None:
+        """(Re)build the IVF lists with spherical k-means over (a sample of) the rows"""
+        size = len(self._ids)
+        if size == 0:
+            return
+        n_lists = self.n_lists or max(1, int(np.sqrt(size)))
+        n_lists = min(n_lists, size)
+        rng = np.random.default_rng(seed)
+        vectors = self._vectors[:size]
+        sample = vectors if size <= KMEANS_SAMPLE else vectors[rng.choice(size, KMEANS_SAMPLE, replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            assigned = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assigned, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty lists keep their previous centroid
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+        self._writable(size)
+        self._centroids = centroids.astype(np.float32)
+        self._lists[:size] = self._nearest_list(self._vectors[:size])
+        self._trained_rows = size
+
+    def search(self, vector: "np.ndarray", k: int = 4) -> List[Tuple[str, float]]:
+        """
+        Find the rows most similar to a normalized query vector
+
+        Returns:
+            list: Up to ``k`` ``(id, cosine similarity)`` pairs, best first
+        """
+        size = len(self._ids)
+        if size == 0 or k <= 0:
+            return []
+        vector = np.asarray(vector, dtype=np.float32).reshape(self.dim)
+        if self._centroids is not None:
+            probed = np.zeros(self._centroids.shape[0], dtype=bool)
+            probed[np.argsort(self._centroids @ vector)[-self.n_probe:]] = True
+            rows = np.flatnonzero(probed[self._lists[:size]])
+            scores = self._vectors[rows] @ vector
+        else:
+            rows = None
+            scores = self._vectors[:size] @ vector
+        k = min(k, scores.shape[0])
+        if k == 0:
+            return []
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [
+            (self._ids[int(rows[i]) if rows is not None else int(i)], float(scores[i]))
+            for i in top
+        ]
+
+    def save(self, path: str) -> None:
+        """Write the index to a directory (each file is replaced atomically)"""
+        directory = Path(path)
+        directory.mkdir(parents=True, exist_ok=True)
+        size = len(self._ids)
+        arrays = {"vectors": self._vectors[:size], "lists": self._lists[:size]}
+        if self._centroids is not None:
+            arrays["centroids"] = self._centroids
+        for name, array in arrays.items():
+            temporary = directory / f"{name}.tmp.npy"
+            np.save(temporary, array)
+            os.replace(temporary, directory / f"{name}.npy")
+        meta = {
+            "dim": self.dim,
+            "mode": self.mode,
+            "ivf_min_rows": self.ivf_min_rows,
+            "n_lists": self.n_lists,
+            "n_probe": self.n_probe,
+            "trained_rows": self._trained_rows,
+            "ids": self._ids,
+        }
+        temporary = directory / "index.tmp.json"
+        temporary.write_text(json.dumps(meta))
+        os.replace(temporary, directory / "index.json")
+        if self._centroids is None:
+            (directory / "centroids.npy").unlink(missing_ok=True)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "VectorIndex":
+        """Open an index written by ``save`` (memory-mapped unless ``mmap`` is False)"""
+        directory = Path(path)
+        meta = json.loads((directory / "index.json").read_text())
+        index = cls(
+            meta["dim"], meta["mode"], meta["ivf_min_rows"], meta["n_lists"], meta["n_probe"]
+        )
+        mmap_mode = "r" if mmap else None
+        index._vectors = np.load(directory / "vectors.npy", mmap_mode=mmap_mode)
+        index._lists = np.load(directory / "lists.npy", mmap_mode=mmap_mode)
+        if (directory / "centroids.npy").exists():
+            index._centroids = np.load(directory / "centroids.npy", mmap_mode=mmap_mode)
+        index._trained_rows = meta["trained_rows"]
+        index._ids = list(meta["ids"])
+        index._rows = {item_id: row for row, item_id in enumerate(index._ids)}
+        if len(index._ids) != index._vectors.shape[0]:
+            raise ValueError(f"Index at {path} is inconsistent: {len(index._ids)} ids, {index._vectors.shape[0]} rows")
+        index._mapped = mmap
+        return index
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get index size and layout"""
+        return {
+            "rows": len(self._ids),
+            "dim": self.dim,
+            "mode": "ivf" if self._centroids is not None else "flat",
+            "lists": int(self._centroids.shape[0]) if self._centroids is not None else 0,
+            "probe": self.n_probe,
+            "memory_mapped": self._mapped,
+            "bytes": int(self._vectors[:len(self._ids)].nbytes),
+        }
@@ -13,6 +13,7 @@ from core.services.storage import get_storage
 from db import AsyncSessionLocal
 from dependencies.database_health import get_fallback_attendees, get_fallback_registrants
 from models import WebinarRegistrants
+from services.query_cache import cached_query
 
 
 class WebinarService:
@@ -21,7 +22,7 @@ class WebinarService:
     @staticmethod
     async def get_all_registrants():
         """Get all webinar registrants with their photos, with graceful database failure handling"""
-        try:
+        async def load():
             async with AsyncSessionLocal() as session:
                 result = await session.execute(select(WebinarRegistrants))
                 registrants = result.scalars().all()
@@ -41,6 +42,10 @@ class WebinarService:
                     }
                     for registrant in registrants
                 ]
+
+        try:
+            # Read through the query cache: entries are dropped when registrants are written
+            return await cached_query("webinar.registrants", [WebinarRegistrants.__tablename__], load)
         except (OperationalError, DatabaseError, Exception) as e:
             print(f"Database error in WebinarService.get_all_registrants: {e}")
             return get_fallback_registrants()
@@ -48,7 +53,7 @@ class WebinarService:
     @staticmethod
     async def get_webinar_attendees():
         """Get webinar attendees for the marketing demo page, with graceful database failure handling"""
-        try:
+        async def load():
             async with AsyncSessionLocal() as session:
                 result = await session.execute(select(WebinarRegistrants))
                 registrants = result.scalars().all()
@@ -69,6 +74,10 @@ class WebinarService:
                     }
                     for registrant in registrants
                 ]
+
+        try:
+            # Read through the query cache: entries are dropped when registrants are written
+            return await cached_query("webinar.attendees", [WebinarRegistrants.__tablename__], load)
         except (OperationalError, DatabaseError, Exception) as e:
             print(f"Database error in WebinarService.get_webinar_attendees: {e}")
             return get_fallback_attendees()
@@ -102,7 +102,7 @@ class MockProductService:
         self.session = session
         self.settings = settings
 
-    async def get_products_with_stats(self):
+    async def get_products_with_stats(self, **kwargs):
         """Mock implementation of get_products_with_stats."""
         return {
             "products": [
@@ -160,7 +160,7 @@ class MockChatService:
     def __init__(self, settings: Settings):
         self.settings = settings
 
-    async def test_connection(self):
+    async def test_connection(self, probe: bool = False):
         """Mock implementation of test_connection."""
         return {
             "status": "success",
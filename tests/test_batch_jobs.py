@@ -0,0 +1,152 @@
+"""
+Tests for batch chat jobs
+"""
+import asyncio
+from datetime import UTC, datetime, timedelta
+import uuid
+
+from fastapi import HTTPException
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel, select
+
+from dependencies.config import Settings
+from models import ChatBatchItem, ChatBatchJob
+from services.batch_jobs import BatchJobManager
+
+
+@pytest.fixture
+async def session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'batch.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    yield async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    await engine.dispose()
+
+
+class FakeChatService:
+    """Answers prompts locally; can fail or throttle specific prompts"""
+
+    def __init__(self, throttle_once=(), unavailable=False):
+        self.calls = []
+        self.throttle_once = set(throttle_once)
+        self.unavailable = unavailable
+
+    async def complete(self, user_message, user_key="anonymous", history=None):
+        self.calls.append((user_message, user_key))
+        if user_message == "bad":
+            raise HTTPException(status_code=400, detail="Bad request")
+        if user_message in self.throttle_once:
+            self.throttle_once.discard(user_message)
+            raise HTTPException(status_code=429, detail="Slow down", headers={"Retry-After": "0"})
+        if self.unavailable:
+            raise HTTPException(status_code=503, detail="Circuit open", headers={"Retry-After": "0"})
+        return {"raw_response": f"answer: {user_message}", "model": "test-model"}
+
+
+def make_manager(session_factory, chat_service, **overrides) -> BatchJobManager:
+    values = {"batch_concurrency": 3}
+    values.update(overrides)
+    return BatchJobManager(Settings(**values), lambda: chat_service, session_factory)
+
+
+async def wait_finished(manager, job_id, owner):
+    updates = []
+    async for job in manager.watch(job_id, owner):
+        updates.append(job)
+    return updates
+
+
+class TestBatchJobs:
+    """Test job processing, paging and resume."""
+
+    async def test_job_runs_to_completion(self, session_factory):
+        chat = FakeChatService(throttle_once={"p3"})
+        manager = make_manager(session_factory, chat)
+        job = await manager.create_job("user:1", ["p0", "p1", "bad", "p3", "p4"])
+        await manager.start()
+        try:
+            updates = await asyncio.wait_for(wait_finished(manager, job["job_id"], "user:1"), 5)
+        finally:
+            await manager.stop()
+
+        final = updates[-1]
+        assert final["status"] == "completed"
+        assert (final["completed"], final["failed"], final["remaining"]) == (4, 1, 0)
+        assert all(user_key == "batch:user:1" for _, user_key in chat.calls)
+
+        first = await manager.get_items(job["job_id"], "user:1", limit=3)
+        assert [item["position"] for item in first["items"]] == [0, 1, 2]
+        assert first["items"][2]["status"] == "error"
+        rest = await manager.get_items(job["job_id"], "user:1", after=first["next_after"], limit=3)
+        assert [item["response"] for item in rest["items"]] == ["answer: p3", "answer: p4"]
+        assert rest["items"][0]["attempts"] == 1  # the throttled try was not counted
+        assert rest["next_after"] is None
+
+    async def test_requeues_are_capped_while_upstream_is_down(self, session_factory):
+        chat = FakeChatService(unavailable=True)
+        manager = make_manager(session_factory, chat, batch_max_requeues=2)
+        job = await manager.create_job("user:1", ["p0"])
+        await manager.start()
+        try:
+            updates = await asyncio.wait_for(wait_finished(manager, job["job_id"], "user:1"), 5)
+        finally:
+            await manager.stop()
+
+        assert (updates[-1]["status"], updates[-1]["failed"]) == ("completed", 1)
+        assert len(chat.calls) == 3
+        item = (await manager.get_items(job["job_id"], "user:1"))["items"][0]
+        assert item["error"] == "Upstream unavailable after 2 retries: Circuit open"
+
+    async def test_other_owners_cannot_see_jobs(self, session_factory):
+        manager = make_manager(session_factory, FakeChatService())
+        job = await manager.create_job("user:1", ["hello"])
+        assert await manager.get_job(job["job_id"], "user:2") is None
+        assert await manager.cancel_job(job["job_id"], "user:2") is None
+        assert (await manager.cancel_job(job["job_id"], "user:1"))["status"] == "cancelled"
+
+    async def test_watchers_leave_no_events_behind(self, session_factory):
+        manager = make_manager(session_factory, FakeChatService())
+        job = await manager.create_job("user:1", ["hello"])
+        assert await wait_finished(manager, str(uuid.uuid4()), "user:1") == []
+        assert await wait_finished(manager, job["job_id"], "user:2") == []
+        assert manager._job_events == {}
+
+        # A watcher that stops early forgets its event too
+        watcher = manager.watch(job["job_id"], "user:1")
+        assert (await anext(watcher))["job_id"] == job["job_id"]
+        await watcher.aclose()
+        await manager.cancel_job(job["job_id"], "user:1")
+        assert [update["status"] for update in await wait_finished(manager, job["job_id"], "user:1")] == ["cancelled"]
+        assert manager._job_events == {}
+
+    async def test_invalid_prompts_are_rejected(self, session_factory):
+        manager = make_manager(session_factory, FakeChatService(), batch_max_prompts=2)
+        for prompts in ([], ["ok", ""], ["a", "b", "c"], "not a list"):
+            with pytest.raises(HTTPException) as exc_info:
+                await manager.create_job("user:1", prompts)
+            assert exc_info.value.status_code == 400
+
+    async def test_unfinished_items_resume_after_restart(self, session_factory):
+        # A previous process claimed an item and died before finishing it
+        crashed = make_manager(session_factory, FakeChatService())
+        job = await crashed.create_job("user:1", ["p0", "p1"])
+        async with session_factory() as session:
+            item = (await session.execute(select(ChatBatchItem).where(ChatBatchItem.position == 0))).scalar_one()
+            item.status = "running"
+            item.attempts = 1
+            item.updated_at = datetime.now(UTC) - timedelta(hours=1)
+            (await session.get(ChatBatchJob, item.job_id)).status = "running"
+            await session.commit()
+
+        chat = FakeChatService()
+        manager = make_manager(session_factory, chat, batch_item_lease=60)
+        await manager.start()
+        try:
+            updates = await asyncio.wait_for(wait_finished(manager, job["job_id"], "user:1"), 5)
+        finally:
+            await manager.stop()
+
+        assert updates[-1]["completed"] == 2
+        assert sorted(prompt for prompt, _ in chat.calls) == ["p0", "p1"]
+        assert manager.get_stats()["items_reclaimed"] == 1
@@ -0,0 +1,138 @@
+"""
+Tests for streaming one prompt from several models at once
+"""
+from aiohttp.test_utils import TestServer
+from fastapi import HTTPException
+import pytest
+
+from dependencies.config import Settings
+from scripts.mock_llm import STATS_KEY, MockUpstreamConfig, create_app
+from services.chat_service import ChatService, stream_event_name
+from services.conversation_store import ConversationStore
+from services.llm_providers import ProviderRouter, build_backends
+from services.upstream_client import UpstreamClient
+from services.upstream_governor import UpstreamGovernor
+
+
+@pytest.fixture
+async def upstream(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "mock")
+    server = TestServer(create_app(MockUpstreamConfig(tokens_per_second=200, ttft=0, jitter=0)))
+    await server.start_server()
+    yield server
+    await server.close()
+
+
+def _service(settings: Settings) -> ChatService:
+    return ChatService(
+        settings=settings,
+        http_client=UpstreamClient(settings),
+        conversations=ConversationStore(persist=False),
+        providers=ProviderRouter(build_backends(settings)),
+    )
+
+
+class TestCompareStream:
+    """Test fan-out, per-model results and the per-request concurrency cap."""
+
+    async def test_models_stream_side_by_side(self, upstream):
+        settings = Settings(
+            llm_base_url=str(upstream.make_url("/v1")),
+            response_cache_enabled=False,
+            usage_tracking_enabled=False,
+            compare_concurrency=2,
+        )
+        service = _service(settings)
+        active = 0
+        peak = 0
+        attempt_stream = service._attempt_stream
+
+        async def counting(*args, **kwargs):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            try:
+                async for content in attempt_stream(*args, **kwargs):
+                    yield content
+            finally:
+                active -= 1
+
+        service._attempt_stream = counting
+        models = ["model-a", "model-b", "model-c"]
+        try:
+            chunks = [chunk async for chunk in service.compare_stream("what is fastapi?", models)]
+        finally:
+            await service.http_client.close()
+
+        assert chunks[0] == {"models": models}
+        assert stream_event_name(chunks[-1]) == "summary"
+        summary = chunks[-1]["summary"]
+        assert [result["model"] for result in summary] == models
+        for result in summary:
+            assert result["status"] == "ok"
+            assert 0 <= result["queued_ms"] <= result["ttft_ms"] <= result["total_ms"]
+            text = "".join(chunk.get("raw_delta", "") for chunk in chunks if chunk.get("model") == result["model"])
+            assert len(text) == result["chars"] > 0
+        assert peak == 2
+        assert upstream.app[STATS_KEY]["streams"] == 3
+
+    async def test_failed_model_does_not_end_the_comparison(self, upstream):
+        settings = Settings(
+            llm_base_url=str(upstream.make_url("/v1")),
+            response_cache_enabled=False,
+            usage_tracking_enabled=False,
+            governor_max_retries=0,
+        )
+        service = _service(settings)
+        open_stream = service._open_stream
+
+        async def failing(stack, backend, payload):
+            if backend.model == "broken":
+                raise HTTPException(status_code=502, detail="Upstream error")
+            return await open_stream(stack, backend, payload)
+
+        service._open_stream = failing
+        try:
+            chunks = [chunk async for chunk in service.compare_stream("hello", ["broken", "model-a"])]
+        finally:
+            await service.http_client.close()
+
+        broken, working = chunks[-1]["summary"]
+        assert broken["status"] == "error" and broken["ttft_ms"] is None
+        assert working["status"] == "ok" and working["chars"] > 0
+
+    async def test_disconnect_while_queued_releases_queue_places(self, monkeypatch):
+        monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+        settings = Settings(governor_max_concurrent=1, compare_concurrency=2, usage_tracking_enabled=False)
+        governor = UpstreamGovernor(settings)
+        service = ChatService(
+            settings=settings,
+            conversations=ConversationStore(persist=False),
+            governor=governor,
+            providers=ProviderRouter(build_backends(settings)),
+        )
+        held = governor.try_acquire("someone else")
+        stream = service.compare_stream("hello", ["model-a", "model-b"])
+        queued = set()
+        async for chunk in stream:
+            if "queue_position" in chunk:
+                queued.add(chunk["model"])
+            if len(queued) == 2:
+                break
+        assert governor.get_stats()["queued"] == 2
+
+        await stream.aclose()
+        assert governor.get_stats()["queued"] == 0
+        held.release()
+        assert governor.get_stats()["active"] == 0
+
+    def test_invalid_requests(self):
+        settings = Settings(compare_models=["model-a", "model-b"])
+        service = _service(settings)
+        for message, models in (("", ["model-a", "model-b"]), ("hi", ["model-a", "model-a"]), ("hi", ["model-x"])):
+            with pytest.raises(HTTPException) as error:
+                service.compare_stream(message, models)
+            assert error.value.status_code == 400
+        with pytest.raises(HTTPException) as error:
+            service.compare_stream("hi", ["model-a", "model-x"])
+        assert "model-x" in error.value.detail
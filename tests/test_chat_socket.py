@@ -0,0 +1,188 @@
+"""
+Tests for the multiplexed WebSocket chat transport
+"""
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.middleware.sessions import SessionMiddleware
+
+from dependencies.config import Settings
+from dependencies.services import get_chat_service
+from routes.chat import ws_router
+from services.chat_service import ChatService
+from services.chat_socket import ChatSocketSession
+from services.conversation_store import ConversationStore
+from services.llm_providers import ProviderRouter, build_backends
+from services.stream_metrics import StreamMetrics
+
+
+class FakeChatService:
+    """Streams numbered tokens for a message; ``wait:`` messages never finish"""
+
+    def __init__(self, **overrides):
+        self.settings = Settings(**overrides)
+        self.stream_metrics = StreamMetrics()
+        self.produced = {}
+        self.calls = []
+
+    async def chat_with_llama_stream(self, user_message, snapshot=False, user_key="anonymous",
+                                     conversation_id=None, regenerate=False, rag=False, owner=None):
+        self.calls.append((user_message, regenerate))
+        yield {"conversation_id": conversation_id or "c1"}
+        count = 1000 if user_message.startswith("wait:") else 3
+        for index in range(count):
+            self.produced[user_message] = index + 1
+            yield {"raw_delta": f"{user_message}-{index}"}
+            await asyncio.sleep(0)
+
+
+class Client:
+    """Collects sent frames; clear ``reading`` to stop reading"""
+
+    def __init__(self):
+        self.frames = []
+        self.reading = asyncio.Event()
+        self.reading.set()
+        self.closed = None
+
+    async def send(self, frame):
+        await self.reading.wait()
+        self.frames.append(frame)
+
+    async def close(self, code, reason):
+        self.closed = code
+
+    def of(self, stream_id):
+        return [frame for frame in self.frames if frame.get("id") == stream_id]
+
+
+async def settle():
+    for _ in range(50):
+        await asyncio.sleep(0)
+
+
+class TestChatSocketSession:
+    """Test multiplexing, cancel frames and backpressure."""
+
+    async def test_streams_are_multiplexed_and_cancellable(self):
+        chat = FakeChatService()
+        client = Client()
+        session = ChatSocketSession(chat, "ip:test", client.send, client.close)
+        await session.start()
+        try:
+            await session.handle({"type": "chat", "id": "a", "message": "one"})
+            await session.handle({"type": "chat", "id": "b", "message": "wait:two"})
+            await session.handle({"type": "chat", "id": "b", "message": "again"})
+            await settle()
+            await session.handle({"type": "cancel", "id": "b"})
+            await session.handle({"type": "ping"})
+            await settle()
+        finally:
+            await session.close()
+
+        a_types = [frame["type"] for frame in client.of("a")]
+        assert a_types == ["conversation", "message", "message", "message", "complete"]
+        b_types = [frame["type"] for frame in client.of("b")]
+        assert b_types.count("error") == 1  # the duplicate id
+        assert b_types[-1] == "cancelled"
+        assert client.frames[-1] == {"type": "pong"}
+        stats = chat.stream_metrics.get_stats()
+        assert (stats["completed"], stats["cancelled"]) == (1, 1)
+
+    async def test_slow_reader_pauses_streams(self):
+        chat = FakeChatService(ws_send_queue_size=4, ws_send_timeout=0.2)
+        client = Client()
+        client.reading.clear()
+        session = ChatSocketSession(chat, "ip:test", client.send, client.close)
+        await session.start()
+        try:
+            await session.handle({"type": "chat", "id": "a", "message": "wait:slow"})
+            await settle()
+            # One frame in the blocked send plus the queued credits, not the whole answer
+            assert chat.produced["wait:slow"] <= 5
+            await asyncio.sleep(0.4)
+        finally:
+            await session.close()
+
+        assert client.closed == 1008
+        assert session.active_streams == 0
+
+    async def test_control_frame_flood_closes_the_socket(self):
+        chat = FakeChatService(ws_send_queue_size=4)
+        client = Client()
+        client.reading.clear()
+        session = ChatSocketSession(chat, "ip:test", client.send, client.close)
+        await session.start()
+        try:
+            for _ in range(100):
+                await session.handle({"type": "bogus"})
+            await settle()
+            assert session._outbox.qsize() <= 4
+        finally:
+            await session.close()
+
+        assert client.closed == 1008
+
+    async def test_stream_limit_per_connection(self):
+        chat = FakeChatService(ws_max_streams=1)
+        client = Client()
+        session = ChatSocketSession(chat, "ip:test", client.send, client.close)
+        await session.start()
+        try:
+            await session.handle({"type": "chat", "id": "a", "message": "wait:a"})
+            await session.handle({"type": "chat", "id": "b", "message": "b"})
+            await session.handle({"type": "regenerate", "id": "a", "conversation_id": "c1"})
+            await settle()
+        finally:
+            await session.close()
+
+        assert client.of("b")[0]["status_code"] == 429
+        assert "cancelled" in [frame["type"] for frame in client.of("a")]
+        assert chat.calls[-1] == ("", True)
+
+
+class TestRegenerate:
+    """Test regenerating the last answer of a conversation."""
+
+    async def test_regenerate_replaces_last_answer(self, monkeypatch):
+        monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+        settings = Settings(response_cache_enabled=False, stream_coalescing_enabled=False)
+        service = ChatService(
+            settings=settings,
+            conversations=ConversationStore(persist=False),
+            providers=ProviderRouter(build_backends(settings)),
+        )
+        conversation_id = await service.conversations.create("ip:test")
+        await service.conversations.append(conversation_id, "ip:test", "user", "tell me a story")
+        await service.conversations.append(conversation_id, "ip:test", "assistant", "old answer")
+
+        async def fake_stream(payload, cache_key, tried, avoid=None, ticket=None, user_key="anonymous"):
+            assert payload["messages"][-1] == {"role": "user", "content": "tell me a story"}
+            yield "new answer"
+
+        monkeypatch.setattr(service, "_attempt_stream", fake_stream)
+        chunks = [chunk async for chunk in service.chat_with_llama_stream(
+            "", user_key="ip:test", conversation_id=conversation_id, regenerate=True
+        )]
+
+        assert chunks[0] == {"conversation_id": conversation_id}
+        history = await service.conversations.get_history(conversation_id, "ip:test")
+        assert [m["content"] for m in history] == ["tell me a story", "new answer"]
+
+    def test_websocket_route(self):
+        chat = FakeChatService()
+        app = FastAPI()
+        app.add_middleware(SessionMiddleware, secret_key="test")
+        app.include_router(ws_router)
+        app.dependency_overrides[get_chat_service] = lambda: chat
+
+        with TestClient(app) as client, client.websocket_connect("/ws/chat") as websocket:
+            websocket.send_json({"type": "chat", "id": "a", "message": "hi"})
+            frames = []
+            while not frames or frames[-1]["type"] != "complete":
+                frames.append(websocket.receive_json())
+            websocket.send_text("not json")
+            assert websocket.receive_json()["error"] == "Invalid JSON"
+
+        assert "".join(frame.get("raw_delta", "") for frame in frames) == "hi-0hi-1hi-2"
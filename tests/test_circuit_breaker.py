@@ -0,0 +1,153 @@
+"""
+Tests for the upstream circuit breaker
+"""
+import asyncio
+
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+import pytest
+from starlette.middleware.sessions import SessionMiddleware
+
+from dependencies.config import Settings
+from dependencies.services import get_chat_service
+from models import User
+import routes.chat
+from services.chat_service import ChatService
+from services.circuit_breaker import CircuitBreaker
+from services.conversation_store import ConversationStore
+from services.llm_providers import BackendError, LLMBackend, ProviderRouter
+from services.upstream_client import UpstreamClient
+from services.upstream_governor import UpstreamGovernor
+
+
+def make_breaker(**overrides) -> CircuitBreaker:
+    values = {"min_requests": 4, "failure_rate": 0.5, "open_seconds": 0.05, "slow_call_seconds": 1.0}
+    values.update(overrides)
+    return CircuitBreaker("test", **values)
+
+
+class TestCircuitBreaker:
+    """Test state transitions."""
+
+    def test_opens_on_error_rate_and_rejects(self):
+        breaker = make_breaker()
+        for _ in range(2):
+            breaker.record_success(0.1)
+        assert breaker.state == "closed"
+        for _ in range(2):
+            breaker.record_failure()
+
+        assert breaker.state == "open"
+        assert not breaker.allow_request()
+        stats = breaker.get_stats()
+        assert stats["rejected"] == 1
+        assert stats["transitions"] == {"closed->open": 1}
+
+    def test_opens_on_slow_calls(self):
+        breaker = make_breaker(slow_call_rate=0.75)
+        for _ in range(4):
+            breaker.record_success(2.0)
+        assert breaker.state == "open"
+
+    async def test_half_open_probe_closes_or_reopens(self):
+        breaker = make_breaker()
+        for _ in range(4):
+            breaker.record_failure()
+        await asyncio.sleep(0.06)
+
+        assert breaker.state == "half_open"
+        assert breaker.allow_request()
+        assert not breaker.allow_request()  # one probe at a time
+        breaker.record_failure()
+        assert breaker.state == "open"
+
+        await asyncio.sleep(0.06)
+        assert breaker.allow_request()
+        breaker.record_success(0.1)
+        assert breaker.state == "closed"
+        assert breaker.get_stats()["transitions"] == {
+            "closed->open": 1, "open->half_open": 2, "half_open->open": 1, "half_open->closed": 1
+        }
+
+
+class TestChatCircuit:
+    """Test fail-fast chat calls and the cached connection test."""
+
+    def make_service(self) -> ChatService:
+        settings = Settings(response_cache_enabled=False, governor_backoff_max=0, governor_max_retries=0)
+        backend = LLMBackend("primary", "http://primary/v1", "model-a", api_key="key", breaker=make_breaker())
+        return ChatService(
+            settings=settings,
+            http_client=UpstreamClient(settings),
+            governor=UpstreamGovernor(settings),
+            conversations=ConversationStore(persist=False),
+            providers=ProviderRouter([backend]),
+        )
+
+    async def test_open_circuit_fails_fast(self, monkeypatch):
+        service = self.make_service()
+        calls = []
+
+        async def failing(backend, payload):
+            calls.append(backend)
+            raise BackendError(500, "primary API error (status 500)")
+
+        monkeypatch.setattr(service, "_post_completion", failing)
+        for _ in range(4):
+            with pytest.raises(HTTPException):
+                await service.chat_with_llama("hello")
+
+        with pytest.raises(HTTPException) as exc_info:
+            await service.chat_with_llama("hello")
+        assert exc_info.value.status_code == 503
+        assert "Retry-After" in exc_info.value.headers
+        assert len(calls) == 4
+
+    async def test_connection_reports_cached_state_unless_probed(self, monkeypatch):
+        service = self.make_service()
+        probes = []
+
+        async def probe(backend):
+            probes.append(backend)
+            return {"status": "error", "message": "API error (status 502): bad gateway", "status_code": 502}
+
+        monkeypatch.setattr(service, "_probe_connection", probe)
+
+        result = await service.test_connection()
+        assert result["status"] == "success" and result["cached"]
+        assert probes == []
+
+        for _ in range(4):
+            result = await service.test_connection(probe=True)
+        assert len(probes) == 4
+        assert result["circuit"]["state"] == "open"
+
+        cached = await service.test_connection()
+        assert cached["status"] == "error"
+        assert cached["circuits"]["primary"]["state"] == "open"
+
+    def test_only_superusers_can_probe_over_http(self, monkeypatch):
+        service = self.make_service()
+        probes = []
+
+        async def probe(backend):
+            probes.append(backend)
+            return {"status": "success", "message": "ok"}
+
+        monkeypatch.setattr(service, "_probe_connection", probe)
+        app = FastAPI()
+        app.add_middleware(SessionMiddleware, secret_key="test")
+        app.include_router(routes.chat.router, prefix="/api")
+        app.dependency_overrides[get_chat_service] = lambda: service
+        with TestClient(app) as client:
+            response = client.get("/api/chat/test?probe=true")
+            assert response.status_code == 200 and response.json()["cached"]
+            assert probes == []
+
+            async def superuser(request):
+                return User(email="admin@example.com", hashed_password="x", is_superuser=True)
+
+            monkeypatch.setattr(routes.chat, "get_current_superuser", superuser)
+            response = client.get("/api/chat/test?probe=true")
+            assert response.status_code == 200 and not response.json().get("cached")
+            assert len(probes) == 1
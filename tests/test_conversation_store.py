@@ -0,0 +1,143 @@
+"""
+Tests for conversation history and context packing
+"""
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel
+from starlette.middleware.sessions import SessionMiddleware
+
+from dependencies.config import Settings
+from dependencies.services import get_chat_service
+from routes.chat import router
+from services.chat_service import ChatService
+from services.conversation_store import ConversationStore, estimate_tokens, pack_messages
+from services.upstream_client import UpstreamClient
+
+
+@pytest.fixture
+async def session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'conversations.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    yield async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    await engine.dispose()
+
+
+class TestContextPacking:
+    """Test the token estimator and budget packer."""
+
+    def test_estimate_tokens(self):
+        assert estimate_tokens("") == 0
+        assert estimate_tokens("Hello, world!") == 4
+        assert estimate_tokens("x" * 400) == 100
+
+    def test_keeps_most_recent_turns_within_budget(self):
+        history = []
+        for i in range(20):
+            history.append({"role": "user", "content": f"question {i} " * 20})
+            history.append({"role": "assistant", "content": f"answer {i} " * 20})
+
+        messages = pack_messages("system", history, "latest", budget=300)
+
+        assert messages[0] == {"role": "system", "content": "system"}
+        assert messages[-1] == {"role": "user", "content": "latest"}
+        assert messages[1]["role"] == "user"
+        assert messages[-2]["content"] == history[-1]["content"]
+        assert 1 < len(messages) - 2 < len(history)
+        assert sum(estimate_tokens(m["content"]) + 4 for m in messages) <= 300
+
+
+class TestConversationStore:
+    """Test ownership and persistence."""
+
+    async def test_history_survives_restart(self, session_factory):
+        store = ConversationStore(session_factory=session_factory)
+        conversation_id = await store.create("user:1")
+        await store.append(conversation_id, "user:1", "user", "Hi")
+        await store.append(conversation_id, "user:1", "assistant", "Hello!")
+
+        restarted = ConversationStore(session_factory=session_factory)
+        history = await restarted.get_history(conversation_id, "user:1")
+        assert [(m["role"], m["content"]) for m in history] == [("user", "Hi"), ("assistant", "Hello!")]
+        assert restarted.get_stats()["loaded_from_db"] == 1
+
+    async def test_other_owners_cannot_read_or_delete(self, session_factory):
+        store = ConversationStore(session_factory=session_factory)
+        conversation_id = await store.create("user:1")
+        assert await store.get_history(conversation_id, "ip:10.0.0.1") is None
+        assert await store.delete(conversation_id, "ip:10.0.0.1") is False
+        assert await store.delete(conversation_id, "user:1") is True
+        assert await ConversationStore(session_factory=session_factory).get_history(conversation_id, "user:1") is None
+
+    async def test_drop_last_exchange_is_persisted(self, session_factory):
+        store = ConversationStore(session_factory=session_factory)
+        conversation_id = await store.create("user:1")
+        for role, content in [("user", "Hi"), ("assistant", "Hello!"), ("user", "Again"), ("assistant", "Hey")]:
+            await store.append(conversation_id, "user:1", role, content)
+
+        assert await store.drop_last_exchange(conversation_id, "user:2") is False
+        assert await store.drop_last_exchange(conversation_id, "user:1") is True
+        history = await ConversationStore(session_factory=session_factory).get_history(conversation_id, "user:1")
+        assert [m["content"] for m in history] == ["Hi", "Hello!"]
+
+
+class TestMultiTurnChat:
+    """Test that ChatService sends the stored history."""
+
+    async def test_second_turn_includes_history(self, monkeypatch):
+        settings = Settings(response_cache_enabled=False)
+        service = ChatService(
+            settings=settings,
+            http_client=UpstreamClient(settings),
+            conversations=ConversationStore(persist=False),
+        )
+        payloads = []
+
+        async def complete(backend, payload):
+            payloads.append(payload)
+            return {"choices": [{"message": {"content": f"answer {len(payloads)}"}}]}
+
+        monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+        monkeypatch.setattr(service, "_post_completion", complete)
+
+        first = await service.chat_with_llama("first question", user_key="user:1")
+        await service.chat_with_llama("second question", user_key="user:1", conversation_id=first["conversation_id"])
+
+        assert [m["content"] for m in payloads[1]["messages"][1:]] == [
+            "first question", "answer 1", "second question"
+        ]
+        with pytest.raises(HTTPException) as exc_info:
+            await service.chat_with_llama("hijack", user_key="user:2", conversation_id=first["conversation_id"])
+        assert exc_info.value.status_code == 404
+
+    def test_owner_is_the_session_not_the_ip(self, monkeypatch):
+        settings = Settings(response_cache_enabled=False)
+        service = ChatService(
+            settings=settings,
+            http_client=UpstreamClient(settings),
+            conversations=ConversationStore(persist=False),
+        )
+
+        async def complete(backend, payload):
+            return {"choices": [{"message": {"content": "answer"}}]}
+
+        monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+        monkeypatch.setattr(service, "_post_completion", complete)
+        app = FastAPI()
+        app.add_middleware(SessionMiddleware, secret_key="test")
+        app.include_router(router, prefix="/api")
+        app.dependency_overrides[get_chat_service] = lambda: service
+
+        # Both clients come from the same IP
+        with TestClient(app) as owner, TestClient(app) as neighbour:
+            conversation_id = owner.post("/api/chat", json={"message": "hello"}).json()["conversation_id"]
+            path = f"/api/chat/conversations/{conversation_id}"
+            assert neighbour.get(path).status_code == 404
+            assert neighbour.delete(path).status_code == 404
+
+            # Signing in keeps the session cookie, and with it the conversation
+            owner.cookies.set("access_token", "signed-in")
+            assert [m["content"] for m in owner.get(path).json()["messages"]] == ["hello", "answer"]
+            assert owner.delete(path).status_code == 200
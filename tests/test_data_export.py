@@ -0,0 +1,102 @@
+"""
+Tests for streaming NDJSON/CSV exports
+"""
+import csv
+from datetime import UTC, datetime, timedelta
+import gzip
+import io
+import json
+import zlib
+
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel
+from starlette.middleware.sessions import SessionMiddleware
+
+from core.services.auth import get_current_staff_or_admin
+from dependencies.config import Settings
+from models import Product, User
+from routes.api import router
+import services.data_export
+from services.data_export import DataExport
+
+
+@pytest.fixture
+async def session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'export.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    factory = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with factory() as session:
+        session.add_all([
+            Product(
+                name=f'Product {i}, "special"' if i == 3 else f"Product {i}",
+                price=10.0 + i,
+                created_at=datetime(2025, 1, 1, tzinfo=UTC) + timedelta(minutes=i),
+            )
+            for i in range(10)
+        ])
+        await session.commit()
+    yield factory
+    await engine.dispose()
+
+
+async def _collect(exporter, name, fmt, compress=False):
+    return [chunk async for chunk in await exporter.start(name, fmt, compress)]
+
+
+class TestDataExport:
+    """Test batch-by-batch encoding, gzip, empty tables and staff-only routes."""
+
+    async def test_ndjson_and_csv_stream_in_batches(self, session_factory):
+        exporter = DataExport(Settings(export_batch_size=3), session_factory)
+
+        chunks = await _collect(exporter, "products", "ndjson")
+        assert len(chunks) == 4  # one chunk per batch of at most 3 rows
+        rows = [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+        assert [row["name"] for row in rows][:4] == ["Product 0", "Product 1", "Product 2", 'Product 3, "special"']
+        assert rows[0]["price"] == 10.0 and rows[0]["in_stock"] is True and rows[0]["created_at"].startswith("2025")
+
+        text = b"".join(await _collect(exporter, "products", "csv")).decode()
+        records = list(csv.DictReader(io.StringIO(text)))
+        assert len(records) == 10 and records[3]["name"] == 'Product 3, "special"'
+
+    async def test_gzip_and_empty_tables(self, session_factory):
+        exporter = DataExport(Settings(export_batch_size=4), session_factory)
+        plain = b"".join(await _collect(exporter, "products", "csv"))
+        compressed = await _collect(exporter, "products", "csv", compress=True)
+        assert len(compressed) == 4
+        assert gzip.decompress(b"".join(compressed)) == plain
+        # Every batch is flushed, so what arrived so far already decompresses
+        first = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(compressed[0])
+        assert first.startswith(b"id,name,description") and first.count(b"\n") == 5 and plain.startswith(first)
+
+        registrants = b"".join(await _collect(exporter, "registrants", "csv")).decode()
+        assert registrants.splitlines() == [
+            "id,name,email,company,webinar_title,webinar_date,registration_date,status,"
+            "assigned_sales_rep,group,is_public,notes,photo_url,created_at,updated_at"
+        ]
+        assert await _collect(exporter, "registrants", "ndjson") == [b""]
+
+        with pytest.raises(HTTPException) as error:
+            await exporter.start("products", "xml")
+        assert error.value.status_code == 400
+
+    def test_routes_are_staff_only(self, session_factory, monkeypatch):
+        monkeypatch.setattr(services.data_export, "_data_export", DataExport(Settings(), session_factory))
+        app = FastAPI()
+        app.add_middleware(SessionMiddleware, secret_key="test")
+        app.include_router(router, prefix="/api")
+        with TestClient(app) as client:
+            assert client.get("/api/products/export").status_code in (401, 403)
+
+            staff = User(email="staff@example.com", hashed_password="x", is_staff=True)
+            app.dependency_overrides[get_current_staff_or_admin] = lambda: staff
+            response = client.get("/api/products/export?format=csv&gzip=true")
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/csv")
+            assert response.headers["content-encoding"] == "gzip"
+            assert 'filename="products-' in response.headers["content-disposition"]
+            assert len(list(csv.DictReader(io.StringIO(response.text)))) == 10
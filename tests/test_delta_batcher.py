@@ -0,0 +1,57 @@
+"""
+Tests for time-window batching of stream deltas
+"""
+import asyncio
+
+import pytest
+
+from services.delta_batcher import batch_deltas
+
+
+async def deltas(items, delay=0.0):
+    for item in items:
+        await asyncio.sleep(delay)
+        yield item
+
+
+class TestBatchDeltas:
+    """Test the flush policy."""
+
+    async def test_first_delta_is_not_delayed_and_text_is_preserved(self):
+        items = [f"t{i} " for i in range(100)]
+        batches = [batch async for batch in batch_deltas(deltas(items), interval=1.0, max_chars=40)]
+        assert batches[0] == "t0 "
+        assert "".join(batches) == "".join(items)
+        assert len(batches) < 20
+
+    async def test_window_flushes_while_upstream_stalls(self):
+        async def stalled():
+            yield "a"
+            yield "b"
+            await asyncio.sleep(0.3)
+            yield "c"
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        arrivals = []
+        async for batch in batch_deltas(stalled(), interval=0.02, max_chars=1000):
+            arrivals.append((batch, loop.time() - start))
+
+        assert [batch for batch, _ in arrivals] == ["a", "b", "c"]
+        assert arrivals[1][1] < 0.2  # "b" did not wait for "c"
+
+    async def test_errors_propagate_after_pending_text(self):
+        async def failing():
+            yield "a"
+            yield "b"
+            raise ValueError("upstream failed")
+
+        batches = []
+        with pytest.raises(ValueError):
+            async for batch in batch_deltas(failing(), interval=1.0, max_chars=1000):
+                batches.append(batch)
+        assert batches == ["a", "b"]
+
+    async def test_disabled_passes_through(self):
+        batches = [batch async for batch in batch_deltas(deltas(["a", "b", "c"]), interval=0, max_chars=1)]
+        assert batches == ["a", "b", "c"]
@@ -0,0 +1,110 @@
+"""
+Tests for ETags and conditional GET on the JSON API endpoints
+"""
+from datetime import UTC, datetime
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel, select
+
+import db
+from dependencies.config import Settings, get_settings
+from dependencies.http_cache import etag_matches
+from dependencies.services import get_product_service
+from models import Product, WebinarRegistrants
+from routes.api import router
+from services import webinar_service
+from services.product_service import ProductService
+
+
+@pytest.fixture
+async def session_factory(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'etags.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    factory = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with factory() as session:
+        session.add_all([
+            Product(name="Desk Lamp", price=30.0, category="Home & Kitchen"),
+            WebinarRegistrants(email="ana@example.com", name="Ana Lima", webinar_title="Scaling FastAPI",
+                               webinar_date=datetime(2025, 3, 4, tzinfo=UTC)),
+        ])
+        await session.commit()
+    monkeypatch.setattr(db, "AsyncSessionLocal", factory)
+    monkeypatch.setattr(webinar_service, "AsyncSessionLocal", factory)
+    yield factory
+    await engine.dispose()
+
+
+def _client(session_factory, settings, calls):
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+
+    async def product_service():
+        async with session_factory() as session:
+            service = ProductService(session, settings)
+            load_page = service._load_page
+
+            async def counting(*args):
+                calls.append(args)
+                return await load_page(*args)
+
+            service._load_page = counting
+            yield service
+
+    app.dependency_overrides[get_product_service] = product_service
+    app.dependency_overrides[get_settings] = lambda: settings
+    return TestClient(app)
+
+
+class TestConditionalGet:
+    """Test 304 responses, invalidation on writes, representations and Cache-Control policies."""
+
+    def test_etag_matching(self):
+        assert etag_matches('"a", W/"b"', '"b"')
+        assert etag_matches("*", '"a"')
+        assert not etag_matches('"ab"', '"a"')
+
+    def test_not_modified_until_the_table_changes(self, session_factory):
+        calls = []
+        with _client(session_factory, Settings(), calls) as client:
+            first = client.get("/api/products?limit=10")
+            etag = first.headers["etag"]
+            assert first.status_code == 200 and first.headers["cache-control"] == "private, no-cache"
+            assert first.headers["vary"] == "HX-Request"
+
+            again = client.get("/api/products?limit=10", headers={"If-None-Match": etag})
+            assert again.status_code == 304 and again.content == b"" and again.headers["etag"] == etag
+            assert len(calls) == 1  # the service never ran for the 304
+
+            # Another page, or the HTMX rows, is another representation
+            assert client.get("/api/products?limit=5", headers={"If-None-Match": etag}).status_code == 200
+            rows = client.get("/api/products?limit=10", headers={"If-None-Match": etag, "HX-Request": "true"})
+            assert rows.status_code == 200 and rows.headers["etag"] != etag
+
+            async def rename():
+                async with session_factory() as session:
+                    product = (await session.execute(select(Product))).scalars().one()
+                    product.price = 35.0
+                    await session.commit()
+
+            client.portal.call(rename)
+            changed = client.get("/api/products?limit=10", headers={"If-None-Match": etag})
+            assert changed.status_code == 200 and changed.headers["etag"] != etag
+            assert changed.json()["products"][0]["price"] == 35.0
+
+    def test_cache_control_per_route(self, session_factory):
+        settings = Settings(http_cache_control={"webinar-attendees": "public, max-age=60"})
+        with _client(session_factory, settings, []) as client:
+            response = client.get("/api/webinar-attendees")
+            assert response.headers["cache-control"] == "public, max-age=60"
+            assert response.json()["attendees"][0]["name"] == "Ana Lima"
+
+            etag = response.headers["etag"]
+            assert client.get("/api/webinar-attendees", headers={"If-None-Match": etag}).status_code == 304
+
+        with _client(session_factory, Settings(http_etags_enabled=False), []) as client:
+            response = client.get("/api/webinar-attendees")
+            assert "etag" not in response.headers and response.headers["cache-control"] == "private, no-cache"
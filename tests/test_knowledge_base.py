@@ -0,0 +1,213 @@
+"""
+Tests for the vector index and retrieval over project data
+"""
+from datetime import UTC, datetime
+
+from aiohttp.test_utils import TestServer
+from fastapi import HTTPException
+import pytest
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel, select
+
+from dependencies.config import Settings
+from models import Product, WebinarRegistrants
+from scripts.mock_llm import MockUpstreamConfig, create_app
+from services.chat_service import ChatService
+from services.conversation_store import ConversationStore
+from services.knowledge_base import KnowledgeBase, chunk_text
+from services.llm_providers import ProviderRouter, build_backends
+from services.upstream_client import UpstreamClient
+from services.vector_index import VectorIndex
+
+np = pytest.importorskip("numpy")
+
+
+@pytest.fixture
+async def session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'rag.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    factory = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with factory() as session:
+        session.add_all([
+            Product(name="Ergonomic Office Chair", price=249.0, category="Furniture",
+                    description="Adjustable lumbar support and breathable mesh back"),
+            Product(name="Mechanical Keyboard", price=89.0, category="Electronics",
+                    description="Hot-swappable switches with RGB backlight"),
+            Product(name="Standing Desk", price=499.0, category="Furniture", in_stock=False,
+                    description="Electric height adjustment with memory presets"),
+            WebinarRegistrants(email="ana@example.com", name="Ana Lima", company="Acme",
+                               webinar_title="Scaling FastAPI", webinar_date=datetime(2025, 3, 4, tzinfo=UTC)),
+            WebinarRegistrants(email="bo@example.com", name="Bo Private", company="Hidden Co",
+                               webinar_title="Scaling FastAPI", webinar_date=datetime(2025, 3, 4, tzinfo=UTC),
+                               is_public=False),
+        ])
+        await session.commit()
+    yield factory
+    await engine.dispose()
+
+
+def _unit(rows: int, dim: int, seed: int = 0):
+    vectors = np.random.default_rng(seed).standard_normal((rows, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class TestVectorIndex:
+    """Test flat and IVF search, removal and memory-mapped persistence."""
+
+    def test_chunk_text_repeats_the_heading(self):
+        chunks = chunk_text("Product: Chair\n" + " ".join(["word"] * 100), 60)
+        assert len(chunks) > 1
+        assert all(chunk.startswith("Product: Chair\n") and len(chunk) <= 60 for chunk in chunks)
+        assert chunk_text("short", 60) == ["short"]
+
+    def test_flat_and_ivf_agree(self):
+        vectors = _unit(2000, 32)
+        ids = [str(i) for i in range(2000)]
+        flat = VectorIndex(32, mode="flat")
+        ivf = VectorIndex(32, mode="ivf", n_lists=16, n_probe=16)
+        flat.add(ids, vectors)
+        ivf.add(ids, vectors)
+
+        assert ivf.get_stats()["mode"] == "ivf" and ivf.get_stats()["lists"] == 16
+        for row in (0, 999, 1999):
+            assert flat.search(vectors[row], 1)[0][0] == str(row)
+            # Probing every list is exact
+            assert ivf.search(vectors[row], 3) == flat.search(vectors[row], 3)
+
+    def test_auto_mode_switches_to_ivf(self):
+        index = VectorIndex(16, mode="auto", ivf_min_rows=100)
+        index.add([str(i) for i in range(99)], _unit(99, 16))
+        assert not index.is_ivf
+        index.add(["99"], _unit(1, 16, seed=1))
+        assert index.is_ivf
+
+    def test_remove_and_replace(self):
+        vectors = _unit(3, 8)
+        index = VectorIndex(8, mode="flat")
+        index.add(["a", "b", "c"], vectors)
+        assert index.remove(["a", "missing"]) == 1
+        assert len(index) == 2 and "a" not in index
+        assert index.search(vectors[2], 1)[0][0] == "c"
+        index.add(["b"], vectors[2:3])
+        assert len(index) == 2
+        assert [item_id for item_id, _ in index.search(vectors[2], 2)] in (["b", "c"], ["c", "b"])
+
+    def test_save_and_memory_mapped_load(self, tmp_path):
+        vectors = _unit(500, 16)
+        index = VectorIndex(16, mode="ivf", n_lists=8, n_probe=8)
+        index.add([str(i) for i in range(500)], vectors)
+        index.save(str(tmp_path))
+
+        loaded = VectorIndex.load(str(tmp_path))
+        assert loaded.get_stats()["memory_mapped"] is True
+        assert loaded.search(vectors[7], 5) == index.search(vectors[7], 5)
+        # The first change copies the mapped arrays into memory
+        loaded.remove(["7"])
+        assert loaded.get_stats()["memory_mapped"] is False
+        assert loaded.search(vectors[7], 1)[0][0] != "7"
+
+
+class TestKnowledgeBase:
+    """Test ingestion, incremental updates and retrieval over the tables."""
+
+    async def test_build_and_search(self, session_factory):
+        knowledge = KnowledgeBase(Settings(), session_factory)
+        await knowledge.build()
+
+        assert knowledge.get_stats()["rows"] == 4  # the private registration is not indexed
+        results = knowledge.search("office chair with lumbar support")
+        assert results[0]["title"] == "Ergonomic Office Chair"
+        assert results[0]["source"] == "products"
+        assert "Hidden Co" not in str(knowledge.search("Hidden Co Bo Private"))
+        stats = knowledge.get_stats()
+        assert stats["builds"] == 1 and stats["queries"] == 2 and stats["query_ms_p50"] is not None
+
+    async def test_orm_changes_are_synced(self, session_factory):
+        knowledge = KnowledgeBase(Settings(), session_factory)
+        await knowledge.build()
+        knowledge.install_listeners()
+        try:
+            async with session_factory() as session:
+                session.add(Product(name="Noise Cancelling Headphones", price=199.0, category="Audio"))
+                desk = (await session.execute(select(Product).where(Product.name == "Standing Desk"))).scalar_one()
+                await session.delete(desk)
+                await session.commit()
+            assert knowledge.get_stats()["pending_rows"] == 2
+            assert await knowledge.sync() == 2
+        finally:
+            knowledge.remove_listeners()
+
+        assert knowledge.search("noise cancelling headphones")[0]["title"] == "Noise Cancelling Headphones"
+        assert all(result["title"] != "Standing Desk" for result in knowledge.search("standing desk"))
+
+    async def test_reconcile_catches_bulk_statements(self, session_factory, tmp_path):
+        settings = Settings(rag_index_path=str(tmp_path / "index"))
+        knowledge = KnowledgeBase(settings, session_factory)
+        await knowledge.build()
+        async with session_factory() as session:
+            await session.execute(delete(Product).where(Product.category == "Furniture"))
+            await session.commit()
+
+        # A restarted worker maps the saved index and catches up with the tables
+        restarted = KnowledgeBase(settings, session_factory)
+        restarted.load(settings.rag_index_path)
+        assert restarted.get_stats()["index"]["memory_mapped"] is True
+        assert await restarted.reconcile() == 2
+        assert restarted.get_stats()["rows"] == 2
+        assert await restarted.reconcile() == 0
+
+
+class TestRetrievalChat:
+    """Test that retrieval-augmented chat puts the records in the prompt."""
+
+    async def test_complete_with_rag(self, monkeypatch, session_factory):
+        monkeypatch.setenv("OPENROUTER_API_KEY", "mock")
+        server = TestServer(create_app(MockUpstreamConfig(tokens_per_second=0, ttft=0, jitter=0)))
+        await server.start_server()
+        settings = Settings(
+            llm_base_url=str(server.make_url("/v1")),
+            response_cache_enabled=False,
+            usage_tracking_enabled=False,
+        )
+        knowledge = KnowledgeBase(settings, session_factory)
+        await knowledge.build()
+        service = ChatService(
+            settings=settings,
+            http_client=UpstreamClient(settings),
+            conversations=ConversationStore(persist=False),
+            providers=ProviderRouter(build_backends(settings)),
+            knowledge=knowledge,
+        )
+        payloads = []
+        post_completion = service._post_completion
+
+        async def capture(backend, payload):
+            payloads.append(payload)
+            return await post_completion(backend, payload)
+
+        service._post_completion = capture
+        try:
+            result = await service.complete("Which keyboard do you sell?", rag=True)
+            chunks = [chunk async for chunk in service.chat_with_llama_stream("Which keyboard?", rag=True)]
+        finally:
+            await service.http_client.close()
+            await server.close()
+
+        assert result["sources"][0]["title"] == "Mechanical Keyboard"
+        assert "Hot-swappable switches" in payloads[0]["messages"][0]["content"]
+        assert chunks[1]["sources"][0]["title"] == "Mechanical Keyboard"
+        assert service.get_metrics()["knowledge_base"]["queries"] == 2
+
+    async def test_rag_unavailable(self):
+        settings = Settings(rag_enabled=False)
+        service = ChatService(
+            settings=settings,
+            http_client=UpstreamClient(settings),
+            conversations=ConversationStore(persist=False),
+            providers=ProviderRouter(build_backends(settings)),
+        )
+        with pytest.raises(HTTPException) as error:
+            await service.complete("hello", rag=True)
+        assert error.value.status_code == 503
@@ -0,0 +1,166 @@
+"""
+Tests for LLM backend routing, health scoring and failover
+"""
+import json
+
+from fastapi import HTTPException
+import pytest
+
+from dependencies.config import Settings
+from services.chat_service import ChatService
+from services.conversation_store import ConversationStore
+from services.llm_providers import BackendError, LLMBackend, ProviderRouter, build_backends
+from services.upstream_client import UpstreamClient
+from services.upstream_governor import UpstreamGovernor, UpstreamRetryableError
+
+
+def make_router() -> ProviderRouter:
+    return ProviderRouter([
+        LLMBackend("primary", "http://primary/v1", "model-a", weight=3, api_key="key-a"),
+        LLMBackend("secondary", "http://secondary/v1", "model-b", weight=1, api_key="key-b"),
+    ])
+
+
+def make_service(router: ProviderRouter) -> ChatService:
+    settings = Settings(response_cache_enabled=False, stream_coalescing_enabled=False, stream_flush_interval_ms=0)
+    return ChatService(
+        settings=settings,
+        http_client=UpstreamClient(settings),
+        governor=UpstreamGovernor(settings),
+        conversations=ConversationStore(persist=False),
+        providers=router,
+    )
+
+
+class TestProviderRouter:
+    """Test backend configuration and routing order."""
+
+    def test_build_backends_from_settings(self):
+        settings = Settings(llm_backends=[
+            {"name": "local", "base_url": "http://localhost:9000/v1/", "model": "mock", "weight": 2},
+            {"model": "meta-llama/llama-3.3-70b-instruct", "api_key_env": "SECOND_KEY"},
+        ])
+        backends = build_backends(settings)
+        assert backends[0].chat_completions_url == "http://localhost:9000/v1/chat/completions"
+        assert backends[0].configured
+        assert backends[1].name == "backend-1"
+        assert backends[1].base_url == "https://openrouter.ai/api/v1"
+
+    def test_backends_without_env_key_are_skipped(self, monkeypatch):
+        monkeypatch.delenv("MISSING_KEY", raising=False)
+        router = ProviderRouter([
+            LLMBackend("a", "http://a/v1", "m", api_key_env="MISSING_KEY"),
+            LLMBackend("b", "http://b/v1", "m"),
+        ])
+        assert [backend.name for backend in router.candidates()] == ["b"]
+
+    def test_unhealthy_backend_is_deprioritized(self):
+        router = make_router()
+        primary, secondary = router.backends
+        for _ in range(10):
+            primary.record_failure("status 500")
+        secondary.record_success(0.1)
+
+        assert primary.health() < 0.2 < secondary.health()
+        firsts = [router.candidates()[0].name for _ in range(200)]
+        assert firsts.count("secondary") > firsts.count("primary")
+
+
+class TestFailover:
+    """Test that ChatService fails over before the client sees an error."""
+
+    async def test_non_streaming_failover(self, monkeypatch):
+        router = make_router()
+        router.backends[0].weight = 1000  # always tried first
+        service = make_service(router)
+
+        async def post(backend, payload):
+            if backend.name == "primary":
+                raise BackendError(500, "primary API error (status 500)")
+            return {"choices": [{"message": {"content": "from secondary"}}]}
+
+        monkeypatch.setattr(service, "_post_completion", post)
+        result = await service.chat_with_llama("hello")
+
+        assert result["raw_response"] == "from secondary"
+        assert result["model"] == "model-b"
+        stats = {b["name"]: b for b in service.get_metrics()["providers"]["backends"]}
+        assert stats["primary"]["failovers"] == 1
+        assert stats["secondary"]["successes"] == 1
+
+    async def test_all_backends_fail(self, monkeypatch):
+        service = make_service(make_router())
+
+        async def post(backend, payload):
+            raise BackendError(401, "Authentication failed.")
+
+        monkeypatch.setattr(service, "_post_completion", post)
+        with pytest.raises(HTTPException) as exc_info:
+            await service.chat_with_llama("hello")
+        assert exc_info.value.status_code == 401
+
+    async def test_throttled_round_is_retried(self, monkeypatch):
+        service = make_service(make_router())
+        service.settings.governor_backoff_max = 0
+        calls = []
+
+        async def post(backend, payload):
+            calls.append(backend.name)
+            if len(calls) <= 2:
+                raise UpstreamRetryableError(429, "slow down")
+            return {"choices": [{"message": {"content": "ok"}}]}
+
+        monkeypatch.setattr(service, "_post_completion", post)
+        result = await service.chat_with_llama("hello")
+        assert result["raw_response"] == "ok"
+        assert len(calls) == 3
+
+    async def test_streaming_failover(self, monkeypatch):
+        service = make_service(make_router())
+
+        class Response:
+            def __init__(self, status, lines):
+                self.status = status
+                self.headers = {}
+                self.lines = lines
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                pass
+
+            async def text(self):
+                return "upstream failure"
+
+            def release(self):
+                pass
+
+            @property
+            def content(self):
+                return self
+
+            async def readline(self):
+                return self.lines.pop(0) if self.lines else b""
+
+        class Session:
+            def post(self, url, headers, json):
+                if url.startswith("http://primary"):
+                    return Response(502, [])
+                data = {"choices": [{"delta": {"content": "streamed"}}]}
+                return Response(200, [f"data: {_dumps(data)}\n".encode(), b"data: [DONE]\n"])
+
+        async def get_session():
+            return Session()
+
+        monkeypatch.setattr(service.http_client, "get_session", get_session)
+        # The primary fails with a retryable status; the secondary answers in the same round
+        router = service.providers
+        router.backends[0].weight = 1000
+        chunks = [chunk async for chunk in service.chat_with_llama_stream("hello")][1:]
+        assert "".join(chunk["raw_delta"] for chunk in chunks) == "streamed"
+        assert router.backends[0].failovers == 1
+
+
+def _dumps(data) -> str:
+    return json.dumps(data)
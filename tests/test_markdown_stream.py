@@ -0,0 +1,94 @@
+"""
+Tests for incremental markdown rendering of streamed chat responses
+"""
+import re
+
+import markdown
+
+from services.code_highlight import CachedHighlightExtension, HighlightCache
+from services.markdown_stream import StreamingMarkdownRenderer, render_markdown
+
+SAMPLE = (
+    "# Title\n\n"
+    "Some **bold** text\nsecond line\n\n"
+    "- one\n- two\n\n- loose item\n\n"
+    "1. first\n2. second\n\n"
+    "```python\nx = 1\n\ny = 2\n```\n\n"
+    "| a | b |\n|---|---|\n| 1 | 2 |\n\n"
+    "The end"
+)
+
+
+def _normalize(html: str) -> str:
+    return re.sub(r"\n+", "\n", html).strip()
+
+
+def _stream(renderer: StreamingMarkdownRenderer, text: str, step: int) -> str:
+    """Feed text in fixed-size pieces, applying deltas the way the browser does"""
+    closed = ""
+    html = ""
+    for i in range(0, len(text), step):
+        delta = renderer.feed(text[i:i + step])
+        closed += delta["append"]
+        html = closed + delta["tail"]
+    return html
+
+
+class TestStreamingMarkdownRenderer:
+    """Test the delta renderer against a full render."""
+
+    def test_deltas_match_full_render(self):
+        for step in (1, 3, 17):
+            renderer = StreamingMarkdownRenderer()
+            html = _stream(renderer, SAMPLE, step)
+            assert _normalize(html) == _normalize(render_markdown(SAMPLE))
+            assert _normalize(renderer.html) == _normalize(html)
+
+    def test_closed_blocks_are_not_rerendered(self):
+        renderer = StreamingMarkdownRenderer()
+        renderer.feed("First paragraph.\n\nSecond paragraph starts here")
+        delta = renderer.feed(" and continues")
+        assert delta["append"] == ""
+        assert "First paragraph" not in delta["tail"]
+        assert "continues" in delta["tail"]
+
+    def test_blank_lines_inside_fence_do_not_split(self):
+        renderer = StreamingMarkdownRenderer()
+        delta = renderer.feed("```\nline one\n\nline two\n")
+        assert delta["append"] == ""
+        assert "line two" in delta["tail"]
+
+    def test_open_fence_is_shown_as_plain_code(self):
+        renderer = StreamingMarkdownRenderer()
+        delta = renderer.feed("Intro\n\n```python\nif a < b:\n    pass\n")
+        assert "<code>if a &lt; b:" in delta["tail"]
+        assert 'class="k"' not in delta["tail"]  # not highlighted yet
+        delta = renderer.feed("```\n")
+        assert '<span class="k">if</span>' in delta["tail"]
+
+
+class TestHighlightCache:
+    """Test that highlighted code blocks are reused and the cache stays bounded."""
+
+    def _render(self, text: str, cache: HighlightCache) -> str:
+        extensions = ['fenced_code', 'codehilite', CachedHighlightExtension(cache)]
+        return markdown.markdown(text, extensions=extensions)
+
+    def test_output_matches_and_blocks_are_reused(self):
+        cache = HighlightCache()
+        text = "```python\nx = 1\n```\n\n```\nplain <b>\n```\n\n```js hl_lines=\"1\"\nvar a;\n```\n"
+        html = self._render(text, cache)
+        assert html == markdown.markdown(text, extensions=['fenced_code', 'codehilite'])
+        assert cache.get_stats()["misses"] == 2  # hl_lines blocks are left to fenced_code
+
+        self._render("Other text\n\n```python\nx = 1\n```\n", cache)
+        assert cache.get_stats()["hits"] == 1
+        assert len(cache) == 2
+
+    def test_bounded_by_bytes(self):
+        cache = HighlightCache(max_bytes=600)
+        for i in range(10):
+            self._render(f"```python\nvalue_{i} = {i}\n```\n", cache)
+        stats = cache.get_stats()
+        assert 0 < stats["bytes"] <= 600
+        assert stats["evictions"] == 10 - stats["entries"]
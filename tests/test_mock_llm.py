@@ -0,0 +1,80 @@
+"""
+Tests for the local mock upstream and the benchmark helpers
+"""
+from aiohttp.test_utils import TestServer
+from fastapi import HTTPException
+import pytest
+
+from dependencies.config import Settings
+from scripts.bench_chat import percentile
+from scripts.mock_llm import STATS_KEY, MockUpstreamConfig, create_app, response_tokens
+from services.chat_service import ChatService, mock_response_parts
+from services.conversation_store import ConversationStore
+from services.llm_providers import ProviderRouter, build_backends
+from services.upstream_client import UpstreamClient
+from services.upstream_governor import UpstreamGovernor
+
+
+async def start_mock(**overrides) -> TestServer:
+    values = {"tokens_per_second": 0, "ttft": 0, "jitter": 0}
+    values.update(overrides)
+    server = TestServer(create_app(MockUpstreamConfig(**values)))
+    await server.start_server()
+    return server
+
+
+def make_service(server: TestServer, **overrides) -> ChatService:
+    values = {
+        "llm_base_url": str(server.make_url("/v1")),
+        "response_cache_enabled": False,
+        "stream_coalescing_enabled": False,
+        "governor_max_retries": 0,
+    }
+    values.update(overrides)
+    settings = Settings(**values)
+    return ChatService(
+        settings=settings,
+        http_client=UpstreamClient(settings),
+        governor=UpstreamGovernor(settings),
+        conversations=ConversationStore(persist=False),
+        providers=ProviderRouter(build_backends(settings)),
+    )
+
+
+class TestMockUpstream:
+    """Test ChatService against the mock upstream over real HTTP."""
+
+    async def test_stream_matches_canned_answer(self, monkeypatch):
+        monkeypatch.setenv("OPENROUTER_API_KEY", "mock")
+        server = await start_mock()
+        service = make_service(server)
+        try:
+            chunks = [chunk async for chunk in service.chat_with_llama_stream("tell me a story")][1:]
+            reply = await service.complete("hello")
+        finally:
+            await service.http_client.close()
+            await server.close()
+
+        assert "".join(chunk["raw_delta"] for chunk in chunks) == "".join(mock_response_parts("story"))
+        assert reply["raw_response"] == "".join(mock_response_parts("hello"))
+        assert server.app[STATS_KEY]["streams"] == 1
+
+    async def test_injected_errors_reach_the_client(self, monkeypatch):
+        monkeypatch.setenv("OPENROUTER_API_KEY", "mock")
+        server = await start_mock(error_rate=1.0, error_status=503)
+        service = make_service(server, governor_backoff_max=0)
+        try:
+            with pytest.raises(HTTPException) as exc_info:
+                await service.complete("hello")
+        finally:
+            await service.http_client.close()
+            await server.close()
+
+        assert exc_info.value.status_code == 503
+        assert server.app[STATS_KEY]["errors"] == 1
+
+    def test_response_length_and_percentiles(self):
+        assert len(response_tokens("hello", 500)) == 500
+        assert percentile([], 0.5) is None
+        assert percentile([0.1, 0.2, 0.3, 0.4], 0.5) == 0.2
+        assert percentile([0.1, 0.2, 0.3, 0.4], 0.99) == 0.4
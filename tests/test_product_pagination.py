@@ -0,0 +1,133 @@
+"""
+Tests for keyset-paginated, filterable and sortable product listings
+"""
+from datetime import UTC, datetime, timedelta
+
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel, select
+
+from dependencies.config import Settings
+from dependencies.services import get_product_service
+from models import Product
+from routes.api import router
+from services.product_pagination import ProductFilters
+from services.product_service import ProductService
+
+CREATED = datetime(2025, 1, 1, tzinfo=UTC)
+
+
+@pytest.fixture
+async def session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'products.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    factory = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with factory() as session:
+        # Pairs of products share a created_at, so pages must break ties on id
+        session.add_all([
+            Product(
+                name=f"Product {i:02d}",
+                price=float(10 * (i % 7) + 5),
+                category="Books" if i % 3 == 0 else "Sports",
+                in_stock=i % 4 != 0,
+                created_at=CREATED + timedelta(hours=i // 2),
+            )
+            for i in range(25)
+        ])
+        await session.commit()
+    yield factory
+    await engine.dispose()
+
+
+async def _walk(factory, settings, sort, filters=None, limit=4):
+    """Follow next_cursor from the first page to the last"""
+    names, cursor, pages = [], None, 0
+    while True:
+        async with factory() as session:
+            page = await ProductService(session, settings).get_products_with_stats(
+                limit=limit, cursor=cursor, sort=sort, filters=filters, include_stats=False
+            )
+        names += [product["name"] for product in page["products"]]
+        pages += 1
+        cursor = page["next_cursor"]
+        if not page["has_more"]:
+            assert cursor is None
+            return names, pages
+
+
+class TestProductPages:
+    """Test paging through every sort order, filters, cursors and the HTMX rows."""
+
+    @pytest.mark.parametrize("sort, key, reverse", [
+        ("newest", lambda p: (p.created_at, p.id), True),
+        ("oldest", lambda p: (p.created_at, p.id), False),
+        ("price_asc", lambda p: (p.price, p.id), False),
+        ("price_desc", lambda p: (p.price, p.id), True),
+        ("name", lambda p: (p.name, p.id), False),
+    ])
+    async def test_pages_cover_every_product_once_in_order(self, session_factory, sort, key, reverse):
+        async with session_factory() as session:
+            products = (await session.execute(select(Product))).scalars().all()
+        expected = [product.name for product in sorted(products, key=key, reverse=reverse)]
+
+        names, pages = await _walk(session_factory, Settings(), sort)
+        assert names == expected
+        assert pages == 7
+
+    async def test_filters(self, session_factory):
+        filters = ProductFilters(category="Books", in_stock=True, min_price=10, max_price=50)
+        names, _ = await _walk(session_factory, Settings(), "price_asc", filters, limit=2)
+        assert names == ["Product 15", "Product 09", "Product 03", "Product 18"]
+
+        names, _ = await _walk(session_factory, Settings(), "name", ProductFilters(search="product 1"))
+        assert names == [f"Product {i}" for i in range(10, 20)]
+
+    async def test_first_page_statistics_and_limits(self, session_factory):
+        settings = Settings(products_page_size=10, products_page_max=20)
+        async with session_factory() as session:
+            service = ProductService(session, settings)
+            first = await service.get_products_with_stats()
+            stats_only = await service.get_products_with_stats(limit=0)
+            capped = await service.get_products_with_stats(limit=500, include_stats=False)
+            second = await service.get_products_with_stats(cursor=first["next_cursor"])
+
+        assert len(first["products"]) == 10 and first["has_more"]
+        assert first["stats"]["total_products"] == 25
+        assert sum(bucket["count"] for bucket in first["price_ranges"]) == 25
+        assert stats_only["products"] == [] and stats_only["stock"]["total"] == 25
+        assert len(capped["products"]) == 20 and "stats" not in capped
+        assert "stats" not in second  # statistics come with the first page only
+
+    async def test_invalid_sort_and_cursor(self, session_factory):
+        async with session_factory() as session:
+            service = ProductService(session, Settings())
+            page = await service.get_products_with_stats(limit=2, sort="newest")
+            for cursor, sort in (("not-a-cursor", "newest"), (page["next_cursor"], "price_asc"), (None, "random")):
+                with pytest.raises(HTTPException) as error:
+                    await service.get_products_with_stats(cursor=cursor, sort=sort)
+                assert error.value.status_code == 400
+
+    def test_htmx_rows_end_in_a_lazy_loading_row(self, session_factory):
+        app = FastAPI()
+        app.include_router(router, prefix="/api")
+
+        async def product_service():
+            async with session_factory() as session:
+                yield ProductService(session, Settings())
+
+        app.dependency_overrides[get_product_service] = product_service
+        with TestClient(app) as client:
+            response = client.get("/api/products?limit=20&sort=name&category=Sports", headers={"HX-Request": "true"})
+            assert response.status_code == 200
+            assert response.text.count("<tr class=") == 16
+            assert 'hx-trigger="revealed"' not in response.text
+
+            response = client.get("/api/products?limit=10&sort=name", headers={"HX-Request": "true"})
+            assert response.text.count("<tr class=") == 10
+            assert 'hx-trigger="revealed"' in response.text and "sort=name" in response.text
+
+            data = client.get("/api/products?limit=10&in_stock=false").json()
+            assert [product["in_stock"] for product in data["products"]] == [False] * 7
@@ -0,0 +1,124 @@
+"""
+Tests for product statistics and the maintained stats table
+"""
+import pytest
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel
+
+from dependencies.config import Settings
+from models import Product
+from services import product_service
+from services.product_service import ProductService
+from services.product_stats import ProductStatsTable, aggregate_product_stats, price_ranges
+
+
+@pytest.fixture
+async def session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'stats.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    factory = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with factory() as session:
+        session.add_all([
+            Product(name="Office Chair", price=249.0, category="Furniture"),
+            Product(name="Standing Desk", price=499.0, category="Furniture", in_stock=False),
+            Product(name="Keyboard", price=89.0, category="Electronics"),
+            Product(name="Gift Card", price=25.0),
+        ])
+        await session.commit()
+    yield factory
+    await engine.dispose()
+
+
+@pytest.fixture
+async def stats_table(session_factory):
+    table = ProductStatsTable(session_factory)
+    await table.start()
+    yield table
+    await table.stop()
+
+
+async def _table_matches_aggregate(table, session_factory):
+    async with session_factory() as session:
+        expected = await aggregate_product_stats(session)
+        expected["price_ranges"] = await price_ranges(session)
+        assert await table.read(session) == expected
+    result = await table.check(rebuild=False)
+    assert result["mismatched"] == [] and result["mismatched_ranges"] == []
+
+
+class TestProductStats:
+    """Test the aggregate query and keeping the stats table in step with writes."""
+
+    async def test_aggregate(self, session_factory):
+        async with session_factory() as session:
+            summary = await aggregate_product_stats(session)
+
+        assert summary["categories"] == [
+            {"category": "Electronics", "count": 1},
+            {"category": "Furniture", "count": 2},
+        ]
+        assert summary["stats"] == {"avg_price": 215.5, "min_price": 25.0, "max_price": 499.0, "total_products": 4}
+        assert summary["stock"] == {"total": 4, "in_stock": 3, "out_of_stock": 1}
+
+    async def test_hooks_follow_inserts_updates_and_deletes(self, session_factory, stats_table):
+        assert stats_table.ready
+        await _table_matches_aggregate(stats_table, session_factory)
+
+        async with session_factory() as session:
+            session.add(Product(name="Monitor", price=199.0, category="Electronics"))
+            await session.commit()
+        await _table_matches_aggregate(stats_table, session_factory)
+
+        async with session_factory() as session:
+            products = {p.name: p for p in (await session.execute(select(Product))).scalars()}
+            products["Standing Desk"].in_stock = True
+            await session.commit()
+            await _table_matches_aggregate(stats_table, session_factory)
+
+            products["Office Chair"].price = 599.0  # new category maximum
+            products["Keyboard"].category = "Accessories"
+            products["Gift Card"].category = "Accessories"
+            await session.commit()
+            await _table_matches_aggregate(stats_table, session_factory)
+
+            await session.delete(products["Standing Desk"])
+            await session.delete(products["Monitor"])
+            await session.commit()
+        await _table_matches_aggregate(stats_table, session_factory)
+
+        async with session_factory() as session:
+            summary = await stats_table.read(session)
+        assert summary["categories"] == [
+            {"category": "Accessories", "count": 2},
+            {"category": "Furniture", "count": 1},
+        ]
+        assert summary["stats"]["max_price"] == 599.0
+        assert [bucket["count"] for bucket in summary["price_ranges"]] == [0, 1, 1, 0, 1]
+
+    async def test_check_rebuilds_after_bulk_writes(self, session_factory, stats_table):
+        async with session_factory() as session:
+            # Bulk statements bypass the ORM hooks
+            await session.execute(delete(Product).where(Product.category == "Furniture"))
+            await session.commit()
+
+        result = await stats_table.check(rebuild=False)
+        assert result["mismatched"] == ["Furniture"] and not result["rebuilt"]
+        assert result["mismatched_ranges"] == ["$100 - $500"]
+
+        result = await stats_table.check()
+        assert result["rebuilt"] and result["categories"] == 2
+        await _table_matches_aggregate(stats_table, session_factory)
+
+    async def test_page_reads_price_ranges_from_the_table(self, session_factory, stats_table, monkeypatch):
+        async def scan(session):
+            raise AssertionError("price ranges were aggregated over the products table")
+
+        monkeypatch.setattr(product_service, "get_product_stats_table", lambda settings: stats_table)
+        monkeypatch.setattr(product_service, "price_ranges", scan)
+        async with session_factory() as session:
+            page = await ProductService(session, Settings()).get_products_with_stats(include_stats=True)
+
+        assert page["database_available"]
+        assert [bucket["count"] for bucket in page["price_ranges"]] == [0, 1, 1, 2, 0]
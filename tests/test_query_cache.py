@@ -0,0 +1,151 @@
+"""
+Tests for the table-versioned read-through query cache
+"""
+import asyncio
+import threading
+
+import pytest
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel, select
+
+from models import Product, User
+from services.query_cache import QueryCache, SQLiteTableVersions
+
+PRODUCTS = [Product.__tablename__]
+
+
+@pytest.fixture
+async def session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'cache.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    factory = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with factory() as session:
+        session.add(Product(name="Desk Lamp", price=30.0, category="Home & Kitchen"))
+        await session.commit()
+    yield factory
+    await engine.dispose()
+
+
+@pytest.fixture
+async def cache():
+    cache = QueryCache(max_entries=2)
+    await cache.start()
+    yield cache
+    await cache.stop()
+
+
+def counting_loader(factory):
+    calls = []
+
+    async def load():
+        calls.append(1)
+        async with factory() as session:
+            return [product.name for product in (await session.execute(select(Product))).scalars()]
+
+    return load, calls
+
+
+class TestQueryCache:
+    """Test hits, version invalidation on commit, bounds and shared versions."""
+
+    async def test_commits_to_the_table_invalidate(self, session_factory, cache):
+        load, calls = counting_loader(session_factory)
+        assert await cache.get_or_load("names", PRODUCTS, load) == ["Desk Lamp"]
+        assert await cache.get_or_load("names", PRODUCTS, load) == ["Desk Lamp"]
+        assert len(calls) == 1
+
+        # Rolled back writes and writes to other tables keep the entry
+        async with session_factory() as session:
+            session.add(Product(name="Rolled Back", price=1.0))
+            await session.flush()
+            await session.rollback()
+            session.add(User(email="staff@example.com", hashed_password="x"))
+            await session.commit()
+        assert await cache.get_or_load("names", PRODUCTS, load) == ["Desk Lamp"]
+        assert len(calls) == 1
+
+        async with session_factory() as session:
+            session.add(Product(name="Bookshelf", price=80.0))
+            await session.commit()
+        assert sorted(await cache.get_or_load("names", PRODUCTS, load)) == ["Bookshelf", "Desk Lamp"]
+
+        # ORM bulk statements write without a flush
+        async with session_factory() as session:
+            await session.execute(update(Product).where(Product.name == "Bookshelf").values(name="Shelf"))
+            await session.commit()
+        assert sorted(await cache.get_or_load("names", PRODUCTS, load)) == ["Desk Lamp", "Shelf"]
+
+        assert len(calls) == 3
+        stats = cache.get_stats()
+        assert stats["hits"] == 2 and stats["misses"] == 3 and stats["invalidations"] == 2 and stats["bumps"] == 2
+
+    async def test_bounds_and_failed_loads(self, session_factory, cache):
+        load, calls = counting_loader(session_factory)
+        for page in (1, 2, 3, 1):
+            await cache.get_or_load("page", PRODUCTS, load, {"page": page})
+        assert len(calls) == 4 and cache.get_stats()["evictions"] == 2
+
+        async def failing():
+            raise RuntimeError("database is down")
+
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await cache.get_or_load("failing", PRODUCTS, failing)
+        assert cache.get_stats()["entries"] == 2
+
+        cache.ttl_seconds = 0
+        await cache.get_or_load("expiring", PRODUCTS, load)
+        await cache.get_or_load("expiring", PRODUCTS, load)
+        assert cache.get_stats()["expirations"] == 1
+
+    async def test_versions_shared_between_workers(self, tmp_path, session_factory):
+        path = str(tmp_path / "versions.db")
+        worker_a = QueryCache(SQLiteTableVersions(path))
+        worker_b = QueryCache(SQLiteTableVersions(path))
+        load, calls = counting_loader(session_factory)
+        await worker_b.get_or_load("names", PRODUCTS, load)
+
+        # Only worker A listens for this write, as if it happened in another process
+        await worker_a.start()
+        try:
+            async with session_factory() as session:
+                session.add(Product(name="Bookshelf", price=80.0))
+                await session.commit()
+        finally:
+            await worker_a.stop()
+
+        assert len(await worker_b.get_or_load("names", PRODUCTS, load)) == 2
+        assert len(calls) == 2 and worker_b.get_stats()["invalidations"] == 1
+
+    async def test_shared_version_writes_run_off_the_event_loop(self, tmp_path, session_factory):
+        versions = SQLiteTableVersions(str(tmp_path / "versions.db"))
+        cache = QueryCache(versions)
+        release, threads = threading.Event(), []
+        write = versions.write
+
+        def slow_write(tables):
+            threads.append(threading.current_thread())
+            release.wait(5)
+            write(tables)
+
+        versions.write = slow_write
+        load, calls = counting_loader(session_factory)
+        await cache.start()
+        try:
+            await cache.get_or_load("names", PRODUCTS, load)
+            async with session_factory() as session:
+                session.add(Product(name="Bookshelf", price=80.0))
+                await session.commit()
+
+            # The commit returned while the file write is blocked, and this worker already sees it
+            assert len(await cache.get_or_load("names", PRODUCTS, load)) == 2
+            assert len(calls) == 2
+            await asyncio.sleep(0.05)
+            assert threads and threads[0] is not threading.main_thread()
+        finally:
+            release.set()
+            await cache.stop()
+        assert cache.get_stats()["version_errors"] == 0
+        assert (await SQLiteTableVersions(versions.db_path).get(PRODUCTS))[PRODUCTS[0]] > 0
@@ -0,0 +1,100 @@
+"""
+Tests for the chat response cache
+"""
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.middleware.sessions import SessionMiddleware
+
+from core.services.auth import get_current_superuser
+from dependencies.config import Settings
+from dependencies.services import get_chat_service
+from models import User
+from routes.chat import router
+from services.chat_service import ChatService
+from services.conversation_store import ConversationStore
+from services.response_cache import ResponseCache, make_cache_key
+from services.upstream_client import UpstreamClient
+
+MESSAGES = [{"role": "user", "content": "What is FastAPI?"}]
+
+
+class TestResponseCache:
+    """Test LRU, TTL and SQLite persistence."""
+
+    def test_cache_key_is_canonical(self):
+        key = make_cache_key("model", MESSAGES, 0.7, 1000)
+        assert key == make_cache_key("model", [dict(reversed(list(MESSAGES[0].items())))], 0.7, 1000)
+        assert key != make_cache_key("model", MESSAGES, 0.2, 1000)
+
+    async def test_lru_eviction(self):
+        cache = ResponseCache(max_entries=2, ttl_seconds=60)
+        await cache.set("a", {"raw": "1"})
+        await cache.set("b", {"raw": "2"})
+        assert await cache.get("a") is not None  # "a" is now most recent
+        await cache.set("c", {"raw": "3"})
+
+        assert await cache.get("b") is None
+        stats = cache.get_stats()
+        assert stats["evictions"] == 1
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
+    async def test_ttl_expiry(self):
+        cache = ResponseCache(max_entries=10, ttl_seconds=-1)
+        await cache.set("a", {"raw": "1"})
+        assert await cache.get("a") is None
+        assert cache.get_stats()["expirations"] == 1
+
+    async def test_sqlite_tier_survives_restart(self, tmp_path):
+        db_path = str(tmp_path / "cache.db")
+        await ResponseCache(db_path=db_path).set("a", {"raw": "persisted"})
+
+        restarted = ResponseCache(db_path=db_path)
+        assert await restarted.get("a") == {"raw": "persisted"}
+        assert restarted.get_stats()["disk_hits"] == 1
+
+
+class TestCachedChat:
+    """Test that ChatService serves and replays cached answers."""
+
+    def _service(self) -> ChatService:
+        settings = Settings(response_cache_replay_delay=0, response_cache_replay_chunk_chars=5)
+        return ChatService(
+            settings=settings,
+            http_client=UpstreamClient(settings),
+            response_cache=ResponseCache(),
+            conversations=ConversationStore(persist=False),
+        )
+
+    async def _prime(self, service: ChatService, message: str) -> None:
+        key = service._cache_key(service._build_payload(message))
+        await service.response_cache.set(key, {"raw": "**Hello** there", "html": "<p>hi</p>", "model": "m"})
+
+    async def test_non_streaming_hit(self):
+        service = self._service()
+        await self._prime(service, "hello")
+        result = await service.chat_with_llama("hello")
+        assert result["cached"] is True
+        assert result["raw_response"] == "**Hello** there"
+
+    async def test_stream_replay(self):
+        service = self._service()
+        await self._prime(service, "hello")
+        chunks = [chunk async for chunk in service.chat_with_llama_stream("hello")][1:]
+        assert len(chunks) == 3
+        assert "".join(chunk["raw_delta"] for chunk in chunks) == "**Hello** there"
+        assert all(chunk["cached"] for chunk in chunks)
+
+    def test_metrics_are_superuser_only(self):
+        app = FastAPI()
+        app.add_middleware(SessionMiddleware, secret_key="test")
+        app.include_router(router, prefix="/api")
+        app.dependency_overrides[get_chat_service] = self._service
+        with TestClient(app) as client:
+            assert client.get("/api/chat/metrics").status_code == 401
+
+            admin = User(email="admin@example.com", hashed_password="x", is_superuser=True)
+            app.dependency_overrides[get_current_superuser] = lambda: admin
+            response = client.get("/api/chat/metrics")
+            assert response.status_code == 200
+            assert "response_cache" in response.json() and "process" in response.json()
@@ -0,0 +1,97 @@
+"""
+Tests for the semantic near-duplicate prompt cache
+"""
+from aiohttp.test_utils import TestServer
+import pytest
+
+pytest.importorskip("numpy")
+
+from dependencies.config import Settings
+from scripts.mock_llm import STATS_KEY, MockUpstreamConfig, create_app
+from services.chat_service import ChatService
+from services.conversation_store import ConversationStore
+from services.llm_providers import ProviderRouter, build_backends
+from services.response_cache import ResponseCache
+from services.semantic_cache import SemanticCache, context_hash, normalize_prompt
+from services.upstream_client import UpstreamClient
+
+PAYLOAD = {
+    "model": "m",
+    "messages": [{"role": "user", "content": "what is fastapi?"}],
+    "temperature": 0.7,
+    "max_tokens": 1000,
+}
+
+
+class TestSemanticCache:
+    """Test normalization, thresholded lookup and eviction."""
+
+    def test_normalize_prompt(self):
+        assert normalize_prompt("What's FastAPI?") == "what is fastapi"
+        assert normalize_prompt("It  isn't   here!") == "it is not here"
+
+    def test_near_duplicate_hits(self):
+        cache = SemanticCache(max_entries=16)
+        cache.add("what is fastapi?", 1, "fastapi")
+        cache.add("how do I deploy to fly.io", 1, "deploy")
+
+        key, similarity = cache.lookup("What's FastAPI", 1)
+        assert key == "fastapi"
+        assert similarity >= cache.threshold
+        assert cache.lookup("what is django?", 1) is None
+        assert cache.lookup("what is fastapi?", 2) is None  # different history or model
+        assert cache.get_stats()["hits"] == 1
+
+    def test_lru_eviction(self):
+        cache = SemanticCache(max_entries=2)
+        cache.add("first question about sqlite", 1, "a")
+        cache.add("second question about postgres", 1, "b")
+        assert cache.lookup("first question about sqlite", 1)[0] == "a"  # "a" is now most recent
+        cache.add("third question about redis", 1, "c")
+
+        assert len(cache) == 2
+        assert cache.lookup("second question about postgres", 1) is None
+        assert cache.lookup("first question about sqlite", 1)[0] == "a"
+        assert cache.get_stats()["evictions"] == 1
+
+    def test_context_hash_ignores_the_last_message(self):
+        rephrased = dict(PAYLOAD, messages=[{"role": "user", "content": "What's FastAPI"}])
+        assert context_hash(PAYLOAD) == context_hash(rephrased)
+        assert context_hash(PAYLOAD) != context_hash(dict(PAYLOAD, temperature=0.2))
+
+
+class TestSemanticChat:
+    """Test that ChatService answers near-duplicate prompts from the cache."""
+
+    async def test_rephrased_prompt_is_served_from_cache(self, monkeypatch):
+        monkeypatch.setenv("OPENROUTER_API_KEY", "mock")
+        server = TestServer(create_app(MockUpstreamConfig(tokens_per_second=0, ttft=0, jitter=0)))
+        await server.start_server()
+        settings = Settings(
+            llm_base_url=str(server.make_url("/v1")),
+            usage_tracking_enabled=False,
+            response_cache_replay_delay=0,
+        )
+        service = ChatService(
+            settings=settings,
+            http_client=UpstreamClient(settings),
+            response_cache=ResponseCache(),
+            conversations=ConversationStore(persist=False),
+            providers=ProviderRouter(build_backends(settings)),
+            semantic_cache=SemanticCache(max_entries=16),
+        )
+        try:
+            first = await service.complete("what is fastapi?")
+            second = await service.complete("What's FastAPI")
+            chunks = [chunk async for chunk in service.chat_with_llama_stream("what is FastAPI")]
+            other = await service.complete("how do I deploy to fly.io")
+        finally:
+            await service.http_client.close()
+            await server.close()
+
+        assert second["cached"] is True
+        assert second["raw_response"] == first["raw_response"]
+        assert "".join(chunk.get("raw_delta", "") for chunk in chunks) == first["raw_response"]
+        assert "cached" not in other
+        assert server.app[STATS_KEY]["requests"] == 2
+        assert service.get_metrics()["semantic_cache"]["hits"] == 2
@@ -0,0 +1,113 @@
+"""
+Tests for upstream stream cancellation and server-side stream caps
+"""
+import asyncio
+import json
+
+from dependencies.config import Settings
+from services.chat_service import ChatService
+from services.conversation_store import ConversationStore
+from services.stream_metrics import StreamMetrics
+from services.upstream_client import UpstreamClient
+from services.upstream_governor import UpstreamGovernor
+
+
+class FakeContent:
+    """Minimal stand-in for aiohttp's StreamReader"""
+
+    def __init__(self, tokens, delay=0.0):
+        self.lines = [
+            f"data: {json.dumps({'choices': [{'delta': {'content': token}}]})}\n".encode()
+            for token in tokens
+        ] + [b"data: [DONE]\n"]
+        self.delay = delay
+        self.reads = 0
+
+    async def readline(self):
+        await asyncio.sleep(self.delay)
+        if self.reads >= len(self.lines):
+            return b""
+        self.reads += 1
+        return self.lines[self.reads - 1]
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.status = 200
+        self.headers = {}
+        self.content = content
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.closed = True
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+
+    def post(self, *args, **kwargs):
+        return self.response
+
+
+def make_service(monkeypatch, content, **overrides) -> ChatService:
+    settings = Settings(
+        response_cache_enabled=False,
+        stream_coalescing_enabled=False,
+        stream_flush_interval_ms=0,
+        **overrides,
+    )
+    service = ChatService(
+        settings=settings,
+        http_client=UpstreamClient(settings),
+        governor=UpstreamGovernor(settings),
+        stream_metrics=StreamMetrics(),
+        conversations=ConversationStore(persist=False),
+    )
+    response = FakeResponse(content)
+
+    async def get_session():
+        return FakeSession(response)
+
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    monkeypatch.setattr(service.http_client, "get_session", get_session)
+    service.fake_response = response
+    return service
+
+
+class TestStreamCancellation:
+    """Test that closing the client stream aborts the upstream request."""
+
+    async def test_close_aborts_upstream(self, monkeypatch):
+        content = FakeContent(["token "] * 50)
+        service = make_service(monkeypatch, content)
+
+        stream = service.chat_with_llama_stream("hello")
+        assert "conversation_id" in await stream.__anext__()
+        for _ in range(3):
+            await stream.__anext__()
+        await stream.aclose()
+
+        assert service.fake_response.closed
+        assert content.reads == 3
+        assert service.stream_metrics.get_stats()["upstream_aborted"] == 1
+        assert service.governor.get_stats()["active"] == 0
+
+
+class TestStreamCaps:
+    """Test the wall-time and token caps."""
+
+    async def test_max_tokens(self, monkeypatch):
+        service = make_service(monkeypatch, FakeContent(["token "] * 50), stream_max_tokens=5)
+        chunks = [chunk async for chunk in service.chat_with_llama_stream("hello")][1:]
+        assert len(chunks) == 5
+        assert service.stream_metrics.get_stats()["truncated"] == {"max_tokens": 1}
+
+    async def test_max_duration(self, monkeypatch):
+        service = make_service(monkeypatch, FakeContent(["token "] * 50, delay=0.02), stream_max_duration=0.1)
+        chunks = [chunk async for chunk in service.chat_with_llama_stream("hello")][1:]
+        assert 0 < len(chunks) < 50
+        assert service.stream_metrics.get_stats()["truncated"] == {"max_duration": 1}
@@ -0,0 +1,71 @@
+"""
+Tests for single-flight coalescing of identical upstream streams
+"""
+import asyncio
+
+from services.stream_coalescer import StreamCoalescer
+
+
+class TestStreamCoalescer:
+    """Test leader/follower sharing of one upstream stream."""
+
+    async def test_concurrent_requests_share_upstream(self):
+        coalescer = StreamCoalescer()
+        calls = 0
+
+        async def upstream():
+            nonlocal calls
+            calls += 1
+            for part in ("a", "b", "c"):
+                await asyncio.sleep(0.01)
+                yield part
+
+        async def consume():
+            return [chunk async for chunk in coalescer.stream("key", upstream)]
+
+        results = await asyncio.gather(*(consume() for _ in range(5)))
+        assert calls == 1
+        assert all(result == ["a", "b", "c"] for result in results)
+        assert coalescer.get_stats()["followers"] == 4
+
+    async def test_late_joiner_receives_backlog(self):
+        coalescer = StreamCoalescer()
+        release = asyncio.Event()
+
+        async def upstream():
+            yield "first"
+            await release.wait()
+            yield "second"
+
+        leader = coalescer.stream("key", upstream)
+        assert await leader.__anext__() == "first"
+
+        async def late():
+            return [chunk async for chunk in coalescer.stream("key", upstream)]
+
+        late_task = asyncio.create_task(late())
+        await asyncio.sleep(0)
+        release.set()
+        assert [chunk async for chunk in leader] == ["second"]
+        assert await late_task == ["first", "second"]
+
+    async def test_upstream_cancelled_when_all_subscribers_leave(self):
+        coalescer = StreamCoalescer()
+        cancelled = asyncio.Event()
+
+        async def upstream():
+            try:
+                yield "first"
+                await asyncio.sleep(10)
+                yield "never"
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        stream = coalescer.stream("key", upstream)
+        assert await stream.__anext__() == "first"
+        await stream.aclose()
+
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+        assert coalescer.get_stats()["abandoned"] == 1
+        assert coalescer.get_stats()["inflight"] == 0
@@ -0,0 +1,151 @@
+"""
+Tests for hedged upstream streams
+"""
+import asyncio
+import json
+
+import pytest
+
+from dependencies.config import Settings
+from services.chat_service import ChatService
+from services.conversation_store import ConversationStore
+from services.llm_providers import LLMBackend, ProviderRouter
+from services.stream_hedger import StreamHedger
+from services.stream_metrics import StreamMetrics
+from services.upstream_client import UpstreamClient
+from services.upstream_governor import UpstreamGovernor
+
+
+def make_hedger(**overrides) -> StreamHedger:
+    values = {"hedge_initial_delay": 0.05, "hedge_min_delay": 0.01, "hedge_min_samples": 5}
+    values.update(overrides)
+    return StreamHedger(Settings(**values))
+
+
+async def slow_stream(delay: float, items, closed=None):
+    try:
+        await asyncio.sleep(delay)
+        for item in items:
+            yield item
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+
+class TestStreamHedger:
+    """Test the TTFT estimate and the primary/hedge race."""
+
+    async def test_hedge_wins_and_primary_is_closed(self):
+        hedger = make_hedger()
+        closed = []
+        stream = hedger.stream(slow_stream(5, ["slow"], closed), lambda: slow_stream(0, ["fast", "!"]))
+
+        assert [item async for item in stream] == ["fast", "!"]
+        assert closed == [True]
+        stats = hedger.get_stats()
+        assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
+
+    async def test_fast_primary_is_not_hedged(self):
+        hedger = make_hedger()
+        hedges = []
+
+        def start_hedge():
+            hedges.append(True)
+            return slow_stream(0, ["hedge"])
+
+        assert [item async for item in hedger.stream(slow_stream(0, ["a", "b"]), start_hedge)] == ["a", "b"]
+        assert hedges == []
+        assert hedger.get_stats()["ttft_samples"] == 1
+
+    async def test_budget_limits_hedges(self):
+        hedger = make_hedger(hedge_budget_ratio=0)
+        for _ in range(2):
+            stream = hedger.stream(slow_stream(0.1, ["slow"]), lambda: slow_stream(0, ["fast"]))
+            [item async for item in stream]
+        stats = hedger.get_stats()
+        assert stats["hedged"] == 1
+        assert stats["skipped_budget"] == 1
+
+    async def test_primary_error_propagates(self):
+        hedger = make_hedger()
+
+        async def failing():
+            raise RuntimeError("upstream down")
+            yield  # pragma: no cover
+
+        with pytest.raises(RuntimeError):
+            [item async for item in hedger.stream(failing(), lambda: None)]
+
+    def test_delay_follows_ttft_p95(self):
+        hedger = make_hedger(hedge_max_delay=2.0)
+        assert hedger.delay() == 0.05
+        for seconds in [0.1, 0.2, 0.3, 0.4, 1.0]:
+            hedger.record_ttft(seconds)
+        assert hedger.delay() == 1.0
+        hedger.record_ttft(9.0)
+        assert hedger.delay() == 2.0
+
+
+class TestHedgedChatStream:
+    """Test hedging across backends in ChatService."""
+
+    async def test_slow_backend_is_hedged(self, monkeypatch):
+        settings = Settings(
+            response_cache_enabled=False,
+            stream_coalescing_enabled=False,
+            stream_flush_interval_ms=0,
+            hedge_initial_delay=0.05,
+        )
+        router = ProviderRouter([
+            LLMBackend("slow", "http://slow/v1", "model-a", weight=1000, api_key="key-a"),
+            LLMBackend("fast", "http://fast/v1", "model-b", weight=1, api_key="key-b"),
+        ])
+        governor = UpstreamGovernor(settings)
+        metrics = StreamMetrics()
+        service = ChatService(
+            settings=settings,
+            http_client=UpstreamClient(settings),
+            governor=governor,
+            stream_metrics=metrics,
+            conversations=ConversationStore(persist=False),
+            providers=router,
+            hedger=StreamHedger(settings),
+        )
+
+        class Response:
+            status = 200
+            headers = {}
+
+            def __init__(self, delay, text):
+                self.delay = delay
+                data = {"choices": [{"delta": {"content": text}}]}
+                self.lines = [f"data: {json.dumps(data)}\n".encode(), b"data: [DONE]\n"]
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                pass
+
+            @property
+            def content(self):
+                return self
+
+            async def readline(self):
+                await asyncio.sleep(self.delay)
+                return self.lines.pop(0) if self.lines else b""
+
+        class Session:
+            def post(self, url, headers, json):
+                return Response(5, "slow") if url.startswith("http://slow") else Response(0, "fast")
+
+        async def get_session():
+            return Session()
+
+        monkeypatch.setattr(service.http_client, "get_session", get_session)
+        chunks = [chunk async for chunk in service.chat_with_llama_stream("hello")][1:]
+
+        assert "".join(chunk["raw_delta"] for chunk in chunks) == "fast"
+        assert service.get_metrics()["hedging"]["hedge_wins"] == 1
+        assert metrics.upstream_aborted == 1
+        assert governor.get_stats()["active"] == 0
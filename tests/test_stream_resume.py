@@ -0,0 +1,104 @@
+"""
+Tests for resumable streams (Last-Event-ID replay buffer)
+"""
+import asyncio
+
+import pytest
+
+from services.stream_coalescer import StreamGapError
+from services.stream_resume import StreamResumer, parse_last_event_id
+
+
+async def numbered_events(count, gate=None, state=None):
+    try:
+        for i in range(count):
+            if gate is not None:
+                await gate.wait()
+            yield {"event": "message", "data": str(i)}
+            await asyncio.sleep(0)
+        if state is not None:
+            state["finished"] = True
+    finally:
+        if state is not None:
+            state["closed"] = True
+
+
+class TestStreamResumer:
+    """Test replay after a reconnect, the bounded buffer and the grace period."""
+
+    def test_parse_last_event_id(self):
+        assert parse_last_event_id("abc-123:7") == ("abc-123", 7)
+        assert parse_last_event_id("abc:x") is None
+        assert parse_last_event_id("7") is None
+        assert parse_last_event_id(None) is None
+
+    async def test_reconnect_replays_missed_events_and_follows_live(self):
+        resumer = StreamResumer(grace=5)
+        gate = asyncio.Event()
+        gate.set()
+        state = {}
+        stream = resumer.start(numbered_events(10, gate, state))
+
+        first = resumer.subscribe(stream.key)
+        received = [await anext(first) for _ in range(3)]
+        await first.aclose()  # the client drops off
+        assert [event["id"] for event in received] == [f"{stream.key}:{i}" for i in range(3)]
+
+        await asyncio.sleep(0.01)
+        stream_id, sequence = parse_last_event_id(received[-1]["id"])
+        resumed = [event async for event in resumer.subscribe(stream_id, sequence)]
+
+        assert [event["data"] for event in resumed] == [str(i) for i in range(3, 10)]
+        assert state["finished"] is True
+        stats = resumer.get_stats()
+        assert stats["started"] == 1 and stats["resumed"] == 1 and stats["abandoned"] == 0
+
+    async def test_events_older_than_the_buffer(self):
+        resumer = StreamResumer(grace=5, max_events=4)
+        stream = resumer.start(numbered_events(10))
+        await stream.task
+
+        with pytest.raises(StreamGapError):
+            resumer.subscribe(stream.key, 2)
+        assert [event["data"] async for event in resumer.subscribe(stream.key, 6)] == ["7", "8", "9"]
+        with pytest.raises(KeyError):
+            resumer.subscribe("unknown", 0)
+
+    async def test_only_the_owner_can_attach(self):
+        resumer = StreamResumer(grace=5)
+        stream = resumer.start(numbered_events(3), owner="client:a")
+        await stream.task
+
+        for owner in ("client:b", None):
+            with pytest.raises(KeyError):
+                resumer.subscribe(stream.key, 0, owner=owner)
+        assert [event["data"] async for event in resumer.subscribe(stream.key, 0, owner="client:a")] == ["1", "2"]
+
+    async def test_grace_period_cancels_an_abandoned_stream(self):
+        resumer = StreamResumer(grace=0.05)
+        gate = asyncio.Event()
+        state = {}
+        stream = resumer.start(numbered_events(10, gate, state))
+
+        follow = resumer.subscribe(stream.key)
+        gate.set()
+        await anext(follow)
+        gate.clear()
+        await follow.aclose()
+        await asyncio.sleep(0.02)
+        assert not stream.task.done()  # still within the grace period
+
+        await asyncio.sleep(0.1)
+        assert stream.task.done() and state["closed"] is True and "finished" not in state
+        assert resumer.get_stats()["abandoned"] == 1
+        with pytest.raises(KeyError):
+            resumer.subscribe(stream.key, 0)
+
+    async def test_finished_stream_expires_after_grace(self):
+        resumer = StreamResumer(grace=0.02)
+        stream = resumer.start(numbered_events(2))
+        await stream.task
+        assert len([event async for event in resumer.subscribe(stream.key)]) == 2
+        await asyncio.sleep(0.05)
+        stats = resumer.get_stats()
+        assert stats["buffered"] == 0 and stats["expired"] == 1 and stats["abandoned"] == 0
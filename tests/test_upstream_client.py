@@ -0,0 +1,46 @@
+"""
+Tests for the shared upstream HTTP client used by ChatService
+"""
+
+from dependencies.config import Settings
+from dependencies.services import get_chat_service
+from services.chat_service import ChatService
+from services.upstream_client import UpstreamClient
+
+
+class TestUpstreamClient:
+    """Test the lifespan-managed pooled client."""
+
+    async def test_start_and_close(self):
+        """Starting twice reuses the same session; closing releases it."""
+        client = UpstreamClient(Settings(upstream_pool_limit=7))
+        await client.start()
+        await client.start()
+        assert client.sessions_created == 1
+
+        stats = client.get_stats()
+        assert stats["started"] is True
+        assert stats["limit"] == 7
+
+        await client.close()
+        assert client.get_stats()["started"] is False
+
+    async def test_get_session_starts_lazily(self):
+        """get_session works without an explicit start and counts requests."""
+        client = UpstreamClient(Settings())
+        first = await client.get_session()
+        second = await client.get_session()
+        assert first is second
+        assert client.requests_total == 2
+        await client.close()
+
+
+class TestChatServiceInjection:
+    """Test that ChatService receives the shared client."""
+
+    def test_chat_service_uses_injected_client(self):
+        settings = Settings()
+        client = UpstreamClient(settings)
+        service = get_chat_service(settings=settings, http_client=client)
+        assert isinstance(service, ChatService)
+        assert service.http_client is client
@@ -0,0 +1,172 @@
+"""
+Tests for the upstream concurrency governor
+"""
+import asyncio
+
+from fastapi import HTTPException
+import pytest
+
+from dependencies.config import Settings
+from services.chat_service import ChatService
+from services.conversation_store import ConversationStore
+from services.upstream_client import UpstreamClient
+from services.upstream_governor import (
+    GovernorQueueFull,
+    GovernorQueueTimeout,
+    TokenBucket,
+    UpstreamGovernor,
+    UpstreamRetryableError,
+    parse_retry_after,
+)
+
+
+def make_governor(**overrides) -> UpstreamGovernor:
+    values = {
+        "governor_max_concurrent": 1,
+        "governor_global_rpm": 6000,
+        "governor_global_burst": 100,
+        "governor_user_rpm": 6000,
+        "governor_user_burst": 100,
+        "governor_max_queue": 10,
+        "governor_max_queue_time": 5,
+    }
+    values.update(overrides)
+    return UpstreamGovernor(Settings(**values))
+
+
+async def _drain(ticket):
+    async for _ in ticket.wait():
+        pass
+
+
+class TestTokenBucket:
+    """Test token bucket refill and wait times."""
+
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(rate=1.0, capacity=2)
+        for _ in range(2):
+            assert bucket.wait_time() == 0
+            bucket.take()
+        assert 0 < bucket.wait_time() <= 1.0
+
+    def test_parse_retry_after(self):
+        assert parse_retry_after("3") == 3.0
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") is None
+
+
+class TestUpstreamGovernor:
+    """Test queueing, rejection and timeouts."""
+
+    async def test_queue_positions_until_slot_frees(self):
+        governor = make_governor()
+        first = await governor.run("a")
+
+        ticket = governor.enqueue("b")
+        positions = []
+
+        async def wait():
+            async for position in ticket.wait():
+                positions.append(position)
+
+        waiter = asyncio.create_task(wait())
+        await asyncio.sleep(0.01)
+        assert governor.get_stats()["queued"] == 1
+        first.release()
+        await asyncio.wait_for(waiter, 1)
+
+        assert positions == [1]
+        assert ticket.acquired
+        assert governor.get_stats()["active"] == 1
+
+    async def test_queue_full(self):
+        governor = make_governor(governor_max_queue=1)
+        await governor.run("a")
+        governor.enqueue("b")
+        with pytest.raises(GovernorQueueFull):
+            governor.enqueue("c")
+        assert governor.get_stats()["rejected"] == 1
+
+    async def test_per_user_bucket_times_out(self):
+        governor = make_governor(
+            governor_max_concurrent=5, governor_user_rpm=0.01, governor_user_burst=1, governor_max_queue_time=0.05
+        )
+        (await governor.run("a")).release()
+        with pytest.raises(GovernorQueueTimeout):
+            await governor.run("a")
+        # Other users are not affected
+        assert (await governor.run("b")).acquired
+        assert governor.get_stats()["timeouts"] == 1
+
+    async def test_throttled_user_does_not_delay_others(self):
+        governor = make_governor(
+            governor_max_concurrent=5, governor_user_rpm=0.01, governor_user_burst=1, governor_max_queue_time=5
+        )
+        (await governor.run("a")).release()
+        throttled = governor.enqueue("a")
+        waiter = asyncio.create_task(_drain(throttled))
+        await asyncio.sleep(0.01)
+
+        # "a" is first in the queue but over their rate; "b" is admitted at once
+        ticket = await asyncio.wait_for(governor.run("b"), 0.5)
+        assert ticket.acquired and not throttled.acquired
+        assert throttled.position == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        throttled.release()
+        assert governor.get_stats()["queued"] == 0
+
+    async def test_queue_places_per_user_are_capped(self):
+        governor = make_governor(governor_max_queue_per_user=2)
+        await governor.run("a")
+        governor.enqueue("a")
+        governor.enqueue("a")
+        with pytest.raises(GovernorQueueFull) as exc_info:
+            governor.enqueue("a")
+        assert exc_info.value.retry_after >= 1
+        # Other users still get queue places
+        assert governor.enqueue("b").position == 3
+        assert governor.get_stats()["rejected"] == 1
+
+    async def test_refilled_user_token_admits_the_queued_ticket(self):
+        governor = make_governor(governor_max_concurrent=5, governor_user_rpm=600, governor_user_burst=1)
+        (await governor.run("a")).release()
+        # The next token arrives after 0.1 s; the refill timer admits the ticket without another event
+        ticket = await asyncio.wait_for(governor.run("a"), 1)
+        assert ticket.acquired
+
+    def test_backoff_honors_retry_after(self):
+        governor = make_governor(governor_backoff_max=10)
+        assert governor.backoff_delay(0, retry_after=4) == 4
+        assert governor.backoff_delay(0, retry_after=60) == 10
+        assert 0 <= governor.backoff_delay(3) <= 8
+
+
+class TestGovernedChat:
+    """Test retry handling in ChatService."""
+
+    async def test_retries_then_gives_up_with_retry_after(self, monkeypatch):
+        settings = Settings(governor_max_retries=2, governor_backoff_max=0, response_cache_enabled=False)
+        service = ChatService(
+            settings=settings,
+            http_client=UpstreamClient(settings),
+            governor=UpstreamGovernor(settings),
+            conversations=ConversationStore(persist=False),
+        )
+        calls = []
+
+        async def throttled(backend, payload):
+            calls.append(payload)
+            raise UpstreamRetryableError(429, "slow down", retry_after=7)
+
+        monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+        monkeypatch.setattr(service, "_post_completion", throttled)
+
+        with pytest.raises(HTTPException) as exc_info:
+            await service.chat_with_llama("hello")
+
+        assert exc_info.value.status_code == 429
+        assert exc_info.value.headers == {"Retry-After": "7"}
+        assert len(calls) == 3
+        assert service.governor.get_stats()["active"] == 0
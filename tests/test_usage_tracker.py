@@ -0,0 +1,129 @@
+"""
+Tests for token usage accounting
+"""
+from aiohttp.test_utils import TestServer
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel
+
+from core.services.auth import get_current_superuser
+from dependencies.config import Settings
+from models import User
+import routes.chat
+from scripts.mock_llm import MockUpstreamConfig, create_app
+from services.chat_service import ChatService
+from services.conversation_store import ConversationStore
+from services.llm_providers import ProviderRouter, build_backends
+from services.upstream_client import UpstreamClient
+from services.usage_tracker import UsageRecorder
+
+
+@pytest.fixture
+async def session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'usage.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    yield async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    await engine.dispose()
+
+
+class TestUsageRecorder:
+    """Test buffering, batched writes and aggregates."""
+
+    async def test_aggregates_per_user_and_model(self, session_factory):
+        recorder = UsageRecorder(Settings(usage_batch_size=2), session_factory)
+        recorder.record("user:1", "a", "model-a", 100, 50, 0.5, cost=0.001)
+        recorder.record("user:1", "b", "model-b", 10, 5, 1.5, estimated=True)
+        recorder.record("user:2", "a", "model-a", 20, 10, 1.0, cost=0.002)
+        await recorder.stop()
+
+        by_user = await recorder.summarize("user")
+        assert [(row["key"], row["requests"], row["total_tokens"]) for row in by_user] == [
+            ("user:1", 2, 165), ("user:2", 1, 30)
+        ]
+        assert by_user[0]["cost"] == 0.001
+        assert by_user[0]["estimated"] == 1
+        assert by_user[0]["avg_latency_ms"] == 1000
+
+        by_model = await recorder.summarize("model", user_key="user:1")
+        assert [row["key"] for row in by_model] == ["model-a", "model-b"]
+        assert len(await recorder.summarize("day")) == 1
+        assert recorder.get_stats()["written"] == 3
+        assert recorder.get_stats()["flushes"] == 2
+        with pytest.raises(ValueError):
+            await recorder.summarize("backend")
+
+    async def test_usage_route_clamps_the_window(self, session_factory, monkeypatch):
+        recorder = UsageRecorder(Settings(), session_factory)
+        recorder.record("user:1", "a", "model-a", 100, 50, 0.5)
+        await recorder.stop()
+        monkeypatch.setattr(routes.chat, "get_usage_recorder", lambda: recorder)
+        app = FastAPI()
+        app.include_router(routes.chat.router, prefix="/api")
+        app.dependency_overrides[get_current_superuser] = lambda: User(
+            email="admin@example.com", hashed_password="x", is_superuser=True
+        )
+        with TestClient(app) as client:
+            response = client.get("/api/chat/usage", params={"days": 10**9})
+            assert response.status_code == 200
+            assert response.json()["days"] == 366 and len(response.json()["rows"]) == 1
+            assert client.get("/api/chat/usage", params={"days": -5}).json()["days"] == 1
+
+    async def test_records_survive_database_errors(self, session_factory):
+        class Broken:
+            async def __aenter__(self):
+                raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+            async def __aexit__(self, *exc):
+                pass
+
+        recorder = UsageRecorder(Settings(usage_buffer_size=2), lambda: Broken())
+        for _ in range(3):
+            recorder.record("user:1", "a", "model-a", 1, 1, 0.1)
+        assert await recorder.flush() == 0
+
+        stats = recorder.get_stats()
+        assert (stats["buffered"], stats["dropped"], stats["db_errors"]) == (2, 1, 1)
+        recorder._session_factory = session_factory
+        assert await recorder.flush() == 2
+
+
+class TestChatUsage:
+    """Test that ChatService records upstream usage."""
+
+    async def test_stream_and_completion_usage(self, monkeypatch, session_factory):
+        monkeypatch.setenv("OPENROUTER_API_KEY", "mock")
+        server = TestServer(create_app(MockUpstreamConfig(tokens_per_second=0, ttft=0, jitter=0)))
+        await server.start_server()
+        settings = Settings(
+            llm_base_url=str(server.make_url("/v1")),
+            response_cache_enabled=False,
+            stream_coalescing_enabled=False,
+            llm_prompt_price=1.0,
+            llm_completion_price=2.0,
+        )
+        recorder = UsageRecorder(settings, session_factory)
+        service = ChatService(
+            settings=settings,
+            http_client=UpstreamClient(settings),
+            conversations=ConversationStore(persist=False),
+            providers=ProviderRouter(build_backends(settings)),
+            usage=recorder,
+        )
+        try:
+            async for _ in service.chat_with_llama_stream("tell me a story", user_key="user:1"):
+                pass
+            await service.complete("hello", user_key="user:2")
+        finally:
+            await service.http_client.close()
+            await server.close()
+        await recorder.stop()
+
+        rows = {row["key"]: row for row in await recorder.summarize("user")}
+        assert set(rows) == {"user:1", "user:2"}
+        assert all(row["estimated"] == 0 and row["completion_tokens"] > 0 for row in rows.values())
+        story = rows["user:1"]
+        assert story["cost"] == pytest.approx((story["prompt_tokens"] + 2 * story["completion_tokens"]) / 1e6)